@@ -0,0 +1,61 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from .connection import db_connection_params
+
+# --- Pool asíncrono (psycopg 3) para las tools que ejecuta el agente ---
+# Comparte las variables DB_POOL_* con el pool síncrono, pero cada pool tiene su propio tamaño.
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN", os.getenv("DB_POOL_MIN", "1")))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", os.getenv("DB_POOL_MAX", "10")))
+ASYNC_DB_POOL_TIMEOUT = float(os.getenv("ASYNC_DB_POOL_TIMEOUT", os.getenv("DB_POOL_TIMEOUT", "10")))
+
+_async_pool = None
+_async_pool_lock = asyncio.Lock()
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """Devuelve el pool asíncrono del proceso, abriéndolo en el primer uso."""
+    global _async_pool
+    if _async_pool is None:
+        async with _async_pool_lock:
+            if _async_pool is None:
+                logging.info(f"Abriendo pool asíncrono PostgreSQL (min={ASYNC_DB_POOL_MIN}, max={ASYNC_DB_POOL_MAX}).")
+                pool = AsyncConnectionPool(
+                    conninfo=make_conninfo(**db_connection_params),
+                    min_size=ASYNC_DB_POOL_MIN,
+                    max_size=ASYNC_DB_POOL_MAX,
+                    timeout=ASYNC_DB_POOL_TIMEOUT,
+                    check=AsyncConnectionPool.check_connection,  # Valida la conexión en cada checkout
+                    open=False,
+                )
+                await pool.open()
+                _async_pool = pool
+    return _async_pool
+
+
+@asynccontextmanager
+async def async_db_connection():
+    """
+    Versión asíncrona de db_connection(). Al salir del bloque la conexión vuelve al pool:
+    se hace commit si no hubo excepción y rollback en caso contrario.
+    """
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+def get_async_pool_stats() -> dict:
+    """Estadísticas del pool asíncrono (vacío si aún no se abrió)."""
+    return _async_pool.get_stats() if _async_pool is not None else {}
+
+
+async def close_async_pool():
+    """Cierra el pool asíncrono (se llama al apagar la aplicación)."""
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+        logging.info("Pool asíncrono PostgreSQL cerrado.")
@@ -0,0 +1,338 @@
+"""
+Versiones asíncronas (psycopg 3) de las funciones CRUD usadas por las tools del agente.
+
+Reutilizan las consultas, constantes y funciones de formato de crud.py, de modo que
+las respuestas son idénticas a las de la versión síncrona, que sigue disponible para scripts.
+El trabajo bloqueante que no es de base de datos (API de lluvia, modelo, WhatsApp)
+se ejecuta en un hilo con asyncio.to_thread para no bloquear el event loop.
+"""
+import asyncio
+import logging
+from datetime import datetime
+import psycopg
+import psycopg.errors
+from app.database import crud
+from app.database.async_connection import async_db_connection
+from app.database.facility_catalog import get_facility_catalog
+from app.notifications.whatsapp import send_whatsapp_message
+
+
+async def _aget_user_booking_history(conn, session_id: str) -> tuple:
+    """Versión asíncrona de crud._get_user_booking_history."""
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute(crud.SQL_ESTADISTICAS_CLIENTE, (session_id,))
+            fila = await cur.fetchone()
+        return tuple(fila) if fila else (0, 0)
+    except Exception as e:
+        logging.error(f"Error al obtener historial de usuario: {e}")
+        return 0, 0
+
+
+async def _acheck_availability(conn, facility_name: str, date_str: str, time_str: str) -> str:
+    """Versión asíncrona de crud._check_availability sobre una conexión ya abierta."""
+    MADRID_TZ = crud._get_madrid_tz()
+
+    catalogo = await get_facility_catalog().asnapshot()
+    id_instalacion = catalogo.id_of(facility_name)
+    if id_instalacion is None:
+        logging.warning(f"Instalación no encontrada en el catálogo: {facility_name}")
+        return crud._invalid_facility_error(catalogo)
+
+    try:
+        requested_start_dt, requested_end_dt = crud._parse_requested_slot(date_str, time_str, MADRID_TZ)
+        now_madrid = datetime.now(MADRID_TZ)
+    except ValueError:
+        logging.error(f"Error de formato al parsear fecha/hora: {date_str} {time_str}")
+        return "ERROR: Formato invalido"
+
+    if requested_start_dt < now_madrid:
+        logging.warning("Intento de consulta en el pasado.")
+        return "ERROR: Fecha pasada"
+
+    async with conn.cursor() as cur:
+        await cur.execute(crud.SQL_RESERVA_SOLAPADA, (id_instalacion, requested_start_dt, requested_end_dt))
+        result = await cur.fetchone()
+
+    if not result:
+        logging.info(f"Slot solicitado ({time_str}) está DISPONIBLE.")
+        return "ESTADO: Disponible"
+
+    booking_id, prob_cancelacion = result
+    logging.info(f"Slot solicitado ({time_str}) está OCUPADO. Buscando alternativas...")
+    requested_date = requested_start_dt.date()
+    async with conn.cursor() as cur:
+        await cur.execute(crud.SQL_RESERVAS_DEL_DIA, (id_instalacion, *crud._day_bounds(requested_date, MADRID_TZ)))
+        booked_slots = await cur.fetchall()
+
+    available_slots_str = crud._find_alternative_slots(booked_slots, requested_date, now_madrid, MADRID_TZ)
+    return crud._format_occupied_status(prob_cancelacion, available_slots_str)
+
+
+# --- Funciones Principales CRUD asíncronas (para las Tools) ---
+
+async def aget_available_facilities_db(filtro_tipo: str = None, **kwargs) -> str:
+    """Versión asíncrona de crud.get_available_facilities_db."""
+    logging.info(f"aget_available_facilities_db recibió: filtro_tipo={filtro_tipo}, kwargs={kwargs}")
+    catalogo = await get_facility_catalog().asnapshot()
+    if not catalogo.facilities:
+        return "ERROR: Problema tecnico DB al listar instalaciones"
+    respuesta = crud._format_facilities(catalogo, filtro_tipo)
+    logging.info(f"Resultado (catálogo): {respuesta}")
+    return respuesta
+
+
+async def acheck_availability_db(facility_name: str, date_str: str, time_str: str) -> str:
+    """Versión asíncrona de crud.check_availability_db (mismos strings de respuesta)."""
+    logging.info(f"--- Ejecutando acheck_availability_db ---")
+    logging.info(f"Recibido: Instalación='{facility_name}', Fecha='{date_str}', Hora='{time_str}'")
+
+    try:
+        async with async_db_connection() as conn:
+            return await _acheck_availability(conn, facility_name, date_str, time_str)
+    except psycopg.Error as e:
+        logging.error(f"Error de base de datos en acheck_availability: {e}")
+        return "ERROR: Problema tecnico DB"
+    except Exception as e:
+        logging.error(f"Error inesperado en acheck_availability: {e}", exc_info=True)
+        return "ERROR: Inesperado"
+
+
+async def acheck_availability_multi_db(date_str: str, time_from: str, time_to: str = None,
+                                       facility_type: str = None, facility_names: list = None, **kwargs) -> str:
+    """Versión asíncrona de crud.check_availability_multi_db (mismos strings de respuesta)."""
+    logging.info(f"--- Ejecutando acheck_availability_multi_db ---")
+    logging.info(f"Recibido: Tipo='{facility_type}', Instalaciones={facility_names}, Fecha='{date_str}', Ventana='{time_from}'-'{time_to}'")
+
+    if not facility_type and not facility_names:
+        return "ERROR: Indica un tipo de instalacion o una lista de instalaciones"
+
+    MADRID_TZ = crud._get_madrid_tz()
+    try:
+        requested_date, desde, hasta = crud._parse_time_window(date_str, time_from, time_to)
+    except ValueError:
+        logging.error(f"Error de formato al parsear fecha/ventana: {date_str} {time_from}-{time_to}")
+        return "ERROR: Formato invalido"
+
+    now_madrid = datetime.now(MADRID_TZ)
+    if requested_date < now_madrid.date():
+        return "ERROR: Fecha pasada"
+
+    try:
+        catalogo = await get_facility_catalog().asnapshot()
+        ids_instalacion = crud._resolve_facility_ids(catalogo, facility_type, facility_names)
+        if not ids_instalacion:
+            return crud._no_match_error(catalogo)
+
+        async with async_db_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(crud.SQL_OCUPACION_INSTALACIONES,
+                                  crud._multi_availability_params(requested_date, requested_date, ids_instalacion, MADRID_TZ))
+                rows = await cur.fetchall()
+
+        return crud._format_multi_availability(rows, requested_date, desde, hasta, now_madrid, MADRID_TZ)
+
+    except psycopg.Error as e:
+        logging.error(f"Error de base de datos en acheck_availability_multi_db: {e}")
+        return "ERROR: Problema tecnico DB"
+    except Exception as e:
+        logging.error(f"Error inesperado en acheck_availability_multi_db: {e}", exc_info=True)
+        return "ERROR: Inesperado"
+
+
+async def acheck_availability_range_db(date_from: str, date_to: str = None, facility_type: str = None,
+                                       facility_names: list = None, time_from: str = None, time_to: str = None, **kwargs) -> str:
+    """Versión asíncrona de crud.check_availability_range_db (mismos strings de respuesta)."""
+    logging.info(f"--- Ejecutando acheck_availability_range_db ---")
+    logging.info(f"Recibido: Tipo='{facility_type}', Instalaciones={facility_names}, Rango='{date_from}'-'{date_to}', Franja='{time_from}'-'{time_to}'")
+
+    if not facility_type and not facility_names:
+        return "ERROR: Indica un tipo de instalacion o una lista de instalaciones"
+
+    MADRID_TZ = crud._get_madrid_tz()
+    try:
+        fechas = crud._parse_date_range(date_from, date_to)
+        if time_from or time_to:
+            crud._parse_time_window(date_from, time_from or "00:00", time_to or "23:59")
+    except ValueError:
+        logging.error(f"Rango inválido: {date_from}-{date_to} {time_from}-{time_to}")
+        return f"ERROR: Rango invalido | Fechas AAAA-MM-DD, horas HH:MM, máximo {crud.MAX_DIAS_RANGO} días"
+
+    now_madrid = datetime.now(MADRID_TZ)
+    if fechas[-1] < now_madrid.date():
+        return "ERROR: Fecha pasada"
+
+    try:
+        catalogo = await get_facility_catalog().asnapshot()
+        ids_instalacion = crud._resolve_facility_ids(catalogo, facility_type, facility_names)
+        if not ids_instalacion:
+            return crud._no_match_error(catalogo)
+
+        async with async_db_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(crud.SQL_OCUPACION_INSTALACIONES,
+                                  crud._multi_availability_params(fechas[0], fechas[-1], ids_instalacion, MADRID_TZ))
+                rows = await cur.fetchall()
+
+        return crud._format_range_availability(rows, fechas, time_from, time_to, now_madrid, MADRID_TZ)
+
+    except psycopg.Error as e:
+        logging.error(f"Error de base de datos en acheck_availability_range_db: {e}")
+        return "ERROR: Problema tecnico DB"
+    except Exception as e:
+        logging.error(f"Error inesperado en acheck_availability_range_db: {e}", exc_info=True)
+        return "ERROR: Inesperado"
+
+
+async def amake_reservation_db(facility_name: str, date_str: str, time_str: str, user_name: str, session_id: str = None) -> str:
+    """Versión asíncrona de crud.make_reservation_db (mismo flujo: trabajo lento fuera de la transacción corta)."""
+    logging.info(f"--- Ejecutando amake_reservation_db ---")
+    logging.info(f"Recibido: Inst: '{facility_name}', Fecha: '{date_str}', Hora: '{time_str}', Usr: '{user_name}', Session: '{session_id}'")
+
+    if not session_id:
+        logging.error("Error: No se proporcionó número de teléfono (session_id)")
+        return "ERROR: Reserva Fallida - Se requiere un número de teléfono válido para realizar la reserva."
+
+    MADRID_TZ = crud._get_madrid_tz()
+
+    try:
+        # PASO 1: Verificación previa e historial del cliente (conexión corta, sin locks)
+        async with async_db_connection() as conn:
+            availability_status = await _acheck_availability(conn, facility_name, date_str, time_str)
+            is_overbooking = availability_status.startswith("ESTADO: Ocupado | Overbooking Posible")
+
+            if not is_overbooking and availability_status != "ESTADO: Disponible":
+                logging.warning(f"Intento de reserva fallido por no disponibilidad/error: {availability_status}")
+                return f"ERROR: Reserva Fallida - {availability_status}"
+
+            reservas_previas, cancelaciones_previas = await _aget_user_booking_history(conn, session_id)
+
+        # PASO 2: Datos para el INSERT
+        id_instalacion = get_facility_catalog().current().id_of(facility_name)
+        if id_instalacion is None:
+            return f"ERROR: Reserva Fallida - No se encontró ID para '{facility_name}' (esto no debería pasar)."
+
+        try:
+            start_dt, end_dt = crud._parse_requested_slot(date_str, time_str, MADRID_TZ)
+        except ValueError:
+            logging.error(f"Error de formato al parsear fecha/hora para INSERT: {date_str} {time_str}")
+            return "ERROR: Reserva Fallida - Formato de fecha/hora inválido para guardar."
+
+        # PASO 3: Features y probabilidad de cancelación (lluvia y modelo) en un hilo, sin conexión abierta
+        try:
+            features = await asyncio.to_thread(
+                crud._build_features, id_instalacion, date_str, time_str, reservas_previas, cancelaciones_previas
+            )
+            prob_cancelacion, version_modelo = await asyncio.to_thread(crud._predict_cancellation_probability, features)
+            logging.info(f"Probabilidad de cancelación calculada: {prob_cancelacion:.2%} (modelo {version_modelo})")
+        except Exception as e:
+            logging.error(f"Error al calcular probabilidad de cancelación: {e}")
+            prob_cancelacion, version_modelo = 0.0, None
+            features = crud.DEFAULT_FEATURES
+
+        # PASO 4: Transacción corta: lock del slot, nueva verificación e INSERT
+        async with async_db_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(crud.SQL_BLOQUEO_SLOT, crud._slot_lock_key(id_instalacion, start_dt))
+                await cur.execute(crud.SQL_RESERVA_SOLAPADA, (id_instalacion, start_dt, end_dt))
+                decision = crud._decide_booking(is_overbooking, await cur.fetchone())
+                if isinstance(decision, str):
+                    await conn.rollback()
+                    logging.warning(f"Slot ocupado durante la reserva: {facility_name} {date_str} {time_str}")
+                    return decision
+                is_overbooking, original_booking_id = decision
+
+                await cur.execute(crud.SQL_INSERTAR_RESERVA, crud._reservation_insert_params(
+                    id_instalacion, user_name, session_id, start_dt, end_dt, datetime.now(MADRID_TZ),
+                    is_overbooking, prob_cancelacion, features, original_booking_id, version_modelo
+                ))
+                booking_id = (await cur.fetchone())[0]
+            await conn.commit()
+
+        return crud._format_reservation_result(booking_id, user_name, is_overbooking)
+
+    except psycopg.errors.ExclusionViolation:
+        logging.warning(f"Reserva rechazada por la restricción de exclusión: {facility_name} {date_str} {time_str}")
+        return crud.SLOT_RECIEN_OCUPADO
+    except psycopg.Error as e:
+        logging.error(f"Error de base de datos al realizar reserva: {e}")
+        return "ERROR: Problema tecnico DB al reservar"
+    except Exception as e:
+        logging.error(f"Error inesperado en amake_reservation_db: {e}", exc_info=True)
+        return "ERROR: Inesperado al reservar"
+
+
+async def acancel_reservation_db(session_id: str = None, **kwargs) -> str:
+    """Versión asíncrona de crud.cancel_reservation_db."""
+    logging.info(f"--- Ejecutando acancel_reservation_db ---")
+    logging.info(f"Usando teléfono: {session_id}")
+
+    if not session_id:
+        logging.error("Error en acancel_reservation_db: No se proporcionó session_id.")
+        return "ERROR_CANCELACION: No se pudo buscar las reservas. Falta el identificador de sesión."
+
+    MADRID_TZ = crud._get_madrid_tz()
+
+    try:
+        async with async_db_connection() as conn:
+            now = datetime.now(MADRID_TZ)
+            async with conn.cursor() as cur:
+                await cur.execute(crud.SQL_RESERVAS_FUTURAS_CLIENTE, (session_id, now))
+                future_bookings = await cur.fetchall()
+
+        return crud._format_future_bookings(future_bookings, MADRID_TZ)
+
+    except psycopg.Error as e:
+        logging.error(f"Error de base de datos al buscar reservas: {e}")
+        return "ERROR_CANCELACION: No se pudo buscar las reservas. Motivo: Error técnico en la base de datos."
+    except Exception as e:
+        logging.error(f"Error inesperado en acancel_reservation_db: {e}", exc_info=True)
+        return "ERROR_CANCELACION: No se pudo buscar las reservas. Motivo: Error inesperado."
+
+
+async def aconfirm_cancel_reservation(booking_id: str, session_id: str = None, **kwargs) -> str:
+    """Versión asíncrona de crud.confirm_cancel_reservation."""
+    logging.info(f"--- Ejecutando aconfirm_cancel_reservation ---")
+    logging.info(f"Recibido: Booking ID='{booking_id}', Teléfono='{session_id}'")
+
+    MADRID_TZ = crud._get_madrid_tz()
+
+    try:
+        async with async_db_connection() as conn:
+            now = datetime.now(MADRID_TZ)
+            async with conn.cursor() as cur:
+                await cur.execute(crud.SQL_RESERVA_CANCELABLE, (booking_id, session_id, now))
+                booking = await cur.fetchone()
+
+                if not booking:
+                    return "ERROR_CANCELACION: No se pudo cancelar la reserva. Motivo: La reserva no existe, no pertenece a tu número, ya ha pasado o ya está cancelada."
+
+                await cur.execute(crud.SQL_OVERBOOKINGS_PENDIENTES, (booking_id,))
+                overbookings = await cur.fetchall()
+
+                await cur.execute(crud.SQL_CANCELAR_RESERVA, (booking_id,))
+
+                overbookings, en_espera = crud._split_overbookings(overbookings)
+                if overbookings:
+                    overbooking_ids = [o[0] for o in overbookings]
+                    await cur.execute(crud.SQL_CONFIRMAR_OVERBOOKINGS, (overbooking_ids,))
+                    if en_espera:
+                        await cur.execute(crud.SQL_REASIGNAR_OVERBOOKINGS, (overbooking_ids[0], [o[0] for o in en_espera]))
+            await conn.commit()
+
+        # Notificaciones por WhatsApp (HTTP bloqueante) fuera del event loop
+        for ov_id, ov_user, ov_phone, ov_facility, ov_start_dt in overbookings:
+            try:
+                message_text = crud._overbooking_confirmed_message(ov_user, ov_facility, ov_start_dt, MADRID_TZ)
+                await asyncio.to_thread(send_whatsapp_message, ov_phone, message_text)
+            except Exception as e:
+                logging.error(f"No se pudo enviar la notificación de overbooking confirmado para la reserva {ov_id}: {e}")
+
+        return crud._format_cancelled_result(booking_id, booking, MADRID_TZ)
+
+    except psycopg.Error as e:
+        logging.error(f"Error de base de datos al cancelar reserva: {e}")
+        return "ERROR_CANCELACION: No se pudo cancelar la reserva. Motivo: Error técnico en la base de datos."
+    except Exception as e:
+        logging.error(f"Error inesperado en aconfirm_cancel_reservation: {e}", exc_info=True)
+        return "ERROR_CANCELACION: No se pudo cancelar la reserva. Motivo: Error inesperado."
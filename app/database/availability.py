@@ -0,0 +1,210 @@
+"""
+Motor de disponibilidad basado en mapas de bits de ocupación.
+
+Cada día de una instalación se representa con un entero de Python en el que el bit i
+indica si la celda i (de RESOLUCION_MINUTOS minutos, contando desde la hora de apertura)
+está ocupada por alguna reserva confirmada. Con 5 minutos de resolución una jornada de
+8:00 a 22:00 son 168 bits, así que las operaciones sobre el día completo son unas pocas
+operaciones de enteros, sin importar cuántas reservas haya ni la duración del slot.
+
+Los mapas se construyen a partir de las filas de una sola consulta
+(crud.SQL_OCUPACION_INSTALACIONES) que puede abarcar varias instalaciones y varios días,
+por lo que lo pueden reutilizar todas las tools que necesiten saber qué está libre u ocupado.
+"""
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+# Granularidad del mapa: los slots de 30, 60 o 90 minutos son múltiplos exactos
+RESOLUCION_MINUTOS = 5
+
+
+def _celdas_jornada(hora_inicio: int, hora_fin: int) -> int:
+    return (hora_fin - hora_inicio) * 60 // RESOLUCION_MINUTOS
+
+
+def _minutos_locales(dt: datetime, dia: date, madrid_tz) -> int:
+    """Minutos de reloj desde la medianoche de `dia` (negativo si es de un día anterior)."""
+    if dt.tzinfo is None:
+        dt = madrid_tz.localize(dt)
+    else:
+        dt = dt.astimezone(madrid_tz)
+    return (dt.date() - dia).days * 1440 + dt.hour * 60 + dt.minute
+
+
+def _to_local_date(dt: datetime, madrid_tz) -> date:
+    if dt.tzinfo is None:
+        return dt.date()
+    return dt.astimezone(madrid_tz).date()
+
+
+def marcar_ocupado(mapa: int, dia: date, inicio: datetime, fin: datetime, madrid_tz,
+                   hora_inicio: int, hora_fin: int) -> int:
+    """Devuelve el mapa con las celdas que toca la reserva [inicio, fin) puestas a 1."""
+    apertura = hora_inicio * 60
+    total = _celdas_jornada(hora_inicio, hora_fin)
+    # Redondeo hacia fuera: una reserva que cubre parte de una celda la ocupa entera
+    primera = max((_minutos_locales(inicio, dia, madrid_tz) - apertura) // RESOLUCION_MINUTOS, 0)
+    ultima = min(-(-(_minutos_locales(fin, dia, madrid_tz) - apertura) // RESOLUCION_MINUTOS), total)
+    if ultima <= primera:
+        return mapa
+    return mapa | (((1 << (ultima - primera)) - 1) << primera)
+
+
+def construir_mapas(filas, fechas, madrid_tz, hora_inicio: int, hora_fin: int) -> dict:
+    """
+    Construye los mapas de ocupación a partir de filas (id_instalacion, inicio, fin).
+    Devuelve {(id_instalacion, fecha): mapa}; las claves sin reservas no aparecen (mapa 0).
+    """
+    fechas = set(fechas)
+    mapas = {}
+    for id_instalacion, inicio, fin in filas:
+        # Una reserva puede cruzar la medianoche: se marca en cada día que toca
+        dia = _to_local_date(inicio, madrid_tz)
+        dia_fin = _to_local_date(fin, madrid_tz)
+        while dia <= dia_fin:
+            if dia in fechas:
+                clave = (id_instalacion, dia)
+                mapas[clave] = marcar_ocupado(mapas.get(clave, 0), dia, inicio, fin, madrid_tz, hora_inicio, hora_fin)
+            dia += timedelta(days=1)
+    return mapas
+
+
+def mapa_ocupacion(reservas, dia: date, madrid_tz, hora_inicio: int, hora_fin: int) -> int:
+    """Mapa de un único día a partir de pares (inicio, fin), p. ej. las filas de SQL_RESERVAS_DEL_DIA."""
+    mapa = 0
+    for inicio, fin in reservas:
+        mapa = marcar_ocupado(mapa, dia, inicio, fin, madrid_tz, hora_inicio, hora_fin)
+    return mapa
+
+
+def _minuto_a_celda(minuto: int, hora_inicio: int) -> int:
+    """Primera celda que empieza en `minuto` o después (redondeo hacia arriba)."""
+    return -(-(minuto - hora_inicio * 60) // RESOLUCION_MINUTOS)
+
+
+@lru_cache(maxsize=64)
+def rejilla_inicios(hora_inicio: int, hora_fin: int, duracion_minutos: int, paso_minutos: int) -> int:
+    """
+    Rejilla de slots compartida por todas las consultas: máscara con un 1 en cada celda donde
+    puede empezar un slot de `duracion_minutos` (múltiplo de `paso_minutos` desde la apertura
+    y terminando, como tarde, a la hora de cierre). Se calcula una vez por combinación.
+    """
+    total = _celdas_jornada(hora_inicio, hora_fin)
+    largo = duracion_minutos // RESOLUCION_MINUTOS
+    paso = max(paso_minutos // RESOLUCION_MINUTOS, 1)
+    rejilla = 0
+    for celda in range(0, total - largo + 1, paso):
+        rejilla |= 1 << celda
+    return rejilla
+
+
+def inicios_libres(mapa: int, duracion_minutos: int, paso_minutos: int, hora_inicio: int, hora_fin: int,
+                   desde_minuto: int = 0, hasta_minuto: int = None) -> int:
+    """
+    Máscara con el bit i a 1 si un slot de `duracion_minutos` que empieza en la celda i
+    cabe entero en huecos libres, está en la rejilla de inicios y empieza dentro de
+    [desde_minuto, hasta_minuto] (minutos desde la medianoche; p. ej. para excluir el pasado).
+    """
+    total = _celdas_jornada(hora_inicio, hora_fin)
+    largo = duracion_minutos // RESOLUCION_MINUTOS
+    if largo <= 0 or largo > total:
+        return 0
+
+    libres = ~mapa & ((1 << total) - 1)
+    # Tras el bucle, el bit i sigue a 1 solo si las celdas i..i+largo-1 están libres.
+    # Cada vuelta duplica la longitud comprobada: O(log largo) operaciones de enteros.
+    cubiertas = 1
+    while cubiertas < largo:
+        salto = min(cubiertas, largo - cubiertas)
+        libres &= libres >> salto
+        cubiertas += salto
+    libres &= rejilla_inicios(hora_inicio, hora_fin, duracion_minutos, paso_minutos)
+
+    primera = max(_minuto_a_celda(desde_minuto, hora_inicio), 0)
+    libres &= ~((1 << primera) - 1)
+    if hasta_minuto is not None:
+        ultima = (hasta_minuto - hora_inicio * 60) // RESOLUCION_MINUTOS
+        libres &= (1 << max(ultima + 1, 0)) - 1
+    return libres
+
+
+def _celda_a_minuto(celda: int, hora_inicio: int) -> int:
+    return hora_inicio * 60 + celda * RESOLUCION_MINUTOS
+
+
+def _hhmm(minuto: int) -> str:
+    return f"{minuto // 60:02d}:{minuto % 60:02d}"
+
+
+def _bits(mascara: int):
+    """Índices de los bits a 1, de menor a mayor."""
+    while mascara:
+        bajo = mascara & -mascara
+        yield bajo.bit_length() - 1
+        mascara ^= bajo
+
+
+def celdas_a_horas(mascara: int, hora_inicio: int) -> list[str]:
+    """Convierte los bits a 1 de una máscara en horas 'HH:MM' (sin crear datetimes)."""
+    return [_hhmm(_celda_a_minuto(celda, hora_inicio)) for celda in _bits(mascara)]
+
+
+def ventanas_libres(mascara: int, duracion_minutos: int, paso_minutos: int, hora_inicio: int) -> list[tuple[int, int]]:
+    """
+    Agrupa inicios libres consecutivos (separados exactamente por `paso_minutos`) en ventanas
+    (minuto_inicio, minuto_fin), donde minuto_fin es el final del último slot de la ventana.
+    Ej.: slots de 60 min libres a las 08, 09 y 10 -> (480, 660), es decir 08:00-11:00.
+    """
+    ventanas = []
+    for celda in _bits(mascara):
+        inicio = _celda_a_minuto(celda, hora_inicio)
+        if ventanas and inicio - ventanas[-1][2] == paso_minutos:
+            ventanas[-1][1] = inicio + duracion_minutos
+            ventanas[-1][2] = inicio
+        else:
+            ventanas.append([inicio, inicio + duracion_minutos, inicio])
+    return [(inicio, fin) for inicio, fin, _ in ventanas]
+
+
+def formatear_ventanas(ventanas: list[tuple[int, int]]) -> str:
+    """'08:00-11:00, 15:00-22:00'"""
+    return ", ".join(f"{_hhmm(inicio)}-{_hhmm(fin)}" for inicio, fin in ventanas)
+
+
+def _desde_minuto(ahora: datetime, dia: date, madrid_tz) -> int:
+    """Primer minuto del día en el que todavía puede empezar un slot (0 si el día es futuro)."""
+    desde = _minutos_locales(ahora, dia, madrid_tz)
+    if ahora.second or ahora.microsecond:
+        desde += 1  # 10:00:30 ya no admite el slot de las 10:00
+    return max(desde, 0)
+
+
+def inicios_libres_desde(mapa: int, dia: date, ahora: datetime, madrid_tz, hora_inicio: int, hora_fin: int,
+                         duracion_minutos: int, paso_minutos: int = None,
+                         desde_minuto: int = 0, hasta_minuto: int = None) -> int:
+    """inicios_libres descartando además los slots que ya empezaron respecto a `ahora`."""
+    desde = max(_desde_minuto(ahora, dia, madrid_tz), desde_minuto)
+    if desde >= hora_fin * 60:
+        return 0
+    return inicios_libres(mapa, duracion_minutos, paso_minutos or duracion_minutos,
+                          hora_inicio, hora_fin, desde_minuto=desde, hasta_minuto=hasta_minuto)
+
+
+def slots_libres(mapa: int, dia: date, ahora: datetime, madrid_tz, hora_inicio: int, hora_fin: int,
+                 duracion_minutos: int, paso_minutos: int = None,
+                 desde_minuto: int = 0, hasta_minuto: int = None) -> list[str]:
+    """
+    Horas 'HH:MM' en las que empieza un slot libre de `duracion_minutos` el día `dia`.
+    Por defecto los slots empiezan cada `duracion_minutos` desde la apertura; con
+    `paso_minutos` se pueden ofrecer, p. ej., slots de 90 minutos cada 30.
+    """
+    return celdas_a_horas(inicios_libres_desde(mapa, dia, ahora, madrid_tz, hora_inicio, hora_fin, duracion_minutos,
+                                               paso_minutos, desde_minuto, hasta_minuto), hora_inicio)
+
+
+def rango_consulta(fecha_desde: date, fecha_hasta: date, madrid_tz) -> tuple:
+    """Límites [00:00 de fecha_desde, 00:00 del día siguiente a fecha_hasta) para SQL_OCUPACION_INSTALACIONES."""
+    inicio = madrid_tz.localize(datetime.combine(fecha_desde, datetime.min.time()))
+    fin = madrid_tz.localize(datetime.combine(fecha_hasta + timedelta(days=1), datetime.min.time()))
+    return inicio, fin
+
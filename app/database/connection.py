@@ -1,6 +1,11 @@
 import os
-import psycopg2
+import time
 import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -61,3 +66,192 @@ def get_db_connection():
         logging.error(f"Error general de Psycopg2 al conectar: {e}")
         raise 
 
+
+
+# --- Pool de conexiones compartido por todo el proceso ---
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # Segundos máximos esperando una conexión libre
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))  # Segundos de inactividad tras los que se valida la conexión
+
+
+class PooledConnectionProvider:
+    """
+    Pool de conexiones PostgreSQL seguro para hilos.
+
+    Envuelve `psycopg2.pool.ThreadedConnectionPool` añadiendo:
+    - Espera acotada (con timeout) cuando todas las conexiones están en uso,
+      en lugar de fallar inmediatamente con PoolError.
+    - Validación (`SELECT 1`) de las conexiones que llevan tiempo inactivas.
+    - Estadísticas de uso (en uso, esperando, tiempo de espera) para dimensionarlo.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, healthcheck_idle: float, **conn_params):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **conn_params)
+        # El semáforo garantiza que nunca se pidan más conexiones de las que el pool puede dar
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}  # id(conn) -> instante de la última devolución al pool
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def getconn(self):
+        """Obtiene una conexión sana del pool, esperando como máximo `timeout` segundos."""
+        start = time.perf_counter()
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.timeout)
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self._timeouts += 1
+        if not acquired:
+            logging.error(f"Timeout esperando conexión del pool tras {waited:.2f}s (max={self.maxconn}).")
+            raise pg_pool.PoolError("No hay conexiones libres en el pool de base de datos.")
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def _checkout_healthy(self):
+        """Saca conexiones del pool descartando las cerradas o que no responden."""
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if conn.closed:
+                self._discard(conn)
+                continue
+            last_used = self._last_used.get(id(conn))
+            if last_used is not None and time.monotonic() - last_used < self.healthcheck_idle:
+                return conn
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+                return conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                logging.warning(f"Conexión del pool no válida, se descarta: {e}")
+                self._discard(conn)
+        raise psycopg2.OperationalError("No se pudo obtener una conexión válida del pool.")
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        with self._lock:
+            self._discarded += 1
+        self._pool.putconn(conn, close=True)
+
+    def putconn(self, conn):
+        """Devuelve una conexión al pool, deshaciendo cualquier transacción abierta."""
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error as e:
+                    logging.warning(f"No se pudo hacer rollback al devolver la conexión, se descarta: {e}")
+                    self._discard(conn)
+                    return
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """Devuelve las estadísticas actuales del pool."""
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_avg_ms": (self._wait_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                "wait_max_ms": self._wait_max * 1000,
+            }
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_init_lock = threading.Lock()
+
+
+def get_pool() -> PooledConnectionProvider:
+    """Devuelve el pool del proceso, creándolo en el primer uso."""
+    global _pool
+    if _pool is None:
+        with _pool_init_lock:
+            if _pool is None:
+                logging.info(f"Creando pool de conexiones PostgreSQL (min={DB_POOL_MIN}, max={DB_POOL_MAX}).")
+                _pool = PooledConnectionProvider(
+                    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_IDLE,
+                    **db_connection_params
+                )
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """
+    Context manager que toma prestada una conexión del pool y la devuelve al salir.
+    Si el bloque lanza una excepción se hace rollback; el commit es responsabilidad de quien llama.
+
+    Ejemplo:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(...)
+            conn.commit()
+    """
+    provider = get_pool()
+    conn = provider.getconn()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        provider.putconn(conn)
+
+
+def get_pool_stats() -> dict:
+    """Estadísticas del pool (en uso, esperando, tiempos de espera). Vacío si aún no se creó."""
+    return _pool.stats() if _pool is not None else {}
+
+
+def close_pool():
+    """Cierra todas las conexiones del pool (se llama al apagar la aplicación)."""
+    global _pool
+    with _pool_init_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            logging.info("Pool de conexiones PostgreSQL cerrado.")
@@ -1,223 +1,505 @@
 import logging
 import psycopg2
+import psycopg2.errors
 from psycopg2 import sql
 from datetime import datetime, timedelta, time, timezone
 import pytz
-from .connection import get_db_connection
-import pickle
-import requests
+from .connection import db_connection
+from .facility_catalog import get_facility_catalog, normalizar
+from . import availability
 import json
 import os
-from pathlib import Path
+from app.ml.calendario import get_calendario
+from app.ml.registry import get_model_registry
+from app.ml.weather import get_weather_provider
 from app.notifications.whatsapp import send_whatsapp_message
 
-# Lista global para caché simple de instalaciones (opcional pero útil)
-# Se recomienda poblarla al inicio de la aplicación llamando a get_available_facilities_db
-ALL_FACILITIES_CACHE = []
-
 # Configuración básica de logging (puedes tener una configuración centralizada)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Lista de feriados de Madrid
-FERIADOS_MADRID = [
-    "2024-12-25",
-    "2025-01-01",
-    "2025-01-06",
-    "2025-04-17",
-    "2025-04-18",
-    "2025-05-01",
-    "2025-05-02",
-    "2025-05-15",
-    "2025-07-25",
-    "2025-08-15",
-    "2025-11-01",
-    "2025-11-10",
-    "2025-12-06",
-    "2025-12-08",
-    "2025-12-25",
-]
+# === Variables Configurables (compartidas por la versión síncrona y la asíncrona en async_crud.py) ===
+HORA_INICIO_OPERACION = 8
+HORA_FIN_OPERACION = 22
+DURACION_SLOT_MINUTOS = 60
+UMBRAL_OVERBOOKING = 0.65  # 65% de probabilidad de cancelación
+MAX_DIAS_RANGO = 14  # Días máximos de una consulta de disponibilidad por rango
+
+# --- Consultas SQL (texto plano para poder usarlas tanto con psycopg2 como con psycopg 3) ---
+
+# Historial del cliente para las features del modelo: una fila por clave primaria,
+# mantenida por triggers sobre public.reservas (ver sql/cliente_estadisticas.sql).
+SQL_ESTADISTICAS_CLIENTE = """
+    SELECT n_confirmadas, n_canceladas
+    FROM public.cliente_estadisticas
+    WHERE ds_telefono = %s
+"""
+
+# Las consultas de solapamiento usan la columna rango_reserva (tstzrange) y el índice GiST
+# de la restricción excl_reservas_confirmadas_sin_solape (ver sql/rango_reservas_gist.sql).
+SQL_RESERVA_SOLAPADA = """
+    SELECT r.id_reserva, r.probabilidad_cancelacion
+    FROM public.reservas r
+    WHERE r.id_instalacion = %s
+    AND r.ds_estado = 'Confirmada'
+    AND r.rango_reserva && tstzrange(%s::timestamptz, %s::timestamptz, '[)')
+"""
+
+SQL_RESERVAS_DEL_DIA = """
+    SELECT dt_fechahora_inicio, dt_fechahora_fin
+    FROM public.reservas
+    WHERE id_instalacion = %s
+    AND ds_estado = 'Confirmada'
+    AND rango_reserva && tstzrange(%s::timestamptz, %s::timestamptz, '[)')
+    ORDER BY dt_fechahora_inicio;
+"""
+
+# Lock de transacción por (instalación, día AAAAMMDD): serializa solo las reservas
+# concurrentes de la misma instalación y día, y se libera solo al hacer COMMIT/ROLLBACK.
+SQL_BLOQUEO_SLOT = "SELECT pg_advisory_xact_lock(%s, %s)"
+
+SQL_INSERTAR_RESERVA = """
+    INSERT INTO public.reservas (
+        id_instalacion,
+        ds_nombre_cliente,
+        ds_telefono,
+        dt_fechahora_inicio,
+        dt_fechahora_fin,
+        dt_fechahora_creacion,
+        ds_estado,
+        ds_comentarios,
+        es_simulado,
+        probabilidad_cancelacion,
+        lluvia,
+        antelacion_dias,
+        reservas_previas,
+        cancelaciones_previas,
+        es_finde,
+        es_horario_pico,
+        es_feriado,
+        es_overbooking,
+        id_reserva_original,
+        ds_version_modelo
+    ) VALUES (
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+    )
+    RETURNING id_reserva
+"""
+
+SQL_RESERVAS_FUTURAS_CLIENTE = """
+    SELECT r.id_reserva, i.ds_nombre, r.dt_fechahora_inicio
+    FROM public.reservas r
+    JOIN public.instalaciones i ON r.id_instalacion = i.id_instalacion
+    WHERE r.ds_telefono = %s
+    AND r.ds_estado = 'Confirmada'
+    AND r.dt_fechahora_inicio > %s
+    ORDER BY r.dt_fechahora_inicio
+"""
+
+SQL_RESERVA_CANCELABLE = """
+    SELECT r.id_reserva, i.ds_nombre, r.dt_fechahora_inicio
+    FROM public.reservas r
+    JOIN public.instalaciones i ON r.id_instalacion = i.id_instalacion
+    WHERE r.id_reserva = %s
+    AND r.ds_telefono = %s
+    AND r.ds_estado = 'Confirmada'
+    AND r.dt_fechahora_inicio > %s
+"""
+
+SQL_OVERBOOKINGS_PENDIENTES = """
+    SELECT r.id_reserva, r.ds_nombre_cliente, r.ds_telefono, i.ds_nombre, r.dt_fechahora_inicio
+    FROM public.reservas r
+    JOIN public.instalaciones i ON r.id_instalacion = i.id_instalacion
+    WHERE r.id_reserva_original = %s
+    AND r.ds_estado = 'Pendiente'
+    AND r.es_overbooking = true
+    ORDER BY r.id_reserva
+"""
+
+SQL_CANCELAR_RESERVA = """
+    UPDATE public.reservas
+    SET ds_estado = 'Cancelada'
+    WHERE id_reserva = %s
+"""
+
+SQL_CONFIRMAR_OVERBOOKINGS = """
+    UPDATE public.reservas
+    SET ds_estado = 'Confirmada'
+    WHERE id_reserva = ANY(%s)
+"""
+
+# Varias instalaciones (resueltas por tipo o nombre con el catálogo) con sus reservas
+# confirmadas en un rango de días: una sola consulta para ConsultarDisponibilidadMultiple
+# (un día) y ConsultarDisponibilidadRango (varios).
+# El LEFT JOIN devuelve también las instalaciones sin reservas (inicio/fin a NULL).
+SQL_OCUPACION_INSTALACIONES = """
+    SELECT i.id_instalacion, i.ds_nombre, r.dt_fechahora_inicio, r.dt_fechahora_fin
+    FROM public.instalaciones i
+    LEFT JOIN public.reservas r
+        ON r.id_instalacion = i.id_instalacion
+        AND r.ds_estado = 'Confirmada'
+        AND r.rango_reserva && tstzrange(%s::timestamptz, %s::timestamptz, '[)')
+    WHERE i.id_instalacion = ANY(%s)
+    ORDER BY i.ds_nombre
+"""
+
+# Los overbookings que no se confirman pasan a depender del que sí se confirmó
+SQL_REASIGNAR_OVERBOOKINGS = """
+    UPDATE public.reservas
+    SET id_reserva_original = %s
+    WHERE id_reserva = ANY(%s)
+"""
+
+
+def _get_madrid_tz():
+    """Devuelve la zona horaria de Madrid (o UTC si no está disponible)."""
+    try:
+        return pytz.timezone('Europe/Madrid')
+    except pytz.exceptions.UnknownTimeZoneError:
+        logging.error("No se pudo encontrar la zona horaria 'Europe/Madrid'. Usando UTC.")
+        return pytz.utc
+
+
+def _to_madrid(dt, madrid_tz):
+    """Asegura que un datetime leído de la DB esté expresado en hora de Madrid."""
+    if dt.tzinfo is None:
+        return madrid_tz.localize(dt)
+    return dt.astimezone(madrid_tz)
+
 
 def _get_rain_probability(date_str: str) -> int:
-    """Obtiene la probabilidad de lluvia para una fecha específica usando OpenMeteo API."""
-    try:
-        # Coordenadas de Madrid
-        lat = 40.4168
-        lon = -3.7038
-        
-        # Construir URL para la API
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&daily=precipitation_probability_max&timezone=Europe%2FMadrid&start_date={date_str}&end_date={date_str}"
-        
-        response = requests.get(url)
-        data = response.json()
-        
-        # Obtener la probabilidad máxima de precipitación para el día
-        rain_prob = data['daily']['precipitation_probability_max'][0]
-        
-        # Convertir a binario (1 si hay probabilidad de lluvia > 30%, 0 en caso contrario)
-        return 1 if rain_prob > 30 else 0
-    except Exception as e:
-        logging.error(f"Error al obtener probabilidad de lluvia: {e}")
-        return 0
+    """Lluvia (0/1) de una fecha desde la caché de previsión (app/ml/weather.py), sin esperar a la red."""
+    return get_weather_provider().lluvia(date_str)
 
 def _get_user_booking_history(conn, session_id: str) -> tuple:
     """Obtiene el historial de reservas y cancelaciones de un usuario."""
     try:
         with conn.cursor() as cur:
-            # Obtener total de reservas previas
-            cur.execute("""
-                SELECT COUNT(*) FROM public.reservas 
-                WHERE ds_telefono = %s AND ds_estado = 'Confirmada'
-            """, (session_id,))
-            reservas_previas = cur.fetchone()[0]
-            
-            # Obtener total de cancelaciones previas
-            cur.execute("""
-                SELECT COUNT(*) FROM public.reservas 
-                WHERE ds_telefono = %s AND ds_estado = 'Cancelada'
-            """, (session_id,))
-            cancelaciones_previas = cur.fetchone()[0]
-            
-            return reservas_previas, cancelaciones_previas
+            cur.execute(SQL_ESTADISTICAS_CLIENTE, (session_id,))
+            fila = cur.fetchone()
+        # Cliente sin reservas todavía: no tiene fila
+        return tuple(fila) if fila else (0, 0)
     except Exception as e:
         logging.error(f"Error al obtener historial de usuario: {e}")
         return 0, 0
 
-def _calculate_features(conn, id_instalacion: int, date_str: str, time_str: str, session_id: str) -> dict:
-    """Calcula todos los features necesarios para el modelo."""
+def _build_features(id_instalacion: int, date_str: str, time_str: str, reservas_previas: int, cancelaciones_previas: int) -> dict:
+    """Construye el dict de features a partir del historial ya consultado (sin acceso a la DB)."""
     try:
         # Calcular antelación en días
         fecha_reserva = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
         antelacion_dias = (fecha_reserva - datetime.now()).days
-        
-        # Obtener historial de usuario
-        reservas_previas, cancelaciones_previas = _get_user_booking_history(conn, session_id)
-        
-        # Calcular si es fin de semana
-        es_finde = 1 if fecha_reserva.weekday() >= 5 else 0
-        
-        # Calcular si es horario pico
-        hora = fecha_reserva.hour
-        es_horario_pico = 1 if 18 <= hora <= 22 else 0
-        
-        # Calcular si es feriado
-        es_feriado = 1 if date_str in FERIADOS_MADRID else 0
-        
+
+        # Fin de semana, horario pico y festivo desde la tabla de calendario (app/ml/calendario.py)
+        calendario = get_calendario().features(fecha_reserva.date(), fecha_reserva.hour)
+
         # Obtener probabilidad de lluvia
         lluvia = _get_rain_probability(date_str)
-        
+
         return {
             'id_instalacion': id_instalacion,
             'antelacion_dias': antelacion_dias,
             'reservas_previas': reservas_previas,
             'cancelaciones_previas': cancelaciones_previas,
-            'es_finde': es_finde,
-            'es_horario_pico': es_horario_pico,
-            'es_feriado': es_feriado,
+            **calendario,
             'lluvia': lluvia
         }
     except Exception as e:
         logging.error(f"Error al calcular features: {e}")
         raise
 
-def _predict_cancellation_probability(features: dict) -> float:
-    """Realiza la predicción de probabilidad de cancelación usando el modelo."""
+# Features por defecto si falla el cálculo (la reserva se registra igualmente)
+DEFAULT_FEATURES = {
+    'antelacion_dias': 0,
+    'reservas_previas': 0,
+    'cancelaciones_previas': 0,
+    'es_finde': 0,
+    'es_horario_pico': 0,
+    'es_feriado': 0,
+    'lluvia': 0
+}
+
+def _predict_cancellation_probability(features: dict) -> tuple[float, str | None]:
+    """
+    Probabilidad de cancelación y versión del modelo que la calcula.
+    El modelo se sirve desde memoria (app/ml/registry.py); el orden de las features
+    es el de ML/columnas_modelo.json.
+    """
     try:
-        # Cargar el modelo
-        model_path = Path(__file__).parent.parent.parent / 'ML' / 'rf_cancelaciones.pkl'
-        with open(model_path, 'rb') as f:
-            model = pickle.load(f)
-        
-        # Preparar los datos en el orden correcto según columnas_modelo.json
-        feature_order = ["id_instalacion", "lluvia", "antelacion_dias", "reservas_previas", 
-                        "cancelaciones_previas", "es_finde", "es_horario_pico", "es_feriado"]
-        X = [[features[feature] for feature in feature_order]]
-        
-        # Realizar la predicción
-        proba = model.predict_proba(X)[0][1]  # Probabilidad de clase 1 (cancelación)
-        return float(proba)
+        return get_model_registry().predict(features)
     except Exception as e:
         logging.error(f"Error al predecir probabilidad de cancelación: {e}")
-        return 0.0
+        return 0.0, None
 
 # --- Funciones Auxiliares ---
 
-def _get_facility_id(conn, facility_name: str) -> int | None:
-    """Obtiene el ID de una instalación por su nombre. Asume conexión abierta."""
-    global ALL_FACILITIES_CACHE
-    # Primero verifica caché local para evitar DB hit si ya la tenemos
-    if not ALL_FACILITIES_CACHE:
-         # Si la caché está vacía, intenta llenarla (esto podría ser redundante si se llama al inicio)
-         logging.warning("Caché ALL_FACILITIES vacía, intentando poblar desde _get_facility_id...")
-         try:
-             with conn.cursor() as cur_cache:
-                cur_cache.execute("SELECT ds_nombre FROM public.instalaciones ORDER BY ds_nombre")
-                ALL_FACILITIES_CACHE = [row[0] for row in cur_cache.fetchall()]
-         except psycopg2.Error as e:
-             logging.error(f"Error al intentar poblar caché de instalaciones: {e}")
-             # No podemos continuar sin saber las instalaciones válidas
-             return None
-
-    # Validación con la caché (case-insensitive)
-    found_name = None
-    for fac_name in ALL_FACILITIES_CACHE:
-        if facility_name.lower() == fac_name.lower():
-            found_name = fac_name # Guardamos el nombre con las mayúsculas correctas de la DB
-            break
-
-    if not found_name:
-         logging.warning(f"Intento de obtener ID para instalación no listada/cacheada: {facility_name}")
-         return None
-
-    # Si el nombre es válido, obtenemos su ID
-    with conn.cursor() as cur:
-        query = sql.SQL("SELECT id_instalacion FROM public.instalaciones WHERE ds_nombre = %s")
-        cur.execute(query, (found_name,)) # Usamos el nombre encontrado con mayúsculas correctas
-        result = cur.fetchone()
-        return result[0] if result else None
+def _resolve_facility_ids(catalogo, facility_type: str | None, facility_names: list | None) -> list[int]:
+    """IDs de las instalaciones del tipo indicado y/o de la lista de nombres, sin repetir."""
+    ids = list(catalogo.ids_for_type(facility_type)) if facility_type else []
+    for name in facility_names or []:
+        id_instalacion = catalogo.id_of(name)
+        if id_instalacion is not None and id_instalacion not in ids:
+            ids.append(id_instalacion)
+    return ids
+
+def _invalid_facility_error(catalogo) -> str:
+    return f"ERROR: Instalacion no valida | Opciones: {catalogo.names_str('ninguna encontrada')}"
+
+def _no_match_error(catalogo) -> str:
+    return f"ERROR: Ninguna instalacion coincide | Tipos: {', '.join(catalogo.types)}"
+
+def _format_facilities(catalogo, filtro_tipo: str = None) -> str:
+    """Aplica el filtro (por tipo o parte del nombre, sin tildes) y construye la respuesta de ListarInstalaciones."""
+    facilities = catalogo.facilities
+    if filtro_tipo:
+        filtro = normalizar(filtro_tipo)
+        facilities = [f for f in facilities
+                      if filtro in normalizar(f.nombre) or (f.tipo and normalizar(f.tipo) in filtro)]
+    if not facilities:
+        return "No hay instalaciones configuradas en la base de datos."
+    # Devuelve solo la lista, el LLM la formateará
+    return ', '.join(f.nombre for f in facilities)
+
+def _parse_requested_slot(date_str: str, time_str: str, madrid_tz):
+    """Convierte fecha/hora de texto en el intervalo [inicio, fin) del slot. Lanza ValueError si el formato es inválido."""
+    naive_dt = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+    start_dt = madrid_tz.localize(naive_dt)
+    end_dt = start_dt + timedelta(minutes=DURACION_SLOT_MINUTOS)
+    return start_dt, end_dt
+
+def _day_bounds(requested_date, madrid_tz):
+    """Intervalo [00:00, 00:00 del día siguiente) en hora de Madrid, para consultas por día con &&."""
+    day_start = madrid_tz.localize(datetime.combine(requested_date, time(0, 0)))
+    day_end = madrid_tz.localize(datetime.combine(requested_date + timedelta(days=1), time(0, 0)))
+    return day_start, day_end
+
+def _split_overbookings(overbookings: list) -> tuple[list, list]:
+    """
+    Solo el overbooking pendiente más antiguo puede confirmarse: la restricción de exclusión
+    impide dos reservas confirmadas solapadas. El resto queda pendiente del confirmado.
+    """
+    return overbookings[:1], overbookings[1:]
+
+def _find_alternative_slots(booked_slots: list, requested_date, now_madrid, madrid_tz) -> list[str]:
+    """Calcula los slots libres del día (HH:MM) a partir de las reservas confirmadas."""
+    mapa = availability.mapa_ocupacion(booked_slots, requested_date, madrid_tz,
+                                       HORA_INICIO_OPERACION, HORA_FIN_OPERACION)
+    return availability.slots_libres(mapa, requested_date, now_madrid, madrid_tz,
+                                     HORA_INICIO_OPERACION, HORA_FIN_OPERACION, DURACION_SLOT_MINUTOS)
+
+DIAS_SEMANA = ['lun', 'mar', 'mié', 'jue', 'vie', 'sáb', 'dom']
+
+def _parse_time_window(date_str: str, time_from: str, time_to: str | None):
+    """Valida la fecha y la ventana horaria de una consulta múltiple. Lanza ValueError si es inválida."""
+    requested_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    desde = datetime.strptime(time_from, "%H:%M").strftime("%H:%M")
+    hasta = datetime.strptime(time_to or time_from, "%H:%M").strftime("%H:%M")
+    if hasta < desde:
+        raise ValueError(f"Ventana horaria invertida: {desde}-{hasta}")
+    return requested_date, desde, hasta
+
+def _parse_date_range(date_from: str, date_to: str | None) -> list:
+    """Lista de fechas de [date_from, date_to]. Lanza ValueError si el rango es inválido o supera MAX_DIAS_RANGO."""
+    fecha_desde = datetime.strptime(date_from, "%Y-%m-%d").date()
+    fecha_hasta = datetime.strptime(date_to, "%Y-%m-%d").date() if date_to else fecha_desde + timedelta(days=6)
+    dias = (fecha_hasta - fecha_desde).days + 1
+    if dias < 1 or dias > MAX_DIAS_RANGO:
+        raise ValueError(f"Rango de {dias} días fuera de 1..{MAX_DIAS_RANGO}")
+    return [fecha_desde + timedelta(days=i) for i in range(dias)]
+
+def _hhmm_to_minute(hhmm: str | None, default: int | None) -> int | None:
+    if not hhmm:
+        return default
+    horas, minutos = hhmm.split(':')
+    return int(horas) * 60 + int(minutos)
+
+def _multi_availability_params(fecha_desde, fecha_hasta, ids_instalacion: list, madrid_tz) -> tuple:
+    """Parámetros de SQL_OCUPACION_INSTALACIONES."""
+    return (*availability.rango_consulta(fecha_desde, fecha_hasta, madrid_tz), ids_instalacion)
+
+def _facility_maps(rows: list, fechas: list, madrid_tz) -> tuple[dict, dict]:
+    """
+    A partir de las filas de SQL_OCUPACION_INSTALACIONES devuelve
+    ({id_instalacion: nombre} en orden, {(id_instalacion, fecha): mapa de ocupación}).
+    """
+    instalaciones = {}
+    for id_instalacion, nombre, _, _ in rows:
+        instalaciones.setdefault(id_instalacion, nombre)
+    ocupacion = [(id_i, inicio, fin) for id_i, _, inicio, fin in rows if inicio is not None]
+    mapas = availability.construir_mapas(ocupacion, fechas, madrid_tz, HORA_INICIO_OPERACION, HORA_FIN_OPERACION)
+    return instalaciones, mapas
+
+def _format_multi_availability(rows: list, requested_date, desde: str, hasta: str, now_madrid, madrid_tz) -> str:
+    """Agrupa por instalación los slots libres que empiezan dentro de [desde, hasta]."""
+    instalaciones, mapas = _facility_maps(rows, [requested_date], madrid_tz)
+
+    ventana = f"{requested_date.isoformat()} {desde}" + (f"-{hasta}" if hasta != desde else "")
+    con_huecos, sin_huecos = [], []
+    for id_instalacion, nombre in instalaciones.items():
+        libres = availability.slots_libres(
+            mapas.get((id_instalacion, requested_date), 0), requested_date, now_madrid, madrid_tz,
+            HORA_INICIO_OPERACION, HORA_FIN_OPERACION, DURACION_SLOT_MINUTOS,
+            desde_minuto=_hhmm_to_minute(desde, 0), hasta_minuto=_hhmm_to_minute(hasta, None)
+        )
+        if libres:
+            con_huecos.append(f"{nombre}: {', '.join(libres)}")
+        else:
+            sin_huecos.append(nombre)
 
-# --- Funciones Principales CRUD (para las Tools) ---
+    if not con_huecos:
+        return f"DISPONIBILIDAD: {ventana} | Sin huecos en ninguna instalación ({', '.join(sin_huecos)})"
+    respuesta = f"DISPONIBILIDAD: {ventana} | " + " | ".join(con_huecos)
+    if sin_huecos:
+        respuesta += f" | Sin huecos: {', '.join(sin_huecos)}"
+    return respuesta
 
-def get_available_facilities_db(filtro_tipo: str = None, **kwargs) -> str:
+def _format_range_availability(rows: list, fechas: list, time_from: str | None, time_to: str | None,
+                               now_madrid, madrid_tz) -> str:
     """
-    Obtiene la lista de nombres de instalaciones desde la DB,
-    actualiza la caché global y devuelve un string formateado.
-    Si se pasa filtro_tipo, filtra por ese tipo (ej: 'padel', 'tenis').
+    Respuesta compacta para el LLM: por instalación, las ventanas libres de cada día
+    (inicios consecutivos fusionados, ej. '08:00-11:00' = slots de las 8, 9 y 10).
+    Los días sin huecos se agrupan en 'completo' y los días pasados no se listan.
     """
-    global ALL_FACILITIES_CACHE
-    logging.info(f"get_available_facilities_db recibió: filtro_tipo={filtro_tipo}, kwargs={kwargs}")
-    conn = None
-    facilities = [] # Lista local para esta ejecución
-    try:
-        conn = get_db_connection()
-        with conn.cursor() as cur:
-            cur.execute("SELECT ds_nombre FROM public.instalaciones ORDER BY ds_nombre")
-            facilities = [row[0] for row in cur.fetchall()]
+    instalaciones, mapas = _facility_maps(rows, fechas, madrid_tz)
+    desde_minuto = _hhmm_to_minute(time_from, 0)
+    hasta_minuto = _hhmm_to_minute(time_to, None)
+    fechas = [f for f in fechas if f >= now_madrid.date()]
+
+    bloques = []
+    for id_instalacion, nombre in instalaciones.items():
+        dias = []
+        for fecha in fechas:
+            mascara = availability.inicios_libres_desde(
+                mapas.get((id_instalacion, fecha), 0), fecha, now_madrid, madrid_tz,
+                HORA_INICIO_OPERACION, HORA_FIN_OPERACION, DURACION_SLOT_MINUTOS,
+                desde_minuto=desde_minuto, hasta_minuto=hasta_minuto
+            )
+            etiqueta = f"{DIAS_SEMANA[fecha.weekday()]} {fecha.strftime('%d/%m')}"
+            if mascara:
+                ventanas = availability.ventanas_libres(mascara, DURACION_SLOT_MINUTOS, DURACION_SLOT_MINUTOS, HORA_INICIO_OPERACION)
+                dias.append(f"{etiqueta} {availability.formatear_ventanas(ventanas)}")
+            else:
+                dias.append(f"{etiqueta} completo")
+        bloques.append(f"{nombre}: {'; '.join(dias)}")
+
+    franja = f" {time_from or ''}-{time_to or ''}" if time_from or time_to else ""
+    cabecera = f"DISPONIBILIDAD_RANGO: {fechas[0].isoformat()} a {fechas[-1].isoformat()}{franja} (slots de {DURACION_SLOT_MINUTOS} min)"
+    return cabecera + " | " + " | ".join(bloques)
+
+def _format_occupied_status(prob_cancelacion: float | None, available_slots_str: list[str]) -> str:
+    """Formatea la respuesta de slot ocupado según si hay overbooking posible."""
+    prob_cancelacion = prob_cancelacion or 0.0
+    if prob_cancelacion >= UMBRAL_OVERBOOKING:
+        if available_slots_str:
+            horas_disponibles = ", ".join(available_slots_str)
+            return f"ESTADO: Ocupado | Overbooking Posible: {int(prob_cancelacion*100)}% | Alternativas: {horas_disponibles}"
+        else:
+            return f"ESTADO: Ocupado | Overbooking Posible: {int(prob_cancelacion*100)}% | Sin Alternativas"
+    else:
+        if available_slots_str:
+            horas_disponibles = ", ".join(available_slots_str)
+            return f"ESTADO: Ocupado | Alternativas: {horas_disponibles}"
+        else:
+            return "ESTADO: Ocupado | Sin Alternativas"
 
-        # Aplica el filtro si corresponde
-        if filtro_tipo:
-            facilities = [f for f in facilities if filtro_tipo.lower() in f.lower()]
+SLOT_RECIEN_OCUPADO = "ERROR: Reserva Fallida - ESTADO: Ocupado | El horario acaba de ser reservado por otra persona"
 
-        # Actualiza la caché global
-        ALL_FACILITIES_CACHE = facilities.copy()  # Usamos copy() para asegurar que no se pierda la referencia
-        logging.info(f"Caché ALL_FACILITIES actualizada. Resultado (DB): {', '.join(facilities)}")
+def _slot_lock_key(id_instalacion: int, start_dt) -> tuple[int, int]:
+    """Claves de SQL_BLOQUEO_SLOT. Por día y no por hora, para cubrir slots que cruzan varias horas."""
+    return id_instalacion, int(start_dt.strftime('%Y%m%d'))
 
-        if not facilities:
-            return "No hay instalaciones configuradas en la base de datos."
-        # Devuelve solo la lista, el LLM la formateará
-        return ', '.join(facilities)
+def _decide_booking(expected_overbooking: bool, overlap: tuple | None):
+    """
+    Con el lock ya tomado, decide cómo insertar según la reserva confirmada que solapa ahora (o None).
+    Devuelve (is_overbooking, original_booking_id) o el string de error si el slot ya no se puede reservar.
+    """
+    if overlap is None:
+        # Libre. Si se esperaba overbooking, la reserva original se canceló entretanto: reserva normal
+        return False, None
+    original_booking_id, prob_cancelacion = overlap
+    if expected_overbooking and (prob_cancelacion or 0.0) >= UMBRAL_OVERBOOKING:
+        return True, original_booking_id
+    # Se verificó libre pero alguien reservó mientras se calculaban los features:
+    # no se convierte en overbooking sin que el usuario lo haya aceptado
+    return SLOT_RECIEN_OCUPADO
+
+def _reservation_insert_params(id_instalacion, user_name, session_id, start_dt, end_dt, now,
+                               is_overbooking, prob_cancelacion, features, original_booking_id,
+                               version_modelo=None) -> tuple:
+    """Parámetros de SQL_INSERTAR_RESERVA en el orden de sus columnas."""
+    return (
+        id_instalacion,
+        user_name,
+        session_id,
+        start_dt,
+        end_dt,
+        now,  # dt_fechahora_creacion
+        'Pendiente' if is_overbooking else 'Confirmada',  # Estado especial para overbooking
+        None,  # ds_comentarios
+        False,  # es_simulado
+        prob_cancelacion,
+        bool(features['lluvia']),  # Convertir a boolean para la columna lluvia
+        features['antelacion_dias'],
+        features['reservas_previas'],
+        features['cancelaciones_previas'],
+        features['es_finde'],
+        features['es_horario_pico'],
+        features['es_feriado'],
+        is_overbooking,  # es_overbooking
+        original_booking_id,  # id_reserva_original
+        version_modelo  # ds_version_modelo
+    )
+
+def _format_reservation_result(booking_id: int, user_name: str, is_overbooking: bool) -> str:
+    if is_overbooking:
+        logging.info(f"Resultado (DB): Overbooking {booking_id} creado para {user_name}")
+        return f"OVERBOOKING_OK: Overbooking {booking_id} creado para {user_name}. Se confirmará si la reserva original se cancela."
+    else:
+        logging.info(f"Resultado (DB): Reserva {booking_id} exitosa para {user_name}")
+        return f"RESERVA_OK: Reserva {booking_id} confirmada para {user_name}."
+
+def _format_future_bookings(future_bookings: list, madrid_tz) -> str:
+    """Construye la respuesta de CancelarReserva a partir de las reservas futuras del cliente."""
+    if not future_bookings:
+        return "SIN_RESERVAS_ACTIVAS: No encontré reservas futuras activas asociadas a tu número de teléfono."
+
+    if len(future_bookings) == 1:
+        # Solo una reserva encontrada
+        booking_id, facility_name, start_dt = future_bookings[0]
+        start_dt = _to_madrid(start_dt, madrid_tz)
+        return f"CONFIRMACION_NECESARIA: Se encontró una reserva para {facility_name} el {start_dt.strftime('%Y-%m-%d')} a las {start_dt.strftime('%H:%M')} (ID: {booking_id}) asociada a tu número. ¿Confirmas que deseas cancelarla (responde con 'Sí, cancelar reserva {booking_id}' o 'No')?"
+
+    # Múltiples reservas encontradas
+    bookings_list = []
+    for idx, (bid, facility, start) in enumerate(future_bookings, 1):
+        start = _to_madrid(start, madrid_tz)
+        bookings_list.append(f"{idx}. ID {bid} para {facility} el {start.strftime('%Y-%m-%d')} a las {start.strftime('%H:%M')}")
+
+    return f"MULTIPLES_RESERVAS: Encontré estas reservas asociadas a ti: {' '.join(bookings_list)} Por favor, dime el ID de la reserva que quieres cancelar."
+
+def _overbooking_confirmed_message(ov_user: str, ov_facility: str, ov_start_dt, madrid_tz) -> str:
+    ov_start_dt = _to_madrid(ov_start_dt, madrid_tz)
+    return f"¡Buenas noticias, {ov_user}! Tu reserva pendiente para la instalación '{ov_facility}' el día {ov_start_dt.strftime('%Y-%m-%d')} a las {ov_start_dt.strftime('%H:%M')} ha sido confirmada. ¡Te esperamos!"
+
+def _format_cancelled_result(booking_id, booking: tuple, madrid_tz) -> str:
+    facility_name = booking[1]
+    start_dt = _to_madrid(booking[2], madrid_tz)
+    return f"RESERVA_CANCELADA: La reserva con ID {booking_id} para {facility_name} el {start_dt.strftime('%Y-%m-%d')} a las {start_dt.strftime('%H:%M')} ha sido cancelada exitosamente."
 
-    except psycopg2.Error as e:
-        logging.error(f"Error al obtener instalaciones: {e}")
-        ALL_FACILITIES_CACHE = [] # Limpiar caché en caso de error
+# --- Funciones Principales CRUD (para las Tools) ---
+
+def get_available_facilities_db(filtro_tipo: str = None, **kwargs) -> str:
+    """
+    Devuelve la lista de nombres de instalaciones del catálogo como string formateado.
+    Si se pasa filtro_tipo, filtra por ese tipo o parte del nombre (ej: 'padel', 'tenis').
+    El filtro no altera el catálogo compartido.
+    """
+    logging.info(f"get_available_facilities_db recibió: filtro_tipo={filtro_tipo}, kwargs={kwargs}")
+    catalogo = get_facility_catalog().snapshot()
+    if not catalogo.facilities:
         return "ERROR: Problema tecnico DB al listar instalaciones"
-    except Exception as e:
-        logging.error(f"Error inesperado en get_available_facilities_db: {e}")
-        ALL_FACILITIES_CACHE = []
-        return "ERROR: Inesperado al listar instalaciones"
-    finally:
-        if conn:
-            conn.close()
-            logging.debug("Conexión cerrada en get_available_facilities_db")
+    respuesta = _format_facilities(catalogo, filtro_tipo)
+    logging.info(f"Resultado (catálogo): {respuesta}")
+    return respuesta
 
 
 def check_availability_db(facility_name: str, date_str: str, time_str: str) -> str:
@@ -232,134 +514,172 @@ def check_availability_db(facility_name: str, date_str: str, time_str: str) -> s
     logging.info(f"--- Ejecutando check_availability_db ---")
     logging.info(f"Recibido: Instalación='{facility_name}', Fecha='{date_str}', Hora='{time_str}'")
 
-    # === Variables Configurables ===
-    HORA_INICIO_OPERACION = 8
-    HORA_FIN_OPERACION = 22
-    DURACION_SLOT_MINUTOS = 60
-    UMBRAL_OVERBOOKING = 0.65  # 65% de probabilidad de cancelación
     try:
-        MADRID_TZ = pytz.timezone('Europe/Madrid')
-    except pytz.exceptions.UnknownTimeZoneError:
-        logging.error("No se pudo encontrar la zona horaria 'Europe/Madrid'. Usando UTC.")
-        MADRID_TZ = pytz.utc
-    # ==============================
+        with db_connection() as conn:
+            return _check_availability(conn, facility_name, date_str, time_str)
+    except psycopg2.Error as e:
+        logging.error(f"Error de base de datos en check_availability: {e}")
+        return "ERROR: Problema tecnico DB"
+    except Exception as e:
+        logging.error(f"Error inesperado en check_availability: {e}")
+        import traceback; logging.error(traceback.format_exc())
+        return "ERROR: Inesperado"
+
 
-    conn = None
+def _check_availability(conn, facility_name: str, date_str: str, time_str: str) -> str:
+    """
+    Lógica de check_availability_db sobre una conexión ya abierta, para que
+    make_reservation_db pueda verificar e insertar con una única conexión del pool.
+    Las excepciones de base de datos se propagan a quien llama.
+    """
+    MADRID_TZ = _get_madrid_tz()
+
+    # --- Obtener ID Instalación (búsqueda en el catálogo, sin consulta) ---
+    catalogo = get_facility_catalog().snapshot()
+    id_instalacion = catalogo.id_of(facility_name)
+    if id_instalacion is None:
+        logging.warning(f"Instalación no encontrada en el catálogo: {facility_name}")
+        return _invalid_facility_error(catalogo)
+
+    # --- Procesar Fecha/Hora Solicitada y Validar ---
     try:
-        conn = get_db_connection()
+        requested_start_dt, requested_end_dt = _parse_requested_slot(date_str, time_str, MADRID_TZ)
+        now_madrid = datetime.now(MADRID_TZ)
+    except ValueError:
+        logging.error(f"Error de formato al parsear fecha/hora: {date_str} {time_str}")
+        return "ERROR: Formato invalido"
 
-        # --- Obtener ID Instalación (usa la caché actualizada) ---
-        id_instalacion = _get_facility_id(conn, facility_name)
-        if id_instalacion is None:
-             opciones_validas = ', '.join(ALL_FACILITIES_CACHE) if ALL_FACILITIES_CACHE else 'ninguna encontrada'
-             return f"ERROR: Instalacion no valida | Opciones: {opciones_validas}"
+    if requested_start_dt < now_madrid:
+        logging.warning("Intento de consulta en el pasado.")
+        return f"ERROR: Fecha pasada"
+
+    # --- Comprobar el Slot Específico Solicitado ---
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL(SQL_RESERVA_SOLAPADA), (id_instalacion, requested_start_dt, requested_end_dt))
+        result = cur.fetchone()
+
+    # --- Generar Respuesta ---
+    if not result:
+        logging.info(f"Slot solicitado ({time_str}) está DISPONIBLE.")
+        return "ESTADO: Disponible"
+
+    booking_id, prob_cancelacion = result
+    logging.info(f"Slot solicitado ({time_str}) está OCUPADO. Buscando alternativas...")
+    # --- Buscar Alternativas ---
+    requested_date = requested_start_dt.date()
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL(SQL_RESERVAS_DEL_DIA), (id_instalacion, *_day_bounds(requested_date, MADRID_TZ)))
+        booked_slots = cur.fetchall()
+
+    available_slots_str = _find_alternative_slots(booked_slots, requested_date, now_madrid, MADRID_TZ)
+    return _format_occupied_status(prob_cancelacion, available_slots_str)
 
-        # --- Procesar Fecha/Hora Solicitada y Validar ---
-        try:
-            naive_dt = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-            requested_start_dt = MADRID_TZ.localize(naive_dt)
-            requested_end_dt = requested_start_dt + timedelta(minutes=DURACION_SLOT_MINUTOS)
-            now_madrid = datetime.now(MADRID_TZ)
-        except ValueError:
-            logging.error(f"Error de formato al parsear fecha/hora: {date_str} {time_str}")
-            return "ERROR: Formato invalido"
-
-        if requested_start_dt < now_madrid:
-            logging.warning("Intento de consulta en el pasado.")
-            return f"ERROR: Fecha pasada"
-
-        # --- Comprobar el Slot Específico Solicitado ---
-        is_requested_slot_booked = False
-        booking_id = None
-        prob_cancelacion = 0.0
-        
-        with conn.cursor() as cur:
-            query_check = sql.SQL("""
-                SELECT r.id_reserva, r.probabilidad_cancelacion
-                FROM public.reservas r
-                WHERE r.id_instalacion = %s 
-                AND r.ds_estado = 'Confirmada'
-                AND (r.dt_fechahora_inicio, r.dt_fechahora_fin) OVERLAPS (%s::timestamptz, %s::timestamptz)
-            """)
-            cur.execute(query_check, (id_instalacion, requested_start_dt, requested_end_dt))
-            result = cur.fetchone()
-            if result:
-                is_requested_slot_booked = True
-                booking_id, prob_cancelacion = result
-
-        # --- Generar Respuesta ---
-        if not is_requested_slot_booked:
-            logging.info(f"Slot solicitado ({time_str}) está DISPONIBLE.")
-            return "ESTADO: Disponible"
-        else:
-            logging.info(f"Slot solicitado ({time_str}) está OCUPADO. Buscando alternativas...")
-            # --- Buscar Alternativas ---
-            booked_slots = []
-            available_slots_str = []
-            requested_date = requested_start_dt.date()
 
+def check_availability_multi_db(date_str: str, time_from: str, time_to: str = None,
+                                facility_type: str = None, facility_names: list = None, **kwargs) -> str:
+    """
+    Disponibilidad de todas las instalaciones de un tipo (ds_tipo, ej: 'Padel') o de una
+    lista de nombres, para los slots que empiezan entre time_from y time_to (ambas incluidas).
+    Devuelve "DISPONIBILIDAD: AAAA-MM-DD HH:MM-HH:MM | Instalación: HH:MM, HH:MM | ... | Sin huecos: ..."
+    o "ERROR: [Mensaje específico]".
+    """
+    logging.info(f"--- Ejecutando check_availability_multi_db ---")
+    logging.info(f"Recibido: Tipo='{facility_type}', Instalaciones={facility_names}, Fecha='{date_str}', Ventana='{time_from}'-'{time_to}'")
+
+    if not facility_type and not facility_names:
+        return "ERROR: Indica un tipo de instalacion o una lista de instalaciones"
+
+    MADRID_TZ = _get_madrid_tz()
+    try:
+        requested_date, desde, hasta = _parse_time_window(date_str, time_from, time_to)
+    except ValueError:
+        logging.error(f"Error de formato al parsear fecha/ventana: {date_str} {time_from}-{time_to}")
+        return "ERROR: Formato invalido"
+
+    now_madrid = datetime.now(MADRID_TZ)
+    if requested_date < now_madrid.date():
+        return "ERROR: Fecha pasada"
+
+    try:
+        catalogo = get_facility_catalog().snapshot()
+        ids_instalacion = _resolve_facility_ids(catalogo, facility_type, facility_names)
+        if not ids_instalacion:
+            return _no_match_error(catalogo)
+
+        with db_connection() as conn:
             with conn.cursor() as cur:
-                query_all = sql.SQL("""
-                    SELECT dt_fechahora_inicio, dt_fechahora_fin
-                    FROM public.reservas
-                    WHERE id_instalacion = %s
-                    AND DATE(dt_fechahora_inicio AT TIME ZONE %s) = %s
-                    AND ds_estado = 'Confirmada'
-                    ORDER BY dt_fechahora_inicio;
-                """)
-                cur.execute(query_all, (id_instalacion, MADRID_TZ.zone, requested_date))
-                booked_slots = cur.fetchall()
-
-            day_start_dt = datetime.combine(requested_date, time(HORA_INICIO_OPERACION, 0))
-            day_start_aware = MADRID_TZ.localize(day_start_dt)
-            day_end_dt = datetime.combine(requested_date, time(HORA_FIN_OPERACION, 0))
-            day_end_aware = MADRID_TZ.localize(day_end_dt)
-
-            current_slot_start = day_start_aware
-            while current_slot_start < day_end_aware:
-                current_slot_end = current_slot_start + timedelta(minutes=DURACION_SLOT_MINUTOS)
-                if current_slot_end > day_end_aware: break
-                if current_slot_start < now_madrid:
-                    current_slot_start += timedelta(minutes=DURACION_SLOT_MINUTOS); continue
-
-                is_potential_slot_booked = False
-                for booked_start, booked_end in booked_slots:
-                     if (current_slot_start < booked_end) and (current_slot_end > booked_start):
-                        is_potential_slot_booked = True; break
-                if not is_potential_slot_booked:
-                    available_slots_str.append(current_slot_start.strftime('%H:%M'))
-                current_slot_start += timedelta(minutes=DURACION_SLOT_MINUTOS)
-
-            # Formatear respuesta según si hay overbooking posible
-            if prob_cancelacion >= UMBRAL_OVERBOOKING:
-                if available_slots_str:
-                    horas_disponibles = ", ".join(available_slots_str)
-                    return f"ESTADO: Ocupado | Overbooking Posible: {int(prob_cancelacion*100)}% | Alternativas: {horas_disponibles}"
-                else:
-                    return f"ESTADO: Ocupado | Overbooking Posible: {int(prob_cancelacion*100)}% | Sin Alternativas"
-            else:
-                if available_slots_str:
-                    horas_disponibles = ", ".join(available_slots_str)
-                    return f"ESTADO: Ocupado | Alternativas: {horas_disponibles}"
-                else:
-                    return "ESTADO: Ocupado | Sin Alternativas"
+                cur.execute(SQL_OCUPACION_INSTALACIONES,
+                            _multi_availability_params(requested_date, requested_date, ids_instalacion, MADRID_TZ))
+                rows = cur.fetchall()
+
+        return _format_multi_availability(rows, requested_date, desde, hasta, now_madrid, MADRID_TZ)
 
     except psycopg2.Error as e:
-        logging.error(f"Error de base de datos en check_availability: {e}")
-        if conn: conn.rollback()
+        logging.error(f"Error de base de datos en check_availability_multi_db: {e}")
         return "ERROR: Problema tecnico DB"
     except Exception as e:
-        logging.error(f"Error inesperado en check_availability: {e}")
+        logging.error(f"Error inesperado en check_availability_multi_db: {e}")
+        import traceback; logging.error(traceback.format_exc())
+        return "ERROR: Inesperado"
+
+
+def check_availability_range_db(date_from: str, date_to: str = None, facility_type: str = None,
+                                facility_names: list = None, time_from: str = None, time_to: str = None, **kwargs) -> str:
+    """
+    Ventanas libres de una o varias instalaciones (por tipo o por nombres) en un rango de
+    hasta MAX_DIAS_RANGO días (por defecto, 7 días desde date_from), opcionalmente limitadas
+    a una franja de horas de inicio. Una sola consulta para todo el rango.
+    Devuelve "DISPONIBILIDAD_RANGO: ... | Instalación: lun 12/05 08:00-11:00, 15:00-22:00; mar 13/05 completo | ..."
+    o "ERROR: [Mensaje específico]".
+    """
+    logging.info(f"--- Ejecutando check_availability_range_db ---")
+    logging.info(f"Recibido: Tipo='{facility_type}', Instalaciones={facility_names}, Rango='{date_from}'-'{date_to}', Franja='{time_from}'-'{time_to}'")
+
+    if not facility_type and not facility_names:
+        return "ERROR: Indica un tipo de instalacion o una lista de instalaciones"
+
+    MADRID_TZ = _get_madrid_tz()
+    try:
+        fechas = _parse_date_range(date_from, date_to)
+        if time_from or time_to:
+            _parse_time_window(date_from, time_from or "00:00", time_to or "23:59")
+    except ValueError:
+        logging.error(f"Rango inválido: {date_from}-{date_to} {time_from}-{time_to}")
+        return f"ERROR: Rango invalido | Fechas AAAA-MM-DD, horas HH:MM, máximo {MAX_DIAS_RANGO} días"
+
+    now_madrid = datetime.now(MADRID_TZ)
+    if fechas[-1] < now_madrid.date():
+        return "ERROR: Fecha pasada"
+
+    try:
+        catalogo = get_facility_catalog().snapshot()
+        ids_instalacion = _resolve_facility_ids(catalogo, facility_type, facility_names)
+        if not ids_instalacion:
+            return _no_match_error(catalogo)
+
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SQL_OCUPACION_INSTALACIONES,
+                            _multi_availability_params(fechas[0], fechas[-1], ids_instalacion, MADRID_TZ))
+                rows = cur.fetchall()
+
+        return _format_range_availability(rows, fechas, time_from, time_to, now_madrid, MADRID_TZ)
+
+    except psycopg2.Error as e:
+        logging.error(f"Error de base de datos en check_availability_range_db: {e}")
+        return "ERROR: Problema tecnico DB"
+    except Exception as e:
+        logging.error(f"Error inesperado en check_availability_range_db: {e}")
         import traceback; logging.error(traceback.format_exc())
         return "ERROR: Inesperado"
-    finally:
-        if conn:
-            conn.close()
-            logging.debug("Conexión cerrada en check_availability_db")
 
 
 def make_reservation_db(facility_name: str, date_str: str, time_str: str, user_name: str, session_id: str = None) -> str:
-    """Realiza una reserva en la DB tras verificar disponibilidad."""
+    """
+    Realiza una reserva en la DB tras verificar disponibilidad.
+    El trabajo lento (API de lluvia, modelo) se hace sin conexión ni transacción abiertas;
+    después una transacción corta toma el lock del slot, vuelve a verificar e inserta.
+    """
     logging.info(f"--- Ejecutando make_reservation_db ---")
     logging.info(f"Recibido: Inst: '{facility_name}', Fecha: '{date_str}', Hora: '{time_str}', Usr: '{user_name}', Session: '{session_id}'")
 
@@ -368,149 +688,75 @@ def make_reservation_db(facility_name: str, date_str: str, time_str: str, user_n
         logging.error("Error: No se proporcionó número de teléfono (session_id)")
         return "ERROR: Reserva Fallida - Se requiere un número de teléfono válido para realizar la reserva."
 
-    # === Variables Configurables (podrían compartirse o venir de DB) ===
-    DURACION_SLOT_MINUTOS = 60
-    try:
-        MADRID_TZ = pytz.timezone('Europe/Madrid')
-    except pytz.exceptions.UnknownTimeZoneError:
-        logging.error("No se pudo encontrar la zona horaria 'Europe/Madrid'. Usando UTC.")
-        MADRID_TZ = pytz.utc
-    # ====================================================================
+    MADRID_TZ = _get_madrid_tz()
 
-    conn = None
     try:
-        # PASO 1: Verificar Disponibilidad PRIMERO usando la función actualizada
-        availability_status = check_availability_db(facility_name, date_str, time_str)
+        # PASO 1: Verificación previa e historial del cliente (conexión corta, sin locks)
+        with db_connection() as conn:
+            availability_status = _check_availability(conn, facility_name, date_str, time_str)
+
+            # Determinar si es overbooking basado en la respuesta
+            is_overbooking = availability_status.startswith("ESTADO: Ocupado | Overbooking Posible")
 
-        # Determinar si es overbooking basado en la respuesta
-        is_overbooking = availability_status.startswith("ESTADO: Ocupado | Overbooking Posible")
-        
-        if not is_overbooking and availability_status != "ESTADO: Disponible":
-            logging.warning(f"Intento de reserva fallido por no disponibilidad/error: {availability_status}")
-            return f"ERROR: Reserva Fallida - {availability_status}"
+            if not is_overbooking and availability_status != "ESTADO: Disponible":
+                logging.warning(f"Intento de reserva fallido por no disponibilidad/error: {availability_status}")
+                return f"ERROR: Reserva Fallida - {availability_status}"
 
-        # PASO 2: Si está disponible o es overbooking válido, proceder a insertar
-        conn = get_db_connection()
-        id_instalacion = _get_facility_id(conn, facility_name)
+            reservas_previas, cancelaciones_previas = _get_user_booking_history(conn, session_id)
 
+        # PASO 2: Datos para el INSERT
+        id_instalacion = get_facility_catalog().current().id_of(facility_name)
         if id_instalacion is None:
-             return f"ERROR: Reserva Fallida - No se encontró ID para '{facility_name}' (esto no debería pasar)."
+            return f"ERROR: Reserva Fallida - No se encontró ID para '{facility_name}' (esto no debería pasar)."
 
-        # PASO 3: Preparar datos para INSERT
         try:
-            naive_dt = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-            start_dt = MADRID_TZ.localize(naive_dt)
-            end_dt = start_dt + timedelta(minutes=DURACION_SLOT_MINUTOS)
-            now = datetime.now(MADRID_TZ)
+            start_dt, end_dt = _parse_requested_slot(date_str, time_str, MADRID_TZ)
         except ValueError:
             logging.error(f"Error de formato al parsear fecha/hora para INSERT: {date_str} {time_str}")
             return "ERROR: Reserva Fallida - Formato de fecha/hora inválido para guardar."
 
-        # PASO 4: Calcular features y probabilidad de cancelación
+        # PASO 3: Features y probabilidad de cancelación, fuera de cualquier transacción
         try:
-            features = _calculate_features(conn, id_instalacion, date_str, time_str, session_id)
-            prob_cancelacion = _predict_cancellation_probability(features)
-            logging.info(f"Probabilidad de cancelación calculada: {prob_cancelacion:.2%}")
+            features = _build_features(id_instalacion, date_str, time_str, reservas_previas, cancelaciones_previas)
+            prob_cancelacion, version_modelo = _predict_cancellation_probability(features)
+            logging.info(f"Probabilidad de cancelación calculada: {prob_cancelacion:.2%} (modelo {version_modelo})")
         except Exception as e:
             logging.error(f"Error al calcular probabilidad de cancelación: {e}")
-            prob_cancelacion = 0.0
-            features = {
-                'antelacion_dias': 0,
-                'reservas_previas': 0,
-                'cancelaciones_previas': 0,
-                'es_finde': 0,
-                'es_horario_pico': 0,
-                'es_feriado': 0,
-                'lluvia': 0
-            }
-
-        # PASO 5: Ejecutar INSERT
-        with conn.cursor() as cur:
-            # Si es overbooking, necesitamos obtener el ID de la reserva original
-            original_booking_id = None
-            if is_overbooking:
-                query_original = sql.SQL("""
-                    SELECT id_reserva
-                    FROM public.reservas
-                    WHERE id_instalacion = %s 
-                    AND ds_estado = 'Confirmada'
-                    AND (dt_fechahora_inicio, dt_fechahora_fin) OVERLAPS (%s::timestamptz, %s::timestamptz)
-                """)
-                cur.execute(query_original, (id_instalacion, start_dt, end_dt))
-                result = cur.fetchone()
-                if result:
-                    original_booking_id = result[0]
-
-            query = sql.SQL("""
-                INSERT INTO public.reservas (
-                    id_instalacion, 
-                    ds_nombre_cliente, 
-                    ds_telefono, 
-                    dt_fechahora_inicio, 
-                    dt_fechahora_fin, 
-                    dt_fechahora_creacion,
-                    ds_estado, 
-                    ds_comentarios,
-                    es_simulado,
-                    probabilidad_cancelacion,
-                    lluvia,
-                    antelacion_dias,
-                    reservas_previas,
-                    cancelaciones_previas,
-                    es_finde,
-                    es_horario_pico,
-                    es_feriado,
-                    es_overbooking,
-                    id_reserva_original
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                RETURNING id_reserva
-            """)
-            cur.execute(query, (
-                id_instalacion,
-                user_name,
-                session_id,
-                start_dt,
-                end_dt,
-                now,  # dt_fechahora_creacion
-                'Pendiente' if is_overbooking else 'Confirmada',  # Estado especial para overbooking
-                None,  # ds_comentarios
-                False,  # es_simulado
-                prob_cancelacion,
-                bool(features['lluvia']),  # Convertir a boolean para la columna lluvia
-                features['antelacion_dias'],
-                features['reservas_previas'],
-                features['cancelaciones_previas'],
-                features['es_finde'],
-                features['es_horario_pico'],
-                features['es_feriado'],
-                is_overbooking,  # es_overbooking
-                original_booking_id  # id_reserva_original
-            ))
-            booking_id = cur.fetchone()[0]
-            conn.commit() 
-            
-            if is_overbooking:
-                logging.info(f"Resultado (DB): Overbooking {booking_id} creado para {user_name}")
-                return f"OVERBOOKING_OK: Overbooking {booking_id} creado para {user_name}. Se confirmará si la reserva original se cancela."
-            else:
-                logging.info(f"Resultado (DB): Reserva {booking_id} exitosa para {user_name}")
-                return f"RESERVA_OK: Reserva {booking_id} confirmada para {user_name}."
+            prob_cancelacion, version_modelo = 0.0, None
+            features = DEFAULT_FEATURES
+
+        # PASO 4: Transacción corta: lock del slot, nueva verificación e INSERT
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SQL_BLOQUEO_SLOT, _slot_lock_key(id_instalacion, start_dt))
+                cur.execute(sql.SQL(SQL_RESERVA_SOLAPADA), (id_instalacion, start_dt, end_dt))
+                decision = _decide_booking(is_overbooking, cur.fetchone())
+                if isinstance(decision, str):
+                    conn.rollback()
+                    logging.warning(f"Slot ocupado durante la reserva: {facility_name} {date_str} {time_str}")
+                    return decision
+                is_overbooking, original_booking_id = decision
+
+                cur.execute(sql.SQL(SQL_INSERTAR_RESERVA), _reservation_insert_params(
+                    id_instalacion, user_name, session_id, start_dt, end_dt, datetime.now(MADRID_TZ),
+                    is_overbooking, prob_cancelacion, features, original_booking_id, version_modelo
+                ))
+                booking_id = cur.fetchone()[0]
+            conn.commit()
 
+        return _format_reservation_result(booking_id, user_name, is_overbooking)
+
+    except psycopg2.errors.ExclusionViolation:
+        # Última defensa: la restricción de exclusión rechaza un solape que haya escapado al lock
+        logging.warning(f"Reserva rechazada por la restricción de exclusión: {facility_name} {date_str} {time_str}")
+        return SLOT_RECIEN_OCUPADO
     except psycopg2.Error as e:
         logging.error(f"Error de base de datos al realizar reserva: {e}")
-        if conn: conn.rollback() # Deshacer si falla la inserción
         return "ERROR: Problema tecnico DB al reservar"
     except Exception as e:
         logging.error(f"Error inesperado en make_reservation_db: {e}")
-        if conn: conn.rollback()
         import traceback; logging.error(traceback.format_exc())
         return "ERROR: Inesperado al reservar"
-    finally:
-        if conn:
-            conn.close()
-            logging.debug("Conexión cerrada en make_reservation_db")
 
 
 def cancel_reservation_db(session_id: str = None, **kwargs) -> str:
@@ -525,71 +771,27 @@ def cancel_reservation_db(session_id: str = None, **kwargs) -> str:
             logging.error("Error en cancel_reservation_db: No se proporcionó session_id.")
             return "ERROR_CANCELACION: No se pudo buscar las reservas. Falta el identificador de sesión."
 
+    MADRID_TZ = _get_madrid_tz()
 
     try:
-        MADRID_TZ = pytz.timezone('Europe/Madrid')
-    except pytz.exceptions.UnknownTimeZoneError:
-        logging.error("No se pudo encontrar la zona horaria 'Europe/Madrid'. Usando UTC.")
-        MADRID_TZ = pytz.utc
+        with db_connection() as conn:
+            now = datetime.now(MADRID_TZ)
 
-    conn = None
-    try:
-        conn = get_db_connection()
-        now = datetime.now(MADRID_TZ)
+            # Buscar reservas futuras
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL(SQL_RESERVAS_FUTURAS_CLIENTE), (session_id, now))
+                future_bookings = cur.fetchall()
 
-        # Buscar reservas futuras
-        with conn.cursor() as cur:
-            query = sql.SQL("""
-                SELECT r.id_reserva, i.ds_nombre, r.dt_fechahora_inicio
-                FROM public.reservas r
-                JOIN public.instalaciones i ON r.id_instalacion = i.id_instalacion
-                WHERE r.ds_telefono = %s
-                AND r.ds_estado = 'Confirmada'
-                AND r.dt_fechahora_inicio > %s
-                ORDER BY r.dt_fechahora_inicio
-            """)
-            cur.execute(query, (session_id, now))
-            future_bookings = cur.fetchall()
-
-            if not future_bookings:
-                return "SIN_RESERVAS_ACTIVAS: No encontré reservas futuras activas asociadas a tu número de teléfono."
-
-            if len(future_bookings) == 1:
-                # Solo una reserva encontrada
-                booking_id, facility_name, start_dt = future_bookings[0]
-                # Corrección: asegurar zona horaria Madrid
-                if start_dt.tzinfo is None:
-                    start_dt = MADRID_TZ.localize(start_dt)
-                else:
-                    start_dt = start_dt.astimezone(MADRID_TZ)
-                return f"CONFIRMACION_NECESARIA: Se encontró una reserva para {facility_name} el {start_dt.strftime('%Y-%m-%d')} a las {start_dt.strftime('%H:%M')} (ID: {booking_id}) asociada a tu número. ¿Confirmas que deseas cancelarla (responde con 'Sí, cancelar reserva {booking_id}' o 'No')?"
-
-            # Múltiples reservas encontradas
-            bookings_list = []
-            for idx, (bid, facility, start) in enumerate(future_bookings, 1):
-                # Corrección: asegurar zona horaria Madrid
-                if start.tzinfo is None:
-                    start = MADRID_TZ.localize(start)
-                else:
-                    start = start.astimezone(MADRID_TZ)
-                bookings_list.append(f"{idx}. ID {bid} para {facility} el {start.strftime('%Y-%m-%d')} a las {start.strftime('%H:%M')}")
-            
-            return f"MULTIPLES_RESERVAS: Encontré estas reservas asociadas a ti: {' '.join(bookings_list)} Por favor, dime el ID de la reserva que quieres cancelar."
+        return _format_future_bookings(future_bookings, MADRID_TZ)
 
     except psycopg2.Error as e:
         logging.error(f"Error de base de datos al buscar reservas: {e}")
-        if conn: conn.rollback()
         return "ERROR_CANCELACION: No se pudo buscar las reservas. Motivo: Error técnico en la base de datos."
     except Exception as e:
         logging.error(f"Error inesperado en cancel_reservation_db: {e}")
-        if conn: conn.rollback()
         import traceback
         logging.error(traceback.format_exc())
         return "ERROR_CANCELACION: No se pudo buscar las reservas. Motivo: Error inesperado."
-    finally:
-        if conn:
-            conn.close()
-            logging.debug("Conexión cerrada en cancel_reservation_db")
 
 def confirm_cancel_reservation(booking_id: str, session_id: str = None, **kwargs) -> str:
     """
@@ -599,101 +801,54 @@ def confirm_cancel_reservation(booking_id: str, session_id: str = None, **kwargs
     logging.info(f"--- Ejecutando confirm_cancel_reservation ---")
     logging.info(f"Recibido: Booking ID='{booking_id}', Teléfono='{session_id}'")
 
-    try:
-        MADRID_TZ = pytz.timezone('Europe/Madrid')
-    except pytz.exceptions.UnknownTimeZoneError:
-        logging.error("No se pudo encontrar la zona horaria 'Europe/Madrid'. Usando UTC.")
-        MADRID_TZ = pytz.utc
+    MADRID_TZ = _get_madrid_tz()
 
-    conn = None
     try:
-        conn = get_db_connection()
-        now = datetime.now(MADRID_TZ)
+        with db_connection() as conn:
+            now = datetime.now(MADRID_TZ)
 
-        # Verificar que la reserva existe y cumple las condiciones
-        with conn.cursor() as cur:
-            query_check = sql.SQL("""
-                SELECT r.id_reserva, i.ds_nombre, r.dt_fechahora_inicio
-                FROM public.reservas r
-                JOIN public.instalaciones i ON r.id_instalacion = i.id_instalacion
-                WHERE r.id_reserva = %s
-                AND r.ds_telefono = %s
-                AND r.ds_estado = 'Confirmada'
-                AND r.dt_fechahora_inicio > %s
-            """)
-            cur.execute(query_check, (booking_id, session_id, now))
-            booking = cur.fetchone()
-
-            if not booking:
-                return "ERROR_CANCELACION: No se pudo cancelar la reserva. Motivo: La reserva no existe, no pertenece a tu número, ya ha pasado o ya está cancelada."
-
-            # Buscar overbookings pendientes para notificar
-            query_overbookings = sql.SQL("""
-                SELECT r.id_reserva, r.ds_nombre_cliente, r.ds_telefono, i.ds_nombre, r.dt_fechahora_inicio
-                FROM public.reservas r
-                JOIN public.instalaciones i ON r.id_instalacion = i.id_instalacion
-                WHERE r.id_reserva_original = %s
-                AND r.ds_estado = 'Pendiente'
-                AND r.es_overbooking = true
-            """)
-            cur.execute(query_overbookings, (booking_id,))
-            overbookings = cur.fetchall()
-
-            # Si todo está bien, proceder con la cancelación
-            query_cancel = sql.SQL("""
-                UPDATE public.reservas
-                SET ds_estado = 'Cancelada'
-                WHERE id_reserva = %s
-            """)
-            cur.execute(query_cancel, (booking_id,))
-
-            # Confirmar overbookings pendientes y enviar notificaciones
-            if overbookings:
-                overbooking_ids = [o[0] for o in overbookings]
-                query_confirm_overbookings = sql.SQL("""
-                    UPDATE public.reservas
-                    SET ds_estado = 'Confirmada'
-                    WHERE id_reserva = ANY(%s)
-                """)
-                cur.execute(query_confirm_overbookings, (overbooking_ids,))
-                
-                # Enviar notificaciones
-                for ov_id, ov_user, ov_phone, ov_facility, ov_start_dt in overbookings:
-                    try:
-                        # Corrección: asegurar zona horaria Madrid
-                        if ov_start_dt.tzinfo is None:
-                            ov_start_dt = MADRID_TZ.localize(ov_start_dt)
-                        else:
-                            ov_start_dt = ov_start_dt.astimezone(MADRID_TZ)
-                        message_text = f"¡Buenas noticias, {ov_user}! Tu reserva pendiente para la instalación '{ov_facility}' el día {ov_start_dt.strftime('%Y-%m-%d')} a las {ov_start_dt.strftime('%H:%M')} ha sido confirmada. ¡Te esperamos!"
-                        send_whatsapp_message(ov_phone, message_text)
-                    except Exception as e:
-                        logging.error(f"No se pudo enviar la notificación de overbooking confirmado para la reserva {ov_id}: {e}")
-                        # No detener el proceso, solo loguear el error
+            # Verificar que la reserva existe y cumple las condiciones
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL(SQL_RESERVA_CANCELABLE), (booking_id, session_id, now))
+                booking = cur.fetchone()
 
-            conn.commit()
+                if not booking:
+                    return "ERROR_CANCELACION: No se pudo cancelar la reserva. Motivo: La reserva no existe, no pertenece a tu número, ya ha pasado o ya está cancelada."
 
-            # Formatear mensaje de éxito
-            facility_name = booking[1]
-            start_dt = booking[2]
-            # Corrección: asegurar zona horaria Madrid
-            if start_dt.tzinfo is None:
-                start_dt = MADRID_TZ.localize(start_dt)
-            else:
-                start_dt = start_dt.astimezone(MADRID_TZ)
-            return f"RESERVA_CANCELADA: La reserva con ID {booking_id} para {facility_name} el {start_dt.strftime('%Y-%m-%d')} a las {start_dt.strftime('%H:%M')} ha sido cancelada exitosamente."
+                # Buscar overbookings pendientes para notificar
+                cur.execute(sql.SQL(SQL_OVERBOOKINGS_PENDIENTES), (booking_id,))
+                overbookings = cur.fetchall()
+
+                # Si todo está bien, proceder con la cancelación
+                cur.execute(sql.SQL(SQL_CANCELAR_RESERVA), (booking_id,))
+
+                # Confirmar el overbooking pendiente más antiguo; el resto pasa a depender de él
+                overbookings, en_espera = _split_overbookings(overbookings)
+                if overbookings:
+                    overbooking_ids = [o[0] for o in overbookings]
+                    cur.execute(sql.SQL(SQL_CONFIRMAR_OVERBOOKINGS), (overbooking_ids,))
+                    if en_espera:
+                        cur.execute(sql.SQL(SQL_REASIGNAR_OVERBOOKINGS), (overbooking_ids[0], [o[0] for o in en_espera]))
+
+                conn.commit()
+
+        # Enviar notificaciones (ya con la conexión devuelta al pool)
+        for ov_id, ov_user, ov_phone, ov_facility, ov_start_dt in overbookings:
+            try:
+                message_text = _overbooking_confirmed_message(ov_user, ov_facility, ov_start_dt, MADRID_TZ)
+                send_whatsapp_message(ov_phone, message_text)
+            except Exception as e:
+                logging.error(f"No se pudo enviar la notificación de overbooking confirmado para la reserva {ov_id}: {e}")
+                # No detener el proceso, solo loguear el error
+
+        # Formatear mensaje de éxito
+        return _format_cancelled_result(booking_id, booking, MADRID_TZ)
 
     except psycopg2.Error as e:
         logging.error(f"Error de base de datos al cancelar reserva: {e}")
-        if conn: conn.rollback()
         return "ERROR_CANCELACION: No se pudo cancelar la reserva. Motivo: Error técnico en la base de datos."
     except Exception as e:
         logging.error(f"Error inesperado en confirm_cancel_reservation: {e}")
-        if conn: conn.rollback()
         import traceback
         logging.error(traceback.format_exc())
         return "ERROR_CANCELACION: No se pudo cancelar la reserva. Motivo: Error inesperado."
-    finally:
-        if conn:
-            conn.close()
-            logging.debug("Conexión cerrada en confirm_cancel_reservation")
\ No newline at end of file
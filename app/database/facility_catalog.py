@@ -0,0 +1,231 @@
+"""
+Catálogo de instalaciones: única fuente de nombres, IDs y tipos para crud, async_crud,
+los esquemas de las tools, sus descripciones y el prompt del agente.
+
+El catálogo publica instantáneas inmutables (CatalogSnapshot) con índices precalculados,
+de modo que validar un nombre u obtener su ID es una búsqueda en un dict y no requiere
+ninguna consulta. La instantánea se recarga:
+- cuando caduca (FACILITY_CATALOG_TTL segundos), al pedirla con snapshot()/asnapshot();
+- al recibir un NOTIFY en el canal 'catalogo_instalaciones' (ver sql/catalogo_instalaciones_notify.sql),
+  si se arrancó el hilo de escucha con start_listener().
+Los suscriptores (subscribe) reciben la nueva instantánea solo cuando el contenido cambia.
+"""
+import logging
+import os
+import select
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from types import MappingProxyType
+import psycopg2
+import psycopg2.extensions
+from .connection import db_connection, get_db_connection
+
+FACILITY_CATALOG_TTL = int(os.getenv("FACILITY_CATALOG_TTL", 300))
+CANAL_NOTIFY = "catalogo_instalaciones"
+
+SQL_CATALOGO = """
+    SELECT id_instalacion, ds_nombre, ds_tipo, ds_descripcion
+    FROM public.instalaciones
+    ORDER BY ds_nombre
+"""
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin tildes y sin espacios sobrantes: 'Pista  Pádel 1' -> 'pista padel 1'."""
+    sin_tildes = ''.join(c for c in unicodedata.normalize('NFD', texto.lower()) if unicodedata.category(c) != 'Mn')
+    return ' '.join(sin_tildes.split())
+
+
+@dataclass(frozen=True)
+class Facility:
+    id_instalacion: int
+    nombre: str
+    tipo: str | None
+    descripcion: str | None
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Instantánea inmutable del catálogo. Se sustituye entera en cada recarga, nunca se modifica."""
+    facilities: tuple = ()
+    cargado_en: float = 0.0
+    por_nombre: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    por_normalizado: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    por_tipo: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+
+    @classmethod
+    def from_rows(cls, rows) -> "CatalogSnapshot":
+        facilities = tuple(Facility(*row) for row in rows)
+        por_tipo = {}
+        for f in facilities:
+            if f.tipo:
+                por_tipo.setdefault(normalizar(f.tipo), []).append(f.id_instalacion)
+        return cls(
+            facilities=facilities,
+            cargado_en=time.monotonic(),
+            por_nombre=MappingProxyType({f.nombre: f for f in facilities}),
+            por_normalizado=MappingProxyType({normalizar(f.nombre): f.nombre for f in facilities}),
+            por_tipo=MappingProxyType({tipo: tuple(ids) for tipo, ids in por_tipo.items()}),
+        )
+
+    @property
+    def names(self) -> list[str]:
+        return [f.nombre for f in self.facilities]
+
+    @property
+    def types(self) -> list[str]:
+        return sorted({f.tipo for f in self.facilities if f.tipo})
+
+    def names_str(self, vacio: str = "ninguna especificada") -> str:
+        return ', '.join(self.names) if self.facilities else vacio
+
+    def match(self, nombre: str) -> str | None:
+        """Nombre canónico (con las mayúsculas de la DB) o None. Ignora mayúsculas, tildes y espacios extra."""
+        return self.por_normalizado.get(normalizar(nombre)) if nombre else None
+
+    def id_of(self, nombre: str) -> int | None:
+        canonico = self.match(nombre)
+        return self.por_nombre[canonico].id_instalacion if canonico else None
+
+    def ids_for_type(self, texto: str) -> tuple:
+        """IDs de las instalaciones cuyo tipo aparece en `texto` ('padel', 'una pista de pádel')."""
+        texto = normalizar(texto or '')
+        return tuple(i for tipo, ids in self.por_tipo.items() if tipo and tipo in texto for i in ids)
+
+    def content_key(self) -> tuple:
+        return self.facilities
+
+
+class FacilityCatalog:
+    def __init__(self, ttl: int = FACILITY_CATALOG_TTL):
+        self._ttl = ttl
+        self._snapshot = CatalogSnapshot()
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._listener = None
+        self._stop = threading.Event()
+
+    # --- Lectura ---
+
+    def current(self) -> CatalogSnapshot:
+        """Última instantánea publicada, sin acceder a la DB (para validadores y código caliente)."""
+        return self._snapshot
+
+    def _stale(self) -> bool:
+        snap = self._snapshot
+        return not snap.facilities or time.monotonic() - snap.cargado_en > self._ttl
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Instantánea vigente; si está vacía o caducada la recarga (consulta síncrona)."""
+        if self._stale():
+            self.refresh()
+        return self._snapshot
+
+    async def asnapshot(self) -> CatalogSnapshot:
+        """Como snapshot(), pero recargando con el pool asíncrono para no bloquear el event loop."""
+        if self._stale():
+            await self.arefresh()
+        return self._snapshot
+
+    # --- Recarga ---
+
+    def refresh(self) -> bool:
+        """Recarga desde la DB. Si falla, conserva la instantánea anterior. Devuelve True si cambió."""
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SQL_CATALOGO)
+                    rows = cur.fetchall()
+        except Exception as e:
+            logging.error(f"No se pudo recargar el catálogo de instalaciones: {e}")
+            return False
+        return self.publish(rows)
+
+    async def arefresh(self) -> bool:
+        from .async_connection import async_db_connection
+        try:
+            async with async_db_connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(SQL_CATALOGO)
+                    rows = await cur.fetchall()
+        except Exception as e:
+            logging.error(f"No se pudo recargar el catálogo de instalaciones: {e}")
+            return False
+        return self.publish(rows)
+
+    def publish(self, rows) -> bool:
+        """Publica una nueva instantánea a partir de filas de SQL_CATALOGO y avisa a los suscriptores si cambió."""
+        nuevo = CatalogSnapshot.from_rows(rows)
+        with self._lock:
+            cambiado = nuevo.content_key() != self._snapshot.content_key()
+            self._snapshot = nuevo  # Aunque no cambie, se renueva cargado_en
+        if cambiado:
+            logging.info(f"Catálogo de instalaciones actualizado: {nuevo.names_str()}")
+            for callback in list(self._subscribers):
+                try:
+                    callback(nuevo)
+                except Exception as e:
+                    logging.error(f"Error en suscriptor del catálogo de instalaciones: {e}", exc_info=True)
+        return cambiado
+
+    def subscribe(self, callback):
+        """Registra callback(snapshot), llamado cada vez que cambia el contenido del catálogo."""
+        self._subscribers.append(callback)
+
+    # --- LISTEN/NOTIFY ---
+
+    def start_listener(self):
+        """Arranca un hilo que recarga el catálogo al recibir NOTIFY en CANAL_NOTIFY."""
+        if self._listener and self._listener.is_alive():
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen_loop, name="facility-catalog-listener", daemon=True)
+        self._listener.start()
+
+    def stop_listener(self):
+        self._stop.set()
+        if self._listener:
+            self._listener.join(timeout=10)
+            self._listener = None
+
+    def _listen_loop(self):
+        # Conexión dedicada (fuera del pool): LISTEN la mantiene ocupada mientras dure el hilo
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CANAL_NOTIFY}")
+                logging.info(f"Escuchando cambios del catálogo en el canal '{CANAL_NOTIFY}'")
+                # Recargar al (re)conectar por si hubo cambios mientras no escuchábamos
+                self.refresh()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()  # Varios NOTIFY seguidos -> una sola recarga
+                        self.refresh()
+            except Exception as e:
+                logging.error(f"Error en el listener del catálogo de instalaciones: {e}")
+                self._stop.wait(10)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_facility_catalog() -> FacilityCatalog:
+    """Devuelve el catálogo compartido por toda la aplicación (se crea la primera vez)."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = FacilityCatalog()
+    return _catalog
@@ -6,10 +6,22 @@ from langchain_core.runnables.history import RunnableWithMessageHistory
 from contextlib import asynccontextmanager
 from app.agente.agent_setup import inicializar_componentes_base_agente, get_session_history
 from app.whatsapp.handler import WhatsAppHandler
-from app.rag.retriever import initialize_embeddings
+from app.rag.retriever import initialize_embeddings, initialize_retriever, shutdown_embeddings, get_rag_stats
+from app.database.connection import close_pool, get_pool_stats
+from app.database.async_connection import get_async_pool, close_async_pool, get_async_pool_stats
+from app.database.facility_catalog import get_facility_catalog
+from app.ml.calendario import get_calendario
+from app.ml.registry import get_model_registry
+from app.ml.weather import get_weather_provider
+from app.memory.session_cache import get_session_cache
 import os
+import sys
 import asyncio 
 
+# psycopg 3 asíncrono no funciona con el ProactorEventLoop por defecto de Windows
+if sys.platform == "win32":
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
 # ---  Caché  de IDs de mensajes procesados ---
 processed_message_ids = set()
 # Un Lock para evitar condiciones de carrera al modificar el set desde múltiples tareas async
@@ -25,46 +37,96 @@ main_agent_handler = None
 whatsapp_handler_global  = None
 
 
+def construir_agente():
+    """Crea el agente (tools y prompt con la instantánea actual del catálogo) envuelto con historial."""
+    agent_logic, tools_list, _ = inicializar_componentes_base_agente()
+
+    agent_executor_base = AgentExecutor(
+        agent=agent_logic,
+        tools=tools_list,
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=8,
+        return_intermediate_steps=True,
+        callbacks=None,  # Asegurarnos de que no hay callbacks que interfieran
+        configurable={"session_id": None},  # Agregar configuración base
+        run_manager_config={"configurable": {"session_id": None}}  # Agregar configuración para run_manager
+    )
+
+    return RunnableWithMessageHistory(
+        runnable=agent_executor_base,
+        get_session_history=get_session_history,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+        output_messages_key="output"
+    )
+
+
+def on_catalog_change(snapshot):
+    """
+    Las descripciones de las tools y el prompt incluyen los nombres de las instalaciones:
+    al cambiar el catálogo se reconstruye el agente y se sustituye en el handler.
+    Los mensajes en curso terminan con el agente anterior.
+    """
+    global main_agent_handler
+    if whatsapp_handler_global is None:
+        return
+    logging.info("Catálogo de instalaciones modificado: reconstruyendo el agente...")
+    main_agent_handler = construir_agente()
+    whatsapp_handler_global.agent_executor = main_agent_handler
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global main_agent_handler, whatsapp_handler_global
+    catalog = get_facility_catalog()
     try:
         # 1. Cargar modelos pesados (como embeddings) primero
         logging.info("Inicializando modelo de embeddings...")
         initialize_embeddings()
+        initialize_retriever()
         logging.info("Modelo de embeddings listo.")
 
-        # 2. Inicializar los componentes del agente
-        agent_logic, tools_list, _ = inicializar_componentes_base_agente()
-        
-        agent_executor_base = AgentExecutor(
-            agent=agent_logic,
-            tools=tools_list,
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=8,
-            return_intermediate_steps=True,
-            callbacks=None,  # Asegurarnos de que no hay callbacks que interfieran
-            configurable={"session_id": None},  # Agregar configuración base
-            run_manager_config={"configurable": {"session_id": None}}  # Agregar configuración para run_manager
-        )
-
-        main_agent_handler = RunnableWithMessageHistory(
-            runnable=agent_executor_base,
-            get_session_history=get_session_history,
-            input_messages_key="input",
-            history_messages_key="chat_history",
-            output_messages_key="output"
-        )
+        # Modelo de cancelación: se carga ahora para que la primera reserva no pague la deserialización
+        version_modelo = await asyncio.to_thread(get_model_registry().warm_up)
+        await asyncio.to_thread(get_calendario)
+        logging.info(f"Modelo de cancelación listo: {version_modelo}")
+
+        # Previsión de lluvia: primera carga ahora y recarga periódica en segundo plano
+        await asyncio.to_thread(get_weather_provider().refresh)
+        get_weather_provider().start()
+
+        # 2. Abrir el pool asíncrono que usan las tools del agente
+        await get_async_pool()
+
+        # 3. Cargar el catálogo de instalaciones e inicializar los componentes del agente
+        await catalog.arefresh()
+        main_agent_handler = construir_agente()
 
         whatsapp_handler_global = WhatsAppHandler(main_agent_handler)
         logging.info("Agente con historial y WhatsAppHandler inicializados correctamente.")
 
-        yield
+        # 4. Mantener el catálogo al día (NOTIFY desde la DB + TTL) y reconstruir el agente si cambia
+        catalog.subscribe(on_catalog_change)
+        catalog.start_listener()
+
     except Exception as e:
         logging.error(f"Error al inicializar el agente, la memoria o WhatsAppHandler: {e}")
         raise e
 
+    try:
+        yield
+    finally:
+        catalog.stop_listener()
+        get_weather_provider().stop()
+        shutdown_embeddings()
+        # Los mensajes con escritura diferida se guardan antes de cerrar los pools
+        await asyncio.to_thread(get_session_cache().close)
+        logging.info(f"Estadísticas finales del pool de BD: {get_pool_stats()}")
+        logging.info(f"Estadísticas finales del pool asíncrono de BD: {get_async_pool_stats()}")
+        close_pool()
+        await close_async_pool()
+
 app = FastAPI(lifespan=lifespan)
 
 async def process_message_async(payload: dict):
@@ -89,6 +151,26 @@ async def process_message_async(payload: dict):
         logging.error(f"Error crítico en process_message_async: {e}", exc_info=True)
 
 
+@app.get("/health/db-pool")
+async def db_pool_stats():
+    """Estadísticas del pool de conexiones (en uso, esperando, tiempo de espera) para dimensionarlo."""
+    return {"sync": get_pool_stats(), "async": get_async_pool_stats()}
+
+@app.get("/health/weather")
+async def weather_stats():
+    """Estado de la caché de previsión de lluvia (aciertos, datos caducados o ausentes, errores de la API)."""
+    return get_weather_provider().stats()
+
+@app.get("/health/history")
+async def history_cache_stats():
+    """Aciertos de la caché de historiales, tiempo medio de carga por turno y escrituras pendientes."""
+    return get_session_cache().stats()
+
+@app.get("/health/rag")
+async def rag_stats():
+    """Aciertos de las cachés del RAG, tiempo ahorrado estimado y reparto y latencia de las rutas léxica e híbrida."""
+    return get_rag_stats()
+
 @app.get("/webhook")
 async def verify_webhook(request: Request):
     """
@@ -0,0 +1,99 @@
+"""
+Almacén de objetos para el historial de chats.
+
+El historial guarda sus segmentos como objetos inmutables: solo hace falta escribir, leer y
+borrar por clave. Dos implementaciones:
+
+    S3ObjectStore          bucket BUCKET_NAME de S3 o de un servicio compatible (MinIO,
+                           LocalStack...) indicado con S3_ENDPOINT_URL
+    FilesystemObjectStore  ficheros bajo HISTORY_FS_ROOT, para desarrollo y pruebas sin S3
+
+HISTORY_STORE ('s3' por defecto o 'fs') elige cuál usa get_object_store().
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+HISTORY_STORE = os.getenv("HISTORY_STORE", "s3")
+HISTORY_FS_ROOT = Path(os.getenv("HISTORY_FS_ROOT", Path(__file__).resolve().parent.parent.parent / 'data' / 'historial_local'))
+
+
+class ObjectStore(ABC):
+    """Interfaz mínima: get lanza KeyError si el objeto no existe."""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def delete(self, keys: list[str]) -> None:
+        ...
+
+
+class S3ObjectStore(ObjectStore):
+    def __init__(self, bucket: str = None, endpoint_url: str = None):
+        import boto3
+        self.bucket = bucket or os.getenv("BUCKET_NAME")
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or os.getenv("S3_ENDPOINT_URL") or None)
+
+    def put(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            raise KeyError(key)
+
+    def delete(self, keys: list[str]) -> None:
+        # delete_objects admite hasta 1000 claves por llamada
+        for inicio in range(0, len(keys), 1000):
+            lote = keys[inicio:inicio + 1000]
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": k} for k in lote], "Quiet": True})
+
+
+class FilesystemObjectStore(ObjectStore):
+    def __init__(self, root=HISTORY_FS_ROOT):
+        self.root = Path(root)
+
+    def _ruta(self, key: str) -> Path:
+        ruta = (self.root / key).resolve()
+        if self.root.resolve() not in ruta.parents:
+            raise ValueError(f"Clave fuera del almacén: {key}")
+        return ruta
+
+    def put(self, key: str, data: bytes) -> None:
+        ruta = self._ruta(key)
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        temporal = ruta.with_name(f".{ruta.name}.tmp")
+        temporal.write_bytes(data)
+        os.replace(temporal, ruta)
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self._ruta(key).read_bytes()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def delete(self, keys: list[str]) -> None:
+        for key in keys:
+            self._ruta(key).unlink(missing_ok=True)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_object_store() -> ObjectStore:
+    """Almacén compartido según HISTORY_STORE (el cliente de boto3 es seguro entre hilos)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = FilesystemObjectStore() if HISTORY_STORE == "fs" else S3ObjectStore()
+    return _store
@@ -0,0 +1,327 @@
+"""
+Historial de chats en PostgreSQL: un mensaje por fila (JSONB) en historial_mensajes.
+
+Con el historial en S3 cada lectura son dos viajes dependientes (manifiesto en PostgreSQL y
+descarga de los objetos) y cada turno una subida más un upsert. Con nuestros tamaños de
+mensaje la indirección solo añade latencia, así que con HISTORY_BACKEND=postgres:
+
+    lectura   una consulta por la clave primaria (ds_telefono, nu_mensaje); los n últimos
+              mensajes con un recorrido inverso del mismo índice
+    escritura una sentencia: el upsert de la cabecera (historial_chats) reserva los números
+              de mensaje y los inserta a la vez
+
+historial_chats.ds_ubicacion indica dónde están los mensajes de cada teléfono ('pg' o 's3').
+S3 queda para el archivo de sesiones frías: archivar_historial() las mueve a un segmento de
+S3PostgresChatMessageHistory y mover_a_postgres() las devuelve, lo que ocurre solo en la
+siguiente escritura de ese teléfono. Las sesiones que aún están en S3 se leen desde allí.
+Migración: sql/historial_mensajes.sql; scripts/migrar_historial_postgres.py y
+scripts/archivar_historial.py.
+"""
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+import json
+import os
+import asyncio
+import uuid
+from typing import List
+from app.database.connection import db_connection # Pool de conexiones PostgreSQL
+from app.memory.object_store import ObjectStore, get_object_store
+from app.memory.s3_postgres_history import SQL_LEER_SEGMENTOS, S3PostgresChatMessageHistory, _descargar
+from app.memory.serializacion import EXTENSION, serializar
+
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "s3")  # 's3' o 'postgres'
+
+SQL_LEER_MENSAJES = """
+    SELECT tx_mensaje FROM historial_mensajes WHERE ds_telefono = %s ORDER BY nu_mensaje
+"""
+
+SQL_LEER_ULTIMOS_MENSAJES = """
+    SELECT tx_mensaje FROM (
+        SELECT nu_mensaje, tx_mensaje FROM historial_mensajes
+        WHERE ds_telefono = %s
+        ORDER BY nu_mensaje DESC
+        LIMIT %s
+    ) ultimos
+    ORDER BY nu_mensaje
+"""
+
+SQL_LEER_MENSAJES_DESDE = """
+    SELECT nu_mensaje, tx_mensaje FROM historial_mensajes
+    WHERE ds_telefono = %s AND nu_mensaje >= %s
+    ORDER BY nu_mensaje
+"""
+
+# Reserva los números de mensaje en la cabecera e inserta los mensajes en una sola sentencia.
+# Si el teléfono está en S3 el upsert no actualiza nada y no se inserta ninguna fila.
+SQL_ANEXAR_MENSAJES = """
+    WITH cabecera AS (
+        INSERT INTO historial_chats (ds_telefono, s3_chat_history_key, nu_mensajes, ds_ubicacion, last_updated)
+        VALUES (%(telefono)s, NULL, %(n)s, 'pg', CURRENT_TIMESTAMP)
+        ON CONFLICT (ds_telefono)
+        DO UPDATE SET
+            nu_mensajes = historial_chats.nu_mensajes + EXCLUDED.nu_mensajes,
+            last_updated = CURRENT_TIMESTAMP
+        WHERE historial_chats.ds_ubicacion = 'pg'
+        RETURNING nu_mensajes
+    )
+    INSERT INTO historial_mensajes (ds_telefono, nu_mensaje, tx_mensaje)
+    SELECT %(telefono)s, cabecera.nu_mensajes - %(n)s + m.orden - 1, m.mensaje
+    FROM cabecera, jsonb_array_elements(%(mensajes)s::jsonb) WITH ORDINALITY AS m(mensaje, orden)
+"""
+
+SQL_BLOQUEAR_CABECERA = """
+    SELECT s3_chat_history_key, ds_ubicacion, nu_ultimo_segmento
+    FROM historial_chats WHERE ds_telefono = %s FOR UPDATE
+"""
+
+SQL_INSERTAR_MENSAJES = """
+    INSERT INTO historial_mensajes (ds_telefono, nu_mensaje, tx_mensaje)
+    SELECT %(telefono)s, %(primero)s + m.orden - 1, m.mensaje
+    FROM jsonb_array_elements(%(mensajes)s::jsonb) WITH ORDINALITY AS m(mensaje, orden)
+"""
+
+
+def _json_mensajes(messages: List[BaseMessage]) -> str:
+    return json.dumps([message_to_dict(m) for m in messages])
+
+
+class PostgresChatMessageHistory(BaseChatMessageHistory):
+    def __init__(self, session_id: str, store: ObjectStore = None):
+        self.session_id = session_id # número de telefono
+        self.store = store or get_object_store()
+        self._messages = None  # Cache para mensajes
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """Obtiene los mensajes del historial."""
+        if self._messages is None:
+            self._messages = self._get_messages_sync()
+        return self._messages
+
+    def leer(self, ultimos: int = None) -> List[BaseMessage]:
+        """
+        Mensajes en orden (los `ultimos` si se indica); los de una sesión archivada, desde S3.
+        Si la sesión se mueve a PostgreSQL mientras se lee de S3, se vuelve a leer.
+        A diferencia de `messages`, los errores se propagan a quien llama.
+        """
+        for intento in range(2):
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    if ultimos is None:
+                        cur.execute(SQL_LEER_MENSAJES, (self.session_id,))
+                    else:
+                        cur.execute(SQL_LEER_ULTIMOS_MENSAJES, (self.session_id, ultimos))
+                    filas = cur.fetchall()
+                    if not filas:
+                        # Sin filas: sesión nueva o todavía en S3 (archivada o sin migrar)
+                        cur.execute("SELECT ds_ubicacion FROM historial_chats WHERE ds_telefono = %s", (self.session_id,))
+                        cabecera = cur.fetchone()
+            if filas:
+                return messages_from_dict([fila[0] for fila in filas])
+            if not cabecera or cabecera[0] != 's3':
+                return []
+            try:
+                mensajes = S3PostgresChatMessageHistory(self.session_id, self.store).leer(ultimos)
+            except KeyError:
+                if intento:
+                    raise
+                continue
+            if mensajes or intento:
+                return mensajes
+        return []
+
+    def leer_desde(self, desde: int) -> tuple[int, List[BaseMessage]]:
+        """
+        (posición del primer mensaje devuelto, mensajes) a partir de la posición `desde`, con un
+        recorrido del índice de la clave primaria; los de una sesión archivada, desde S3.
+        """
+        for intento in range(2):
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SQL_LEER_MENSAJES_DESDE, (self.session_id, desde))
+                    filas = cur.fetchall()
+                    if not filas:
+                        cur.execute("SELECT ds_ubicacion, nu_mensajes FROM historial_chats WHERE ds_telefono = %s",
+                                    (self.session_id,))
+                        cabecera = cur.fetchone()
+            if filas:
+                return filas[0][0], messages_from_dict([fila[1] for fila in filas])
+            if not cabecera:
+                return 0, []
+            if cabecera[0] != 's3':
+                return cabecera[1], []
+            try:
+                primero, mensajes = S3PostgresChatMessageHistory(self.session_id, self.store).leer_desde(desde)
+            except KeyError:
+                if intento:
+                    raise
+                continue
+            if mensajes or intento:
+                return primero, mensajes
+        return 0, []
+
+    def _get_messages_sync(self) -> List[BaseMessage]:
+        """Obtiene los mensajes de forma síncrona."""
+        try:
+            return self.leer()
+        except Exception as e:
+            print(f"Error al recuperar mensajes: {str(e)}")
+            return []
+
+    def ultimos_mensajes(self, n: int) -> List[BaseMessage]:
+        """Los `n` últimos mensajes, leídos con el índice de la clave primaria."""
+        if self._messages is not None:
+            return self._messages[-n:] if n > 0 else []
+        if n <= 0:
+            return []
+        try:
+            return self.leer(ultimos=n)
+        except Exception as e:
+            print(f"Error al recuperar mensajes: {str(e)}")
+            return []
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Añade un mensaje al historial."""
+        self.add_messages([message])
+
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        """Añade múltiples mensajes al historial en una sola sentencia."""
+        if not messages:
+            return
+        parametros = {"telefono": self.session_id, "n": len(messages), "mensajes": _json_mensajes(messages)}
+        try:
+            for intento in range(2):
+                with db_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(SQL_ANEXAR_MENSAJES, parametros)
+                        insertados = cur.rowcount
+                    conn.commit()
+                if insertados:
+                    break
+                if intento:
+                    raise RuntimeError(f"No se pudo anexar al historial de {self.session_id}")
+                # El historial está en S3 (archivado o sin migrar): se trae a PostgreSQL y se reintenta
+                mover_a_postgres(self.session_id, self.store)
+
+            if self._messages is not None:
+                self._messages.extend(messages)
+
+        except Exception as e:
+            print(f"Error al añadir mensajes: {str(e)}")
+            raise
+
+    def clear(self) -> None:
+        """Limpia el historial de mensajes."""
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM historial_mensajes WHERE ds_telefono = %s", (self.session_id,))
+                conn.commit()
+            # Cabecera, segmentos archivados y sus objetos
+            S3PostgresChatMessageHistory(self.session_id, self.store).clear()
+            self._messages = []
+
+        except Exception as e:
+            print(f"Error al limpiar historial: {str(e)}")
+            raise
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """Versión asíncrona de get_messages."""
+        if self._messages is None:
+            loop = asyncio.get_event_loop()
+            self._messages = await loop.run_in_executor(None, self._get_messages_sync)
+        return self._messages
+
+    async def aadd_messages(self, messages: List[BaseMessage]) -> None:
+        """Versión asíncrona de add_messages."""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.add_messages, messages)
+
+    async def aclear(self) -> None:
+        """Versión asíncrona de clear."""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.clear)
+
+
+def crear_historial(session_id: str) -> BaseChatMessageHistory:
+    """Historial de la sesión según HISTORY_BACKEND ('s3' por defecto o 'postgres')."""
+    if HISTORY_BACKEND == "postgres":
+        return PostgresChatMessageHistory(session_id)
+    return S3PostgresChatMessageHistory(session_id)
+
+
+# === Movimiento entre S3 y PostgreSQL ===
+
+def mover_a_postgres(telefono: str, store: ObjectStore = None, dry_run: bool = False) -> int:
+    """
+    Trae a historial_mensajes el historial de un teléfono que está en S3 (objeto antiguo y
+    segmentos) y devuelve cuántos mensajes movió. Se hace con la cabecera bloqueada, así que
+    los turnos y compactaciones simultáneos esperan; los objetos se borran tras el commit.
+    """
+    store = store or get_object_store()
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_BLOQUEAR_CABECERA, (telefono,))
+            cabecera = cur.fetchone()
+            if not cabecera or cabecera[1] != 's3':
+                conn.rollback()
+                return 0
+            cur.execute(SQL_LEER_SEGMENTOS, (telefono,))
+            claves = ([cabecera[0]] if cabecera[0] else []) + [fila[1] for fila in cur.fetchall()]
+            mensajes = _descargar(store, claves)
+            if dry_run:
+                conn.rollback()
+                return len(mensajes)
+            cur.execute(SQL_INSERTAR_MENSAJES, {"telefono": telefono, "primero": 0, "mensajes": _json_mensajes(mensajes)})
+            cur.execute("DELETE FROM historial_segmentos WHERE ds_telefono = %s", (telefono,))
+            cur.execute("""
+                UPDATE historial_chats
+                SET ds_ubicacion = 'pg', s3_chat_history_key = NULL, nu_mensajes = %s, last_updated = CURRENT_TIMESTAMP
+                WHERE ds_telefono = %s
+            """, (len(mensajes), telefono))
+        conn.commit()
+    store.delete(claves)
+    return len(mensajes)
+
+
+def archivar_historial(telefono: str, store: ObjectStore = None, dry_run: bool = False) -> int:
+    """
+    Mueve a S3 el historial de un teléfono que está en PostgreSQL, como un único segmento, y
+    devuelve cuántos mensajes archivó. Si algo falla después de subir el objeto, se borra.
+    """
+    store = store or get_object_store()
+    clave = f"historial/{telefono}/{uuid.uuid4().hex}{EXTENSION}"
+    subido = False
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SQL_BLOQUEAR_CABECERA, (telefono,))
+                cabecera = cur.fetchone()
+                if not cabecera or cabecera[1] != 'pg':
+                    conn.rollback()
+                    return 0
+                cur.execute(SQL_LEER_MENSAJES, (telefono,))
+                mensajes = messages_from_dict([fila[0] for fila in cur.fetchall()])
+                if dry_run:
+                    conn.rollback()
+                    return len(mensajes)
+                if mensajes:
+                    contenido = serializar(mensajes)
+                    store.put(clave, contenido)
+                    subido = True
+                    cur.execute("""
+                        INSERT INTO historial_segmentos (ds_telefono, nu_segmento, ds_clave, nu_primer_mensaje, nu_mensajes, nu_bytes)
+                        VALUES (%s, %s, %s, 0, %s, %s)
+                    """, (telefono, cabecera[2] + 1, clave, len(mensajes), len(contenido)))
+                cur.execute("DELETE FROM historial_mensajes WHERE ds_telefono = %s", (telefono,))
+                cur.execute("""
+                    UPDATE historial_chats
+                    SET ds_ubicacion = 's3', nu_mensajes = %s, nu_ultimo_segmento = nu_ultimo_segmento + 1
+                    WHERE ds_telefono = %s
+                """, (len(mensajes), telefono))
+            conn.commit()
+    except Exception:
+        if subido:
+            store.delete([clave])
+        raise
+    return len(mensajes)
@@ -1,30 +1,132 @@
+"""
+Historial de chats en segmentos de solo anexado: objetos en S3 (o en disco) + manifiesto en PostgreSQL.
+
+Cada llamada a add_messages sube únicamente los mensajes nuevos como un objeto inmutable
+(historial/<telefono>/<uuid>.hc, codificado por app/memory/serializacion.py) y registra en historial_segmentos su número de segmento y
+su posición en la conversación; historial_chats guarda el total de mensajes y el último
+segmento asignado. Escribir un turno cuesta lo mismo con 5 mensajes previos que con 5000.
+
+Al leer se descargan los segmentos en orden (en paralelo) y, con ultimos_mensajes(n) o
+leer_desde(posicion), solo los que contienen los n últimos o los que siguen a esa posición. compactar_historial() fusiona los segmentos pequeños y
+convierte el objeto único de los historiales anteriores (s3_chat_history_key) en el segmento 0.
+Migración: sql/historial_segmentos.sql.
+"""
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
-import boto3 # Para S3
-import psycopg2 # Para PostgreSQL
-import json
-import os 
+from langchain_core.messages import BaseMessage
+import os
 import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+from app.database.connection import db_connection # Pool de conexiones PostgreSQL
+from app.memory.object_store import ObjectStore, get_object_store
+from app.memory.serializacion import EXTENSION, deserializar, serializar
+
+HISTORY_READ_WORKERS = int(os.getenv("HISTORY_READ_WORKERS", 8))  # Descargas de segmentos en paralelo
+HISTORY_SEGMENT_TARGET_MESSAGES = int(os.getenv("HISTORY_SEGMENT_TARGET_MESSAGES", 200))  # Tamaño objetivo al compactar
+
+SQL_LEER_CABECERA = """
+    SELECT s3_chat_history_key, nu_mensajes, ds_ubicacion FROM historial_chats WHERE ds_telefono = %s
+"""
+
+SQL_LEER_SEGMENTOS = """
+    SELECT nu_segmento, ds_clave, nu_primer_mensaje, nu_mensajes
+    FROM historial_segmentos
+    WHERE ds_telefono = %s
+    ORDER BY nu_segmento
+"""
+
+# Solo los segmentos que contienen alguno de los %s últimos mensajes
+SQL_LEER_ULTIMOS_SEGMENTOS = """
+    SELECT s.nu_segmento, s.ds_clave, s.nu_primer_mensaje, s.nu_mensajes
+    FROM historial_segmentos s
+    JOIN historial_chats h ON h.ds_telefono = s.ds_telefono
+    WHERE s.ds_telefono = %s AND s.nu_primer_mensaje + s.nu_mensajes > h.nu_mensajes - %s
+    ORDER BY s.nu_segmento
+"""
+
+# Solo los segmentos con algún mensaje en la posición %s o después
+SQL_LEER_SEGMENTOS_DESDE = """
+    SELECT nu_segmento, ds_clave, nu_primer_mensaje, nu_mensajes
+    FROM historial_segmentos
+    WHERE ds_telefono = %s AND nu_primer_mensaje + nu_mensajes > %s
+    ORDER BY nu_segmento
+"""
+
+# Reserva el siguiente número de segmento y registra el segmento en una sola sentencia:
+# el upsert bloquea la fila de la cabecera, así que dos turnos simultáneos quedan en orden.
+# Si los mensajes del teléfono están en historial_mensajes (ds_ubicacion = 'pg', ver
+# app/memory/postgres_history.py) el upsert no actualiza nada y no se registra el segmento.
+SQL_ANEXAR_SEGMENTO = """
+    WITH cabecera AS (
+        INSERT INTO historial_chats (ds_telefono, s3_chat_history_key, nu_mensajes, nu_ultimo_segmento, last_updated)
+        VALUES (%(telefono)s, NULL, %(n)s, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (ds_telefono)
+        DO UPDATE SET
+            nu_mensajes = historial_chats.nu_mensajes + EXCLUDED.nu_mensajes,
+            nu_ultimo_segmento = historial_chats.nu_ultimo_segmento + 1,
+            last_updated = CURRENT_TIMESTAMP
+        WHERE historial_chats.ds_ubicacion = 's3'
+        RETURNING nu_mensajes, nu_ultimo_segmento
+    )
+    INSERT INTO historial_segmentos (ds_telefono, nu_segmento, ds_clave, nu_primer_mensaje, nu_mensajes, nu_bytes)
+    SELECT %(telefono)s, nu_ultimo_segmento, %(clave)s, nu_mensajes - %(n)s, %(n)s, %(bytes)s
+    FROM cabecera
+"""
+
+
+def _descargar(store: ObjectStore, claves: List[str]) -> List[BaseMessage]:
+    """Mensajes de todas las claves, en orden. KeyError si alguna ya no existe."""
+    def una(clave):
+        return deserializar(store.get(clave))
+    if len(claves) <= 1:
+        partes = [una(clave) for clave in claves]
+    else:
+        with ThreadPoolExecutor(max_workers=min(HISTORY_READ_WORKERS, len(claves))) as pool:
+            partes = list(pool.map(una, claves))
+    return [m for parte in partes for m in parte]
 
 
 class S3PostgresChatMessageHistory(BaseChatMessageHistory):
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, store: ObjectStore = None):
         self.session_id = session_id # número de telefono
-        self.pg_conn_params = { 
-            "host": os.getenv("DB_HOST"),
-            "port": os.getenv("DB_PORT"),
-            "dbname": os.getenv("DB_NAME"),
-            "user": os.getenv("DB_USER"),
-            "password": os.getenv("DB_PASSWORD"),
-        }
-        self.s3_bucket_name = os.getenv("BUCKET_NAME")
-        self.s3_client = boto3.client('s3')
-        self.s3_object_key_prefix = "historial/" # Carpeta dentro del bucket
+        self.store = store or get_object_store()
+        self.s3_object_key_prefix = f"historial/{session_id}/" # Carpeta de los segmentos de esta sesión
         self._messages = None  # Cache para mensajes
 
-    def _get_s3_object_key(self) -> str:
-        return f"{self.s3_object_key_prefix}{self.session_id}.json"
+    def _nueva_clave(self) -> str:
+        return f"{self.s3_object_key_prefix}{uuid.uuid4().hex}{EXTENSION}"
+
+    def _historial_postgres(self):
+        # Import diferido: postgres_history importa este módulo
+        from app.memory.postgres_history import PostgresChatMessageHistory
+        return PostgresChatMessageHistory(self.session_id, self.store)
+
+    def _leer_manifiesto(self, ultimos: int = None, desde: int = None):
+        """
+        (clave del objeto antiguo o None, mensajes en segmentos, filas (nu_segmento, clave,
+        primer mensaje, mensajes) de los segmentos en orden); con `ultimos`, solo los segmentos
+        que contienen esos últimos mensajes y con `desde`, los que llegan a esa posición. Con
+        objeto antiguo las posiciones no cuentan sus mensajes, así que `desde` lee todos.
+        None si los mensajes del teléfono están en historial_mensajes (ds_ubicacion = 'pg').
+        """
+        # La conexión vuelve al pool antes de las descargas
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SQL_LEER_CABECERA, (self.session_id,))
+                cabecera = cur.fetchone()
+                if not cabecera:
+                    return None, 0, []
+                if cabecera[2] == 'pg':
+                    return None
+                if ultimos is not None:
+                    cur.execute(SQL_LEER_ULTIMOS_SEGMENTOS, (self.session_id, ultimos))
+                elif desde is not None and not cabecera[0]:
+                    cur.execute(SQL_LEER_SEGMENTOS_DESDE, (self.session_id, desde))
+                else:
+                    cur.execute(SQL_LEER_SEGMENTOS, (self.session_id,))
+                segmentos = cur.fetchall()
+        return cabecera[0], cabecera[1], segmentos
 
     @property
     def messages(self) -> List[BaseMessage]:
@@ -33,135 +135,137 @@ class S3PostgresChatMessageHistory(BaseChatMessageHistory):
             self._messages = self._get_messages_sync()
         return self._messages
 
+    def leer(self, ultimos: int = None) -> List[BaseMessage]:
+        """
+        Mensajes del objeto antiguo (si lo hay y hace falta) y de los segmentos, en orden. Si una
+        compactación borra un segmento entre la lectura del manifiesto y su descarga, se relee.
+        A diferencia de `messages`, los errores se propagan a quien llama.
+        """
+        for intento in range(2):
+            manifiesto = self._leer_manifiesto(ultimos)
+            if manifiesto is None:
+                return self._historial_postgres().leer(ultimos)
+            antiguo, total, segmentos = manifiesto
+            claves = [fila[1] for fila in segmentos]
+            # El objeto antiguo (anterior a la segmentación) va delante: solo hace falta si no bastan los segmentos
+            if antiguo and (ultimos is None or ultimos > total):
+                claves = [antiguo] + claves
+            try:
+                return _descargar(self.store, claves)
+            except KeyError:
+                if intento:
+                    raise
+
+    def leer_desde(self, desde: int) -> tuple[int, List[BaseMessage]]:
+        """
+        (posición del primer mensaje devuelto, mensajes): los segmentos que contienen la
+        posición `desde` y los siguientes, así que el primero puede empezar algo antes. Con el
+        objeto antiguo se lee todo desde la posición 0. Los errores se propagan, como en leer().
+        """
+        for intento in range(2):
+            manifiesto = self._leer_manifiesto(desde=desde)
+            if manifiesto is None:
+                return self._historial_postgres().leer_desde(desde)
+            antiguo, total, segmentos = manifiesto
+            claves = [fila[1] for fila in segmentos]
+            primero = segmentos[0][2] if segmentos else total
+            if antiguo:
+                claves, primero = [antiguo] + claves, 0
+            try:
+                return primero, _descargar(self.store, claves)
+            except KeyError:
+                if intento:
+                    raise
+
     def _get_messages_sync(self) -> List[BaseMessage]:
         """Obtiene los mensajes de forma síncrona."""
         try:
-            conn = psycopg2.connect(**self.pg_conn_params)
-            cur = conn.cursor()
-            
-            cur.execute(
-                "SELECT s3_chat_history_key FROM historial_chats WHERE ds_telefono = %s",
-                (self.session_id,)
-            )
-            result = cur.fetchone()
-            
-            if not result or not result[0]:
-                return []
-                
-            s3_key = result[0]
-                
-            try:
-                # Intentar descargar el objeto de S3 usando la clave almacenada
-                response = self.s3_client.get_object(
-                    Bucket=self.s3_bucket_name,
-                    Key=s3_key
-                )
-                
-                # Leer y deserializar el contenido JSON
-                content = response['Body'].read().decode('utf-8')
-                messages_dict = json.loads(content)
-                
-                # Convertir el diccionario a objetos BaseMessage
-                return messages_from_dict(messages_dict)
-                
-            except self.s3_client.exceptions.NoSuchKey:
-                return []
-                
+            return self.leer()
+        except Exception as e:
+            print(f"Error al recuperar mensajes: {str(e)}")
+            return []
+
+    def ultimos_mensajes(self, n: int) -> List[BaseMessage]:
+        """Los `n` últimos mensajes, descargando solo los segmentos que los contienen."""
+        if self._messages is not None:
+            return self._messages[-n:] if n > 0 else []
+        if n <= 0:
+            return []
+        try:
+            return self.leer(ultimos=n)[-n:]
         except Exception as e:
             print(f"Error al recuperar mensajes: {str(e)}")
             return []
-            
-        finally:
-            if 'cur' in locals():
-                cur.close()
-            if 'conn' in locals():
-                conn.close()
 
     def add_message(self, message: BaseMessage) -> None:
         """Añade un mensaje al historial."""
         self.add_messages([message])
 
     def add_messages(self, messages: List[BaseMessage]) -> None:
-        """Añade múltiples mensajes al historial."""
+        """Añade múltiples mensajes al historial: sube un segmento solo con ellos y lo registra en el manifiesto."""
+        if not messages:
+            return
+        clave = self._nueva_clave()
+        contenido = serializar(messages)
         try:
-            # 1. Cargar mensajes actuales
-            current_messages = self.messages
-            
-            # 2. Añadir nuevos mensajes
-            all_messages = current_messages + messages
-            
-            # 3. Serializar a JSON
-            messages_json = json.dumps(messages_to_dict(all_messages))
-            
-            # 4. Subir a S3
-            s3_key = self._get_s3_object_key()
-            self.s3_client.put_object(
-                Bucket=self.s3_bucket_name,
-                Key=s3_key,
-                Body=messages_json
-            )
-            
-            # 5. Actualizar PostgreSQL
-            conn = psycopg2.connect(**self.pg_conn_params)
-            cur = conn.cursor()
-            
-            cur.execute("""
-                INSERT INTO historial_chats (ds_telefono, s3_chat_history_key, last_updated)
-                VALUES (%s, %s, CURRENT_TIMESTAMP)
-                ON CONFLICT (ds_telefono) 
-                DO UPDATE SET 
-                    s3_chat_history_key = EXCLUDED.s3_chat_history_key,
-                    last_updated = CURRENT_TIMESTAMP
-            """, (self.session_id, s3_key))
-            
-            conn.commit()
-            
+            # 1. Subir el segmento (objeto nuevo: nunca se sobrescribe nada)
+            self.store.put(clave, contenido)
+
+            # 2. Registrarlo en PostgreSQL
+            try:
+                for intento in range(2):
+                    with db_connection() as conn:
+                        with conn.cursor() as cur:
+                            cur.execute(SQL_ANEXAR_SEGMENTO, {
+                                "telefono": self.session_id, "n": len(messages), "clave": clave, "bytes": len(contenido),
+                            })
+                            registrados = cur.rowcount
+                        conn.commit()
+                    if registrados:
+                        break
+                    if intento:
+                        raise RuntimeError(f"No se pudo anexar al historial de {self.session_id}")
+                    # El historial está en historial_mensajes (HISTORY_BACKEND=postgres): se
+                    # archiva en un segmento y se reintenta. Import diferido, como en _historial_postgres
+                    from app.memory.postgres_history import archivar_historial
+                    archivar_historial(self.session_id, self.store)
+            except Exception:
+                # Sin fila en el manifiesto el segmento es invisible: se borra para no dejar basura
+                self.store.delete([clave])
+                raise
+
             if self._messages is not None:
                 self._messages.extend(messages)
-            
+
         except Exception as e:
             print(f"Error al añadir mensajes: {str(e)}")
             raise
-            
-        finally:
-            if 'cur' in locals():
-                cur.close()
-            if 'conn' in locals():
-                conn.close()
 
     def clear(self) -> None:
         """Limpia el historial de mensajes."""
         try:
-            # 1. Borrar de S3
-            try:
-                self.s3_client.delete_object(
-                    Bucket=self.s3_bucket_name,
-                    Key=self._get_s3_object_key()
-                )
-            except self.s3_client.exceptions.NoSuchKey:
-                pass
-                
-            # 2. Borrar de PostgreSQL
-            conn = psycopg2.connect(**self.pg_conn_params)
-            cur = conn.cursor()
-            
-            cur.execute(
-                "DELETE FROM historial_chats WHERE ds_telefono = %s",
-                (self.session_id,)
-            )
-            
-            conn.commit()
+            # 1. Borrar de PostgreSQL (desde aquí el historial ya está vacío para los lectores)
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "DELETE FROM historial_segmentos WHERE ds_telefono = %s RETURNING ds_clave",
+                        (self.session_id,)
+                    )
+                    claves = [fila[0] for fila in cur.fetchall()]
+                    cur.execute(
+                        "DELETE FROM historial_chats WHERE ds_telefono = %s RETURNING s3_chat_history_key",
+                        (self.session_id,)
+                    )
+                    claves += [fila[0] for fila in cur.fetchall() if fila[0]]
+                conn.commit()
+
+            # 2. Borrar los objetos
+            self.store.delete(claves)
             self._messages = []
-            
+
         except Exception as e:
             print(f"Error al limpiar historial: {str(e)}")
             raise
-            
-        finally:
-            if 'cur' in locals():
-                cur.close()
-            if 'conn' in locals():
-                conn.close()
 
     async def aget_messages(self) -> List[BaseMessage]:
         """Versión asíncrona de get_messages."""
@@ -178,4 +282,102 @@ class S3PostgresChatMessageHistory(BaseChatMessageHistory):
     async def aclear(self) -> None:
         """Versión asíncrona de clear."""
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self.clear)
\ No newline at end of file
+        await loop.run_in_executor(None, self.clear)
+
+
+# === Compactación ===
+
+def _tramos_a_fusionar(segmentos: list, objetivo: int) -> list[list]:
+    """Agrupa segmentos consecutivos (nu_segmento, clave, primero, n) en tramos de hasta `objetivo` mensajes."""
+    tramos, actual, mensajes = [], [], 0
+    for segmento in segmentos:
+        n = segmento[3]
+        if actual and mensajes + n > objetivo:
+            tramos.append(actual)
+            actual, mensajes = [], 0
+        actual.append(segmento)
+        mensajes += n
+    if actual:
+        tramos.append(actual)
+    return [tramo for tramo in tramos if len(tramo) > 1]
+
+
+def compactar_historial(telefono: str, store: ObjectStore = None,
+                        objetivo: int = HISTORY_SEGMENT_TARGET_MESSAGES, dry_run: bool = False) -> dict:
+    """
+    Fusiona los segmentos consecutivos pequeños de un teléfono en segmentos de hasta `objetivo`
+    mensajes, y el objeto antiguo de antes de la segmentación en el segmento 0.
+
+    Cada fusión sube primero el objeto nuevo y después, en una transacción con la cabecera
+    bloqueada, sustituye las filas del tramo por la del segmento fusionado; si entretanto el
+    tramo cambió (clear, otra compactación) se descarta. Los objetos viejos se borran al final.
+    Los turnos que se anexan a la vez no interfieren: siempre reciben números mayores.
+    """
+    store = store or get_object_store()
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_LEER_CABECERA, (telefono,))
+            cabecera = cur.fetchone()
+            if not cabecera:
+                return {"tramos": 0, "segmentos_fusionados": 0}
+            cur.execute(SQL_LEER_SEGMENTOS, (telefono,))
+            segmentos = cur.fetchall()
+    antiguo = cabecera[0]
+
+    tramos = _tramos_a_fusionar(segmentos, objetivo)
+    if antiguo:
+        # El objeto antiguo va delante de todo: se fusiona con el primer tramo de segmentos (si lo hay)
+        primero = tramos[0] if tramos and tramos[0][0] == segmentos[0] else []
+        tramos = [[(0, antiguo, 0, None)] + primero] + [t for t in tramos if t is not primero]
+    resultado = {"tramos": len(tramos), "segmentos_fusionados": sum(len(t) for t in tramos)}
+    if dry_run:
+        return resultado
+
+    for tramo in tramos:
+        claves = [clave for _, clave, _, _ in tramo]
+        mensajes = _descargar(store, claves)
+        contenido = serializar(mensajes)
+        nueva = f"historial/{telefono}/{uuid.uuid4().hex}{EXTENSION}"
+        store.put(nueva, contenido)
+        con_antiguo = tramo[0][3] is None
+        numeros = [numero for numero, _, _, n in tramo if n is not None]
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT s3_chat_history_key FROM historial_chats WHERE ds_telefono = %s FOR UPDATE",
+                                (telefono,))
+                    fila = cur.fetchone()
+                    cur.execute("""
+                        DELETE FROM historial_segmentos
+                        WHERE ds_telefono = %s AND nu_segmento = ANY(%s)
+                        RETURNING nu_primer_mensaje
+                    """, (telefono, numeros))
+                    posiciones = [f[0] for f in cur.fetchall()]
+                    if not fila or len(posiciones) != len(numeros) or (con_antiguo and fila[0] != antiguo):
+                        conn.rollback()
+                        store.delete([nueva])
+                        continue
+                    primer_mensaje = min(posiciones) if posiciones else 0
+                    if con_antiguo:
+                        # Los mensajes del objeto antiguo pasan a contar: el resto de segmentos se desplaza
+                        n_antiguos = len(mensajes) - sum(n for _, _, _, n in tramo if n is not None)
+                        cur.execute("""
+                            UPDATE historial_chats
+                            SET s3_chat_history_key = NULL, nu_mensajes = nu_mensajes + %s
+                            WHERE ds_telefono = %s
+                        """, (n_antiguos, telefono))
+                        cur.execute("""
+                            UPDATE historial_segmentos SET nu_primer_mensaje = nu_primer_mensaje + %s
+                            WHERE ds_telefono = %s
+                        """, (n_antiguos, telefono))
+                        primer_mensaje = 0
+                    cur.execute("""
+                        INSERT INTO historial_segmentos (ds_telefono, nu_segmento, ds_clave, nu_primer_mensaje, nu_mensajes, nu_bytes)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                    """, (telefono, 0 if con_antiguo else min(numeros), nueva, primer_mensaje, len(mensajes), len(contenido)))
+                conn.commit()
+        except Exception:
+            store.delete([nueva])
+            raise
+        store.delete(claves)
+    return resultado
@@ -0,0 +1,124 @@
+"""
+Codificación de los segmentos del historial de chats.
+
+El formato original es el JSON de messages_to_dict: cada mensaje repite el sobre
+{"type": ..., "data": {"content": ..., "additional_kwargs": {}, "response_metadata": {},
+"type": ..., "name": null, "id": null, "example": false, ...}}, más grande que el propio texto
+en los mensajes cortos de WhatsApp. El formato compacto guarda cada mensaje como
+
+    [tipo, contenido]            o    [tipo, contenido, {campos con valor no por defecto}]
+
+codificado con orjson y comprimido con zstd, detrás de una cabecera de 5 bytes:
+
+    MAGIA (b"\\xffHC") + versión del formato + códec (0 sin comprimir, 1 zstd)
+
+Un JSON nunca empieza por 0xff, así que los objetos sin cabecera se leen como JSON antiguo y
+conviven con los nuevos; scripts/migrar_serializacion_historial.py reescribe los antiguos.
+HISTORY_SERIALIZER elige el formato de escritura: 'compacto' (por defecto) o 'json'.
+"""
+import json
+import os
+from typing import List
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    # Sin zstandard se escribe el formato compacto sin comprimir (y no se leen objetos zstd)
+    zstandard = None
+
+HISTORY_SERIALIZER = os.getenv("HISTORY_SERIALIZER", "compacto")
+HISTORY_ZSTD_LEVEL = int(os.getenv("HISTORY_ZSTD_LEVEL", 3))
+
+MAGIA = b"\xffHC"
+VERSION_COMPACTA = 1
+CODEC_NINGUNO = 0
+CODEC_ZSTD = 1
+# Con menos bytes, comprimir no compensa la trama de zstd
+MIN_BYTES_COMPRESION = 128
+
+# Extensión de las claves de los segmentos nuevos (solo informativa: el formato va en la cabecera)
+EXTENSION = ".json" if HISTORY_SERIALIZER == "json" else ".hc"
+
+
+def _json_dumps(valor) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(valor)
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(contenido: bytes):
+    if orjson is not None:
+        return orjson.loads(contenido)
+    return json.loads(contenido.decode("utf-8"))
+
+
+def _compactar(messages: List[BaseMessage]) -> list:
+    filas = []
+    for mensaje in messages_to_dict(messages):
+        datos = mensaje["data"]
+        # Los campos con su valor por defecto en LangChain (None, False, {} o []) no se guardan
+        extra = {k: v for k, v in datos.items()
+                 if k not in ("content", "type") and not (v is None or v is False or (isinstance(v, (dict, list)) and not v))}
+        fila = [mensaje["type"], datos.get("content", "")]
+        if extra:
+            fila.append(extra)
+        filas.append(fila)
+    return filas
+
+
+def _expandir(filas: list) -> List[BaseMessage]:
+    return messages_from_dict([
+        {"type": fila[0], "data": {"content": fila[1], **(fila[2] if len(fila) > 2 else {})}}
+        for fila in filas
+    ])
+
+
+def serializar_json(messages: List[BaseMessage]) -> bytes:
+    """Formato original: JSON de messages_to_dict."""
+    return json.dumps(messages_to_dict(messages)).encode('utf-8')
+
+
+def serializar_compacto(messages: List[BaseMessage], comprimir: bool = True) -> bytes:
+    cuerpo = _json_dumps(_compactar(messages))
+    codec = CODEC_NINGUNO
+    if comprimir and zstandard is not None and len(cuerpo) >= MIN_BYTES_COMPRESION:
+        cuerpo = zstandard.ZstdCompressor(level=HISTORY_ZSTD_LEVEL).compress(cuerpo)
+        codec = CODEC_ZSTD
+    return MAGIA + bytes([VERSION_COMPACTA, codec]) + cuerpo
+
+
+def serializar(messages: List[BaseMessage]) -> bytes:
+    """Codifica un segmento en el formato de HISTORY_SERIALIZER."""
+    if HISTORY_SERIALIZER == "json":
+        return serializar_json(messages)
+    return serializar_compacto(messages)
+
+
+def es_formato_actual(contenido: bytes) -> bool:
+    """True si el objeto ya está en el formato que se escribe ahora (no hace falta migrarlo)."""
+    if HISTORY_SERIALIZER == "json":
+        return not contenido.startswith(MAGIA)
+    return contenido.startswith(MAGIA) and contenido[len(MAGIA)] == VERSION_COMPACTA
+
+
+def deserializar(contenido: bytes) -> List[BaseMessage]:
+    """Decodifica un segmento en cualquiera de los formatos (detectado por la cabecera)."""
+    if not contenido.startswith(MAGIA):
+        return messages_from_dict(json.loads(contenido.decode('utf-8')))
+    version, codec = contenido[len(MAGIA)], contenido[len(MAGIA) + 1]
+    if version != VERSION_COMPACTA:
+        raise ValueError(f"Versión de historial desconocida: {version}")
+    cuerpo = contenido[len(MAGIA) + 2:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("El historial está comprimido con zstd y zstandard no está instalado")
+        cuerpo = zstandard.ZstdDecompressor().decompress(cuerpo)
+    elif codec != CODEC_NINGUNO:
+        raise ValueError(f"Códec de historial desconocido: {codec}")
+    return _expandir(_json_loads(cuerpo))
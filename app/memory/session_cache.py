@@ -0,0 +1,384 @@
+"""
+Caché en memoria de los historiales de chat activos, con escritura diferida.
+
+Antes cada mensaje entrante creaba un S3PostgresChatMessageHistory y descargaba el historial
+completo antes de llamar al LLM, aunque el mismo socio hubiera escrito diez segundos antes.
+Aquí los historiales se guardan en una LRU por teléfono (HISTORY_CACHE_SIZE entradas, y se
+expulsan tras HISTORY_CACHE_IDLE_SECONDS sin uso); solo el primer mensaje de una sesión paga
+la carga. Todos comparten el almacén de objetos y el pool de PostgreSQL.
+
+get() no hace E/S: RunnableWithMessageHistory lo llama de forma síncrona desde el event loop
+incluso con ainvoke. El historial se carga la primera vez que se leen sus mensajes; desde
+aget_messages, en un hilo del executor, así que el event loop nunca espera a S3 ni a PostgreSQL.
+
+Persistencia según HISTORY_DURABILITY:
+    deferred  (por defecto) add_messages actualiza la memoria y encola los mensajes; un hilo
+              escritor los persiste en orden, juntando en un solo segmento los de un mismo
+              teléfono que se hayan acumulado. close() vacía la cola al apagar la API.
+    sync      add_messages no vuelve hasta que los mensajes están persistidos.
+
+Un historial con escrituras pendientes nunca se expulsa, así que una recarga desde el almacén
+siempre ve todos sus mensajes.
+
+`messages`, lo que lee RunnableWithMessageHistory, no es el historial completo sino la
+ventana de app/memory/ventana.py (resumen + últimos turnos dentro del presupuesto de tokens).
+Por eso solo se carga desde el cursor del resumen (backend.leer_desde): los segmentos ya
+resumidos no se descargan.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+from app.memory import ventana
+from app.memory.postgres_history import HISTORY_BACKEND, crear_historial
+
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", 500))
+HISTORY_CACHE_IDLE_SECONDS = float(os.getenv("HISTORY_CACHE_IDLE_SECONDS", 1800))
+HISTORY_DURABILITY = os.getenv("HISTORY_DURABILITY", "deferred")
+HISTORY_FLUSH_TIMEOUT = float(os.getenv("HISTORY_FLUSH_TIMEOUT", 30))
+REINTENTO_ESCRITURA_SEGUNDOS = 2.0
+# Mensajes como máximo por llamada al modelo de resumen: lo que queda fuera de la ventana se
+# resume por tramos de este tamaño, cada uno sobre el resumen del anterior
+MAX_MENSAJES_RESUMEN = 100
+
+
+class CachedChatMessageHistory(BaseChatMessageHistory):
+    """Historial de una sesión servido desde memoria; las escrituras pasan por la caché."""
+
+    def __init__(self, session_id: str, backend: BaseChatMessageHistory, cache: "SessionHistoryCache"):
+        self.session_id = session_id
+        self.backend = backend
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._carga_lock = threading.Lock()
+        self._cargado = False
+        self._messages = []  # Desde la posición _base del historial, no desde el principio
+        self._tokens = []
+        self._base = 0
+        self.resumen = None
+        self.n_resumidos = 0  # Mensajes (desde el principio) incluidos en el resumen
+        self._resumiendo = False
+
+    def _cargar(self):
+        """Lee el historial y el resumen la primera vez (dos mensajes simultáneos cargan una sola vez)."""
+        if self._cargado:
+            return
+        with self._carga_lock:
+            if not self._cargado:
+                self._cache._cargar(self)
+
+    def _iniciar(self, messages: List[BaseMessage], base: int, resumen: str, n_resumidos: int):
+        tokens = [ventana.tokens_mensaje(m) for m in messages]
+        with self._lock:
+            self._messages, self._tokens, self._base = messages, tokens, base
+            self.resumen, self.n_resumidos = resumen, n_resumidos
+        self._cargado = True
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """Ventana para el agente: resumen + últimos turnos dentro de HISTORY_TOKEN_BUDGET."""
+        self._cargar()
+        with self._lock:
+            mensajes = list(self._messages)
+            tokens = list(self._tokens)
+            base, resumen = self._base, self.resumen
+            # Índices relativos a los mensajes en memoria
+            n_resumidos = min(max(self.n_resumidos - base, 0), len(mensajes))
+        inicio = ventana.inicio_ventana(mensajes, tokens)
+        pendientes = inicio - n_resumidos
+        if pendientes >= ventana.HISTORY_SUMMARY_MIN_MESSAGES:
+            # Fuera de la ventana hay bastante sin resumir: se resume en segundo plano y, hasta
+            # que llegue, los mensajes sin resumir se envían tal cual mientras quepan en el
+            # presupuesto (sin el límite de turnos) para no perderlos del prompt
+            self._cache._programar_resumen(self, base + inicio)
+            inicio = n_resumidos + ventana.inicio_ventana(mensajes[n_resumidos:], tokens[n_resumidos:],
+                                                          turnos=len(mensajes))
+        elif pendientes > 0:
+            # Pocos mensajes entre el resumen y la ventana: se envían tal cual en vez de perderlos
+            inicio = n_resumidos
+        visibles = ventana.construir_ventana(mensajes[inicio:], resumen)
+        self._cache._registrar_ventana(self.session_id, sum(tokens), sum(ventana.tokens_mensaje(m) for m in visibles))
+        return visibles
+
+    def _resumir(self, hasta: int):
+        """
+        Incorpora al resumen los mensajes hasta `hasta` (en el hilo de resúmenes de la caché), por
+        tramos de MAX_MENSAJES_RESUMEN. Cada tramo se guarda al terminar: si uno falla, el
+        siguiente turno continúa desde el último guardado.
+        """
+        try:
+            while True:
+                with self._lock:
+                    previo = self.n_resumidos
+                    desde = max(previo, self._base)
+                    if desde >= hasta:
+                        return
+                    fin = min(hasta, desde + MAX_MENSAJES_RESUMEN)
+                    mensajes = self._messages[desde - self._base:fin - self._base]
+                    resumen_previo = self.resumen
+                nuevo = ventana.resumir(resumen_previo, mensajes)
+                ventana.guardar_resumen(self.session_id, nuevo, fin)
+                with self._lock:
+                    if self.n_resumidos != previo:
+                        # clear() cambió el historial mientras tanto
+                        return
+                    self.resumen, self.n_resumidos = nuevo, fin
+        finally:
+            with self._lock:
+                self._resumiendo = False
+
+    def ultimos_mensajes(self, n: int) -> List[BaseMessage]:
+        """Los `n` últimos de los mensajes en memoria (como mucho, desde el cursor del resumen)."""
+        self._cargar()
+        with self._lock:
+            return self._messages[-n:] if n > 0 else []
+
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        if not messages:
+            return
+        self._cargar()
+        with self._lock:
+            self._messages.extend(messages)
+            self._tokens.extend(ventana.tokens_mensaje(m) for m in messages)
+        self._cache._persistir(self, list(messages))
+
+    def clear(self) -> None:
+        self._cache._descartar_pendientes(self.session_id)
+        self.backend.clear()
+        ventana.borrar_resumen(self.session_id)
+        with self._carga_lock, self._lock:
+            self._messages, self._tokens, self._base = [], [], 0
+            self.resumen, self.n_resumidos = None, 0
+            self._cargado = True
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        if not self._cargado:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._cargar)
+        return self.messages
+
+
+class SessionHistoryCache:
+    def __init__(self, capacidad: int = HISTORY_CACHE_SIZE, inactividad: float = HISTORY_CACHE_IDLE_SECONDS,
+                 durabilidad: str = HISTORY_DURABILITY):
+        if durabilidad not in ("deferred", "sync"):
+            raise ValueError(f"HISTORY_DURABILITY debe ser 'deferred' o 'sync', no {durabilidad!r}")
+        self.capacidad = capacidad
+        self.inactividad = inactividad
+        self.durabilidad = durabilidad
+        self._entradas = OrderedDict()  # teléfono -> (historial, último acceso), de menos a más reciente
+        self._lock = threading.Lock()
+        # Escritura diferida: mensajes pendientes por teléfono, en orden de llegada
+        self._pendientes = OrderedDict()
+        self._en_curso = set()
+        self._cond = threading.Condition()
+        self._cerrado = False
+        self._escritor = None
+        self._stats = {"aciertos": 0, "fallos": 0, "expulsiones": 0, "cargas": 0, "ms_carga": 0.0,
+                       "escrituras": 0, "mensajes_escritos": 0, "errores_escritura": 0,
+                       "turnos": 0, "tokens_historial": 0, "tokens_enviados": 0,
+                       "resumenes": 0, "errores_resumen": 0}
+        self._resumidor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="historial-resumen")
+        if durabilidad == "deferred":
+            self._escritor = threading.Thread(target=self._escribir, name="historial-escritor", daemon=True)
+            self._escritor.start()
+
+    # --- Lectura ---
+
+    def get(self, session_id: str) -> CachedChatMessageHistory:
+        """Historial de la sesión, sin E/S: se carga al leer sus mensajes (ver _cargar)."""
+        with self._lock:
+            self._expulsar_inactivos()
+            entrada = self._entradas.get(session_id)
+            if entrada is not None:
+                self._entradas[session_id] = (entrada[0], time.monotonic())
+                self._entradas.move_to_end(session_id)
+                self._stats["aciertos"] += 1
+                return entrada[0]
+            historial = CachedChatMessageHistory(session_id, crear_historial(session_id), self)
+            self._entradas[session_id] = (historial, time.monotonic())
+            self._stats["fallos"] += 1
+            self._expulsar_sobrantes()
+            return historial
+
+    def _cargar(self, historial: CachedChatMessageHistory):
+        t0 = time.perf_counter()
+        try:
+            resumen, n_resumidos = ventana.leer_resumen(historial.session_id)
+            # Lo anterior al cursor ya está en el resumen: solo se leen la ventana y lo pendiente
+            base, messages = historial.backend.leer_desde(n_resumidos)
+        except Exception as e:
+            # Como antes: se contesta sin contexto, pero el historial vacío no se queda en la
+            # caché y el siguiente mensaje vuelve a intentar la carga
+            logging.error(f"Error al recuperar el historial de {historial.session_id}: {e}")
+            with self._lock:
+                entrada = self._entradas.get(historial.session_id)
+                if entrada is not None and entrada[0] is historial:
+                    del self._entradas[historial.session_id]
+            base, messages, resumen, n_resumidos = 0, [], None, 0
+        historial._iniciar(messages, base, resumen, n_resumidos)
+        with self._lock:
+            self._stats["cargas"] += 1
+            self._stats["ms_carga"] += (time.perf_counter() - t0) * 1000
+
+    def _con_escrituras(self, session_id: str) -> bool:
+        return session_id in self._pendientes or session_id in self._en_curso
+
+    def _expulsar_inactivos(self):
+        limite = time.monotonic() - self.inactividad
+        for session_id, (_, acceso) in list(self._entradas.items()):
+            if acceso >= limite:
+                break
+            if not self._con_escrituras(session_id):
+                del self._entradas[session_id]
+                self._stats["expulsiones"] += 1
+
+    def _expulsar_sobrantes(self):
+        for session_id in list(self._entradas):
+            if len(self._entradas) <= self.capacidad:
+                break
+            if not self._con_escrituras(session_id):
+                del self._entradas[session_id]
+                self._stats["expulsiones"] += 1
+
+    # --- Escritura ---
+
+    def _persistir(self, historial: CachedChatMessageHistory, messages: List[BaseMessage]):
+        if self.durabilidad == "sync":
+            historial.backend.add_messages(messages)
+            with self._cond:
+                self._stats["escrituras"] += 1
+                self._stats["mensajes_escritos"] += len(messages)
+            return
+        with self._cond:
+            if self._cerrado:
+                raise RuntimeError("La caché de historiales está cerrada")
+            self._pendientes.setdefault(historial.session_id, (historial.backend, []))[1].extend(messages)
+            self._cond.notify_all()
+
+    def _descartar_pendientes(self, session_id: str):
+        with self._cond:
+            self._pendientes.pop(session_id, None)
+            # Si hay una escritura en curso se espera a que termine antes de borrar
+            while session_id in self._en_curso:
+                self._cond.wait()
+
+    def _escribir(self):
+        while True:
+            with self._cond:
+                while not self._pendientes and not self._cerrado:
+                    self._cond.wait()
+                # Un teléfono con escritura en curso espera su turno para no desordenar segmentos
+                libres = [s for s in self._pendientes if s not in self._en_curso]
+                if not libres:
+                    if self._cerrado and not self._pendientes:
+                        return
+                    self._cond.wait(timeout=REINTENTO_ESCRITURA_SEGUNDOS)
+                    continue
+                session_id = libres[0]
+                backend, messages = self._pendientes.pop(session_id)
+                self._en_curso.add(session_id)
+            try:
+                backend.add_messages(messages)
+                with self._cond:
+                    self._stats["escrituras"] += 1
+                    self._stats["mensajes_escritos"] += len(messages)
+            except Exception as e:
+                logging.error(f"Error guardando el historial de {session_id} ({len(messages)} mensajes), se reintentará: {e}")
+                with self._cond:
+                    self._stats["errores_escritura"] += 1
+                    # Vuelven delante de los que hayan llegado mientras tanto
+                    _, nuevos = self._pendientes.pop(session_id, (backend, []))
+                    self._pendientes[session_id] = (backend, messages + nuevos)
+                    self._pendientes.move_to_end(session_id, last=False)
+                time.sleep(REINTENTO_ESCRITURA_SEGUNDOS)
+            finally:
+                with self._cond:
+                    self._en_curso.discard(session_id)
+                    self._cond.notify_all()
+
+    # --- Ventana y resúmenes ---
+
+    def _registrar_ventana(self, session_id: str, tokens_historial: int, tokens_enviados: int):
+        logging.info(f"Historial de {session_id}: {tokens_historial} tokens -> {tokens_enviados} enviados al LLM")
+        with self._lock:
+            self._stats["turnos"] += 1
+            self._stats["tokens_historial"] += tokens_historial
+            self._stats["tokens_enviados"] += tokens_enviados
+
+    def _programar_resumen(self, historial: CachedChatMessageHistory, hasta: int):
+        with historial._lock:
+            if historial._resumiendo or self._cerrado:
+                return
+            historial._resumiendo = True
+        self._resumidor.submit(self._resumir, historial, hasta)
+
+    def _resumir(self, historial: CachedChatMessageHistory, hasta: int):
+        try:
+            historial._resumir(hasta)
+            with self._lock:
+                self._stats["resumenes"] += 1
+        except Exception as e:
+            logging.error(f"Error actualizando el resumen del historial de {historial.session_id}: {e}")
+            with self._lock:
+                self._stats["errores_resumen"] += 1
+
+    def flush(self, timeout: float = HISTORY_FLUSH_TIMEOUT) -> bool:
+        """Espera a que se persistan todas las escrituras pendientes. False si vence el plazo."""
+        limite = time.monotonic() + timeout
+        with self._cond:
+            while self._pendientes or self._en_curso:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return False
+                self._cond.wait(timeout=restante)
+        return True
+
+    def close(self, timeout: float = HISTORY_FLUSH_TIMEOUT):
+        """Vacía la cola de escritura y detiene el escritor (al apagar la API)."""
+        completo = self.flush(timeout)
+        with self._cond:
+            self._cerrado = True
+            pendientes = sum(len(m) for _, m in self._pendientes.values())
+            self._cond.notify_all()
+        if self._escritor is not None:
+            self._escritor.join(timeout=5)
+        # Los resúmenes en cola se descartan: se recalculan en el siguiente turno de cada socio
+        self._resumidor.shutdown(wait=False, cancel_futures=True)
+        if not completo:
+            logging.error(f"Caché de historiales cerrada con {pendientes} mensajes sin guardar")
+        logging.info(f"Estadísticas finales de la caché de historiales: {self.stats()}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sesiones"] = len(self._entradas)
+        with self._cond:
+            stats["mensajes_pendientes"] = sum(len(m) for _, m in self._pendientes.values())
+        accesos = stats["aciertos"] + stats["fallos"]
+        stats["tasa_acierto"] = stats["aciertos"] / accesos if accesos else 0.0
+        stats["ms_carga_medio"] = stats["ms_carga"] / stats["cargas"] if stats["cargas"] else 0.0
+        stats["tokens_historial_medio"] = stats["tokens_historial"] / stats["turnos"] if stats["turnos"] else 0.0
+        stats["tokens_enviados_medio"] = stats["tokens_enviados"] / stats["turnos"] if stats["turnos"] else 0.0
+        stats["durabilidad"] = self.durabilidad
+        stats["backend"] = HISTORY_BACKEND
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_session_cache() -> SessionHistoryCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SessionHistoryCache()
+    return _cache
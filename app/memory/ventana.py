@@ -0,0 +1,155 @@
+"""
+Política de ventana del historial que se envía al LLM: últimos turnos literales dentro de un
+presupuesto de tokens y un resumen acumulado de todo lo anterior.
+
+RunnableWithMessageHistory pasaba el historial completo como chat_history en cada turno, así
+que los socios veteranos enviaban prompts cada vez más largos. Ahora el agente recibe:
+
+    [SystemMessage con el resumen]  +  últimos HISTORY_WINDOW_TURNS turnos (un turno empieza
+                                       en un mensaje del socio), recortados por el principio
+                                       hasta caber en HISTORY_TOKEN_BUDGET tokens
+
+Los resultados de herramientas de turnos anteriores (ToolMessage y llamadas a tools sin
+texto) se descartan: su información ya está en la respuesta del agente.
+
+Cuando hay al menos HISTORY_SUMMARY_MIN_MESSAGES mensajes fuera de la ventana sin resumir, se
+actualiza el resumen en segundo plano a partir del resumen anterior y solo de esos mensajes
+(HISTORY_SUMMARY_MODEL, por defecto el modelo del agente) y se guarda en historial_resumenes
+(sql/historial_resumenes.sql). Mientras se actualiza, el turno usa el resumen anterior y envía
+tal cual los mensajes sin resumir que quepan en el presupuesto. Los historiales largos se
+resumen por tramos, cada uno sobre el resumen del anterior.
+"""
+import json
+import os
+from typing import List
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from app.database.connection import db_connection
+
+HISTORY_WINDOW_TURNS = int(os.getenv("HISTORY_WINDOW_TURNS", 6))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 2000))
+HISTORY_SUMMARY_MIN_MESSAGES = int(os.getenv("HISTORY_SUMMARY_MIN_MESSAGES", 6))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL")
+TOKENS_POR_MENSAJE = 4  # Sobrecoste aproximado de rol y separadores de cada mensaje
+
+PROMPT_RESUMEN = (
+    "Eres el asistente de reservas de un club deportivo. Actualiza el resumen de la conversación "
+    "con un socio incorporando los mensajes nuevos. Conserva solo lo útil para atenderle después: "
+    "nombre, preferencias, reservas hechas o canceladas (instalación, fecha y hora), peticiones "
+    "pendientes y cualquier dato que haya dado. Máximo 150 palabras, en español, sin saludos."
+)
+
+SQL_LEER_RESUMEN = """
+    SELECT tx_resumen, nu_mensajes_resumidos FROM historial_resumenes WHERE ds_telefono = %s
+"""
+
+# Nunca se sustituye un resumen por otro que cubra menos mensajes
+SQL_GUARDAR_RESUMEN = """
+    INSERT INTO historial_resumenes (ds_telefono, tx_resumen, nu_mensajes_resumidos, updated_at)
+    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (ds_telefono)
+    DO UPDATE SET
+        tx_resumen = EXCLUDED.tx_resumen,
+        nu_mensajes_resumidos = EXCLUDED.nu_mensajes_resumidos,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE historial_resumenes.nu_mensajes_resumidos < EXCLUDED.nu_mensajes_resumidos
+"""
+
+try:
+    import tiktoken
+    _codificador = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # Sin tiktoken (o sin poder descargar la codificación): unos 4 caracteres por token
+    _codificador = None
+
+
+def _texto(message: BaseMessage) -> str:
+    contenido = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+    llamadas = getattr(message, "tool_calls", None)
+    return contenido + (json.dumps(llamadas, ensure_ascii=False, default=str) if llamadas else "")
+
+
+def tokens_mensaje(message: BaseMessage) -> int:
+    texto = _texto(message)
+    n = len(_codificador.encode(texto, disallowed_special=())) if _codificador else len(texto) // 4
+    return n + TOKENS_POR_MENSAJE
+
+
+def es_resultado_herramienta(message: BaseMessage) -> bool:
+    return isinstance(message, ToolMessage) or (
+        isinstance(message, AIMessage) and bool(getattr(message, "tool_calls", None)) and not message.content
+    )
+
+
+def inicio_ventana(messages: List[BaseMessage], tokens: List[int],
+                   turnos: int = HISTORY_WINDOW_TURNS, presupuesto: int = HISTORY_TOKEN_BUDGET) -> int:
+    """
+    Índice del primer mensaje de la ventana: el comienzo de los últimos `turnos` turnos, y
+    turnos más tarde si no caben en `presupuesto`. El último turno se conserva aunque no quepa.
+    """
+    comienzos = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if not comienzos:
+        return max(len(messages) - turnos * 2, 0)
+    candidatos = comienzos[-turnos:] if turnos > 0 else comienzos[-1:]
+    # Tokens desde cada mensaje hasta el final, sin contar los resultados de herramientas que se descartan
+    sufijo = [0] * (len(messages) + 1)
+    for i in range(len(messages) - 1, -1, -1):
+        sufijo[i] = sufijo[i + 1] + (0 if es_resultado_herramienta(messages[i]) else tokens[i])
+    for inicio in candidatos:
+        if sufijo[inicio] <= presupuesto:
+            return inicio
+    return candidatos[-1]
+
+
+def construir_ventana(messages: List[BaseMessage], resumen: str = None) -> List[BaseMessage]:
+    """Mensajes de la ventana sin resultados de herramientas, precedidos del resumen si lo hay."""
+    visibles = [m for m in messages if not es_resultado_herramienta(m)]
+    if resumen:
+        visibles.insert(0, SystemMessage(content=f"Resumen de la conversación anterior con este socio: {resumen}"))
+    return visibles
+
+
+def leer_resumen(telefono: str) -> tuple[str | None, int]:
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_LEER_RESUMEN, (telefono,))
+            fila = cur.fetchone()
+    return (fila[0], fila[1]) if fila else (None, 0)
+
+
+def guardar_resumen(telefono: str, resumen: str, n_resumidos: int):
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_GUARDAR_RESUMEN, (telefono, resumen, n_resumidos))
+        conn.commit()
+
+
+def borrar_resumen(telefono: str):
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM historial_resumenes WHERE ds_telefono = %s", (telefono,))
+        conn.commit()
+
+
+_llm = None
+
+
+def _get_llm():
+    global _llm
+    if _llm is None:
+        # Import diferido: agent_setup importa la caché de sesiones, que importa este módulo
+        from app.agente.agent_setup import crear_llm
+        _llm = crear_llm(HISTORY_SUMMARY_MODEL)
+    return _llm
+
+
+def resumir(resumen_previo: str | None, messages: List[BaseMessage]) -> str:
+    """Nuevo resumen a partir del anterior y de los mensajes que acaban de salir de la ventana."""
+    transcripcion = "\n".join(
+        f"{'Socio' if isinstance(m, HumanMessage) else 'Asistente'}: {_texto(m)}"
+        for m in messages if not es_resultado_herramienta(m)
+    )
+    respuesta = _get_llm().invoke([
+        SystemMessage(content=PROMPT_RESUMEN),
+        HumanMessage(content=f"Resumen anterior:\n{resumen_previo or '(ninguno)'}\n\nMensajes nuevos:\n{transcripcion}"),
+    ])
+    return respuesta.content.strip()
@@ -0,0 +1,166 @@
+"""
+Features de calendario del modelo de cancelación: es_finde, es_horario_pico y es_feriado.
+
+Antes se calculaban con lógica suelta en cada reserva y los festivos eran una lista fija en
+crud.py, recorrida linealmente y que terminaba en 2025 (los de 2026 nunca se marcaban).
+Ahora:
+
+- Los festivos se cargan de data/feriados_madrid.csv (CALENDARIO_FERIADOS_FILE) o, con
+  CALENDARIO_FERIADOS_FUENTE=db, de la tabla public.feriados (ver sql/feriados.sql).
+- Se precalcula una tabla por día (fin de semana, festivo) y otra por hora (horario pico)
+  para un horizonte de varios años. Consultar una reserva o un lote entero es indexar arrays.
+- La misma tabla alimenta la predicción en línea (crud._build_features), el recálculo por
+  lotes (scripts/rescore_cancelaciones.py) y el entrenamiento, así que las features son
+  idénticas en los tres sitios.
+- Si se pide un año sin festivos cargados se avisa en el log en lugar de devolver 0 en silencio.
+"""
+import csv
+import logging
+import os
+import threading
+from datetime import date, datetime
+from pathlib import Path
+import numpy as np
+
+DATA_DIR = Path(__file__).resolve().parent.parent.parent / 'data'
+CALENDARIO_FERIADOS_FILE = Path(os.getenv("CALENDARIO_FERIADOS_FILE", DATA_DIR / 'feriados_madrid.csv'))
+CALENDARIO_FERIADOS_FUENTE = os.getenv("CALENDARIO_FERIADOS_FUENTE", "archivo")  # 'archivo' o 'db'
+# Horizonte de la tabla: desde CALENDARIO_ANIO_INICIO hasta el año actual + CALENDARIO_ANIOS_FUTUROS
+CALENDARIO_ANIO_INICIO = int(os.getenv("CALENDARIO_ANIO_INICIO", 2020))
+CALENDARIO_ANIOS_FUTUROS = int(os.getenv("CALENDARIO_ANIOS_FUTUROS", 3))
+
+# Horario pico: reservas que empiezan entre las 18:00 y las 22:59
+HORA_PICO_INICIO = 18
+HORA_PICO_FIN = 22
+
+SQL_FERIADOS = "SELECT dt_fecha FROM public.feriados"
+
+_EPOCH = date(1970, 1, 1)
+
+
+def dia_epoch(fecha: date) -> int:
+    """Días desde 1970-01-01 (el índice que usan las tablas y los arrays datetime64[D])."""
+    return (fecha - _EPOCH).days
+
+
+def leer_feriados_archivo(ruta: Path) -> set:
+    with open(ruta, encoding='utf-8', newline='') as f:
+        return {date.fromisoformat(fila['fecha'].strip()) for fila in csv.DictReader(f) if fila.get('fecha')}
+
+
+def leer_feriados_db() -> set:
+    from app.database.connection import db_connection
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_FERIADOS)
+            return {fila[0] for fila in cur.fetchall()}
+
+
+class Calendario:
+    """Tablas inmutables de features de calendario para [anio_inicio, anio_fin]."""
+
+    def __init__(self, feriados: set, anio_inicio: int, anio_fin: int):
+        self.feriados = frozenset(feriados)
+        self.anios_con_feriados = frozenset(f.year for f in self.feriados)
+        self.inicio = dia_epoch(date(anio_inicio, 1, 1))
+        self.fin = dia_epoch(date(anio_fin, 12, 31))
+        dias = np.arange(self.inicio, self.fin + 1, dtype=np.int64)
+        # 1970-01-01 fue jueves (3 con lunes = 0)
+        self.es_finde = ((dias + 3) % 7 >= 5).astype(np.int8)
+        self.es_feriado = np.isin(dias, [dia_epoch(f) for f in self.feriados]).astype(np.int8)
+        horas = np.arange(24)
+        self.es_horario_pico = ((horas >= HORA_PICO_INICIO) & (horas <= HORA_PICO_FIN)).astype(np.int8)
+        self._avisados = set()
+
+    def _comprobar_anios(self, anios):
+        faltan = {int(a) for a in anios} - self.anios_con_feriados - self._avisados
+        if faltan:
+            self._avisados |= faltan
+            logging.warning(f"Calendario sin festivos cargados para {sorted(faltan)}: es_feriado será 0 esos años")
+
+    # --- Una reserva ---
+
+    def features(self, fecha: date, hora: int) -> dict:
+        """es_finde, es_horario_pico y es_feriado de una reserva (fecha y hora locales de inicio)."""
+        if fecha.year not in self.anios_con_feriados:
+            self._comprobar_anios([fecha.year])
+        dia = dia_epoch(fecha)
+        if self.inicio <= dia <= self.fin:
+            es_finde, es_feriado = int(self.es_finde[dia - self.inicio]), int(self.es_feriado[dia - self.inicio])
+        else:
+            es_finde, es_feriado = int(fecha.weekday() >= 5), int(fecha in self.feriados)
+        return {'es_finde': es_finde, 'es_horario_pico': int(self.es_horario_pico[hora]), 'es_feriado': es_feriado}
+
+    # --- Lotes ---
+
+    def features_lote(self, dias: np.ndarray, horas: np.ndarray) -> dict:
+        """
+        Lo mismo para arrays de días (desde 1970-01-01, hora local) y horas locales.
+        Devuelve {feature: array int64} alineado con la entrada.
+        """
+        dias = np.asarray(dias, dtype=np.int64)
+        horas = np.asarray(horas, dtype=np.int64)
+        if len(dias):
+            self._comprobar_anios(np.unique(dias.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970))
+        en_tabla = (dias >= self.inicio) & (dias <= self.fin)
+        indices = np.where(en_tabla, dias - self.inicio, 0)
+        es_finde = np.where(en_tabla, self.es_finde[indices], (dias + 3) % 7 >= 5)
+        es_feriado = np.where(en_tabla, self.es_feriado[indices],
+                              np.isin(dias, [dia_epoch(f) for f in self.feriados]))
+        return {
+            'es_finde': es_finde.astype(np.int64),
+            'es_horario_pico': self.es_horario_pico[horas].astype(np.int64),
+            'es_feriado': es_feriado.astype(np.int64),
+        }
+
+    def tabla(self):
+        """Tabla completa día x hora como DataFrame (fecha, hora, es_finde, es_horario_pico, es_feriado)."""
+        import pandas as pd
+        n_dias = self.fin - self.inicio + 1
+        return pd.DataFrame({
+            'fecha': np.repeat(np.arange(self.inicio, self.fin + 1).astype('datetime64[D]'), 24),
+            'hora': np.tile(np.arange(24), n_dias),
+            'es_finde': np.repeat(self.es_finde, 24),
+            'es_horario_pico': np.tile(self.es_horario_pico, n_dias),
+            'es_feriado': np.repeat(self.es_feriado, 24),
+        })
+
+
+def cargar_calendario(fuente: str = CALENDARIO_FERIADOS_FUENTE, ruta: Path = CALENDARIO_FERIADOS_FILE) -> Calendario:
+    """Construye el calendario con los festivos de la fuente configurada; si la DB falla usa el archivo."""
+    if fuente == "db":
+        try:
+            feriados = leer_feriados_db()
+        except Exception as e:
+            logging.error(f"No se pudieron leer los festivos de la DB, se usa {ruta}: {e}")
+            feriados = leer_feriados_archivo(ruta)
+    else:
+        feriados = leer_feriados_archivo(ruta)
+    anio_fin = datetime.now().year + CALENDARIO_ANIOS_FUTUROS
+    calendario = Calendario(feriados, min([CALENDARIO_ANIO_INICIO, *(f.year for f in feriados)]), anio_fin)
+    logging.info(f"Calendario cargado: {len(feriados)} festivos ({fuente}), años con festivos: "
+                 f"{sorted(calendario.anios_con_feriados)}")
+    return calendario
+
+
+_calendario = None
+_calendario_lock = threading.Lock()
+
+
+def get_calendario() -> Calendario:
+    """Devuelve el calendario compartido por toda la aplicación (se carga la primera vez)."""
+    global _calendario
+    if _calendario is None:
+        with _calendario_lock:
+            if _calendario is None:
+                _calendario = cargar_calendario()
+    return _calendario
+
+
+def recargar_calendario() -> Calendario:
+    """Vuelve a leer los festivos (p. ej. tras añadir los del año siguiente) y sustituye el calendario."""
+    global _calendario
+    nuevo = cargar_calendario()
+    with _calendario_lock:
+        _calendario = nuevo
+    return nuevo
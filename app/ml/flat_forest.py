@@ -0,0 +1,148 @@
+"""
+Random forest aplanado en arrays de NumPy para predecir sin la sobrecarga de sklearn.
+
+Para una sola reserva, RandomForestClassifier.predict_proba dedica la mayor parte del tiempo
+a validar la entrada, repartir el trabajo con joblib y llamar a cada árbol desde Python; el
+recorrido de los árboles en sí es mínimo. Aquí el bosque entero se exporta a unos pocos arrays
+contiguos con los nodos de todos los árboles seguidos:
+
+    feature.npy    (int32)   feature que evalúa cada nodo
+    threshold.npy  (float64) umbral del nodo (va a la izquierda si x <= umbral)
+    left.npy       (int32)   índice global del hijo izquierdo
+    right.npy      (int32)   índice global del hijo derecho
+    value.npy      (float64) proba de cada clase en el nodo, (n_nodos, n_clases)
+    roots.npy      (int32)   nodo raíz de cada árbol
+    meta.json      clases, profundidad máxima y número de features
+
+Las hojas apuntan a sí mismas (left = right = hoja), así que el recorrido avanza todos los
+árboles y todas las filas a la vez durante `max_depth` pasos sin ramas en Python; las que ya
+llegaron a una hoja se quedan en ella. Los arrays se cargan con mmap (np.load(mmap_mode='r')):
+varios procesos comparten las mismas páginas y la carga es inmediata.
+"""
+import json
+import warnings
+from pathlib import Path
+import numpy as np
+
+FICHEROS = ("feature", "threshold", "left", "right", "value", "roots")
+
+
+def exportar(forest, directorio) -> Path:
+    """Convierte un RandomForestClassifier entrenado en los arrays de FlatForest y los guarda en `directorio`."""
+    directorio = Path(directorio)
+    directorio.mkdir(parents=True, exist_ok=True)
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    desplazamiento = 0
+    for estimador in forest.estimators_:
+        arbol = estimador.tree_
+        n = arbol.node_count
+        ids = np.arange(n, dtype=np.int64) + desplazamiento
+        hoja = arbol.children_left == -1
+        roots.append(desplazamiento)
+        feature.append(np.where(hoja, 0, arbol.feature))
+        threshold.append(np.where(hoja, 0.0, arbol.threshold))
+        left.append(np.where(hoja, ids, arbol.children_left + desplazamiento))
+        right.append(np.where(hoja, ids, arbol.children_right + desplazamiento))
+        # value puede ser recuento o fracción según la versión de sklearn: se normaliza
+        valores = arbol.value[:, 0, :].astype(np.float64)
+        value.append(valores / valores.sum(axis=1, keepdims=True))
+        desplazamiento += n
+
+    arrays = {
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float64),
+        "left": np.concatenate(left).astype(np.int32),
+        "right": np.concatenate(right).astype(np.int32),
+        "value": np.ascontiguousarray(np.concatenate(value)),
+        "roots": np.array(roots, dtype=np.int32),
+    }
+    for nombre, array in arrays.items():
+        np.save(directorio / f"{nombre}.npy", array)
+    meta = {
+        "classes": [c.item() if hasattr(c, "item") else c for c in forest.classes_],
+        "max_depth": int(max(e.tree_.max_depth for e in forest.estimators_)),
+        "n_features": int(forest.n_features_in_),
+        "n_nodes": int(desplazamiento),
+    }
+    (directorio / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    return directorio
+
+
+class FlatForest:
+    """Predictor de solo lectura sobre los arrays exportados por exportar()."""
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes, max_depth, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes_ = np.asarray(classes)
+        self.max_depth = max_depth
+        self.n_features_in_ = n_features
+
+    @classmethod
+    def load(cls, directorio, mmap: bool = True) -> "FlatForest":
+        directorio = Path(directorio)
+        meta = json.loads((directorio / "meta.json").read_text(encoding="utf-8"))
+        arrays = {nombre: np.load(directorio / f"{nombre}.npy", mmap_mode="r" if mmap else None)
+                  for nombre in FICHEROS}
+        return cls(**arrays, classes=meta["classes"], max_depth=meta["max_depth"], n_features=meta["n_features"])
+
+    def apply(self, X) -> np.ndarray:
+        """Hoja alcanzada en cada árbol: array (n_filas, n_árboles) de índices globales de nodo."""
+        # sklearn compara en float32: se convierte igual para que los empates den el mismo lado
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        filas = np.arange(X.shape[0])[:, None]
+        nodos = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            izquierda = X[filas, self.feature[nodos]] <= self.threshold[nodos]
+            nodos = np.where(izquierda, self.left[nodos], self.right[nodos])
+        return nodos
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Igual que RandomForestClassifier.predict_proba: media de las probas de las hojas, (n_filas, n_clases)."""
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def predict_proba_row(self, fila) -> float:
+        """Probabilidad de la clase 1 para una sola fila (lista de features en el orden del modelo)."""
+        return float(self.predict_proba(fila)[0, self.indice_clase(1)])
+
+    def indice_clase(self, clase) -> int:
+        return int(np.flatnonzero(self.classes_ == clase)[0])
+
+
+def verificar(forest, flat: FlatForest, X, atol: float = 1e-9) -> float:
+    """
+    Compara las probabilidades de sklearn y de FlatForest sobre X. Devuelve la diferencia
+    máxima y lanza ValueError si supera `atol` (solo se admite el redondeo de la media).
+    """
+    with warnings.catch_warnings():
+        # Modelos entrenados con DataFrame avisan al recibir un array sin nombres de columna
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        esperado = forest.predict_proba(X)
+    obtenido = flat.predict_proba(X)
+    diferencia = float(np.max(np.abs(esperado - obtenido))) if len(esperado) else 0.0
+    if diferencia > atol:
+        raise ValueError(f"FlatForest no es equivalente a sklearn: diferencia máxima {diferencia:.3g}")
+    return diferencia
+
+
+def muestra_verificacion(forest, n: int = 2000, semilla: int = 0) -> np.ndarray:
+    """
+    Filas sintéticas para verificar: cada feature toma valores alrededor de los umbrales
+    reales del bosque (justo por debajo, en el umbral y justo por encima), que es donde
+    una diferencia en la comparación cambiaría de rama.
+    """
+    rng = np.random.default_rng(semilla)
+    X = np.zeros((n, forest.n_features_in_))
+    for j in range(forest.n_features_in_):
+        umbrales = np.concatenate([e.tree_.threshold[e.tree_.feature == j] for e in forest.estimators_])
+        if len(umbrales) == 0:
+            continue
+        candidatos = np.concatenate([umbrales - 0.5, umbrales, umbrales + 0.5, np.floor(umbrales), np.ceil(umbrales)])
+        X[:, j] = rng.choice(candidatos, size=n)
+    return X
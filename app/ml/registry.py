@@ -0,0 +1,204 @@
+"""
+Registro del modelo de cancelación.
+
+Antes cada reserva abría y deserializaba ML/rf_cancelaciones.pkl (~500 KB de random forest),
+con el GIL tomado mientras tanto. El registro carga el modelo una sola vez (al arrancar con
+warm_up() o perezosamente en la primera predicción) y lo sirve desde memoria:
+
+- Recarga en caliente: si el fichero cambia (mtime/tamaño), la siguiente predicción carga la
+  nueva versión. La comprobación se hace como mucho cada MODEL_RELOAD_CHECK_SECONDS.
+- register(ruta) publica otro artefacto (p. ej. un modelo reentrenado) sin reiniciar.
+- Validación: el orden de las features sale de ML/columnas_modelo.json y se comprueba contra
+  el modelo (feature_names_in_ / n_features_in_). Si una versión nueva no es válida se
+  conserva la anterior.
+- Cada predicción devuelve la versión del modelo usada, que se guarda en
+  reservas.ds_version_modelo junto a probabilidad_cancelacion.
+- Si CANCELLATION_MODEL_FLAT está activo, las predicciones de una sola fila se hacen con el
+  bosque aplanado (app/ml/flat_forest.py), exportado una vez por versión a FLAT_FOREST_DIR y
+  verificado contra sklearn al cargarlo. Si la verificación falla se usa sklearn.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+ML_DIR = Path(__file__).resolve().parent.parent.parent / 'ML'
+MODEL_PATH = Path(os.getenv("CANCELLATION_MODEL_PATH", ML_DIR / 'rf_cancelaciones.pkl'))
+COLUMNS_PATH = Path(os.getenv("CANCELLATION_MODEL_COLUMNS", ML_DIR / 'columnas_modelo.json'))
+MODEL_RELOAD_CHECK_SECONDS = float(os.getenv("MODEL_RELOAD_CHECK_SECONDS", 5))
+CANCELLATION_MODEL_FLAT = os.getenv("CANCELLATION_MODEL_FLAT", "1") == "1"
+FLAT_FOREST_DIR = Path(os.getenv("FLAT_FOREST_DIR", ML_DIR / 'flat'))
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    """Modelo cargado e inmutable: se sustituye entero en cada recarga."""
+    model: object
+    columnas: tuple
+    version: str
+    ruta: Path
+    firma: tuple  # (mtime_ns, tamaño) del fichero al cargarlo
+    flat: object = None  # FlatForest equivalente, si está activo y verificado
+
+    def predict_proba(self, features: dict) -> float:
+        """Probabilidad de la clase 1 (cancelación) para un dict de features."""
+        fila = [features[columna] for columna in self.columnas]
+        if self.flat is not None:
+            return self.flat.predict_proba_row(fila)
+        return float(self.model.predict_proba([fila])[0][1])
+
+
+def _firma(ruta: Path) -> tuple:
+    st = ruta.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def _leer_columnas(ruta: Path) -> tuple:
+    with open(ruta, encoding='utf-8') as f:
+        columnas = json.load(f)
+    if not isinstance(columnas, list) or not all(isinstance(c, str) for c in columnas):
+        raise ValueError(f"{ruta} debe contener una lista de nombres de columnas")
+    return tuple(columnas)
+
+
+def _validar(model, columnas: tuple, ruta: Path):
+    """Comprueba que el modelo espera exactamente las columnas de columnas_modelo.json y en ese orden."""
+    if not hasattr(model, 'predict_proba'):
+        raise TypeError(f"{ruta.name} no tiene predict_proba")
+    nombres = getattr(model, 'feature_names_in_', None)
+    if nombres is not None and tuple(nombres) != columnas:
+        raise ValueError(f"{ruta.name} se entrenó con las columnas {list(nombres)}, no con {list(columnas)}")
+    n_features = getattr(model, 'n_features_in_', None)
+    if n_features is not None and n_features != len(columnas):
+        raise ValueError(f"{ruta.name} espera {n_features} features y columnas_modelo.json define {len(columnas)}")
+
+
+def cargar_modelo(ruta: Path, columnas_path: Path = COLUMNS_PATH, version: str = None) -> LoadedModel:
+    """Lee, deserializa y valida un artefacto. La versión por defecto es '<nombre>@<sha256[:12]>'."""
+    firma = _firma(ruta)
+    contenido = ruta.read_bytes()
+    model = pickle.loads(contenido)
+    columnas = _leer_columnas(columnas_path)
+    _validar(model, columnas, ruta)
+    version = version or f"{ruta.stem}@{hashlib.sha256(contenido).hexdigest()[:12]}"
+    flat = _cargar_flat(model, version) if CANCELLATION_MODEL_FLAT else None
+    return LoadedModel(model=model, columnas=columnas, version=version, ruta=ruta, firma=firma, flat=flat)
+
+
+def _cargar_flat(model, version: str):
+    """Exporta el bosque aplanado de esta versión (solo la primera vez), lo carga con mmap y lo verifica."""
+    if not hasattr(model, 'estimators_'):
+        return None
+    from . import flat_forest
+    directorio = FLAT_FOREST_DIR / version.replace('@', '-')
+    try:
+        if not (directorio / 'meta.json').exists():
+            # Exportar a un directorio temporal y renombrar: otro proceso nunca ve una exportación a medias
+            directorio.parent.mkdir(parents=True, exist_ok=True)
+            temporal = Path(tempfile.mkdtemp(dir=directorio.parent, prefix='.export-'))
+            flat_forest.exportar(model, temporal)
+            try:
+                temporal.rename(directorio)
+            except OSError:
+                shutil.rmtree(temporal, ignore_errors=True)  # Otro proceso exportó la misma versión antes
+        flat = flat_forest.FlatForest.load(directorio)
+        flat_forest.verificar(model, flat, flat_forest.muestra_verificacion(model))
+        return flat
+    except Exception as e:
+        logging.error(f"Bosque aplanado no disponible para {version}, se usa sklearn: {e}")
+        return None
+
+
+class ModelRegistry:
+    def __init__(self, ruta: Path = MODEL_PATH, columnas_path: Path = COLUMNS_PATH,
+                 intervalo: float = MODEL_RELOAD_CHECK_SECONDS):
+        self._ruta = Path(ruta)
+        self._columnas_path = Path(columnas_path)
+        self._intervalo = intervalo
+        self._actual = None
+        self._comprobado_en = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> LoadedModel | None:
+        """Modelo publicado, sin tocar el disco (None si todavía no se ha cargado)."""
+        return self._actual
+
+    def get(self) -> LoadedModel:
+        """Modelo vigente; lo carga la primera vez y lo recarga si el fichero ha cambiado."""
+        actual = self._actual
+        if actual is not None and time.monotonic() - self._comprobado_en < self._intervalo:
+            return actual
+        with self._lock:
+            if self._actual is None or time.monotonic() - self._comprobado_en >= self._intervalo:
+                self._recargar_si_cambio()
+            if self._actual is None:
+                raise RuntimeError(f"No hay ningún modelo de cancelación cargado ({self._ruta})")
+            return self._actual
+
+    def _recargar_si_cambio(self):
+        # Se llama con self._lock tomado
+        self._comprobado_en = time.monotonic()
+        try:
+            if self._actual is not None and self._actual.ruta == self._ruta and _firma(self._ruta) == self._actual.firma:
+                return
+            # Un fichero modificado es otra versión: se identifica por su hash aunque se registrara con nombre
+            nuevo = cargar_modelo(self._ruta, self._columnas_path)
+        except Exception as e:
+            # Fichero a medio copiar, columnas incompatibles...: se sigue sirviendo la versión anterior
+            logging.error(f"No se pudo cargar el modelo de cancelación {self._ruta}: {e}")
+            return
+        anterior = self._actual.version if self._actual else None
+        self._actual = nuevo
+        logging.info(f"Modelo de cancelación cargado: {nuevo.version} (anterior: {anterior})")
+
+    def register(self, ruta, version: str = None, columnas_path=None) -> LoadedModel:
+        """
+        Publica otro artefacto como modelo vigente. Se carga y valida antes de sustituir al
+        actual, así que si falla lanza la excepción y el modelo anterior sigue en servicio.
+        """
+        ruta = Path(ruta)
+        columnas_path = Path(columnas_path) if columnas_path else self._columnas_path
+        nuevo = cargar_modelo(ruta, columnas_path, version)
+        with self._lock:
+            anterior = self._actual.version if self._actual else None
+            self._ruta, self._columnas_path = ruta, columnas_path
+            self._actual = nuevo
+            self._comprobado_en = time.monotonic()
+        logging.info(f"Modelo de cancelación registrado: {nuevo.version} (anterior: {anterior})")
+        return nuevo
+
+    def predict(self, features: dict) -> tuple[float, str]:
+        """(probabilidad de cancelación, versión del modelo que la ha calculado)."""
+        modelo = self.get()
+        return modelo.predict_proba(features), modelo.version
+
+    def warm_up(self) -> str | None:
+        """Carga el modelo y hace una predicción de prueba para que la primera reserva no pague la carga."""
+        try:
+            modelo = self.get()
+            modelo.predict_proba(dict.fromkeys(modelo.columnas, 0))
+            return modelo.version
+        except Exception as e:
+            logging.error(f"No se pudo precargar el modelo de cancelación: {e}")
+            return None
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """Devuelve el registro compartido por toda la aplicación (se crea la primera vez)."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
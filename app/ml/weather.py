@@ -0,0 +1,195 @@
+"""
+Previsión de lluvia para la feature `lluvia` del modelo de cancelación.
+
+Antes cada reserva hacía un requests.get a OpenMeteo, sin timeout y para un único día:
+el mismo día se pedía una y otra vez, una API lenta bloqueaba la reserva y un fallo
+convertía la feature en 0 sin que nadie se enterase. Ahora:
+
+- Una sola llamada trae todo el horizonte de previsión (WEATHER_FORECAST_DAYS días) y se
+  guarda por fecha con caducidad (WEATHER_CACHE_TTL).
+- Las reservas leen de la caché con lluvia(fecha) y nunca esperan a la red: si el dato
+  falta o ha caducado se programa una recarga en segundo plano y se usa el último valor
+  conocido (o 0 si no hay ninguno, dejándolo en el log y en las estadísticas).
+- Sesión HTTP reutilizable (pool de conexiones) con timeouts estrictos y un reintento.
+- start() arranca un hilo que recarga la previsión periódicamente.
+- Para trabajar sin conexión: WEATHER_STUB_FILE apunta a un JSON con el mismo formato que
+  la respuesta de OpenMeteo ({"daily": {"time": [...], "precipitation_probability_max": [...]}}),
+  o WEATHER_API_URL a un servidor HTTP local que lo sirva.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.open-meteo.com/v1/forecast")
+WEATHER_STUB_FILE = os.getenv("WEATHER_STUB_FILE")
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", 3600))
+WEATHER_FORECAST_DAYS = int(os.getenv("WEATHER_FORECAST_DAYS", 16))
+WEATHER_CONNECT_TIMEOUT = float(os.getenv("WEATHER_CONNECT_TIMEOUT", 2))
+WEATHER_READ_TIMEOUT = float(os.getenv("WEATHER_READ_TIMEOUT", 5))
+
+# Coordenadas de Madrid
+LATITUD = 40.4168
+LONGITUD = -3.7038
+# Lluvia = 1 si la probabilidad máxima de precipitación del día supera este porcentaje
+UMBRAL_LLUVIA = 30
+
+
+def es_lluvia(probabilidad) -> int:
+    return 1 if (probabilidad or 0) > UMBRAL_LLUVIA else 0
+
+
+def _crear_sesion() -> requests.Session:
+    sesion = requests.Session()
+    reintentos = Retry(total=1, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                       allowed_methods=("GET",))
+    sesion.mount("https://", HTTPAdapter(max_retries=reintentos, pool_maxsize=4))
+    sesion.mount("http://", HTTPAdapter(max_retries=reintentos, pool_maxsize=4))
+    return sesion
+
+
+class WeatherProvider:
+    def __init__(self, ttl: int = WEATHER_CACHE_TTL, stub_file: str = WEATHER_STUB_FILE,
+                 url: str = WEATHER_API_URL):
+        self._ttl = ttl
+        self._stub_file = Path(stub_file) if stub_file else None
+        self._url = url
+        self._sesion = None
+        # {'YYYY-MM-DD': (probabilidad_max, obtenido_en)}; se sustituye entero en cada recarga
+        self._dias = {}
+        self._lock = threading.Lock()
+        self._recargando = threading.Lock()
+        self._hilo = None
+        self._stop = threading.Event()
+        self._stats = {"aciertos": 0, "caducados": 0, "sin_dato": 0, "recargas": 0, "errores": 0,
+                       "ultimo_error": None, "ultima_recarga": None}
+
+    # --- Lectura (sin red) ---
+
+    def lluvia(self, fecha: str) -> int:
+        """Feature lluvia (0/1) de `fecha` desde la caché. Nunca hace la petición HTTP en este hilo."""
+        entrada = self._dias.get(fecha)
+        if entrada is not None and time.time() - entrada[1] <= self._ttl:
+            self._sumar(aciertos=1)
+            return es_lluvia(entrada[0])
+        # Con la caché al día, una fecha sin dato está fuera del horizonte: recargar no la traería
+        if self._caducada():
+            self.refresh_in_background()
+        if entrada is not None:
+            self._sumar(caducados=1)
+            return es_lluvia(entrada[0])
+        self._sumar(sin_dato=1)
+        logging.warning(f"Sin previsión de lluvia para {fecha} (fuera del horizonte o API no disponible): se usa 0")
+        return 0
+
+    def lluvias(self, fecha_desde: str, fecha_hasta: str) -> dict:
+        """
+        {'YYYY-MM-DD': 0/1} de los días del rango que tienen previsión. Pensado para jobs por
+        lotes: si la caché está vacía o caducada recarga en este mismo hilo.
+        """
+        if self._caducada():
+            self.refresh()
+        return {fecha: es_lluvia(prob) for fecha, (prob, _) in self._dias.items() if fecha_desde <= fecha <= fecha_hasta}
+
+    def _caducada(self) -> bool:
+        dias = self._dias
+        return not dias or time.time() - min(obtenido for _, obtenido in dias.values()) > self._ttl
+
+    def _sumar(self, **valores):
+        with self._lock:
+            for clave, valor in valores.items():
+                self._stats[clave] += valor
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "dias_en_cache": len(self._dias)}
+
+    # --- Recarga ---
+
+    def _descargar(self) -> dict:
+        if self._stub_file:
+            datos = json.loads(self._stub_file.read_text(encoding="utf-8"))
+        else:
+            if self._sesion is None:
+                self._sesion = _crear_sesion()
+            respuesta = self._sesion.get(self._url, params={
+                "latitude": LATITUD,
+                "longitude": LONGITUD,
+                "daily": "precipitation_probability_max",
+                "timezone": "Europe/Madrid",
+                "forecast_days": WEATHER_FORECAST_DAYS,
+            }, timeout=(WEATHER_CONNECT_TIMEOUT, WEATHER_READ_TIMEOUT))
+            respuesta.raise_for_status()
+            datos = respuesta.json()
+        return dict(zip(datos["daily"]["time"], datos["daily"]["precipitation_probability_max"]))
+
+    def refresh(self) -> bool:
+        """Descarga todo el horizonte de previsión. Si falla conserva la caché anterior. Devuelve True si cargó."""
+        with self._recargando:
+            try:
+                prevision = self._descargar()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errores"] += 1
+                    self._stats["ultimo_error"] = str(e)
+                logging.error(f"No se pudo obtener la previsión de lluvia: {e}")
+                return False
+            ahora = time.time()
+            hoy = time.strftime("%Y-%m-%d")
+            with self._lock:
+                # Se conservan los días ya conocidos que no vienen en la respuesta, salvo los pasados
+                dias = {fecha: entrada for fecha, entrada in self._dias.items() if fecha >= hoy}
+                dias.update({fecha: (prob, ahora) for fecha, prob in prevision.items()})
+                self._dias = dias
+                self._stats["recargas"] += 1
+                self._stats["ultima_recarga"] = ahora
+            logging.info(f"Previsión de lluvia actualizada: {len(prevision)} días")
+            return True
+
+    def refresh_in_background(self):
+        """Lanza una recarga en un hilo si no hay otra en curso (varias reservas a la vez -> una petición)."""
+        if self._recargando.locked():
+            return
+        threading.Thread(target=self.refresh, name="weather-refresh", daemon=True).start()
+
+    # --- Recarga periódica ---
+
+    def start(self, intervalo: float = None):
+        """Arranca un hilo que recarga la previsión cada `intervalo` segundos (por defecto la mitad del TTL)."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        intervalo = intervalo or max(self._ttl / 2, 60)
+        self._stop.clear()
+        self._hilo = threading.Thread(target=self._bucle, args=(intervalo,), name="weather-provider", daemon=True)
+        self._hilo.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._hilo:
+            self._hilo.join(timeout=10)
+            self._hilo = None
+
+    def _bucle(self, intervalo: float):
+        while not self._stop.is_set():
+            # Tras un fallo se reintenta antes que en el ciclo normal
+            espera = intervalo if self.refresh() else min(intervalo, 60)
+            self._stop.wait(espera)
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_weather_provider() -> WeatherProvider:
+    """Devuelve el proveedor compartido por toda la aplicación (se crea la primera vez)."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = WeatherProvider()
+    return _provider
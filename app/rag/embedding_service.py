@@ -0,0 +1,262 @@
+"""
+Servicio de embeddings fuera del proceso web, con agrupación de peticiones concurrentes.
+
+El forward de e5-large en el proceso de la API compite por el GIL con el bucle de eventos y
+con todo lo demás, y con varias preguntas a la vez cada una hacía su propio forward. Aquí el
+modelo vive en uno o varios procesos hijos (multiprocessing, arranque 'spawn') y el proceso
+web solo habla con ellos por colas:
+
+    embed_query() ──> cola de pendientes ──> agrupador ──> lote ──> proceso(s) del modelo
+         ^                                  (ventana de            |
+         └──────── Future ◄── lector ◄──── RAG_EMBEDDING_BATCH_WINDOW_MS)
+
+El agrupador espera como mucho la ventana (o hasta RAG_EMBEDDING_MAX_BATCH textos) desde la
+primera petición y envía todas las recibidas en un único embed_documents; el lector reparte
+los vectores a las Future de cada petición. Nunca hay más lotes en curso que procesos: con
+todos ocupados las peticiones se acumulan y el siguiente lote sale más grande. Un lote sin
+respuesta en RAG_EMBEDDING_TIMEOUT (proceso caído) se da por perdido y libera su hueco.
+EmbeddingService implementa la interfaz Embeddings de LangChain, así que sustituye a
+HuggingFaceEmbeddings donde se use.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+
+RAG_EMBEDDING_WORKERS = int(os.getenv("RAG_EMBEDDING_WORKERS", 1))
+RAG_EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("RAG_EMBEDDING_BATCH_WINDOW_MS", 5))
+RAG_EMBEDDING_MAX_BATCH = int(os.getenv("RAG_EMBEDDING_MAX_BATCH", 32))
+RAG_EMBEDDING_TIMEOUT = float(os.getenv("RAG_EMBEDDING_TIMEOUT", 30))
+RAG_EMBEDDING_START_TIMEOUT = float(os.getenv("RAG_EMBEDDING_START_TIMEOUT", 300))
+
+
+def _worker(modelo: str, peticiones, respuestas):
+    """Proceso hijo: carga el modelo una vez y calcula los lotes que llegan hasta recibir None."""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    embeddings = HuggingFaceEmbeddings(model_name=modelo)
+    respuestas.put(("listo", os.getpid(), None))
+    while True:
+        peticion = peticiones.get()
+        if peticion is None:
+            break
+        lote_id, textos = peticion
+        try:
+            respuestas.put((lote_id, embeddings.embed_documents(textos), None))
+        except Exception as e:
+            respuestas.put((lote_id, None, f"{type(e).__name__}: {e}"))
+
+
+class EmbeddingService(Embeddings):
+    """Cliente del pool de procesos de embeddings. start() antes de usarlo y stop() al cerrar."""
+
+    def __init__(self, modelo: str, workers: int = RAG_EMBEDDING_WORKERS,
+                 ventana_ms: float = RAG_EMBEDDING_BATCH_WINDOW_MS, max_lote: int = RAG_EMBEDDING_MAX_BATCH,
+                 timeout: float = RAG_EMBEDDING_TIMEOUT):
+        self.modelo = modelo
+        self.n_workers = max(1, workers)
+        self.ventana = ventana_ms / 1000
+        self.max_lote = max(1, max_lote)
+        self.timeout = timeout
+        self._contexto = multiprocessing.get_context("spawn")
+        self._procesos = []
+        self._pendientes = queue.Queue()
+        self._en_vuelo = {}
+        self._en_vuelo_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._listos = threading.Semaphore(0)
+        # Un hueco por proceso: se toma al enviar un lote y se devuelve una sola vez, al llegar su
+        # respuesta o al darlo por perdido
+        self._huecos = threading.BoundedSemaphore(self.n_workers)
+        self._hilos = []
+        self._activo = False
+        self._stats_lock = threading.Lock()
+        self._stats = {"peticiones": 0, "textos": 0, "lotes": 0, "errores": 0, "reinicios": 0}
+
+    # --- Ciclo de vida ---
+
+    def _lanzar_worker(self):
+        proceso = self._contexto.Process(target=_worker, args=(self.modelo, self._peticiones, self._respuestas),
+                                         name="embeddings-worker", daemon=True)
+        proceso.start()
+        return proceso
+
+    def start(self):
+        """Arranca los procesos y espera a que todos hayan cargado el modelo."""
+        if self._activo:
+            return
+        self._peticiones = self._contexto.Queue()
+        self._respuestas = self._contexto.Queue()
+        self._activo = True
+        self._procesos = [self._lanzar_worker() for _ in range(self.n_workers)]
+        self._hilos = [threading.Thread(target=self._agrupar, name="embeddings-agrupador", daemon=True),
+                       threading.Thread(target=self._leer, name="embeddings-lector", daemon=True)]
+        for hilo in self._hilos:
+            hilo.start()
+        for _ in self._procesos:
+            if not self._listos.acquire(timeout=RAG_EMBEDDING_START_TIMEOUT):
+                self.stop()
+                raise TimeoutError(f"Los procesos de embeddings no cargaron {self.modelo} en {RAG_EMBEDDING_START_TIMEOUT:.0f} s")
+        logging.info(f"Servicio de embeddings listo: {self.n_workers} proceso(s) con {self.modelo}, "
+                     f"ventana {self.ventana * 1000:.1f} ms, lotes de hasta {self.max_lote}")
+
+    def stop(self):
+        if not self._activo:
+            return
+        self._activo = False
+        self._pendientes.put(None)
+        for _ in self._procesos:
+            self._peticiones.put(None)
+        for proceso in self._procesos:
+            proceso.join(timeout=5)
+            if proceso.is_alive():
+                proceso.terminate()
+        self._respuestas.put((None, None, None))
+        for hilo in self._hilos:
+            hilo.join(timeout=5)
+        with self._en_vuelo_lock:
+            perdidos, self._en_vuelo = list(self._en_vuelo.values()), {}
+        for lote, _ in perdidos:
+            for _, future in lote:
+                future.set_exception(RuntimeError("Servicio de embeddings detenido"))
+        logging.info(f"Servicio de embeddings detenido: {self.stats()}")
+
+    def _revisar_workers(self):
+        """
+        Si algún proceso ha muerto, rehace la cola de peticiones y el pool: un proceso matado
+        mientras esperaba en get() deja tomado el cerrojo de lectura de la cola y ningún otro
+        podría leer. Los lotes que estaban en curso acaban expirando y devuelven su hueco.
+        """
+        muertos = [proceso for proceso in self._procesos if not proceso.is_alive()]
+        if not muertos or not self._activo:
+            return
+        for proceso in muertos:
+            logging.error(f"Proceso de embeddings {proceso.pid} terminado (código {proceso.exitcode}); se relanza el pool.")
+        for proceso in self._procesos:
+            if proceso.is_alive():
+                proceso.terminate()
+        self._peticiones = self._contexto.Queue()
+        self._procesos = [self._lanzar_worker() for _ in range(self.n_workers)]
+        with self._stats_lock:
+            self._stats["reinicios"] += len(muertos)
+
+    # --- Hilos del cliente ---
+
+    def _expirar_lotes(self):
+        """Da por perdidos los lotes sin respuesta en `timeout` y devuelve sus huecos."""
+        limite = time.monotonic() - self.timeout
+        with self._en_vuelo_lock:
+            expirados = [lote_id for lote_id, (_, enviado) in self._en_vuelo.items() if enviado < limite]
+            lotes = [self._en_vuelo.pop(lote_id)[0] for lote_id in expirados]
+        for lote in lotes:
+            self._huecos.release()
+            with self._stats_lock:
+                self._stats["errores"] += 1
+            for _, future in lote:
+                if not future.done():
+                    future.set_exception(TimeoutError("Lote de embeddings sin respuesta"))
+
+    def _agrupar(self):
+        while True:
+            # Sin hueco libre no se envía nada: las peticiones esperan en la cola
+            if not self._huecos.acquire(timeout=1):
+                if not self._activo:
+                    return
+                self._expirar_lotes()
+                self._revisar_workers()
+                continue
+            # Con el hueco reservado se sigue vigilando: un worker caído o un lote perdido
+            # no deben quedarse sin revisar mientras no llegan peticiones
+            while True:
+                try:
+                    primera = self._pendientes.get(timeout=1)
+                    break
+                except queue.Empty:
+                    self._expirar_lotes()
+                    self._revisar_workers()
+            if primera is None:
+                self._huecos.release()
+                return
+            lote = [primera]
+            n_textos = len(primera[0])
+            limite = time.monotonic() + self.ventana
+            while n_textos < self.max_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    siguiente = self._pendientes.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if siguiente is None:
+                    self._pendientes.put(None)
+                    break
+                lote.append(siguiente)
+                n_textos += len(siguiente[0])
+            self._revisar_workers()
+            lote_id = next(self._ids)
+            with self._en_vuelo_lock:
+                self._en_vuelo[lote_id] = (lote, time.monotonic())
+            with self._stats_lock:
+                self._stats["lotes"] += 1
+                self._stats["textos"] += n_textos
+            self._peticiones.put((lote_id, [texto for textos, _ in lote for texto in textos]))
+
+    def _leer(self):
+        while True:
+            lote_id, vectores, error = self._respuestas.get()
+            if lote_id is None:
+                return
+            if lote_id == "listo":
+                self._listos.release()
+                continue
+            with self._en_vuelo_lock:
+                en_vuelo = self._en_vuelo.pop(lote_id, None)
+            if en_vuelo is None:
+                # Respuesta tardía de un lote ya expirado: su hueco ya se devolvió
+                continue
+            self._huecos.release()
+            lote = en_vuelo[0]
+            if error is not None:
+                with self._stats_lock:
+                    self._stats["errores"] += 1
+                for _, future in lote:
+                    future.set_exception(RuntimeError(f"Error en el proceso de embeddings: {error}"))
+                continue
+            inicio = 0
+            for textos, future in lote:
+                future.set_result(vectores[inicio:inicio + len(textos)])
+                inicio += len(textos)
+
+    # --- Interfaz Embeddings ---
+
+    def submit(self, textos: list[str]) -> Future:
+        """Encola `textos` (que viajan juntos en el mismo lote) y devuelve la Future con sus vectores."""
+        if not self._activo:
+            raise RuntimeError("El servicio de embeddings no está arrancado")
+        future = Future()
+        with self._stats_lock:
+            self._stats["peticiones"] += 1
+        self._pendientes.put((list(textos), future))
+        return future
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self.submit(texts).result(timeout=self.timeout)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.submit([text]).result(timeout=self.timeout)[0]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["textos_por_lote"] = stats["textos"] / stats["lotes"] if stats["lotes"] else 0.0
+        stats["workers_vivos"] = sum(p.is_alive() for p in self._procesos)
+        with self._en_vuelo_lock:
+            stats["lotes_en_vuelo"] = len(self._en_vuelo)
+        return stats
@@ -0,0 +1,129 @@
+"""
+Índice léxico (BM25) de la base de conocimiento, en memoria.
+
+Muchas preguntas nombran términos exactos ("pádel", "piscina exterior", "horario",
+"parking", precios): para ellas basta con un índice invertido y no hace falta pasar la
+consulta por el encoder e5-large. Los tokens se pliegan (minúsculas, sin tildes, sin la 's'
+final del plural) y se descartan las palabras vacías, así que "Pádel", "padel" y "PADEL" son
+el mismo término. Las cabeceras de Markdown de cada fragmento se indexan junto a su texto con
+peso doble: la sección "### Tenis" habla de tenis aunque el término aparezca poco en ella.
+
+Cada término guarda sus fragmentos y el peso BM25 ya calculado en arrays de NumPy; una
+búsqueda son unas pocas sumas vectorizadas sobre decenas de fragmentos.
+"""
+import math
+import re
+import unicodedata
+from pathlib import Path
+import numpy as np
+
+K1 = 1.5
+B = 0.75
+CABECERAS = ("header1", "header2", "header3")
+
+PALABRAS_VACIAS = frozenset("""
+a al algo algun alguna alguno ante como con cual cuales cuando cuanto cuanta cuantos cuantas
+de del desde donde el ella ellos en entre era es esa ese eso esta este esto estan hay la las
+le les lo los me mi mis muy no nos o os para pero por puedo puede pueden que quien se si sin
+sobre su sus te tiene tienen tengo ti tu tus un una uno unos unas y ya yo
+""".split())
+
+_TOKEN = re.compile(r"\w+")
+
+
+def plegar(texto: str) -> str:
+    """Minúsculas y sin tildes (la ñ también se pliega a n, igual en consultas y documentos)."""
+    return ''.join(c for c in unicodedata.normalize('NFD', texto.lower()) if unicodedata.category(c) != 'Mn')
+
+
+def tokenizar(texto: str) -> list[str]:
+    tokens = []
+    for token in _TOKEN.findall(plegar(texto)):
+        if token in PALABRAS_VACIAS:
+            continue
+        # Plural simple: "horarios" -> "horario", "pistas" -> "pista"
+        if len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def secciones_markdown(ruta) -> list[dict]:
+    """Secciones de un fichero Markdown como fragmentos {"texto", "metadata"} con las cabeceras de nivel 1 a 3."""
+    fragmentos = []
+    cabeceras = {}
+    lineas = []
+
+    def cerrar():
+        texto = "\n".join(lineas).strip()
+        if texto:
+            fragmentos.append({"texto": texto, "metadata": dict(cabeceras)})
+        lineas.clear()
+
+    for linea in Path(ruta).read_text(encoding="utf-8").splitlines():
+        cabecera = re.match(r"^(#{1,3})\s+(.*)", linea)
+        if cabecera:
+            cerrar()
+            nivel = len(cabecera.group(1))
+            cabeceras = {k: v for k, v in cabeceras.items() if int(k[-1]) < nivel}
+            cabeceras[f"header{nivel}"] = cabecera.group(2).strip()
+        else:
+            lineas.append(linea)
+    cerrar()
+    return fragmentos
+
+
+class LexicalIndex:
+    """Índice BM25 de solo lectura sobre fragmentos {"texto", "metadata"}."""
+
+    def __init__(self, fragmentos: list[dict]):
+        self.fragmentos = fragmentos
+        documentos = []
+        for f in fragmentos:
+            cabeceras = " ".join(f["metadata"].get(c, "") for c in CABECERAS)
+            documentos.append(tokenizar(f"{cabeceras} {cabeceras} {f['texto']}"))
+        longitudes = np.array([len(d) for d in documentos], dtype=np.float32)
+        media = float(longitudes.mean()) if len(documentos) and longitudes.sum() else 1.0
+        normalizacion = K1 * (1 - B + B * longitudes / media)
+
+        frecuencias = {}
+        for i, documento in enumerate(documentos):
+            for token in documento:
+                por_documento = frecuencias.setdefault(token, {})
+                por_documento[i] = por_documento.get(i, 0) + 1
+        n = len(documentos)
+        # término -> (fragmentos, idf * peso BM25 del término en cada fragmento)
+        self._postings = {}
+        for token, por_documento in frecuencias.items():
+            ids = np.fromiter(por_documento, dtype=np.int32, count=len(por_documento))
+            tf = np.fromiter(por_documento.values(), dtype=np.float32, count=len(por_documento))
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            self._postings[token] = (ids, (idf * tf * (K1 + 1) / (tf + normalizacion[ids])).astype(np.float32))
+
+    def __len__(self) -> int:
+        return len(self.fragmentos)
+
+    def search(self, consulta: str, k: int = 3, margen: float = 1.3) -> tuple[list[tuple[float, dict]], bool]:
+        """
+        ([(puntuación, fragmento), ...] de mayor a menor, confianza). Hay confianza si el mejor
+        fragmento contiene todos los términos de la consulta y supera al segundo en `margen` veces:
+        entonces su respuesta no depende de la similitud semántica.
+        """
+        terminos = set(tokenizar(consulta))
+        if not terminos or not self.fragmentos:
+            return [], False
+        puntuaciones = np.zeros(len(self.fragmentos), dtype=np.float32)
+        cubiertos = np.zeros(len(self.fragmentos), dtype=np.int32)
+        for termino in terminos:
+            if termino in self._postings:
+                ids, pesos = self._postings[termino]
+                puntuaciones[ids] += pesos
+                cubiertos[ids] += 1
+        orden = np.argsort(-puntuaciones, kind="stable")
+        mejores = [int(i) for i in orden[:k] if puntuaciones[i] > 0]
+        if not mejores:
+            return [], False
+        segundo = float(puntuaciones[orden[1]]) if len(orden) > 1 else 0.0
+        confianza = (cubiertos[mejores[0]] == len(terminos)
+                     and float(puntuaciones[mejores[0]]) >= margen * segundo)
+        return [(float(puntuaciones[i]), self.fragmentos[i]) for i in mejores], bool(confianza)
@@ -0,0 +1,186 @@
+"""
+Índice vectorial local para el RAG, en el propio proceso.
+
+La base de conocimiento (data/knowledge-base.txt) son unas decenas de fragmentos: buscar en
+Pinecone suponía un handshake y una consulta remota por pregunta. Aquí los embeddings se
+guardan normalizados en una matriz .npy que se abre con mmap, junto a los textos y metadatos
+de cada fragmento, y la búsqueda top-k es un producto matriz-vector (similitud coseno).
+
+Ficheros del directorio del índice (RAG_LOCAL_INDEX_DIR):
+    embeddings.npy   float32 (n_fragmentos, dimension), filas con norma 1
+    fragmentos.json  [{"id": ..., "texto": ..., "metadata": {...}}, ...] en el mismo orden
+    meta.json        modelo, dimensión, número de fragmentos, versión (hash del contenido)
+    centroides.npy   (solo IVF) centroides de las listas
+    listas.npy       (solo IVF) lista asignada a cada fragmento
+
+Por debajo de unos miles de fragmentos la fuerza bruta es lo más rápido; con n_listas > 0 se
+construye además un IVF (k-means) y la búsqueda solo recorre las `n_probe` listas más cercanas.
+El índice lo construye scripts/index_knowledge.py (--backend local).
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+DATA_DIR = Path(__file__).resolve().parent.parent.parent / 'data'
+RAG_LOCAL_INDEX_DIR = Path(os.getenv("RAG_LOCAL_INDEX_DIR", DATA_DIR / 'indice_local'))
+RAG_INDEX_CHECK_SECONDS = float(os.getenv("RAG_INDEX_CHECK_SECONDS", 5))
+
+
+def normalizar_filas(matriz) -> np.ndarray:
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+    return matriz / np.where(normas == 0, 1, normas)
+
+
+def _kmeans(vectores: np.ndarray, k: int, iteraciones: int = 20, semilla: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """k-means esférico (producto escalar sobre vectores normalizados): (centroides, asignación)."""
+    rng = np.random.default_rng(semilla)
+    centroides = vectores[rng.choice(len(vectores), size=k, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignacion = np.argmax(vectores @ centroides.T, axis=1)
+        for j in range(k):
+            miembros = vectores[asignacion == j]
+            if len(miembros):
+                centroides[j] = miembros.mean(axis=0)
+        centroides = normalizar_filas(centroides)
+    return centroides, np.argmax(vectores @ centroides.T, axis=1).astype(np.int32)
+
+
+def construir_indice(textos: list, metadatos: list, embeddings, directorio=RAG_LOCAL_INDEX_DIR,
+                     modelo: str = None, n_listas: int = 0, ids: list = None) -> dict:
+    """
+    Escribe en `directorio` el índice de `textos` con sus `embeddings` y devuelve su meta.
+    `ids` identifica cada fragmento (hash de su contenido) para las indexaciones incrementales.
+    Se escribe en un directorio temporal y se sustituye al final: un proceso que esté
+    leyendo el índice anterior nunca ve uno a medio escribir.
+    """
+    directorio = Path(directorio)
+    matriz = normalizar_filas(embeddings)
+    ids = ids if ids is not None else [None] * len(textos)
+    fragmentos = [{"id": id_fragmento, "texto": texto, "metadata": dict(meta)}
+                  for id_fragmento, texto, meta in zip(ids, textos, metadatos)]
+    contenido_fragmentos = json.dumps(fragmentos, ensure_ascii=False)
+    version = hashlib.sha256(matriz.tobytes() + contenido_fragmentos.encode("utf-8")).hexdigest()[:12]
+    meta = {
+        "modelo": modelo,
+        "dimension": int(matriz.shape[1]),
+        "n_fragmentos": len(fragmentos),
+        "version": version,
+        "n_listas": 0,
+        "creado": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    directorio.parent.mkdir(parents=True, exist_ok=True)
+    temporal = Path(tempfile.mkdtemp(dir=directorio.parent, prefix=f".{directorio.name}-"))
+    np.save(temporal / "embeddings.npy", matriz)
+    (temporal / "fragmentos.json").write_text(contenido_fragmentos, encoding="utf-8")
+    if n_listas and len(matriz) > n_listas:
+        centroides, listas = _kmeans(matriz, n_listas)
+        np.save(temporal / "centroides.npy", centroides)
+        np.save(temporal / "listas.npy", listas)
+        meta["n_listas"] = n_listas
+    (temporal / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    anterior = directorio.with_name(f".{directorio.name}-anterior")
+    shutil.rmtree(anterior, ignore_errors=True)
+    if directorio.exists():
+        directorio.rename(anterior)
+    temporal.rename(directorio)
+    shutil.rmtree(anterior, ignore_errors=True)
+    return meta
+
+
+class LocalVectorIndex:
+    """Índice de solo lectura sobre los ficheros de construir_indice()."""
+
+    def __init__(self, matriz, fragmentos: list, meta: dict, centroides=None, listas=None):
+        self.matriz = matriz
+        self.fragmentos = fragmentos
+        self.meta = meta
+        self.version = meta.get("version")
+        self.centroides = centroides
+        self.listas = listas
+        # Posiciones de cada lista IVF, precalculadas una vez
+        self._miembros = ([np.flatnonzero(listas == j) for j in range(len(centroides))]
+                          if centroides is not None else None)
+
+    @classmethod
+    def load(cls, directorio=RAG_LOCAL_INDEX_DIR, mmap: bool = True) -> "LocalVectorIndex":
+        directorio = Path(directorio)
+        meta = json.loads((directorio / "meta.json").read_text(encoding="utf-8"))
+        matriz = np.load(directorio / "embeddings.npy", mmap_mode="r" if mmap else None)
+        fragmentos = json.loads((directorio / "fragmentos.json").read_text(encoding="utf-8"))
+        if len(fragmentos) != len(matriz):
+            raise ValueError(f"Índice local inconsistente en {directorio}: {len(matriz)} vectores y {len(fragmentos)} fragmentos")
+        centroides = listas = None
+        if meta.get("n_listas"):
+            centroides = np.load(directorio / "centroides.npy")
+            listas = np.load(directorio / "listas.npy")
+        return cls(matriz, fragmentos, meta, centroides, listas)
+
+    def __len__(self) -> int:
+        return len(self.fragmentos)
+
+    def vectores_por_id(self) -> dict:
+        """{id del fragmento: embedding} de los fragmentos con id, para reutilizarlos al reindexar."""
+        return {f["id"]: np.asarray(self.matriz[i]) for i, f in enumerate(self.fragmentos) if f.get("id")}
+
+    def search(self, vector, k: int = 3, n_probe: int = 2) -> list[tuple[float, dict]]:
+        """Top-k por similitud coseno: [(puntuación, {"texto", "metadata"}), ...] de mayor a menor."""
+        consulta = normalizar_filas(vector).reshape(-1)
+        if self.centroides is not None:
+            listas = np.argsort(self.centroides @ consulta)[::-1][:n_probe]
+            candidatos = np.concatenate([self._miembros[j] for j in listas])
+        else:
+            candidatos = None
+        matriz = self.matriz if candidatos is None else self.matriz[candidatos]
+        puntuaciones = matriz @ consulta
+        k = min(k, len(puntuaciones))
+        if k == 0:
+            return []
+        # argpartition + ordenar solo los k mejores
+        mejores = np.argpartition(-puntuaciones, k - 1)[:k]
+        mejores = mejores[np.argsort(-puntuaciones[mejores])]
+        posiciones = mejores if candidatos is None else candidatos[mejores]
+        return [(float(puntuaciones[m]), self.fragmentos[p]) for m, p in zip(mejores, posiciones)]
+
+
+_indice = None
+_indice_firma = None
+_comprobado_en = 0.0
+
+
+def _firma(directorio: Path):
+    try:
+        return (directorio / "meta.json").stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_local_index(directorio=RAG_LOCAL_INDEX_DIR) -> LocalVectorIndex | None:
+    """
+    Índice local compartido; None si todavía no se ha construido. Si scripts/index_knowledge.py
+    lo reconstruye, se vuelve a abrir (se comprueba como mucho cada RAG_INDEX_CHECK_SECONDS).
+    """
+    global _indice, _indice_firma, _comprobado_en
+    if _indice is not None and time.monotonic() - _comprobado_en < RAG_INDEX_CHECK_SECONDS:
+        return _indice
+    _comprobado_en = time.monotonic()
+    directorio = Path(directorio)
+    firma = _firma(directorio)
+    if firma is None or firma == _indice_firma:
+        return _indice
+    try:
+        _indice = LocalVectorIndex.load(directorio)
+        _indice_firma = firma
+        logging.info(f"Índice RAG local cargado: {len(_indice)} fragmentos (versión {_indice.version})")
+    except Exception as e:
+        # Se sigue con el índice anterior (si lo hay)
+        logging.error(f"No se pudo abrir el índice RAG local {directorio}: {e}")
+    return _indice
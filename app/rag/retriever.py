@@ -1,22 +1,306 @@
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
+from pathlib import Path
+from langchain_core.documents import Document
+from app.rag.embedding_service import EmbeddingService
+from app.rag.lexical_index import LexicalIndex, secciones_markdown
+from app.rag.local_index import get_local_index
 
 # --- Constantes para RAG ---
-PINECONE_INDEX_NAME = "kb-tfm" 
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "kb-tfm")
 EMBEDDING_MODEL_NAME = "intfloat/multilingual-e5-large"
+RAG_TOP_K = 3  # Fragmentos más relevantes que se devuelven
+# 'local': índice en el proceso (app/rag/local_index.py, lo construye scripts/index_knowledge.py)
+# 'pinecone': índice remoto. Si se pide 'local' y no existe el índice, se usa Pinecone.
+RAG_BACKEND = os.getenv("RAG_BACKEND", "local")
+# Búsqueda híbrida: BM25 sobre los mismos fragmentos (o las secciones de la base de conocimiento
+# si se usa Pinecone). Un acierto léxico claro se responde sin el encoder; si no, se fusionan
+# ambas listas con Reciprocal Rank Fusion.
+RAG_LEXICAL = os.getenv("RAG_LEXICAL", "1") == "1"
+RAG_LEXICAL_MARGIN = float(os.getenv("RAG_LEXICAL_MARGIN", 1.3))
+RRF_K = 60
+KNOWLEDGE_BASE_PATH = Path(__file__).resolve().parent.parent.parent / 'data' / 'knowledge-base.txt'
+# '1': el encoder corre en procesos aparte que agrupan las consultas concurrentes
+# (app/rag/embedding_service.py); '0': en el propio proceso web, como antes.
+RAG_EMBEDDING_SERVICE = os.getenv("RAG_EMBEDDING_SERVICE", "1") == "1"
 
 # Variable global para almacenar el modelo de embeddings cacheado
 EMBEDDINGS_MODEL = None
+# Vector store de Pinecone, creado una sola vez (antes se reconectaba en cada pregunta)
+PINECONE_VECTORSTORE = None
+# Índice léxico y versión del índice del que se construyó
+LEXICAL_INDEX = None
+_version_lexica = None
+
+# --- Cachés de consultas ---
+# Los socios repiten mucho las mismas preguntas ("horario de la piscina", "precio pádel"):
+# 1) caché exacta de resultados por texto normalizado, ligada a la versión del índice;
+# 2) LRU de embeddings de consulta (el encoder e5-large tarda cientos de ms en CPU).
+RAG_RESULT_CACHE_SIZE = int(os.getenv("RAG_RESULT_CACHE_SIZE", 512))
+RAG_RESULT_CACHE_TTL = int(os.getenv("RAG_RESULT_CACHE_TTL", 3600))
+RAG_EMBEDDING_CACHE_SIZE = int(os.getenv("RAG_EMBEDDING_CACHE_SIZE", 2048))
+
+
+class _LRU:
+    """Caché LRU con caducidad opcional, segura entre hilos."""
+
+    def __init__(self, capacidad: int, ttl: float = None):
+        self._capacidad = capacidad
+        self._ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            valor, guardado_en = entrada
+            if self._ttl is not None and time.monotonic() - guardado_en > self._ttl:
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def put(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic())
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self._capacidad:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+
+_RESULTADOS_CACHE = _LRU(RAG_RESULT_CACHE_SIZE, RAG_RESULT_CACHE_TTL)
+_EMBEDDINGS_CACHE = _LRU(RAG_EMBEDDING_CACHE_SIZE)
+_version_cacheada = None
+_metricas_lock = threading.Lock()
+_METRICAS = {
+    "consultas": 0,
+    "aciertos_resultado": 0,
+    "aciertos_embedding": 0,
+    "embeddings_calculados": 0,
+    "busquedas": 0,
+    "ms_embedding": 0.0,
+    "ms_busqueda": 0.0,
+    "ms_ahorrados": 0.0,
+    "respuestas_lexicas": 0,
+    "respuestas_hibridas": 0,
+    "ms_ruta_lexica": 0.0,
+    "ms_ruta_hibrida": 0.0,
+}
+
+
+def _sumar(**valores):
+    with _metricas_lock:
+        for clave, valor in valores.items():
+            _METRICAS[clave] += valor
+
+
+def _coste_medio_ms(total: str, n: str, metricas: dict = _METRICAS) -> float:
+    return metricas[total] / metricas[n] if metricas[n] else 0.0
+
+
+def _normalizar_consulta(texto: str) -> str:
+    """Clave de caché: minúsculas, sin tildes, sin signos de puntuación y sin espacios sobrantes."""
+    sin_tildes = ''.join(c for c in unicodedata.normalize('NFD', texto.lower()) if unicodedata.category(c) != 'Mn')
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in sin_tildes).split())
+
+
+def get_rag_stats() -> dict:
+    """
+    Tasas de acierto de las cachés del RAG, tiempo ahorrado estimado (con el coste medio de cada
+    fallo), parte de las búsquedas resueltas solo con el índice léxico y latencia media de cada ruta.
+    """
+    with _metricas_lock:
+        metricas = dict(_METRICAS)
+    consultas = metricas["consultas"]
+    embeddings_pedidos = metricas["aciertos_embedding"] + metricas["embeddings_calculados"]
+    busquedas = metricas["respuestas_lexicas"] + metricas["respuestas_hibridas"]
+    return {
+        **metricas,
+        "tasa_acierto_resultado": metricas["aciertos_resultado"] / consultas if consultas else 0.0,
+        "tasa_acierto_embedding": metricas["aciertos_embedding"] / embeddings_pedidos if embeddings_pedidos else 0.0,
+        "tasa_lexica": metricas["respuestas_lexicas"] / busquedas if busquedas else 0.0,
+        "ms_medio_ruta_lexica": _coste_medio_ms("ms_ruta_lexica", "respuestas_lexicas", metricas),
+        "ms_medio_ruta_hibrida": _coste_medio_ms("ms_ruta_hibrida", "respuestas_hibridas", metricas),
+        "fragmentos_lexicos": len(LEXICAL_INDEX) if LEXICAL_INDEX is not None else 0,
+        "entradas_resultado": len(_RESULTADOS_CACHE),
+        "entradas_embedding": len(_EMBEDDINGS_CACHE),
+        "version_indice": _version_cacheada,
+        "servicio_embeddings": EMBEDDINGS_MODEL.stats() if isinstance(EMBEDDINGS_MODEL, EmbeddingService) else None,
+    }
 
 def initialize_embeddings():
-    """Inicializa el modelo de embeddings y lo cachea globalmente."""
+    """Inicializa el modelo de embeddings (o el cliente del servicio de embeddings) y lo cachea globalmente."""
     global EMBEDDINGS_MODEL
     if EMBEDDINGS_MODEL is None:
         print("Cargando y cacheando el modelo de embeddings por primera vez...")
-        EMBEDDINGS_MODEL = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+        if RAG_EMBEDDING_SERVICE:
+            servicio = EmbeddingService(EMBEDDING_MODEL_NAME)
+            servicio.start()
+            EMBEDDINGS_MODEL = servicio
+        else:
+            EMBEDDINGS_MODEL = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
         print("Modelo de embeddings cargado exitosamente.")
     return EMBEDDINGS_MODEL
 
+def shutdown_embeddings():
+    """Detiene los procesos del servicio de embeddings, si se usa."""
+    global EMBEDDINGS_MODEL
+    if isinstance(EMBEDDINGS_MODEL, EmbeddingService):
+        EMBEDDINGS_MODEL.stop()
+        EMBEDDINGS_MODEL = None
+
+def _get_pinecone_vectorstore():
+    global PINECONE_VECTORSTORE
+    if PINECONE_VECTORSTORE is None:
+        from langchain_pinecone import PineconeVectorStore
+        print(f"Conectando a Pinecone (Índice: {PINECONE_INDEX_NAME})...")
+        PINECONE_VECTORSTORE = PineconeVectorStore.from_existing_index(
+            index_name=PINECONE_INDEX_NAME,
+            embedding=EMBEDDINGS_MODEL # Usar el modelo global
+        )
+    return PINECONE_VECTORSTORE
+
+def _get_lexical_index(indice, version: str):
+    """Índice léxico de los fragmentos del índice local (o de las secciones de la base de conocimiento), rehecho si cambia la versión."""
+    global LEXICAL_INDEX, _version_lexica
+    if not RAG_LEXICAL:
+        return None
+    if version != _version_lexica:
+        t0 = time.perf_counter()
+        fragmentos = indice.fragmentos if indice is not None else secciones_markdown(KNOWLEDGE_BASE_PATH)
+        LEXICAL_INDEX = LexicalIndex(fragmentos)
+        _version_lexica = version
+        print(f"RAG: índice léxico de {len(LEXICAL_INDEX)} fragmentos construido en {(time.perf_counter() - t0) * 1000:.1f} ms")
+    return LEXICAL_INDEX
+
+def _version_indice(indice) -> str:
+    return f"local:{indice.version}" if indice is not None else f"pinecone:{PINECONE_INDEX_NAME}"
+
+def initialize_retriever():
+    """Abre el índice del backend configurado y construye el léxico al arrancar, para que la primera pregunta no lo pague."""
+    indice = get_local_index() if RAG_BACKEND == "local" else None
+    try:
+        _get_lexical_index(indice, _version_indice(indice))
+    except Exception as e:
+        print(f"RAG: no se pudo construir el índice léxico ({e}); solo búsqueda vectorial.")
+    if indice is not None:
+        print(f"RAG: usando el índice local ({len(indice)} fragmentos).")
+        return
+    if RAG_BACKEND == "local":
+        print("RAG: no existe el índice local (python -m scripts.index_knowledge --backend local); se usa Pinecone.")
+    _get_pinecone_vectorstore()
+
+def _embedding_consulta(query: str, clave: str) -> list:
+    """Embedding de la consulta desde la LRU o, si no está, calculado con el modelo."""
+    vector = _EMBEDDINGS_CACHE.get(clave)
+    if vector is not None:
+        _sumar(aciertos_embedding=1, ms_ahorrados=_coste_medio_ms("ms_embedding", "embeddings_calculados"))
+        return vector
+    t0 = time.perf_counter()
+    vector = EMBEDDINGS_MODEL.embed_query(query)
+    _sumar(embeddings_calculados=1, ms_embedding=(time.perf_counter() - t0) * 1000)
+    _EMBEDDINGS_CACHE.put(clave, vector)
+    return vector
+
+def _fusionar(*rankings: list[Document], k: int) -> list[Document]:
+    """Reciprocal Rank Fusion: suma de 1 / (RRF_K + posición) de cada fragmento en cada lista."""
+    puntuaciones, documentos = {}, {}
+    for ranking in rankings:
+        for posicion, doc in enumerate(ranking):
+            puntuaciones[doc.page_content] = puntuaciones.get(doc.page_content, 0.0) + 1 / (RRF_K + posicion + 1)
+            documentos.setdefault(doc.page_content, doc)
+    mejores = sorted(puntuaciones, key=puntuaciones.get, reverse=True)[:k]
+    return [documentos[texto] for texto in mejores]
+
+def _busqueda_vectorial(query: str, clave: str, indice, k: int) -> list[Document]:
+    vector = _embedding_consulta(query, clave)
+    t0 = time.perf_counter()
+    if indice is not None:
+        resultados = [Document(page_content=f["texto"], metadata=f["metadata"])
+                      for _, f in indice.search(vector, k=k)]
+    else:
+        resultados = _get_pinecone_vectorstore().similarity_search_by_vector(vector, k=k)
+    duracion = (time.perf_counter() - t0) * 1000
+    _sumar(busquedas=1, ms_busqueda=duracion)
+    print(f"RAG: búsqueda ({'local' if indice is not None else 'Pinecone'}) en {duracion:.3f} ms")
+    return resultados
+
+def _buscar_fragmentos(query: str) -> list[Document]:
+    """
+    Los RAG_TOP_K fragmentos más relevantes, pasando por las cachés. Si el índice léxico tiene
+    un acierto claro se responde con él sin calcular el embedding; si no, se fusionan los
+    resultados léxicos y los vectoriales (índice local o Pinecone).
+    """
+    global _version_cacheada
+    indice = get_local_index() if RAG_BACKEND == "local" else None
+    version = _version_indice(indice)
+    if version != _version_cacheada:
+        # Índice reconstruido: los resultados guardados ya no valen (los embeddings sí)
+        _RESULTADOS_CACHE.clear()
+        _version_cacheada = version
+
+    clave = _normalizar_consulta(query)
+    _sumar(consultas=1)
+    resultados = _RESULTADOS_CACHE.get((version, clave))
+    if resultados is not None:
+        _sumar(aciertos_resultado=1, ms_ahorrados=_coste_medio_ms("ms_embedding", "embeddings_calculados")
+               + _coste_medio_ms("ms_busqueda", "busquedas"))
+        print("RAG: resultado servido desde la caché.")
+        return resultados
+
+    t0 = time.perf_counter()
+    lexico = _get_lexical_index(indice, version)
+    lexicos, confianza = lexico.search(query, k=RAG_TOP_K * 2, margen=RAG_LEXICAL_MARGIN) if lexico else ([], False)
+    lexicos = [Document(page_content=f["texto"], metadata=f["metadata"]) for _, f in lexicos]
+    if confianza:
+        resultados = lexicos[:RAG_TOP_K]
+        duracion = (time.perf_counter() - t0) * 1000
+        _sumar(respuestas_lexicas=1, ms_ruta_lexica=duracion,
+               ms_ahorrados=_coste_medio_ms("ms_embedding", "embeddings_calculados"))
+        print(f"RAG: acierto léxico en {duracion:.3f} ms (sin embedding).")
+    else:
+        vectoriales = _busqueda_vectorial(query, clave, indice, RAG_TOP_K * 2 if lexicos else RAG_TOP_K)
+        resultados = _fusionar(vectoriales, lexicos, k=RAG_TOP_K)
+        _sumar(respuestas_hibridas=1, ms_ruta_hibrida=(time.perf_counter() - t0) * 1000)
+    _RESULTADOS_CACHE.put((version, clave), resultados)
+    return resultados
+
+def _formatear_resultados(results: list[Document]) -> str:
+    """Contexto para el agente, incluyendo la estructura de Markdown de cada fragmento."""
+    formatted_results = []
+    for doc in results:
+        # Extraer metadatos de headers
+        metadata = doc.metadata
+        header_info = []
+        if 'header1' in metadata:
+            header_info.append(metadata['header1'])
+        if 'header2' in metadata:
+            header_info.append(metadata['header2'])
+        if 'header3' in metadata:
+            header_info.append(metadata['header3'])
+
+        # Construir el resultado formateado
+        result = doc.page_content
+        if header_info:
+            result = f"Sección: {' > '.join(header_info)}\n{result}"
+
+        formatted_results.append(result)
+
+    return "\n\n---\n\n".join(formatted_results)
+
 # === Función para RAG ===
 def buscar_info_complejo(query: str) -> str:
     """Busca información relevante en la base de conocimiento del complejo deportivo para responder la pregunta del usuario."""
@@ -28,46 +312,17 @@ def buscar_info_complejo(query: str) -> str:
             # pero es una salvaguarda.
             initialize_embeddings()
 
-        # Conectar al índice existente
-        print(f"Conectando a Pinecone (Índice: {PINECONE_INDEX_NAME})...")
-        vectorstore = PineconeVectorStore.from_existing_index(
-            index_name=PINECONE_INDEX_NAME,
-            embedding=EMBEDDINGS_MODEL # Usar el modelo global
-        )
-
-        # Crear retriever y buscar
-        retriever = vectorstore.as_retriever(search_kwargs={'k': 3}) # Obtener los 3 fragmentos más relevantes
         print("Recuperando fragmentos relevantes...")
-        results = retriever.invoke(query)
+        results = _buscar_fragmentos(query)
 
         if not results:
             print("RAG: No se encontraron fragmentos relevantes.")
             return "No encontré información específica sobre eso en la base de conocimiento del complejo."
         else:
-            # Formatear los resultados incluyendo la estructura de Markdown
-            formatted_results = []
-            for doc in results:
-                # Extraer metadatos de headers
-                metadata = doc.metadata
-                header_info = []
-                if 'header1' in metadata:
-                    header_info.append(metadata['header1'])
-                if 'header2' in metadata:
-                    header_info.append(metadata['header2'])
-                if 'header3' in metadata:
-                    header_info.append(metadata['header3'])
-                
-                # Construir el resultado formateado
-                result = doc.page_content
-                if header_info:
-                    result = f"Sección: {' > '.join(header_info)}\n{result}"
-                
-                formatted_results.append(result)
-
-            context = "\n\n---\n\n".join(formatted_results)
+            context = _formatear_resultados(results)
             print(f"RAG: Contexto encontrado:\n{context[:500]}...")
             return f"Aquí tienes información relevante encontrada en la base de conocimiento del complejo:\n{context}"
 
     except Exception as e:
         print(f"ERROR en la herramienta RAG 'buscar_info_complejo': {e}")
-        return "Lo siento, tuve un problema al buscar información en la base de conocimiento."
\ No newline at end of file
+        return "Lo siento, tuve un problema al buscar información en la base de conocimiento."
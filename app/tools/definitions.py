@@ -2,14 +2,27 @@ from langchain_core.tools import Tool, StructuredTool
 from langchain_core.runnables.config import var_child_runnable_config
 from app.database.crud import (
     check_availability_db,
+    check_availability_multi_db,
+    check_availability_range_db,
     make_reservation_db,
     get_available_facilities_db,
     cancel_reservation_db, 
     confirm_cancel_reservation
 )
+from app.database.async_crud import (
+    acheck_availability_db,
+    acheck_availability_multi_db,
+    acheck_availability_range_db,
+    amake_reservation_db,
+    aget_available_facilities_db,
+    acancel_reservation_db,
+    aconfirm_cancel_reservation
+)
 from app.rag.retriever import buscar_info_complejo
 from .schemas import (
     create_check_availability_args,
+    create_check_availability_multi_args,
+    create_check_availability_range_args,
     create_make_reservation_args,
     create_cancel_reservation_args,
     create_confirm_cancel_reservation_args,
@@ -17,14 +30,40 @@ from .schemas import (
     ListarInstalacionesArgs
 )
 
-def get_tools_list(all_facilities_list: list) -> list[Tool]:
+def _get_session_id() -> str | None:
+    """Obtiene el session_id (teléfono) de la configuración del runnable en curso."""
+    config = var_child_runnable_config.get()
+    return config.get("configurable", {}).get("session_id") if config else None
+
+# --- Versiones asíncronas de las tools: el agente las usa vía ainvoke sin ocupar hilos del executor ---
+
+async def _arealizar_reserva(facility_name, date_str, time_str, user_name):
+    return await amake_reservation_db(
+        facility_name=facility_name,
+        date_str=date_str,
+        time_str=time_str,
+        user_name=user_name,
+        session_id=_get_session_id()
+    )
+
+async def _acancelar_reserva(**kwargs):
+    print(f"Llamada a CancelarReserva con kwargs: {kwargs}")
+    return await acancel_reservation_db(session_id=_get_session_id(), **kwargs)
+
+async def _aconfirmar_cancelacion(booking_id=None, **kwargs):
+    return await aconfirm_cancel_reservation(booking_id=booking_id, session_id=_get_session_id())
+
+def get_tools_list(catalogo) -> list[Tool]:
     """
-    Crea y devuelve la lista de objetos Tool para el agente.
+    Crea y devuelve la lista de objetos Tool para el agente a partir de una
+    instantánea del catálogo de instalaciones (nombres en las descripciones).
     """
-    facilities_str = ', '.join(all_facilities_list) if all_facilities_list else "ninguna especificada"
+    facilities_str = catalogo.names_str()
   
     # Crear los modelos Pydantic dinámicamente
     CheckAvailabilityArgs = create_check_availability_args()
+    CheckAvailabilityMultiArgs = create_check_availability_multi_args()
+    CheckAvailabilityRangeArgs = create_check_availability_range_args()
     MakeReservationArgs = create_make_reservation_args()
     CancelReservationArgs = create_cancel_reservation_args()
     ConfirmCancelReservationArgs = create_confirm_cancel_reservation_args()
@@ -34,18 +73,34 @@ def get_tools_list(all_facilities_list: list) -> list[Tool]:
     tools = [
         StructuredTool.from_function(
             func=check_availability_db, 
+            coroutine=acheck_availability_db,
             name="ConsultarDisponibilidad",
             description=f"""Verifica disponibilidad. Args: facility_name (uno de: {facilities_str}), date_str (AAAA-MM-DD), time_str (HH:MM).""",
             args_schema=CheckAvailabilityArgs
         ),
+        StructuredTool.from_function(
+            func=check_availability_multi_db,
+            coroutine=acheck_availability_multi_db,
+            name="ConsultarDisponibilidadMultiple",
+            description="""Verifica de una sola vez la disponibilidad de todas las instalaciones de un tipo (ej: 'Padel') o de una lista de instalaciones, en una fecha y una franja horaria. Devuelve los horarios libres agrupados por instalación. Args: facility_type o facility_names, date_str (AAAA-MM-DD), time_from (HH:MM), time_to (HH:MM, opcional).""",
+            args_schema=CheckAvailabilityMultiArgs
+        ),
+        StructuredTool.from_function(
+            func=check_availability_range_db,
+            coroutine=acheck_availability_range_db,
+            name="ConsultarDisponibilidadRango",
+            description="""Devuelve los huecos libres de una o varias instalaciones durante varios días (hasta 14), ej: '¿cuándo está libre la Pista Tenis Tierra 1 esta semana?'. Args: facility_type o facility_names, date_from (AAAA-MM-DD), date_to (AAAA-MM-DD, opcional), time_from y time_to (HH:MM, opcionales).""",
+            args_schema=CheckAvailabilityRangeArgs
+        ),
         StructuredTool.from_function(
             func=lambda facility_name, date_str, time_str, user_name: make_reservation_db(
                 facility_name=facility_name,
                 date_str=date_str,
                 time_str=time_str,
                 user_name=user_name,
-                session_id=var_child_runnable_config.get().get("configurable", {}).get("session_id") if var_child_runnable_config.get() else None
+                session_id=_get_session_id()
             ),
+            coroutine=_arealizar_reserva,
             name="RealizarReserva",
             description=f"""Registra la reserva. Args: facility_name (uno de: {facilities_str}), date_str (AAAA-MM-DD), time_str (HH:MM), user_name.""",
             args_schema=MakeReservationArgs
@@ -54,10 +109,11 @@ def get_tools_list(all_facilities_list: list) -> list[Tool]:
             func=lambda **kwargs: (
                 print(f"Llamada a CancelarReserva con kwargs: {kwargs}"),
                 cancel_reservation_db(
-                    session_id=var_child_runnable_config.get().get("configurable", {}).get("session_id") if var_child_runnable_config.get() else None,
+                    session_id=_get_session_id(),
                     **kwargs
                 )
             )[-1],
+            coroutine=_acancelar_reserva,
             name="CancelarReserva",
             description="""Busca las reservas futuras activas del cliente y solicita confirmación o elección según corresponda.""",
             args_schema=CancelReservationArgs
@@ -65,8 +121,9 @@ def get_tools_list(all_facilities_list: list) -> list[Tool]:
         StructuredTool.from_function(
             func=lambda booking_id=None, **kwargs: confirm_cancel_reservation(
                 booking_id=booking_id,
-                session_id=var_child_runnable_config.get().get("configurable", {}).get("session_id") if var_child_runnable_config.get() else None
+                session_id=_get_session_id()
             ),
+            coroutine=_aconfirmar_cancelacion,
             name="ConfirmarCancelacionReserva",
             description="""Confirma y ejecuta la cancelación de una reserva específica. Args: booking_id (ID de la reserva a cancelar).""",
             args_schema=ConfirmCancelReservationArgs
@@ -74,6 +131,7 @@ def get_tools_list(all_facilities_list: list) -> list[Tool]:
         StructuredTool.from_function(
             name="ListarInstalaciones",
             func=get_available_facilities_db, 
+            coroutine=aget_available_facilities_db,
             description=f"Devuelve lista de nombres exactos de instalaciones disponibles ({facilities_str}). Úsala si el usuario no especifica una o pregunta cuáles hay.",
             args_schema=ListarInstalacionesArgs
         ),
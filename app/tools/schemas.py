@@ -1,24 +1,28 @@
-from pydantic import BaseModel, Field, field_validator, ValidationError
+from pydantic import BaseModel, Field, field_validator, model_validator, ValidationError
 from datetime import datetime
-from app.database.crud import ALL_FACILITIES_CACHE
-from typing import Optional
+from app.database.facility_catalog import get_facility_catalog
+from typing import List, Optional
+
+def _validate_facility_name(v: str) -> str:
+    """Devuelve el nombre canónico según el catálogo de instalaciones (sin consultar la DB)."""
+    catalogo = get_facility_catalog().current()
+    if not catalogo.facilities:
+        raise ValueError("La lista de instalaciones no está disponible. Por favor, intente nuevamente.")
+    canonico = catalogo.match(v)
+    if canonico is None:
+        raise ValueError(f"Instalación '{v}' no válida. Las opciones son: {catalogo.names_str()}")
+    return canonico
 
 def create_check_availability_args():
     class CheckAvailabilityArgs(BaseModel):
-        facility_name: str = Field(description=f"Nombre exacto de la instalación deportiva. Opciones válidas: {', '.join(ALL_FACILITIES_CACHE)}")
+        facility_name: str = Field(description=f"Nombre exacto de la instalación deportiva. Opciones válidas: {get_facility_catalog().current().names_str()}")
         date_str: str = Field(description="Fecha de consulta en formato AAAA-MM-DD. Ej: '2025-04-18'")
         time_str: str = Field(description="Hora de consulta en formato HH:MM (24h). Ej: '13:00'")
 
         @field_validator('facility_name')
         @classmethod
         def validate_facility_name_check(cls, v):
-            from app.database.crud import ALL_FACILITIES_CACHE  # Importamos aquí para asegurar que tenemos la versión más reciente
-            if not ALL_FACILITIES_CACHE:
-                raise ValueError("La lista de instalaciones no está disponible. Por favor, intente nuevamente.")
-            for facility in ALL_FACILITIES_CACHE:
-                if v.lower() == facility.lower():
-                    return facility
-            raise ValueError(f"Instalación '{v}' no válida. Las opciones son: {', '.join(ALL_FACILITIES_CACHE)}")
+            return _validate_facility_name(v)
 
         @field_validator('date_str')
         @classmethod
@@ -39,9 +43,92 @@ def create_check_availability_args():
             return v
     return CheckAvailabilityArgs
 
+def create_check_availability_multi_args():
+    class CheckAvailabilityMultiArgs(BaseModel):
+        facility_type: Optional[str] = Field(default=None, description=f"Tipo de instalación. Consulta todas las de ese tipo. Tipos válidos: {', '.join(get_facility_catalog().current().types)}")
+        facility_names: Optional[List[str]] = Field(default=None, description=f"Lista de nombres exactos de instalaciones a consultar (alternativa a facility_type). Opciones válidas: {get_facility_catalog().current().names_str()}")
+        date_str: str = Field(description="Fecha de consulta en formato AAAA-MM-DD. Ej: '2025-04-18'")
+        time_from: str = Field(description="Primera hora de inicio aceptable en formato HH:MM (24h). Ej: '19:00'")
+        time_to: Optional[str] = Field(default=None, description="Opcional. Última hora de inicio aceptable en formato HH:MM (24h). Si se omite, solo se consulta time_from.")
+
+        @field_validator('facility_names')
+        @classmethod
+        def validate_facility_names(cls, v):
+            return [_validate_facility_name(name) for name in v] if v else None
+
+        @field_validator('date_str')
+        @classmethod
+        def validate_date(cls, v):
+            try:
+                datetime.strptime(v, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError("Formato de fecha inválido, debe ser AAAA-MM-DD")
+            return v
+
+        @field_validator('time_from', 'time_to')
+        @classmethod
+        def validate_time(cls, v):
+            if v is None:
+                return v
+            try:
+                datetime.strptime(v, '%H:%M')
+            except ValueError:
+                raise ValueError("Formato de hora inválido, debe ser HH:MM (24h)")
+            return v
+
+        @model_validator(mode='after')
+        def validate_type_or_names(self):
+            if not self.facility_type and not self.facility_names:
+                raise ValueError("Debes indicar facility_type o facility_names.")
+            return self
+    return CheckAvailabilityMultiArgs
+
+def create_check_availability_range_args():
+    class CheckAvailabilityRangeArgs(BaseModel):
+        facility_type: Optional[str] = Field(default=None, description=f"Tipo de instalación. Consulta todas las de ese tipo. Tipos válidos: {', '.join(get_facility_catalog().current().types)}")
+        facility_names: Optional[List[str]] = Field(default=None, description=f"Lista de nombres exactos de instalaciones (alternativa a facility_type). Opciones válidas: {get_facility_catalog().current().names_str()}")
+        date_from: str = Field(description="Primer día del rango en formato AAAA-MM-DD. Ej: '2025-04-14'")
+        date_to: Optional[str] = Field(default=None, description="Opcional. Último día del rango (AAAA-MM-DD), máximo 14 días. Si se omite, se consultan 7 días.")
+        time_from: Optional[str] = Field(default=None, description="Opcional. Primera hora de inicio aceptable (HH:MM), ej: '17:00' para 'por la tarde'.")
+        time_to: Optional[str] = Field(default=None, description="Opcional. Última hora de inicio aceptable (HH:MM).")
+
+        @field_validator('facility_names')
+        @classmethod
+        def validate_facility_names(cls, v):
+            return [_validate_facility_name(name) for name in v] if v else None
+
+        @field_validator('date_from', 'date_to')
+        @classmethod
+        def validate_date(cls, v):
+            if v is None:
+                return v
+            try:
+                datetime.strptime(v, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError("Formato de fecha inválido, debe ser AAAA-MM-DD")
+            return v
+
+        @field_validator('time_from', 'time_to')
+        @classmethod
+        def validate_time(cls, v):
+            if v is None:
+                return v
+            try:
+                datetime.strptime(v, '%H:%M')
+            except ValueError:
+                raise ValueError("Formato de hora inválido, debe ser HH:MM (24h)")
+            return v
+
+        @model_validator(mode='after')
+        def validate_type_or_names(self):
+            if not self.facility_type and not self.facility_names:
+                raise ValueError("Debes indicar facility_type o facility_names.")
+            return self
+    return CheckAvailabilityRangeArgs
+
 def create_make_reservation_args():
     class MakeReservationArgs(BaseModel):
-        facility_name: str = Field(description=f"Nombre exacto de la instalación deportiva. Opciones válidas: {', '.join(ALL_FACILITIES_CACHE)}")
+        facility_name: str = Field(description=f"Nombre exacto de la instalación deportiva. Opciones válidas: {get_facility_catalog().current().names_str()}")
         date_str: str = Field(description="Fecha de reserva en formato AAAA-MM-DD. Ej: '2025-04-18'")
         time_str: str = Field(description="Hora de reserva en formato HH:MM (24h). Ej: '11:00'")
         user_name: str = Field(description="Nombre de la persona que reserva.'", max_length=100)
@@ -49,13 +136,7 @@ def create_make_reservation_args():
         @field_validator('facility_name')
         @classmethod
         def validate_facility_name(cls, v):
-            from app.database.crud import ALL_FACILITIES_CACHE  # Importamos aquí para asegurar que tenemos la versión más reciente
-            if not ALL_FACILITIES_CACHE:
-                raise ValueError("La lista de instalaciones no está disponible. Por favor, intente nuevamente.")
-            for facility in ALL_FACILITIES_CACHE:
-                if v.lower() == facility.lower():
-                    return facility
-            raise ValueError(f"Instalación '{v}' no válida. Las opciones son: {', '.join(ALL_FACILITIES_CACHE)}")
+            return _validate_facility_name(v)
 
         @field_validator('date_str')
         @classmethod
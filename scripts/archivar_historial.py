@@ -0,0 +1,58 @@
+"""
+Archiva en S3 los historiales de chat inactivos que están en PostgreSQL (HISTORY_BACKEND=postgres).
+
+Los teléfonos sin escrituras en --dias días pasan sus mensajes de historial_mensajes a un único
+segmento en el almacén de objetos (el mismo formato que S3PostgresChatMessageHistory), así la
+tabla solo guarda las conversaciones vivas. Si el socio vuelve a escribir, su historial se lee
+desde S3 y vuelve a PostgreSQL en esa escritura.
+
+Con --dias 0 archiva todos los teléfonos: es el paso previo para volver a HISTORY_BACKEND=s3.
+
+Uso:
+    python -m scripts.archivar_historial [--dias 90] [--telefono 34600000000] [--dry-run]
+"""
+import argparse
+import os
+import time
+from app.database.connection import db_connection
+from app.memory.postgres_history import archivar_historial
+
+HISTORY_ARCHIVE_DAYS = int(os.getenv("HISTORY_ARCHIVE_DAYS", 90))
+
+SQL_CANDIDATOS = """
+    SELECT ds_telefono FROM historial_chats
+    WHERE ds_ubicacion = 'pg'
+      AND last_updated < CURRENT_TIMESTAMP - make_interval(days => %(dias)s)
+      AND (%(telefono)s IS NULL OR ds_telefono = %(telefono)s)
+    ORDER BY last_updated
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dias", type=int, default=HISTORY_ARCHIVE_DAYS, help="Días sin actividad para archivar")
+    parser.add_argument("--telefono", help="Archivar solo este teléfono")
+    parser.add_argument("--dry-run", action="store_true", help="Cuenta los mensajes que se archivarían sin tocar nada")
+    args = parser.parse_args()
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_CANDIDATOS, {"dias": args.dias, "telefono": args.telefono})
+            telefonos = [fila[0] for fila in cur.fetchall()]
+    print(f"Teléfonos en PostgreSQL sin actividad en {args.dias} días: {len(telefonos)}")
+
+    mensajes = errores = 0
+    t0 = time.perf_counter()
+    for telefono in telefonos:
+        try:
+            mensajes += archivar_historial(telefono, dry_run=args.dry_run)
+        except Exception as e:
+            errores += 1
+            print(f"ERROR archivando {telefono}: {e}")
+
+    print(f"Teléfonos: {len(telefonos) - errores}  Mensajes archivados: {mensajes}  Errores: {errores}  "
+          f"({time.perf_counter() - t0:.1f} s){'  (dry-run)' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
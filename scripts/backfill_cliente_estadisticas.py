@@ -0,0 +1,52 @@
+"""
+Rellena public.cliente_estadisticas a partir de las reservas existentes.
+
+Recalcula todos los contadores con un único GROUP BY sobre public.reservas y sustituye el
+contenido de la tabla dentro de una transacción. Mientras dura, public.reservas queda
+bloqueada en modo SHARE (se puede leer pero no escribir), así que ninguna reserva nueva
+queda fuera del recálculo ni se cuenta dos veces por el trigger.
+
+Se ejecuta una vez después de aplicar sql/cliente_estadisticas.sql; también sirve para
+reconstruir la tabla si alguna vez se desincroniza.
+
+Uso:
+    python -m scripts.backfill_cliente_estadisticas
+"""
+import time
+from app.database.connection import get_db_connection
+
+SQL_RECALCULAR = """
+    INSERT INTO public.cliente_estadisticas
+        (ds_telefono, n_confirmadas, n_canceladas, n_no_presentadas, dt_ultima_reserva)
+    SELECT
+        ds_telefono,
+        COUNT(*) FILTER (WHERE ds_estado = 'Confirmada'),
+        COUNT(*) FILTER (WHERE ds_estado = 'Cancelada'),
+        COUNT(*) FILTER (WHERE ds_estado = 'No presentado'),
+        MAX(dt_fechahora_creacion)
+    FROM public.reservas
+    WHERE ds_telefono IS NOT NULL
+    GROUP BY ds_telefono
+"""
+
+
+def main():
+    t0 = time.perf_counter()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("LOCK TABLE public.reservas IN SHARE MODE")
+            cur.execute("DELETE FROM public.cliente_estadisticas")
+            cur.execute(SQL_RECALCULAR)
+            clientes = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"cliente_estadisticas: {clientes} clientes recalculados en {time.perf_counter() - t0:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
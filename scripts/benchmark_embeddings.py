@@ -0,0 +1,80 @@
+"""
+Benchmark del cálculo de embeddings de consulta con varias preguntas a la vez.
+
+Compara el modelo en el propio proceso (HuggingFaceEmbeddings, como antes de
+app/rag/embedding_service.py) con el servicio de embeddings en procesos aparte, que agrupa
+las consultas concurrentes en un único forward. Para cada nivel de concurrencia lanza
+--consultas preguntas desde ese número de hilos y mide consultas por segundo y latencia
+p50/p99. No necesita base de datos ni índice.
+
+Uso:
+    python -m scripts.benchmark_embeddings --concurrencia 1 8 32 --consultas 256 [--workers 1]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from app.rag.embedding_service import RAG_EMBEDDING_BATCH_WINDOW_MS, RAG_EMBEDDING_MAX_BATCH, EmbeddingService
+from app.rag.retriever import EMBEDDING_MODEL_NAME
+
+PREGUNTAS = [
+    "¿Cuál es el horario de la piscina climatizada?",
+    "¿Cuánto cuesta reservar una pista de pádel?",
+    "¿Hay parking para socios?",
+    "¿Qué actividades hay para niños?",
+    "¿Se puede pagar la luz de la pista de tenis aparte?",
+    "¿Es obligatorio el gorro en la piscina?",
+    "¿Cómo me hago socio del club?",
+    "¿Abre el gimnasio los festivos?",
+]
+
+
+def medir(embeddings, concurrencia: int, consultas: int) -> tuple[float, float, float]:
+    """(consultas por segundo, p50 ms, p99 ms). Cada consulta es distinta para no medir cachés."""
+    def una(i: int) -> float:
+        t0 = time.perf_counter()
+        embeddings.embed_query(f"{PREGUNTAS[i % len(PREGUNTAS)]} ({i})")
+        return (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        latencias = np.array(list(pool.map(una, range(consultas))))
+    total = time.perf_counter() - t0
+    return consultas / total, float(np.percentile(latencias, 50)), float(np.percentile(latencias, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrencia", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--consultas", type=int, default=256, help="Consultas por nivel de concurrencia")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos del servicio de embeddings")
+    parser.add_argument("--ventana-ms", type=float, default=RAG_EMBEDDING_BATCH_WINDOW_MS)
+    parser.add_argument("--max-lote", type=int, default=RAG_EMBEDDING_MAX_BATCH)
+    args = parser.parse_args()
+
+    print(f"Cargando {EMBEDDING_MODEL_NAME} en el proceso y en el servicio ({args.workers} proceso(s))...")
+    en_proceso = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    servicio = EmbeddingService(EMBEDDING_MODEL_NAME, workers=args.workers,
+                                ventana_ms=args.ventana_ms, max_lote=args.max_lote)
+    servicio.start()
+    try:
+        # Calentamiento fuera de la medición
+        en_proceso.embed_query(PREGUNTAS[0])
+        servicio.embed_query(PREGUNTAS[0])
+
+        print(f"{'concurrencia':>12} {'variante':>10} {'consultas/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'textos/lote':>12}")
+        for concurrencia in args.concurrencia:
+            qps, p50, p99 = medir(en_proceso, concurrencia, args.consultas)
+            print(f"{concurrencia:>12} {'proceso':>10} {qps:>12.1f} {p50:>9.1f} {p99:>9.1f} {'-':>12}")
+            antes = servicio.stats()
+            qps, p50, p99 = medir(servicio, concurrencia, args.consultas)
+            despues = servicio.stats()
+            por_lote = (despues["textos"] - antes["textos"]) / max(despues["lotes"] - antes["lotes"], 1)
+            print(f"{concurrencia:>12} {'servicio':>10} {qps:>12.1f} {p50:>9.1f} {p99:>9.1f} {por_lote:>12.1f}")
+    finally:
+        servicio.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark de inferencia del modelo de cancelación: sklearn frente al bosque aplanado.
+
+Exporta ML/rf_cancelaciones.pkl con app/ml/flat_forest.py a un directorio temporal, lo carga
+con mmap, comprueba que las probabilidades coinciden con sklearn y mide la latencia
+(p50/p99) de una predicción de una sola fila, que es lo que hace cada reserva, y de un lote.
+No necesita base de datos.
+
+Uso:
+    python -m scripts.benchmark_flat_forest --repeticiones 2000 --lote 10000
+"""
+import argparse
+import pickle
+import tempfile
+import time
+import warnings
+import numpy as np
+from app.ml import flat_forest
+from app.ml.registry import MODEL_PATH
+
+
+def percentiles(tiempos_ms: list) -> tuple:
+    tiempos = np.array(tiempos_ms)
+    return float(np.percentile(tiempos, 50)), float(np.percentile(tiempos, 99))
+
+
+def medir(funcion, filas, repeticiones: int) -> tuple:
+    # Primera llamada fuera de la medición (imports perezosos, cachés de sklearn)
+    funcion(filas[0])
+    tiempos = []
+    for i in range(repeticiones):
+        fila = filas[i % len(filas)]
+        t0 = time.perf_counter()
+        funcion(fila)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return percentiles(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modelo", default=str(MODEL_PATH))
+    parser.add_argument("--repeticiones", type=int, default=2000, help="Predicciones de una fila por variante")
+    parser.add_argument("--lote", type=int, default=10000, help="Filas de la prueba por lotes")
+    args = parser.parse_args()
+    # El modelo se entrenó con un DataFrame; la ruta anterior le pasa listas, igual que aquí
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+    with open(args.modelo, "rb") as f:
+        forest = pickle.load(f)
+    clase = list(forest.classes_).index(1)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        t0 = time.perf_counter()
+        flat_forest.exportar(forest, directorio)
+        t_export = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        flat = flat_forest.FlatForest.load(directorio)
+        t_carga = time.perf_counter() - t0
+
+        X = flat_forest.muestra_verificacion(forest, n=max(args.lote, 2000))
+        diferencia = flat_forest.verificar(forest, flat, X)
+        filas = X[:2000].tolist()
+
+        # Ruta anterior: lista de una fila a predict_proba de sklearn, como en crud
+        p50_sk, p99_sk = medir(lambda fila: float(forest.predict_proba([fila])[0][clase]), filas, args.repeticiones)
+        p50_fl, p99_fl = medir(flat.predict_proba_row, filas, args.repeticiones)
+
+        lote = X[:args.lote]
+        t0 = time.perf_counter()
+        forest.predict_proba(lote)
+        t_lote_sk = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        flat.predict_proba(lote)
+        t_lote_fl = time.perf_counter() - t0
+
+    print("-" * 72)
+    print(f"Árboles: {len(forest.estimators_)}  Nodos: {len(flat.feature)}  Profundidad máxima: {flat.max_depth}")
+    print(f"Exportación: {t_export * 1000:.1f} ms   Carga (mmap): {t_carga * 1000:.2f} ms")
+    print(f"Equivalencia: diferencia máxima {diferencia:.2e} sobre {len(X)} filas")
+    print(f"Una fila   sklearn  p50={p50_sk:8.3f} ms  p99={p99_sk:8.3f} ms")
+    print(f"Una fila   flat     p50={p50_fl:8.3f} ms  p99={p99_fl:8.3f} ms   ({p50_sk / p50_fl:.1f}x en p50)")
+    print(f"Lote {len(lote)}  sklearn  {t_lote_sk * 1000:8.1f} ms   flat  {t_lote_fl * 1000:8.1f} ms")
+    print("-" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Benchmark de reservas concurrentes: ruta anterior frente a la ruta con transacción corta y lock.
+
+- Ruta anterior: una conexión y una transacción desde la verificación hasta el INSERT, con el
+  cálculo de features (API de lluvia + modelo) en medio.
+- Ruta nueva (make_reservation_db): verificación previa corta, features sin conexión abierta y
+  después una transacción corta con pg_advisory_xact_lock, nueva verificación e INSERT.
+
+El cálculo de features se simula con una espera de --latencia-ms. Trabaja sobre un esquema
+aparte `bench_reservas` (instalaciones y reservas sintéticas con la misma restricción de
+exclusión que public.reservas) y lo elimina al terminar. No toca las tablas reales.
+
+Uso:
+    python -m scripts.benchmark_reservas_concurrentes --hilos 16 --intentos 40 --latencia-ms 200
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import psycopg2
+import psycopg2.errors
+import pytz
+from app.database import crud
+from app.database.connection import db_connection, get_db_connection
+
+ESQUEMA = "bench_reservas"
+HORAS_DIA = list(range(crud.HORA_INICIO_OPERACION, crud.HORA_FIN_OPERACION))
+
+SQL_SOLAPADA = crud.SQL_RESERVA_SOLAPADA.replace("public.", f"{ESQUEMA}.")
+SQL_INSERTAR = f"""
+    INSERT INTO {ESQUEMA}.reservas (id_instalacion, dt_fechahora_inicio, dt_fechahora_fin, ds_estado)
+    VALUES (%s, %s, %s, 'Confirmada')
+    RETURNING id_reserva
+"""
+SQL_DOBLES_RESERVAS = f"""
+    SELECT COUNT(*)
+    FROM {ESQUEMA}.reservas a
+    JOIN {ESQUEMA}.reservas b
+      ON a.id_instalacion = b.id_instalacion AND a.id_reserva < b.id_reserva
+     AND a.rango_reserva && b.rango_reserva
+"""
+
+
+def crear_esquema(cur, instalaciones: int, con_restriccion: bool):
+    cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {ESQUEMA}")
+    cur.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    cur.execute(f"""
+        CREATE TABLE {ESQUEMA}.reservas (
+            id_reserva SERIAL PRIMARY KEY,
+            id_instalacion INTEGER NOT NULL,
+            dt_fechahora_inicio TIMESTAMPTZ NOT NULL,
+            dt_fechahora_fin TIMESTAMPTZ NOT NULL,
+            ds_estado VARCHAR(50) DEFAULT 'Confirmada',
+            probabilidad_cancelacion DOUBLE PRECISION,
+            rango_reserva tstzrange GENERATED ALWAYS AS (tstzrange(dt_fechahora_inicio, dt_fechahora_fin, '[)')) STORED
+        )
+    """)
+    if con_restriccion:
+        cur.execute(f"""
+            ALTER TABLE {ESQUEMA}.reservas
+            ADD CONSTRAINT excl_bench_reservas_sin_solape
+            EXCLUDE USING gist (id_instalacion WITH =, rango_reserva WITH &&)
+            WHERE (ds_estado = 'Confirmada')
+        """)
+    else:
+        cur.execute(f"CREATE INDEX ON {ESQUEMA}.reservas USING gist (id_instalacion, rango_reserva)")
+    print(f"Esquema {ESQUEMA} creado ({instalaciones} instalaciones, restricción de exclusión: {con_restriccion})")
+
+
+def ruta_anterior(id_instalacion, inicio, fin, latencia_s) -> str:
+    """Verificación, features e INSERT dentro de la misma transacción."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_SOLAPADA, (id_instalacion, inicio, fin))
+            if cur.fetchone():
+                return "ocupado"
+            time.sleep(latencia_s)  # Features (HTTP lluvia + modelo) con la transacción abierta
+            cur.execute(SQL_INSERTAR, (id_instalacion, inicio, fin))
+        conn.commit()
+    return "reservada"
+
+
+def ruta_nueva(id_instalacion, inicio, fin, latencia_s) -> str:
+    """Misma estructura que make_reservation_db: verificación previa, features fuera, transacción corta con lock."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_SOLAPADA, (id_instalacion, inicio, fin))
+            if cur.fetchone():
+                return "ocupado"
+    time.sleep(latencia_s)  # Features sin conexión ni transacción abiertas
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(crud.SQL_BLOQUEO_SLOT, crud._slot_lock_key(id_instalacion, inicio))
+            cur.execute(SQL_SOLAPADA, (id_instalacion, inicio, fin))
+            if isinstance(crud._decide_booking(False, cur.fetchone()), str):
+                conn.rollback()
+                return "ocupado_al_confirmar"
+            cur.execute(SQL_INSERTAR, (id_instalacion, inicio, fin))
+        conn.commit()
+    return "reservada"
+
+
+def ejecutar(nombre, ruta, slots, args) -> dict:
+    resultados = {}
+    latencias = []
+    lock = threading.Lock()
+    latencia_s = args.latencia_ms / 1000
+
+    def intento(slot):
+        t0 = time.perf_counter()
+        try:
+            resultado = ruta(*slot, latencia_s)
+        except psycopg2.errors.ExclusionViolation:
+            resultado = "rechazada_por_restriccion"
+        except psycopg2.Error as e:
+            resultado = f"error_db: {type(e).__name__}"
+        duracion = time.perf_counter() - t0
+        with lock:
+            resultados[resultado] = resultados.get(resultado, 0) + 1
+            latencias.append(duracion * 1000)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.hilos) as executor:
+        list(executor.map(intento, slots))
+    total = time.perf_counter() - t0
+
+    latencias.sort()
+    return {
+        "ruta": nombre,
+        "segundos": total,
+        "intentos_s": len(slots) / total,
+        "p50_ms": statistics.median(latencias),
+        "p95_ms": latencias[int(len(latencias) * 0.95) - 1],
+        "resultados": resultados,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hilos", type=int, default=16, help="Clientes concurrentes")
+    parser.add_argument("--intentos", type=int, default=40, help="Intentos de reserva por hilo")
+    parser.add_argument("--instalaciones", type=int, default=4)
+    parser.add_argument("--dias", type=int, default=2, help="Días distintos (menos días = más contención)")
+    parser.add_argument("--latencia-ms", type=int, default=200, help="Tiempo simulado de cálculo de features")
+    parser.add_argument("--sin-restriccion", action="store_true",
+                        help="Crear la tabla sin restricción de exclusión, para ver las dobles reservas de la ruta anterior")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el esquema de benchmark al terminar")
+    args = parser.parse_args()
+
+    madrid_tz = pytz.timezone("Europe/Madrid")
+    base = madrid_tz.localize(datetime(2030, 1, 7))
+    random.seed(42)
+    slots = []
+    for _ in range(args.hilos * args.intentos):
+        inicio = base + timedelta(days=random.randrange(args.dias), hours=random.choice(HORAS_DIA))
+        slots.append((random.randint(1, args.instalaciones), inicio, inicio + timedelta(minutes=crud.DURACION_SLOT_MINUTOS)))
+
+    admin = get_db_connection()
+    admin.autocommit = True
+    informes = []
+    try:
+        with admin.cursor() as cur:
+            for nombre, ruta in (("anterior", ruta_anterior), ("nueva", ruta_nueva)):
+                crear_esquema(cur, args.instalaciones, not args.sin_restriccion)
+                informe = ejecutar(nombre, ruta, slots, args)
+                cur.execute(SQL_DOBLES_RESERVAS)
+                informe["dobles_reservas"] = cur.fetchone()[0]
+                informes.append(informe)
+
+            print("-" * 78)
+            print(f"Hilos: {args.hilos}  Intentos: {len(slots)}  Latencia features: {args.latencia_ms} ms  "
+                  f"Slots distintos: {args.instalaciones * args.dias * len(HORAS_DIA)}")
+            for inf in informes:
+                print(f"Ruta {inf['ruta']:<9} {inf['intentos_s']:7.1f} intentos/s   p50={inf['p50_ms']:7.1f} ms   "
+                      f"p95={inf['p95_ms']:7.1f} ms   dobles reservas={inf['dobles_reservas']}")
+                print(f"    resultados: {inf['resultados']}")
+            print("-" * 78)
+
+            if not args.conservar:
+                cur.execute(f"DROP SCHEMA {ESQUEMA} CASCADE")
+    finally:
+        admin.close()
+
+
+if __name__ == "__main__":
+    main()
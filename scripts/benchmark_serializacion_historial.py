@@ -0,0 +1,98 @@
+"""
+Benchmark de los formatos de los segmentos del historial (app/memory/serializacion.py).
+
+Genera conversaciones de reservas como las que guarda el agente (pregunta del socio y
+respuesta del asistente por turno) de --mensajes mensajes: un turno suelto, un segmento
+típico y un historial compactado. Para cada formato mide tamaño, ratio frente al JSON
+original y mediana de codificación/decodificación. Con --telefono mide además el historial
+real de ese teléfono (necesita base de datos y almacén).
+
+Uso:
+    python -m scripts.benchmark_serializacion_historial [--mensajes 2 20 200 2000] [--repeticiones 50]
+                                                        [--telefono 34600000000]
+"""
+import argparse
+import random
+import statistics
+import time
+from langchain_core.messages import AIMessage, HumanMessage
+from app.memory.serializacion import deserializar, serializar_compacto, serializar_json, zstandard
+
+PREGUNTAS = [
+    "Hola, quiero reservar una pista de pádel para mañana a las {h}:00",
+    "¿Está libre la pista de tenis {n} el sábado por la tarde?",
+    "Cancela mi reserva del {d} de la piscina, por favor",
+    "¿Qué reservas tengo esta semana?",
+    "Vale, pues a las {h}:30 entonces",
+    "¿Cuánto cuesta la luz de la pista?",
+    "Gracias!!",
+]
+
+RESPUESTAS = [
+    "¡Hecho! He reservado la Pista de Pádel {n} para mañana de {h}:00 a {h1}:00. "
+    "Recuerda que puedes cancelar sin coste hasta 2 horas antes.",
+    "Lo siento, la Pista de Tenis {n} está ocupada el sábado entre las 17:00 y las 20:00. "
+    "Tengo libres la Pista de Tenis {n1} a las 18:00 y la Pista de Tenis {n} a las 20:00. ¿Te reservo alguna?",
+    "He cancelado tu reserva de la Piscina Climatizada del día {d} a las {h}:00.",
+    "Esta semana tienes: Pista de Pádel {n} el martes a las {h}:00 y Piscina Climatizada el jueves a las 9:00.",
+    "La iluminación de las pistas exteriores cuesta 3 € por hora a partir de las 20:00 y se paga en recepción.",
+    "¡De nada! Si necesitas algo más, aquí estoy.",
+]
+
+
+def conversacion(n_mensajes: int, semilla: int = 0) -> list:
+    azar = random.Random(semilla)
+    mensajes = []
+    while len(mensajes) < n_mensajes:
+        h, n, d = azar.randint(9, 21), azar.randint(1, 6), azar.randint(1, 28)
+        valores = {"h": h, "h1": h + 1, "n": n, "n1": n % 6 + 1, "d": d}
+        mensajes.append(HumanMessage(content=azar.choice(PREGUNTAS).format(**valores)))
+        mensajes.append(AIMessage(content=azar.choice(RESPUESTAS).format(**valores)))
+    return mensajes[:n_mensajes]
+
+
+def mediana_ms(funcion, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(tiempos)
+
+
+def medir(etiqueta: str, mensajes: list, repeticiones: int):
+    formatos = {
+        "json (original)": serializar_json,
+        "compacto": lambda m: serializar_compacto(m, comprimir=False),
+    }
+    if zstandard is not None:
+        formatos["compacto + zstd"] = serializar_compacto
+    base = None
+    print(f"\n{etiqueta}: {len(mensajes)} mensajes")
+    print(f"  {'formato':<18}{'bytes':>10}{'ratio':>8}{'codificar ms':>15}{'decodificar ms':>17}")
+    for nombre, codificar in formatos.items():
+        contenido = codificar(mensajes)
+        base = base or len(contenido)
+        t_codificar = mediana_ms(lambda: codificar(mensajes), repeticiones)
+        t_decodificar = mediana_ms(lambda: deserializar(contenido), repeticiones)
+        print(f"  {nombre:<18}{len(contenido):>10}{base / len(contenido):>7.1f}x{t_codificar:>15.3f}{t_decodificar:>17.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mensajes", type=int, nargs="+", default=[2, 20, 200, 2000])
+    parser.add_argument("--repeticiones", type=int, default=50)
+    parser.add_argument("--telefono", help="Medir también el historial real de este teléfono")
+    args = parser.parse_args()
+
+    if zstandard is None:
+        print("AVISO: zstandard no está instalado; solo se mide el formato compacto sin comprimir.")
+    for n in args.mensajes:
+        medir("Conversación sintética", conversacion(n), args.repeticiones)
+    if args.telefono:
+        from app.memory.s3_postgres_history import S3PostgresChatMessageHistory
+        medir(f"Historial de {args.telefono}", S3PostgresChatMessageHistory(args.telefono).leer(), args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
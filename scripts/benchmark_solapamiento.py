@@ -0,0 +1,153 @@
+"""
+Benchmark de la consulta de solapamiento de reservas: OVERLAPS (sin índice utilizable)
+frente a tstzrange && con el índice GiST de la restricción de exclusión.
+
+Crea un esquema temporal `bench_solapamiento` con una copia sintética de public.reservas
+(por defecto 1.000.000 de filas), mide la latencia de N consultas aleatorias con cada
+variante y elimina el esquema al terminar. No toca las tablas reales.
+
+Uso:
+    python -m scripts.benchmark_solapamiento --filas 1000000 --consultas 300
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+import pytz
+from app.database.connection import get_db_connection
+
+ESQUEMA = "bench_solapamiento"
+N_INSTALACIONES = 13
+HORAS_DIA = list(range(8, 22))
+
+CONSULTA_OVERLAPS = f"""
+    SELECT r.id_reserva, r.probabilidad_cancelacion
+    FROM {ESQUEMA}.reservas r
+    WHERE r.id_instalacion = %s
+    AND r.ds_estado = 'Confirmada'
+    AND (r.dt_fechahora_inicio, r.dt_fechahora_fin) OVERLAPS (%s::timestamptz, %s::timestamptz)
+"""
+
+CONSULTA_RANGO = f"""
+    SELECT r.id_reserva, r.probabilidad_cancelacion
+    FROM {ESQUEMA}.reservas r
+    WHERE r.id_instalacion = %s
+    AND r.ds_estado = 'Confirmada'
+    AND r.rango_reserva && tstzrange(%s::timestamptz, %s::timestamptz, '[)')
+"""
+
+
+def crear_datos(cur, filas: int, inicio: datetime):
+    """Genera reservas horarias sin solapes (una por instalación y hora) durante los días necesarios."""
+    dias = filas // (N_INSTALACIONES * len(HORAS_DIA)) + 1
+    print(f"Generando {filas} reservas en {dias} días...")
+    cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {ESQUEMA}")
+    cur.execute(f"""
+        CREATE UNLOGGED TABLE {ESQUEMA}.reservas (
+            id_reserva SERIAL PRIMARY KEY,
+            id_instalacion INTEGER NOT NULL,
+            dt_fechahora_inicio TIMESTAMPTZ NOT NULL,
+            dt_fechahora_fin TIMESTAMPTZ NOT NULL,
+            ds_estado VARCHAR(50) DEFAULT 'Confirmada',
+            probabilidad_cancelacion DOUBLE PRECISION
+        )
+    """)
+    cur.execute(f"""
+        INSERT INTO {ESQUEMA}.reservas (id_instalacion, dt_fechahora_inicio, dt_fechahora_fin, ds_estado, probabilidad_cancelacion)
+        SELECT i, d + make_interval(hours => h), d + make_interval(hours => h + 1),
+               CASE WHEN random() < 0.8 THEN 'Confirmada' ELSE 'Cancelada' END,
+               random()
+        FROM generate_series(%s::timestamptz, %s::timestamptz + make_interval(days => %s), interval '1 day') AS d,
+             generate_series(1, %s) AS i,
+             generate_series(%s, %s) AS h
+        LIMIT %s
+    """, (inicio, inicio, dias, N_INSTALACIONES, HORAS_DIA[0], HORAS_DIA[-1], filas))
+    cur.execute(f"ANALYZE {ESQUEMA}.reservas")
+
+
+def aplicar_migracion(cur):
+    """Aplica sobre la copia lo mismo que sql/rango_reservas_gist.sql."""
+    cur.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    cur.execute(f"""
+        ALTER TABLE {ESQUEMA}.reservas
+        ADD COLUMN rango_reserva tstzrange
+        GENERATED ALWAYS AS (tstzrange(dt_fechahora_inicio, dt_fechahora_fin, '[)')) STORED
+    """)
+    cur.execute(f"""
+        ALTER TABLE {ESQUEMA}.reservas
+        ADD CONSTRAINT excl_bench_sin_solape
+        EXCLUDE USING gist (id_instalacion WITH =, rango_reserva WITH &&)
+        WHERE (ds_estado = 'Confirmada')
+    """)
+    cur.execute(f"ANALYZE {ESQUEMA}.reservas")
+
+
+def medir(cur, consulta: str, muestras: list) -> list:
+    """Ejecuta la consulta para cada muestra y devuelve las latencias en ms."""
+    latencias = []
+    for params in muestras:
+        t0 = time.perf_counter()
+        cur.execute(consulta, params)
+        cur.fetchall()
+        latencias.append((time.perf_counter() - t0) * 1000)
+    return latencias
+
+
+def resumen(nombre: str, latencias: list):
+    latencias = sorted(latencias)
+    p50 = statistics.median(latencias)
+    p95 = latencias[int(len(latencias) * 0.95) - 1]
+    print(f"{nombre:<28} p50={p50:8.2f} ms   p95={p95:8.2f} ms   max={latencias[-1]:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1_000_000)
+    parser.add_argument("--consultas", type=int, default=300)
+    parser.add_argument("--conservar", action="store_true", help="No borrar el esquema de benchmark al terminar")
+    args = parser.parse_args()
+
+    madrid_tz = pytz.timezone("Europe/Madrid")
+    inicio = madrid_tz.localize(datetime(2015, 1, 1))
+    dias = args.filas // (N_INSTALACIONES * len(HORAS_DIA))
+    muestras = []
+    for _ in range(args.consultas):
+        slot = inicio + timedelta(days=random.randrange(dias), hours=random.choice(HORAS_DIA))
+        muestras.append((random.randint(1, N_INSTALACIONES), slot, slot + timedelta(hours=1)))
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            crear_datos(cur, args.filas, inicio)
+            medir(cur, CONSULTA_OVERLAPS, muestras[:10])  # Calentar caché
+            antes = medir(cur, CONSULTA_OVERLAPS, muestras)
+
+            print("Aplicando migración (columna tstzrange + restricción de exclusión GiST)...")
+            t0 = time.perf_counter()
+            aplicar_migracion(cur)
+            print(f"Migración aplicada en {time.perf_counter() - t0:.1f}s")
+            medir(cur, CONSULTA_RANGO, muestras[:10])
+            despues = medir(cur, CONSULTA_RANGO, muestras)
+
+            cur.execute("EXPLAIN " + CONSULTA_RANGO, muestras[0])
+            plan = "\n".join(row[0] for row in cur.fetchall())
+
+            print("-" * 70)
+            print(f"Filas: {args.filas}  Consultas: {args.consultas}")
+            resumen("Antes (OVERLAPS, seq scan)", antes)
+            resumen("Después (&&, GiST)", despues)
+            print(f"Mejora p50: x{statistics.median(antes) / statistics.median(despues):.1f}")
+            print("-" * 70)
+            print(plan)
+
+            if not args.conservar:
+                cur.execute(f"DROP SCHEMA {ESQUEMA} CASCADE")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
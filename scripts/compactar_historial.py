@@ -0,0 +1,65 @@
+"""
+Compacta el historial de chats segmentado (app/memory/s3_postgres_history.py).
+
+Cada turno de conversación añade un segmento pequeño; este job fusiona los segmentos
+consecutivos de cada teléfono en segmentos de hasta --objetivo mensajes, para que leer un
+historial largo no suponga cientos de descargas. También convierte los historiales antiguos
+(un único objeto en s3_chat_history_key) en el segmento 0.
+
+Se puede ejecutar con la API en marcha: los turnos nuevos no interfieren con la fusión.
+
+Uso:
+    python -m scripts.compactar_historial [--telefono 34600000000] [--min-segmentos 8]
+                                          [--objetivo 200] [--dry-run]
+"""
+import argparse
+from app.database.connection import db_connection
+from app.memory.s3_postgres_history import HISTORY_SEGMENT_TARGET_MESSAGES, compactar_historial
+
+SQL_CANDIDATOS = """
+    SELECT h.ds_telefono, COALESCE(s.n, 0)
+    FROM historial_chats h
+    LEFT JOIN (SELECT ds_telefono, COUNT(*) AS n FROM historial_segmentos GROUP BY ds_telefono) s
+        ON s.ds_telefono = h.ds_telefono
+    WHERE COALESCE(s.n, 0) >= %s OR h.s3_chat_history_key IS NOT NULL
+    ORDER BY COALESCE(s.n, 0) DESC
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--telefono", help="Compactar solo este teléfono")
+    parser.add_argument("--min-segmentos", type=int, default=8, help="Solo teléfonos con al menos estos segmentos")
+    parser.add_argument("--objetivo", type=int, default=HISTORY_SEGMENT_TARGET_MESSAGES,
+                        help="Mensajes máximos por segmento fusionado")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra qué se fusionaría sin tocar nada")
+    args = parser.parse_args()
+
+    if args.telefono:
+        candidatos = [(args.telefono, None)]
+    else:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SQL_CANDIDATOS, (args.min_segmentos,))
+                candidatos = cur.fetchall()
+
+    tramos = fusionados = errores = 0
+    for telefono, n_segmentos in candidatos:
+        try:
+            resultado = compactar_historial(telefono, objetivo=args.objetivo, dry_run=args.dry_run)
+        except Exception as e:
+            errores += 1
+            print(f"ERROR compactando {telefono}: {e}")
+            continue
+        tramos += resultado["tramos"]
+        fusionados += resultado["segmentos_fusionados"]
+        if resultado["tramos"]:
+            print(f"{telefono}: {resultado['segmentos_fusionados']} segmentos"
+                  f"{f' de {n_segmentos}' if n_segmentos is not None else ''} -> {resultado['tramos']}")
+
+    print(f"Teléfonos revisados: {len(candidatos)}  Segmentos fusionados: {fusionados} en {tramos}  "
+          f"Errores: {errores}{'  (dry-run)' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
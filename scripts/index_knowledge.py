@@ -1,17 +1,46 @@
+"""
+Indexa la base de conocimiento para el RAG de forma incremental.
+
+Cada fragmento se identifica por el hash de su contenido (fuente, texto y cabeceras de
+Markdown). En cada ejecución se trocean las fuentes, se compara con lo ya indexado y solo se
+calculan los embeddings de los fragmentos nuevos o modificados, por lotes de --lote; los que
+ya no existen se borran. Si nada cambió no se carga ni el modelo de embeddings, así que
+reindexar tras una edición pequeña tarda segundos.
+
+--backend local     índice en disco para el propio proceso (app/rag/local_index.py); los
+                    embeddings sin cambios se reutilizan del índice anterior
+--backend pinecone  índice remoto PINECONE_INDEX_NAME (el mismo que consulta retriever.py);
+                    upsert y borrado por lotes, con los ids indexados guardados en
+                    data/.pinecone-<índice>.json. Sin ese fichero se vacía el índice y se sube
+                    todo (los vectores del indexador anterior tenían ids aleatorios).
+Por defecto se usa RAG_BACKEND, el mismo que lee la aplicación.
+
+Las fuentes son data/knowledge-base.txt o las indicadas (argumentos o RAG_FUENTES, separadas
+por el separador de rutas del sistema). Los fragmentos de fuentes que no se pasan se borran.
+
+Uso:
+    python -m scripts.index_knowledge [fuente ...] [--backend local|pinecone] [--lote 32]
+                                      [--n-listas 0] [--dry-run] [--completo]
+"""
+import argparse
+import hashlib
+import json
 import os
+from pathlib import Path
 from dotenv import load_dotenv
-from langchain_community.document_loaders import TextLoader 
 from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
 
 load_dotenv()
 
+from app.rag.retriever import EMBEDDING_MODEL_NAME, PINECONE_INDEX_NAME
+
 # --- Configuración---
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-PINECONE_INDEX_NAME = "tfm-index"#"kb-tfm"
-DOCUMENT_PATH = "data\knowledge-base.txt" 
-EMBEDDING_MODEL_NAME = "intfloat/multilingual-e5-large"
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+DOCUMENT_PATH = DATA_DIR / "knowledge-base.txt"
+MANIFIESTO_PINECONE = DATA_DIR / f".pinecone-{PINECONE_INDEX_NAME}.json"
+LOTE_PINECONE = 100  # Vectores por llamada de upsert/delete
 
 # Configuración de headers para Markdown
 headers_to_split_on = [
@@ -20,55 +49,178 @@ headers_to_split_on = [
     ("###", "header3"),
 ]
 
-try:
-    # 1. Cargar el Documento
-    print("Cargando documento...")
-    loader = TextLoader(DOCUMENT_PATH, encoding='utf-8')
-    documents = loader.load()
-    print(f"Documento cargado. Número de páginas/documentos iniciales: {len(documents)}")
-    
-    if not documents:
-        raise ValueError("El documento está vacío o no se pudo cargar correctamente.")
-    
-    # 2. Procesar Markdown
-    print("Procesando estructura Markdown...")
-    markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
-    md_splits = []
-    
-    for doc in documents:
-        # Dividir por headers de Markdown
-        md_header_splits = markdown_splitter.split_text(doc.page_content)
-        md_splits.extend(md_header_splits)
-    
-    print(f"Documento dividido en {len(md_splits)} secciones basadas en Markdown.")
-    
-    # 3. Dividir en Fragmentos más pequeños
-    print("Dividiendo en fragmentos más pequeños...")
+
+def fuentes_por_defecto() -> list[Path]:
+    rutas = os.getenv("RAG_FUENTES")
+    return [Path(r) for r in rutas.split(os.pathsep) if r] if rutas else [DOCUMENT_PATH]
+
+
+def id_fragmento(texto: str, metadata: dict) -> str:
+    contenido = json.dumps([texto, metadata], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:32]
+
+
+def trocear(ruta: Path) -> list[tuple[str, dict]]:
+    """Fragmentos (texto, metadata) de una fuente: primero por cabeceras de Markdown y después por tamaño."""
+    contenido = ruta.read_text(encoding="utf-8")
+    if not contenido.strip():
+        raise ValueError(f"La fuente {ruta} está vacía.")
+    md_splits = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on).split_text(contenido)
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=700,
         chunk_overlap=50
     )
-    splits = text_splitter.split_documents(md_splits)
-    print(f"Documento dividido en {len(splits)} fragmentos finales.")
-    
-    # 4. Inicializar Modelo de Embeddings
-    print("Inicializando modelo de embeddings...")
+    return [(doc.page_content, {**doc.metadata, "fuente": ruta.name})
+            for doc in text_splitter.split_documents(md_splits)]
+
+
+def cargar_fragmentos(fuentes: list[Path]) -> dict:
+    """{id: (texto, metadata)} de todas las fuentes, en orden y sin duplicados."""
+    fragmentos = {}
+    for ruta in fuentes:
+        trozos = trocear(ruta)
+        print(f"{ruta.name}: {len(trozos)} fragmentos.")
+        for texto, metadata in trozos:
+            fragmentos.setdefault(id_fragmento(texto, metadata), (texto, metadata))
+    return fragmentos
+
+
+def embeber_por_lotes(textos: list, lote: int) -> list:
+    """Embeddings de `textos`, calculados en lotes de `lote` (el modelo solo se carga si hay algo que embeber)."""
+    if not textos:
+        return []
+    print(f"Inicializando modelo de embeddings ({EMBEDDING_MODEL_NAME})...")
     embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-    
-    # 5. Crear/Actualizar Vector Store en Pinecone
-    print(f"Conectando y subiendo datos al índice Pinecone '{PINECONE_INDEX_NAME}'...")
-    vectorstore = PineconeVectorStore.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        index_name=PINECONE_INDEX_NAME
-    )
-    
+    vectores = []
+    for inicio in range(0, len(textos), lote):
+        vectores.extend(embeddings.embed_documents(textos[inicio:inicio + lote]))
+        print(f"  Embeddings: {len(vectores)}/{len(textos)}")
+    return vectores
+
+
+def informe(fragmentos: dict, indexados: set) -> tuple[list, list]:
+    """Imprime el diff y devuelve (ids nuevos, ids eliminados)."""
+    nuevos = [i for i in fragmentos if i not in indexados]
+    eliminados = sorted(indexados - set(fragmentos))
     print("-" * 50)
-    print(f"Se han cargado {len(splits)} fragmentos al índice '{PINECONE_INDEX_NAME}' de Pinecone.")
-    print("Los fragmentos incluyen la estructura jerárquica de Markdown.")
+    print(f"Fragmentos: {len(fragmentos)}  Sin cambios: {len(fragmentos) - len(nuevos)}  "
+          f"Nuevos o modificados: {len(nuevos)}  Eliminados: {len(eliminados)}")
+    for id_nuevo in nuevos:
+        texto, metadata = fragmentos[id_nuevo]
+        print(f"  + [{metadata['fuente']}] {texto[:80]!r}")
+    if eliminados:
+        print(f"  - {len(eliminados)} fragmentos que ya no están en las fuentes")
     print("-" * 50)
+    return nuevos, eliminados
+
+
+def indexar_local(fragmentos: dict, args):
+    from app.rag.local_index import RAG_LOCAL_INDEX_DIR, LocalVectorIndex, construir_indice
+    existentes = {}
+    mismas_listas = False
+    if not args.completo and (RAG_LOCAL_INDEX_DIR / "meta.json").exists():
+        anterior = LocalVectorIndex.load(RAG_LOCAL_INDEX_DIR)
+        if anterior.meta.get("modelo") == EMBEDDING_MODEL_NAME:
+            existentes = anterior.vectores_por_id()
+            mismas_listas = anterior.meta.get("n_listas", 0) == (args.n_listas if len(fragmentos) > args.n_listas else 0)
+        else:
+            print(f"El índice local se creó con otro modelo ({anterior.meta.get('modelo')}): se recalcula entero.")
+    nuevos, eliminados = informe(fragmentos, set(existentes))
+    if args.dry_run:
+        return
+    if existentes and not nuevos and not eliminados and mismas_listas:
+        print("El índice local ya está al día.")
+        return
+
+    existentes.update(zip(nuevos, embeber_por_lotes([fragmentos[i][0] for i in nuevos], args.lote)))
+    ids = list(fragmentos)
+    print(f"Escribiendo el índice local en {RAG_LOCAL_INDEX_DIR}...")
+    meta = construir_indice(
+        [fragmentos[i][0] for i in ids],
+        [fragmentos[i][1] for i in ids],
+        [existentes[i] for i in ids],
+        RAG_LOCAL_INDEX_DIR,
+        modelo=EMBEDDING_MODEL_NAME,
+        n_listas=args.n_listas,
+        ids=ids,
+    )
+    print(f"Índice local: {meta['n_fragmentos']} fragmentos, dimensión {meta['dimension']}, "
+          f"versión {meta['version']}{', IVF con ' + str(meta['n_listas']) + ' listas' if meta['n_listas'] else ''}.")
+
+
+def _guardar_manifiesto(ids: list):
+    temporal = MANIFIESTO_PINECONE.with_name(f"{MANIFIESTO_PINECONE.name}.tmp")
+    temporal.write_text(json.dumps({"modelo": EMBEDDING_MODEL_NAME, "ids": ids}), encoding="utf-8")
+    os.replace(temporal, MANIFIESTO_PINECONE)
+
+
+def indexar_pinecone(fragmentos: dict, args):
+    from pinecone import Pinecone
+    indexados = set()
+    completo = args.completo or not MANIFIESTO_PINECONE.exists()
+    if not completo:
+        manifiesto = json.loads(MANIFIESTO_PINECONE.read_text(encoding="utf-8"))
+        if manifiesto.get("modelo") == EMBEDDING_MODEL_NAME:
+            indexados = set(manifiesto["ids"])
+        else:
+            completo = True
+    if completo:
+        print(f"Reindexación completa: se vacía el índice Pinecone '{PINECONE_INDEX_NAME}'.")
+    nuevos, eliminados = informe(fragmentos, indexados)
+    if args.dry_run or not (completo or nuevos or eliminados):
+        if not args.dry_run:
+            print(f"El índice Pinecone '{PINECONE_INDEX_NAME}' ya está al día.")
+        return
+
+    print(f"Conectando al índice Pinecone '{PINECONE_INDEX_NAME}'...")
+    indice = Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME)
+    if completo:
+        try:
+            indice.delete(delete_all=True)
+        except Exception as e:
+            # Un índice (o namespace) vacío responde 404 al borrado total
+            print(f"Aviso al vaciar el índice: {e}")
+
+    vectores = embeber_por_lotes([fragmentos[i][0] for i in nuevos], args.lote)
+    # 'text' es la clave de metadata donde PineconeVectorStore busca el contenido del fragmento
+    registros = [{"id": i, "values": vector, "metadata": {**fragmentos[i][1], "text": fragmentos[i][0]}}
+                 for i, vector in zip(nuevos, vectores)]
+    for inicio in range(0, len(registros), LOTE_PINECONE):
+        indice.upsert(vectors=registros[inicio:inicio + LOTE_PINECONE])
+    for inicio in range(0, len(eliminados), LOTE_PINECONE):
+        indice.delete(ids=eliminados[inicio:inicio + LOTE_PINECONE])
+    _guardar_manifiesto(list(fragmentos))
+    print(f"Índice '{PINECONE_INDEX_NAME}': {len(registros)} fragmentos subidos, {len(eliminados)} borrados.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fuentes", nargs="*", type=Path, default=fuentes_por_defecto(),
+                        help="Ficheros Markdown/texto de la base de conocimiento")
+    parser.add_argument("--backend", choices=("local", "pinecone"), default=os.getenv("RAG_BACKEND", "local"))
+    parser.add_argument("--lote", type=int, default=32, help="Fragmentos por lote de embeddings")
+    parser.add_argument("--n-listas", type=int, default=0,
+                        help="Listas IVF del índice local (0 = fuerza bruta, lo adecuado para pocos miles de fragmentos)")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra qué cambiaría sin calcular embeddings ni escribir")
+    parser.add_argument("--completo", action="store_true", help="Ignora lo indexado y recalcula todos los embeddings")
+    args = parser.parse_args()
+
+    try:
+        print(f"Troceando {len(args.fuentes)} fuente(s)...")
+        fragmentos = cargar_fragmentos(args.fuentes)
+        if not fragmentos:
+            raise ValueError("Las fuentes no contienen fragmentos.")
+
+        if args.backend == "local":
+            indexar_local(fragmentos, args)
+        else:
+            indexar_pinecone(fragmentos, args)
+
+    except Exception as e:
+        print(f"\nERROR DURANTE EL PROCESO: {e}")
+        import traceback
+        print(traceback.format_exc())
+
 
-except Exception as e:
-    print(f"\nERROR DURANTE EL PROCESO: {e}")
-    import traceback
-    print(traceback.format_exc())
\ No newline at end of file
+if __name__ == "__main__":
+    main()
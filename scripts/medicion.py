@@ -0,0 +1,40 @@
+"""Medición por etapas para los scripts por lotes: tiempo y pico de memoria (RSS) del proceso."""
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def pico_rss_mb() -> float | None:
+    """Máximo RSS alcanzado por el proceso hasta ahora, en MB (None si el sistema no lo ofrece)."""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+class Cronometro:
+    def __init__(self):
+        self.etapas = {}
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nombre] = (time.perf_counter() - t0, pico_rss_mb())
+
+    def informe(self) -> str:
+        total = sum(segundos for segundos, _ in self.etapas.values())
+        lineas = [f"  {'etapa':<14} {'tiempo':>12} {'pico RSS':>12}"]
+        for nombre, (segundos, pico) in self.etapas.items():
+            memoria = f"{pico:9.1f} MB" if pico is not None else f"{'n/d':>12}"
+            lineas.append(f"  {nombre:<14} {segundos * 1000:9.1f} ms {memoria}")
+        lineas.append(f"  {'total':<14} {total * 1000:9.1f} ms")
+        return "\n".join(lineas)
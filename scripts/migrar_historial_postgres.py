@@ -0,0 +1,56 @@
+"""
+Migra a PostgreSQL (historial_mensajes) los historiales de chat que siguen en S3.
+
+Con HISTORY_BACKEND=postgres cada teléfono pasa solo a PostgreSQL en su siguiente escritura;
+este job adelanta la migración para todos (o para --telefono). Cada teléfono se mueve en una
+transacción con su cabecera bloqueada y los objetos de S3 se borran después del commit.
+
+Ejecutarlo con la API ya en HISTORY_BACKEND=postgres (y sql/historial_mensajes.sql aplicado):
+una API que siga en 's3' seguiría anexando segmentos a los teléfonos migrados.
+
+Uso:
+    python -m scripts.migrar_historial_postgres [--telefono 34600000000] [--limite 1000] [--dry-run]
+"""
+import argparse
+import time
+from app.database.connection import db_connection
+from app.memory.postgres_history import mover_a_postgres
+
+SQL_CANDIDATOS = """
+    SELECT ds_telefono FROM historial_chats
+    WHERE ds_ubicacion = 's3' AND (%(telefono)s IS NULL OR ds_telefono = %(telefono)s)
+    ORDER BY last_updated DESC
+    LIMIT %(limite)s
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--telefono", help="Migrar solo este teléfono")
+    parser.add_argument("--limite", type=int, default=None, help="Máximo de teléfonos (los más recientes primero)")
+    parser.add_argument("--dry-run", action="store_true", help="Cuenta los mensajes que se moverían sin tocar nada")
+    args = parser.parse_args()
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_CANDIDATOS, {"telefono": args.telefono, "limite": args.limite})
+            telefonos = [fila[0] for fila in cur.fetchall()]
+    print(f"Teléfonos con el historial en S3: {len(telefonos)}")
+
+    mensajes = errores = 0
+    t0 = time.perf_counter()
+    for i, telefono in enumerate(telefonos, start=1):
+        try:
+            mensajes += mover_a_postgres(telefono, dry_run=args.dry_run)
+        except Exception as e:
+            errores += 1
+            print(f"ERROR migrando {telefono}: {e}")
+        if i % 500 == 0:
+            print(f"  {i}/{len(telefonos)} teléfonos")
+
+    print(f"Teléfonos: {len(telefonos) - errores}  Mensajes movidos: {mensajes}  Errores: {errores}  "
+          f"({time.perf_counter() - t0:.1f} s){'  (dry-run)' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
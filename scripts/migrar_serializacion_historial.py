@@ -0,0 +1,112 @@
+"""
+Reescribe los objetos del historial de chats en el formato de HISTORY_SERIALIZER
+(app/memory/serializacion.py; por defecto el compacto orjson + zstd).
+
+Recorre los segmentos de historial_segmentos y los objetos antiguos de historial_chats
+(s3_chat_history_key). Los que no estén ya en el formato actual se decodifican, se vuelven a
+codificar, se comprueba que el resultado devuelve exactamente los mismos mensajes y se
+sobrescriben en la misma clave (el contenido es equivalente, así que los lectores que lleguen
+a la vez leen lo mismo con cualquiera de las dos versiones); nu_bytes se actualiza después.
+Si el segmento desapareció entretanto (compactación, clear), el objeto recién escrito se borra.
+
+Se puede ejecutar con la API en marcha y repetir: lo ya migrado se salta.
+
+Uso:
+    python -m scripts.migrar_serializacion_historial [--telefono 34600000000] [--workers 8] [--dry-run]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import messages_to_dict
+from app.database.connection import db_connection
+from app.memory.object_store import get_object_store
+from app.memory.serializacion import HISTORY_SERIALIZER, deserializar, es_formato_actual, serializar
+
+SQL_OBJETOS = """
+    SELECT ds_telefono, ds_clave, FALSE FROM historial_segmentos WHERE %(telefono)s IS NULL OR ds_telefono = %(telefono)s
+    UNION ALL
+    SELECT ds_telefono, s3_chat_history_key, TRUE FROM historial_chats
+    WHERE s3_chat_history_key IS NOT NULL AND (%(telefono)s IS NULL OR ds_telefono = %(telefono)s)
+    ORDER BY 1, 2
+"""
+
+
+def migrar_objeto(store, telefono: str, clave: str, antiguo: bool, dry_run: bool) -> tuple[str, int, int]:
+    """('migrado' | 'al_dia' | 'desaparecido', bytes antes, bytes después)."""
+    try:
+        contenido = store.get(clave)
+    except KeyError:
+        return "desaparecido", 0, 0
+    if es_formato_actual(contenido):
+        return "al_dia", len(contenido), len(contenido)
+    mensajes = deserializar(contenido)
+    nuevo = serializar(mensajes)
+    if messages_to_dict(deserializar(nuevo)) != messages_to_dict(mensajes):
+        raise ValueError(f"La recodificación de {clave} no conserva los mensajes")
+    if dry_run:
+        return "migrado", len(contenido), len(nuevo)
+
+    store.put(clave, nuevo)
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            if antiguo:
+                cur.execute("SELECT 1 FROM historial_chats WHERE ds_telefono = %s AND s3_chat_history_key = %s",
+                            (telefono, clave))
+                sigue = cur.fetchone() is not None
+            else:
+                cur.execute("UPDATE historial_segmentos SET nu_bytes = %s WHERE ds_telefono = %s AND ds_clave = %s",
+                            (len(nuevo), telefono, clave))
+                sigue = cur.rowcount > 0
+        conn.commit()
+    if not sigue:
+        # Se borró o compactó mientras se migraba: no se deja el objeto reescrito huérfano
+        store.delete([clave])
+        return "desaparecido", 0, 0
+    return "migrado", len(contenido), len(nuevo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--telefono", help="Migrar solo este teléfono")
+    parser.add_argument("--workers", type=int, default=8, help="Objetos procesados en paralelo")
+    parser.add_argument("--dry-run", action="store_true", help="Calcula el ahorro sin escribir nada")
+    args = parser.parse_args()
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_OBJETOS, {"telefono": args.telefono})
+            objetos = cur.fetchall()
+    print(f"Objetos de historial: {len(objetos)}  Formato destino: {HISTORY_SERIALIZER}")
+
+    store = get_object_store()
+    resumen = {"migrado": 0, "al_dia": 0, "desaparecido": 0, "error": 0}
+    bytes_antes = bytes_despues = 0
+    t0 = time.perf_counter()
+
+    def uno(objeto):
+        telefono, clave, antiguo = objeto
+        try:
+            return migrar_objeto(store, telefono, clave, antiguo, args.dry_run)
+        except Exception as e:
+            print(f"ERROR migrando {clave}: {e}")
+            return "error", 0, 0
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        for i, (estado, antes, despues) in enumerate(pool.map(uno, objetos), start=1):
+            resumen[estado] += 1
+            if estado == "migrado":
+                bytes_antes += antes
+                bytes_despues += despues
+            if i % 1000 == 0:
+                print(f"  {i}/{len(objetos)} objetos revisados")
+
+    ratio = bytes_antes / bytes_despues if bytes_despues else 0.0
+    print(f"Migrados: {resumen['migrado']}  Ya en formato actual: {resumen['al_dia']}  "
+          f"Desaparecidos: {resumen['desaparecido']}  Errores: {resumen['error']}  "
+          f"({time.perf_counter() - t0:.1f} s){'  (dry-run)' if args.dry_run else ''}")
+    if resumen["migrado"]:
+        print(f"Tamaño de los migrados: {bytes_antes / 1024:.1f} KiB -> {bytes_despues / 1024:.1f} KiB ({ratio:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
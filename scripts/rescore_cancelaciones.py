@@ -0,0 +1,193 @@
+"""
+Recalcula probabilidad_cancelacion de todas las reservas confirmadas futuras.
+
+La probabilidad se calcula al crear la reserva y check_availability_db la usa después para
+decidir si se ofrece overbooking, pero sus entradas cambian cada día: la previsión de lluvia,
+la antelación y el historial de cancelaciones del cliente. Este job la pone al día en bloque:
+
+1. carga:      una única consulta con cursor con nombre (streaming por lotes de --lote filas),
+               leída directamente a arrays de NumPy, sin un dict por fila;
+2. features:   antelación vectorizada, calendario (fin de semana, horario pico, festivo) desde
+               la tabla de app/ml/calendario.py y lluvia de todo el horizonte con una sola
+               llamada a la API;
+3. predicción: una sola llamada a predict_proba con el modelo del registro (app/ml/registry.py);
+4. escritura:  COPY a una tabla temporal y un único UPDATE ... FROM, que además guarda la
+               versión del modelo en ds_version_modelo.
+
+Las features almacenadas en la reserva (antelacion_dias, lluvia...) no se modifican: son las
+del momento de la reserva y forman parte de los datos de entrenamiento.
+
+Uso:
+    python -m scripts.rescore_cancelaciones [--lote 5000] [--dry-run]
+"""
+import argparse
+import io
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytz
+from app.database import crud
+from app.database.connection import get_db_connection
+from app.ml.calendario import get_calendario
+from app.ml.registry import get_model_registry
+from app.ml.weather import WEATHER_FORECAST_DAYS, get_weather_provider
+from scripts.medicion import Cronometro
+
+# Días después de hoy con previsión en la caché de app/ml/weather.py; más allá la lluvia se toma como 0
+HORIZONTE_PREVISION_DIAS = WEATHER_FORECAST_DAYS - 1
+
+# Instantes como segundos desde 1970 de la hora LOCAL de Madrid: día, hora y día de la
+# semana salen con aritmética entera. El historial del cliente viene de cliente_estadisticas;
+# la propia reserva está incluida en n_confirmadas, por eso se resta 1 (igual que al reservar,
+# cuando aún no existía).
+SQL_RESERVAS_FUTURAS = """
+    SELECT
+        r.id_reserva,
+        r.id_instalacion,
+        EXTRACT(EPOCH FROM r.dt_fechahora_inicio AT TIME ZONE 'Europe/Madrid')::bigint,
+        GREATEST(COALESCE(e.n_confirmadas, 0) - 1, 0),
+        COALESCE(e.n_canceladas, 0)
+    FROM public.reservas r
+    LEFT JOIN public.cliente_estadisticas e ON e.ds_telefono = r.ds_telefono
+    WHERE r.ds_estado = 'Confirmada'
+    AND r.dt_fechahora_inicio > now()
+"""
+
+SQL_TABLA_TEMPORAL = """
+    CREATE TEMP TABLE rescore_cancelaciones (
+        id_reserva INTEGER PRIMARY KEY,
+        probabilidad_cancelacion DOUBLE PRECISION NOT NULL
+    ) ON COMMIT DROP
+"""
+
+# Solo se reescriben las filas cuya probabilidad cambia; la reserva puede haberse cancelado
+# mientras tanto, de ahí la condición sobre ds_estado.
+SQL_ACTUALIZAR = """
+    UPDATE public.reservas r
+    SET probabilidad_cancelacion = t.probabilidad_cancelacion,
+        ds_version_modelo = %s
+    FROM rescore_cancelaciones t
+    WHERE r.id_reserva = t.id_reserva
+    AND r.ds_estado = 'Confirmada'
+    AND (r.probabilidad_cancelacion IS DISTINCT FROM t.probabilidad_cancelacion
+         OR r.ds_version_modelo IS DISTINCT FROM %s)
+"""
+
+SEGUNDOS_DIA = 86400
+COLUMNAS = ("id_reserva", "id_instalacion", "inicio_local", "reservas_previas", "cancelaciones_previas")
+
+
+def cargar_reservas(conn, lote: int) -> dict:
+    """Lee las reservas futuras por lotes con un cursor del servidor y devuelve {columna: array int64}."""
+    bloques = []
+    with conn.cursor(name="rescore_reservas_futuras") as cur:
+        cur.itersize = lote
+        cur.execute(SQL_RESERVAS_FUTURAS)
+        while True:
+            filas = cur.fetchmany(lote)
+            if not filas:
+                break
+            bloques.append(np.array(filas, dtype=np.int64))
+    datos = np.concatenate(bloques) if bloques else np.empty((0, len(COLUMNAS)), dtype=np.int64)
+    return {nombre: datos[:, i] for i, nombre in enumerate(COLUMNAS)}
+
+
+def _dias_epoch(fechas) -> np.ndarray:
+    """Fechas 'YYYY-MM-DD' -> días desde 1970-01-01."""
+    return np.array(fechas, dtype="datetime64[D]").astype(np.int64)
+
+
+def lluvia_por_dia(dias: np.ndarray, hoy: int) -> np.ndarray:
+    """Lluvia (0/1) de cada reserva: una sola llamada a la API para todo el horizonte de previsión."""
+    lluvia = np.zeros(len(dias), dtype=np.int64)
+    ultimo = min(int(dias.max()), hoy + HORIZONTE_PREVISION_DIAS) if len(dias) else hoy - 1
+    if ultimo < hoy:
+        return lluvia
+    desde, hasta = (str(np.datetime64(d, "D")) for d in (hoy, ultimo))
+    prevision = get_weather_provider().lluvias(desde, hasta)
+    if prevision:
+        tabla = np.zeros(ultimo - hoy + 1, dtype=np.int64)
+        indices = _dias_epoch(list(prevision)) - hoy
+        validos = (indices >= 0) & (indices < len(tabla))
+        tabla[indices[validos]] = np.array(list(prevision.values()), dtype=np.int64)[validos]
+        en_horizonte = dias <= ultimo
+        lluvia[en_horizonte] = tabla[dias[en_horizonte] - hoy]
+    return lluvia
+
+
+def construir_features(reservas: dict, ahora_local: datetime) -> dict:
+    """Mismas features que crud._build_features, calculadas para todas las reservas a la vez."""
+    inicio = reservas["inicio_local"]
+    ahora = int((ahora_local - datetime(1970, 1, 1)).total_seconds())
+    dias = inicio // SEGUNDOS_DIA
+    hora = (inicio % SEGUNDOS_DIA) // 3600
+    return {
+        "id_instalacion": reservas["id_instalacion"],
+        # timedelta.days redondea hacia abajo, igual que la división entera
+        "antelacion_dias": (inicio - ahora) // SEGUNDOS_DIA,
+        "reservas_previas": reservas["reservas_previas"],
+        "cancelaciones_previas": reservas["cancelaciones_previas"],
+        # es_finde, es_horario_pico y es_feriado: la misma tabla que usa crud._build_features
+        **get_calendario().features_lote(dias, hora),
+        "lluvia": lluvia_por_dia(dias, ahora // SEGUNDOS_DIA),
+    }
+
+
+def escribir_probabilidades(conn, ids: np.ndarray, probabilidades: np.ndarray, version: str) -> int:
+    """COPY de (id, probabilidad) a una tabla temporal y un único UPDATE ... FROM. Devuelve filas modificadas."""
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.column_stack((ids, probabilidades)), fmt=("%d", "%.17g"), delimiter="\t")
+    buffer.seek(0)
+    with conn.cursor() as cur:
+        cur.execute(SQL_TABLA_TEMPORAL)
+        cur.copy_expert("COPY rescore_cancelaciones (id_reserva, probabilidad_cancelacion) FROM STDIN", buffer)
+        cur.execute(SQL_ACTUALIZAR, (version, version))
+        return cur.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lote", type=int, default=5000, help="Filas por lote del cursor del servidor")
+    parser.add_argument("--dry-run", action="store_true", help="Calcula las probabilidades sin escribirlas")
+    args = parser.parse_args()
+
+    crono = Cronometro()
+    conn = get_db_connection()
+    try:
+        with crono.etapa("modelo"):
+            modelo = get_model_registry().get()
+
+        with crono.etapa("carga"):
+            reservas = cargar_reservas(conn, args.lote)
+        n = len(reservas["id_reserva"])
+        if n == 0:
+            print("No hay reservas confirmadas futuras.")
+            return
+
+        with crono.etapa("features"):
+            features = construir_features(reservas, datetime.now(pytz.timezone("Europe/Madrid")).replace(tzinfo=None))
+            X = pd.DataFrame({columna: features[columna] for columna in modelo.columnas})
+
+        with crono.etapa("prediccion"):
+            probabilidades = modelo.model.predict_proba(X)[:, 1]
+
+        actualizadas = 0
+        if not args.dry_run:
+            with crono.etapa("escritura"):
+                actualizadas = escribir_probabilidades(conn, reservas["id_reserva"], probabilidades, modelo.version)
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    print(f"Reservas futuras: {n}  Modelo: {modelo.version}  "
+          f"Actualizadas: {'(dry-run)' if args.dry_run else actualizadas}")
+    print(f"Probabilidad media: {probabilidades.mean():.2%}  "
+          f">= umbral de overbooking ({crud.UMBRAL_OVERBOOKING:.0%}): {int((probabilidades >= crud.UMBRAL_OVERBOOKING).sum())}")
+    print(crono.informe())
+
+
+if __name__ == "__main__":
+    main()
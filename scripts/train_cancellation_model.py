@@ -0,0 +1,231 @@
+"""
+Entrenamiento del modelo de cancelación a partir de public.reservas.
+
+Sustituye al flujo manual de ML/random-forest.ipynb (pd.read_sql_query de toda la tabla) por
+un pipeline repetible y con memoria acotada:
+
+1. carga:       cuenta las filas, reserva los arrays de NumPy (int32, columnares) y los rellena
+                por lotes desde un cursor con nombre. En memoria solo están los arrays finales
+                y un lote de tuplas, así que sirve para millones de filas;
+2. division:    train/test estratificado;
+3. entrenamiento: RandomForestClassifier con árboles en paralelo (--n-jobs) y, opcionalmente,
+                un submuestreo por árbol (--max-samples) para acotar tiempo y memoria;
+4. evaluacion:  ROC AUC, matriz de confusión e informe de clasificación sobre test;
+5. guardado:    artefacto versionado ML/modelos/<nombre>-<fecha>.pkl junto a su manifiesto
+                (columnas, parámetros, métricas, filas, sha256) y la lista de columnas.
+
+Con --publicar el artefacto sustituye a ML/rf_cancelaciones.pkl (reemplazo atómico) y el
+registro del modelo de la API lo recarga en caliente (app/ml/registry.py).
+
+Las features son las guardadas en cada reserva al crearla, las mismas que vio el modelo en
+producción. Solo se usan resultados definitivos: canceladas y confirmadas ya celebradas.
+
+Uso:
+    python -m scripts.train_cancellation_model --n-jobs -1 [--origen real] [--publicar]
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score
+from sklearn.model_selection import train_test_split
+from app.database.connection import get_db_connection
+from app.ml.registry import COLUMNS_PATH, ML_DIR, MODEL_PATH
+from scripts.medicion import Cronometro
+
+DIRECTORIO_MODELOS = ML_DIR / 'modelos'
+
+# Expresión SQL de cada feature (las columnas de reservas pueden ser NULL o boolean)
+EXPRESIONES = {
+    "id_instalacion": "id_instalacion",
+    "lluvia": "COALESCE(lluvia::int, 0)",
+    "antelacion_dias": "COALESCE(antelacion_dias, 0)",
+    "reservas_previas": "COALESCE(reservas_previas, 0)",
+    "cancelaciones_previas": "COALESCE(cancelaciones_previas, 0)",
+    "es_finde": "COALESCE(es_finde, 0)",
+    "es_horario_pico": "COALESCE(es_horario_pico, 0)",
+    "es_feriado": "COALESCE(es_feriado, 0)",
+}
+
+# Resultado definitivo: canceladas, o confirmadas cuya hora ya pasó (una futura aún puede cancelarse)
+FILTRO_ETIQUETADAS = """
+    (ds_estado = 'Cancelada' OR (ds_estado = 'Confirmada' AND dt_fechahora_inicio < now()))
+"""
+FILTRO_ORIGEN = {
+    "real": "AND es_simulado IS NOT TRUE",
+    "simulado": "AND es_simulado IS TRUE",
+    "todas": "",
+}
+
+
+def leer_columnas() -> list:
+    with open(COLUMNS_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def consulta(columnas: list, origen: str, limite: int | None) -> tuple[str, str]:
+    """(SQL de conteo, SQL de datos) con las features en el orden de `columnas` y la etiqueta al final."""
+    desconocidas = set(columnas) - set(EXPRESIONES)
+    if desconocidas:
+        raise ValueError(f"Features sin expresión SQL en el pipeline: {sorted(desconocidas)}")
+    donde = f"WHERE {FILTRO_ETIQUETADAS} {FILTRO_ORIGEN[origen]}"
+    # ORDER BY para que --limite y la división train/test sean reproducibles
+    sufijo = f"ORDER BY id_reserva LIMIT {int(limite)}" if limite else "ORDER BY id_reserva"
+    select = ", ".join(EXPRESIONES[c] for c in columnas)
+    datos = f"""
+        SELECT {select}, (ds_estado = 'Cancelada')::int
+        FROM public.reservas
+        {donde}
+        {sufijo}
+    """
+    conteo = f"SELECT COUNT(*) FROM (SELECT 1 FROM public.reservas {donde} {sufijo}) t"
+    return conteo, datos
+
+
+def cargar(conn, columnas: list, origen: str, lote: int, limite: int | None) -> tuple[np.ndarray, np.ndarray]:
+    """Rellena por lotes una matriz int32 preasignada: (X, y)."""
+    sql_conteo, sql_datos = consulta(columnas, origen, limite)
+    with conn.cursor() as cur:
+        cur.execute(sql_conteo)
+        n = cur.fetchone()[0]
+    datos = np.empty((n, len(columnas) + 1), dtype=np.int32)
+    fila = 0
+    with conn.cursor(name="entrenamiento_cancelaciones") as cur:
+        cur.itersize = lote
+        cur.execute(sql_datos)
+        while fila < n:
+            bloque = cur.fetchmany(lote)
+            if not bloque:
+                break
+            # Entre el conteo y la lectura pueden entrar filas nuevas: no se pasa del tamaño reservado
+            bloque = bloque[:n - fila]
+            datos[fila:fila + len(bloque)] = bloque
+            fila += len(bloque)
+    datos = datos[:fila]
+    return datos[:, :-1], datos[:, -1]
+
+
+def guardar(modelo, columnas: list, manifiesto: dict, directorio: Path, nombre: str) -> Path:
+    """Escribe el artefacto, sus columnas y su manifiesto. Devuelve la ruta del .pkl."""
+    directorio.mkdir(parents=True, exist_ok=True)
+    marca = datetime.now().strftime("%Y%m%d-%H%M%S")
+    ruta = directorio / f"{nombre}-{marca}.pkl"
+    contenido = pickle.dumps(modelo)
+    ruta.write_bytes(contenido)
+    sha256 = hashlib.sha256(contenido).hexdigest()
+    ruta.with_suffix(".columnas.json").write_text(json.dumps(columnas), encoding="utf-8")
+    manifiesto.update({
+        "artefacto": ruta.name,
+        "sha256": sha256,
+        # Versión con la que lo identifica el registro si se carga desde este fichero
+        "version": f"{ruta.stem}@{sha256[:12]}",
+        "columnas": columnas,
+        "creado": datetime.now().isoformat(timespec="seconds"),
+        "sklearn": sklearn.__version__,
+    })
+    ruta.with_suffix(".manifest.json").write_text(json.dumps(manifiesto, indent=2, ensure_ascii=False), encoding="utf-8")
+    return ruta
+
+
+def publicar(ruta: Path, columnas: list):
+    """Sustituye el modelo en servicio con os.replace, para que nadie lea un fichero a medio escribir."""
+    for origen, destino in ((ruta.read_bytes(), MODEL_PATH), (json.dumps(columnas).encode("utf-8"), COLUMNS_PATH)):
+        temporal = destino.with_name(f".{destino.name}.tmp")
+        temporal.write_bytes(origen)
+        os.replace(temporal, destino)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--origen", choices=FILTRO_ORIGEN, default="real", help="Reservas reales, simuladas o todas")
+    parser.add_argument("--limite", type=int, help="Máximo de filas (las primeras por id_reserva)")
+    parser.add_argument("--lote", type=int, default=50000, help="Filas por lote del cursor del servidor")
+    parser.add_argument("--test-size", type=float, default=0.25)
+    # Hiperparámetros por defecto: los del modelo actual (mejor combinación del GridSearch del notebook)
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--max-depth", type=int, default=5)
+    parser.add_argument("--max-samples", type=float, help="Fracción de filas por árbol (acota tiempo y memoria)")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Árboles entrenados en paralelo (-1 = todos los núcleos)")
+    parser.add_argument("--nombre", default=MODEL_PATH.stem)
+    parser.add_argument("--salida", type=Path, default=DIRECTORIO_MODELOS)
+    parser.add_argument("--publicar", action="store_true", help=f"Copiar el artefacto a {MODEL_PATH.name} (recarga en caliente)")
+    args = parser.parse_args()
+
+    crono = Cronometro()
+    columnas = leer_columnas()
+
+    with crono.etapa("carga"):
+        conn = get_db_connection()
+        try:
+            X, y = cargar(conn, columnas, args.origen, args.lote, args.limite)
+        finally:
+            conn.close()
+    if len(y) == 0 or len(np.unique(y)) < 2:
+        raise SystemExit(f"Datos insuficientes para entrenar: {len(y)} filas, clases {np.unique(y).tolist()}")
+    print(f"Filas: {len(y)}  Canceladas: {int(y.sum())} ({y.mean():.1%})  Origen: {args.origen}")
+
+    with crono.etapa("division"):
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=args.test_size, random_state=42, stratify=y
+        )
+        del X, y
+        # Con nombres de columna: el modelo guarda feature_names_in_ y el registro los valida
+        X_train = pd.DataFrame(X_train, columns=columnas, copy=False)
+        X_test = pd.DataFrame(X_test, columns=columnas, copy=False)
+
+    parametros = {
+        "n_estimators": args.n_estimators,
+        "max_depth": args.max_depth,
+        "max_features": "sqrt",
+        "class_weight": "balanced",
+        "max_samples": args.max_samples,
+        "random_state": 42,
+    }
+    with crono.etapa("entrenamiento"):
+        modelo = RandomForestClassifier(**parametros, n_jobs=args.n_jobs)
+        modelo.fit(X_train, y_train)
+        # Las predicciones en la API son de una fila: repartirlas con joblib solo añade latencia
+        modelo.n_jobs = None
+
+    with crono.etapa("evaluacion"):
+        probabilidades = modelo.predict_proba(X_test)[:, 1]
+        predicciones = (probabilidades >= 0.5).astype(np.int32)
+        metricas = {
+            "roc_auc": float(roc_auc_score(y_test, probabilidades)),
+            "matriz_confusion": confusion_matrix(y_test, predicciones).tolist(),
+            "informe": classification_report(y_test, predicciones, output_dict=True, zero_division=0),
+        }
+
+    with crono.etapa("guardado"):
+        manifiesto = {
+            "origen": args.origen,
+            "filas_entrenamiento": int(len(y_train)),
+            "filas_test": int(len(y_test)),
+            "tasa_cancelacion": float((y_train.sum() + y_test.sum()) / (len(y_train) + len(y_test))),
+            "parametros": parametros,
+            "metricas": metricas,
+        }
+        ruta = guardar(modelo, columnas, manifiesto, args.salida, args.nombre)
+        if args.publicar:
+            publicar(ruta, columnas)
+            manifiesto["version_publicada"] = f"{MODEL_PATH.stem}@{manifiesto['sha256'][:12]}"
+
+    manifiesto["etapas"] = {nombre: {"segundos": round(segundos, 3), "pico_rss_mb": pico}
+                            for nombre, (segundos, pico) in crono.etapas.items()}
+    ruta.with_suffix(".manifest.json").write_text(json.dumps(manifiesto, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    print(f"ROC AUC: {metricas['roc_auc']:.4f}  Matriz de confusión: {metricas['matriz_confusion']}")
+    print(f"Artefacto: {ruta}  Versión: {manifiesto.get('version_publicada', manifiesto['version'])}"
+          + (f"  Publicado en {MODEL_PATH}" if args.publicar else ""))
+    print(crono.informe())
+
+
+if __name__ == "__main__":
+    main()
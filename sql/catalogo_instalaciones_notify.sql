@@ -0,0 +1,33 @@
+-- Migración: aviso de cambios en public.instalaciones por LISTEN/NOTIFY
+--
+-- La aplicación mantiene en memoria un catálogo de instalaciones (app/database/facility_catalog.py)
+-- y escucha el canal 'catalogo_instalaciones' para recargarlo en cuanto se modifica la tabla,
+-- sin esperar a que caduque el TTL (FACILITY_CATALOG_TTL).
+
+CREATE OR REPLACE FUNCTION public.notificar_cambio_instalaciones()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- El contenido del mensaje es solo informativo: el catálogo se recarga entero
+    PERFORM pg_notify('catalogo_instalaciones', TG_OP);
+    RETURN NULL;
+END;
+$$;
+
+-- A nivel de sentencia: un UPDATE masivo genera un único aviso
+DROP TRIGGER IF EXISTS trg_notificar_cambio_instalaciones ON public.instalaciones;
+CREATE TRIGGER trg_notificar_cambio_instalaciones
+AFTER INSERT OR UPDATE OR DELETE ON public.instalaciones
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.notificar_cambio_instalaciones();
+
+DROP TRIGGER IF EXISTS trg_notificar_truncate_instalaciones ON public.instalaciones;
+CREATE TRIGGER trg_notificar_truncate_instalaciones
+AFTER TRUNCATE ON public.instalaciones
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.notificar_cambio_instalaciones();
+
+-- Prueba manual (desde psql):
+--   LISTEN catalogo_instalaciones;
+--   UPDATE public.instalaciones SET ds_descripcion = ds_descripcion WHERE id_instalacion = 1;
@@ -0,0 +1,83 @@
+-- Migración: estadísticas de reservas por cliente mantenidas de forma incremental
+--
+-- Las features del modelo de cancelación (reservas_previas, cancelaciones_previas) se obtenían
+-- con dos COUNT(*) sobre public.reservas filtrando por ds_telefono en cada reserva; sin índice
+-- sobre (ds_telefono, ds_estado) su coste crecía con la tabla. Con esta tabla, la aplicación
+-- lee una única fila por clave primaria (ver crud.SQL_ESTADISTICAS_CLIENTE).
+--
+-- Los contadores los mantiene un trigger sobre public.reservas, así que se actualizan también
+-- con escrituras que no pasan por la aplicación (scripts, psql, simulaciones).
+-- Tras crear la tabla hay que rellenarla con los datos existentes:
+--     python -m scripts.backfill_cliente_estadisticas
+
+CREATE TABLE IF NOT EXISTS public.cliente_estadisticas (
+    ds_telefono VARCHAR(20) PRIMARY KEY,
+    n_confirmadas INTEGER NOT NULL DEFAULT 0,
+    n_canceladas INTEGER NOT NULL DEFAULT 0,
+    -- Reservas con ds_estado = 'No presentado' (el cliente no acudió)
+    n_no_presentadas INTEGER NOT NULL DEFAULT 0,
+    -- Fecha de creación de la reserva más reciente del cliente
+    dt_ultima_reserva TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION public.actualizar_cliente_estadisticas()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Restar la fila anterior (UPDATE / DELETE)
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.ds_telefono IS NOT NULL THEN
+        UPDATE public.cliente_estadisticas
+        SET n_confirmadas = n_confirmadas - (OLD.ds_estado IS NOT DISTINCT FROM 'Confirmada')::int,
+            n_canceladas = n_canceladas - (OLD.ds_estado IS NOT DISTINCT FROM 'Cancelada')::int,
+            n_no_presentadas = n_no_presentadas - (OLD.ds_estado IS NOT DISTINCT FROM 'No presentado')::int,
+            updated_at = now()
+        WHERE ds_telefono = OLD.ds_telefono;
+    END IF;
+
+    -- Sumar la fila nueva (INSERT / UPDATE). El upsert crea la fila del cliente la primera vez.
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.ds_telefono IS NOT NULL THEN
+        INSERT INTO public.cliente_estadisticas AS e
+            (ds_telefono, n_confirmadas, n_canceladas, n_no_presentadas, dt_ultima_reserva)
+        VALUES (
+            NEW.ds_telefono,
+            (NEW.ds_estado IS NOT DISTINCT FROM 'Confirmada')::int,
+            (NEW.ds_estado IS NOT DISTINCT FROM 'Cancelada')::int,
+            (NEW.ds_estado IS NOT DISTINCT FROM 'No presentado')::int,
+            NEW.dt_fechahora_creacion
+        )
+        ON CONFLICT (ds_telefono) DO UPDATE
+        SET n_confirmadas = e.n_confirmadas + EXCLUDED.n_confirmadas,
+            n_canceladas = e.n_canceladas + EXCLUDED.n_canceladas,
+            n_no_presentadas = e.n_no_presentadas + EXCLUDED.n_no_presentadas,
+            -- GREATEST ignora los NULL: una reserva sin fecha de creación no borra la anterior
+            dt_ultima_reserva = GREATEST(e.dt_ultima_reserva, EXCLUDED.dt_ultima_reserva),
+            updated_at = now();
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_cliente_estadisticas_insert_delete ON public.reservas;
+CREATE TRIGGER trg_cliente_estadisticas_insert_delete
+AFTER INSERT OR DELETE ON public.reservas
+FOR EACH ROW
+EXECUTE FUNCTION public.actualizar_cliente_estadisticas();
+
+-- Solo los UPDATE que cambian el estado o el teléfono (p. ej. una cancelación);
+-- actualizar la probabilidad de cancelación u otras columnas no dispara el trigger.
+DROP TRIGGER IF EXISTS trg_cliente_estadisticas_update ON public.reservas;
+CREATE TRIGGER trg_cliente_estadisticas_update
+AFTER UPDATE OF ds_estado, ds_telefono ON public.reservas
+FOR EACH ROW
+WHEN (OLD.ds_estado IS DISTINCT FROM NEW.ds_estado OR OLD.ds_telefono IS DISTINCT FROM NEW.ds_telefono)
+EXECUTE FUNCTION public.actualizar_cliente_estadisticas();
+
+-- Comprobación (desde psql), debe devolver 0 filas tras el backfill:
+--   SELECT r.ds_telefono, COUNT(*) FILTER (WHERE r.ds_estado = 'Confirmada') AS real, e.n_confirmadas
+--   FROM public.reservas r LEFT JOIN public.cliente_estadisticas e USING (ds_telefono)
+--   WHERE r.ds_telefono IS NOT NULL
+--   GROUP BY r.ds_telefono, e.n_confirmadas
+--   HAVING COUNT(*) FILTER (WHERE r.ds_estado = 'Confirmada') IS DISTINCT FROM e.n_confirmadas;
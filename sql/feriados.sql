@@ -0,0 +1,43 @@
+-- Migración: tabla de festivos para las features de calendario del modelo de cancelación
+--
+-- app/ml/calendario.py lee los festivos de data/feriados_madrid.csv por defecto; con
+-- CALENDARIO_FERIADOS_FUENTE=db los lee de esta tabla. Los datos iniciales son los mismos
+-- que los del CSV. Cada año hay que añadir los festivos del año siguiente (en el CSV o aquí):
+-- si faltan, la aplicación lo avisa en el log y es_feriado vale 0 ese año.
+
+CREATE TABLE IF NOT EXISTS public.feriados (
+    dt_fecha DATE PRIMARY KEY,
+    ds_nombre VARCHAR(100)
+);
+
+INSERT INTO public.feriados (dt_fecha, ds_nombre) VALUES
+('2024-12-25', 'Navidad'),
+('2025-01-01', 'Año Nuevo'),
+('2025-01-06', 'Epifanía del Señor'),
+('2025-04-17', 'Jueves Santo'),
+('2025-04-18', 'Viernes Santo'),
+('2025-05-01', 'Fiesta del Trabajo'),
+('2025-05-02', 'Fiesta de la Comunidad de Madrid'),
+('2025-05-15', 'San Isidro'),
+('2025-07-25', 'Santiago Apóstol'),
+('2025-08-15', 'Asunción de la Virgen'),
+('2025-11-01', 'Todos los Santos'),
+('2025-11-10', 'Nuestra Señora de la Almudena (traslado)'),
+('2025-12-06', 'Día de la Constitución'),
+('2025-12-08', 'Inmaculada Concepción'),
+('2025-12-25', 'Navidad'),
+('2026-01-01', 'Año Nuevo'),
+('2026-01-06', 'Epifanía del Señor'),
+('2026-04-02', 'Jueves Santo'),
+('2026-04-03', 'Viernes Santo'),
+('2026-05-01', 'Fiesta del Trabajo'),
+('2026-05-02', 'Fiesta de la Comunidad de Madrid'),
+('2026-05-15', 'San Isidro'),
+('2026-08-15', 'Asunción de la Virgen'),
+('2026-10-12', 'Fiesta Nacional de España'),
+('2026-11-02', 'Todos los Santos (traslado)'),
+('2026-11-09', 'Nuestra Señora de la Almudena'),
+('2026-12-07', 'Día de la Constitución (traslado)'),
+('2026-12-08', 'Inmaculada Concepción'),
+('2026-12-25', 'Navidad')
+ON CONFLICT (dt_fecha) DO NOTHING;
@@ -0,0 +1,28 @@
+-- Migración: historial de chats en PostgreSQL (HISTORY_BACKEND=postgres)
+--
+-- Cada mensaje es una fila con su representación de messages_to_dict en JSONB. La clave
+-- primaria (ds_telefono, nu_mensaje) sirve tanto para leer una conversación entera como sus
+-- n últimos mensajes (recorrido inverso del índice), sin índices adicionales.
+--
+-- historial_chats.ds_ubicacion dice dónde están los mensajes de cada teléfono: 's3' (segmentos
+-- de historial_segmentos, el valor de todas las filas existentes) o 'pg' (historial_mensajes).
+-- Con HISTORY_BACKEND=postgres los teléfonos nuevos empiezan en 'pg' y los que están en S3
+-- pasan a 'pg' en su siguiente escritura (o con scripts/migrar_historial_postgres.py);
+-- scripts/archivar_historial.py devuelve a S3 las sesiones inactivas.
+-- Requiere sql/historial_segmentos.sql.
+
+ALTER TABLE historial_chats
+    ADD COLUMN IF NOT EXISTS ds_ubicacion VARCHAR(2) NOT NULL DEFAULT 's3'
+        CHECK (ds_ubicacion IN ('s3', 'pg'));
+
+CREATE TABLE IF NOT EXISTS historial_mensajes (
+    ds_telefono VARCHAR(20) NOT NULL,
+    nu_mensaje INTEGER NOT NULL,          -- Posición (desde 0) en la conversación
+    tx_mensaje JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (ds_telefono, nu_mensaje)
+);
+
+-- Candidatas a archivar: sesiones en PostgreSQL sin actividad reciente
+CREATE INDEX IF NOT EXISTS idx_historial_chats_pg_actualizado
+    ON historial_chats (last_updated) WHERE ds_ubicacion = 'pg';
@@ -0,0 +1,13 @@
+-- Migración: resúmenes acumulados del historial de chats
+--
+-- El agente ya no recibe la conversación completa, sino los últimos turnos dentro de un
+-- presupuesto de tokens (app/memory/ventana.py) precedidos de un resumen de todo lo anterior.
+-- El resumen se actualiza en segundo plano y se guarda aquí, junto al número de mensajes
+-- (desde el principio del historial) que cubre, para no volver a resumirlos.
+
+CREATE TABLE IF NOT EXISTS historial_resumenes (
+    ds_telefono VARCHAR(20) PRIMARY KEY,
+    tx_resumen TEXT NOT NULL,
+    nu_mensajes_resumidos INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
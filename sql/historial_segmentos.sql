@@ -0,0 +1,27 @@
+-- Migración: historial de chats en segmentos de solo anexado
+--
+-- Antes cada turno reescribía en S3 la conversación completa (historial/<telefono>.json), así
+-- que el coste de escritura crecía con la longitud del chat. Ahora cada turno sube solo sus
+-- mensajes como un objeto nuevo (un segmento) y registra aquí su clave y su posición; el
+-- job scripts/compactar_historial.py fusiona los segmentos pequeños.
+--
+-- historial_chats queda como cabecera por teléfono: número total de mensajes y último número
+-- de segmento asignado. s3_chat_history_key solo se conserva para los historiales antiguos
+-- (un único objeto), que se leen delante de los segmentos hasta que la compactación los
+-- convierte en el segmento 0.
+
+ALTER TABLE historial_chats
+    ALTER COLUMN s3_chat_history_key DROP NOT NULL,
+    ADD COLUMN IF NOT EXISTS nu_mensajes INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS nu_ultimo_segmento INTEGER NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS historial_segmentos (
+    ds_telefono VARCHAR(20) NOT NULL,
+    nu_segmento INTEGER NOT NULL,
+    ds_clave VARCHAR(1024) NOT NULL,
+    nu_primer_mensaje INTEGER NOT NULL,   -- Posición (desde 0) del primer mensaje del segmento
+    nu_mensajes INTEGER NOT NULL,
+    nu_bytes INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (ds_telefono, nu_segmento)
+);
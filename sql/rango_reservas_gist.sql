@@ -0,0 +1,44 @@
+-- Migración: rango tstzrange + índice GiST / restricción de exclusión sobre public.reservas
+--
+-- El predicado (inicio, fin) OVERLAPS (...) no puede usar ningún índice, por lo que cada
+-- consulta de disponibilidad recorría la tabla completa. Con una columna tstzrange y un
+-- índice GiST sobre (id_instalacion, rango) las consultas con && pasan a ser index scans.
+
+-- btree_gist permite combinar id_instalacion (integer, operador =) con el rango en un mismo índice GiST
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+-- Columna generada: siempre coherente con dt_fechahora_inicio / dt_fechahora_fin.
+-- Intervalo semiabierto [inicio, fin), igual que OVERLAPS: una reserva 10:00-11:00 no choca con 11:00-12:00.
+ALTER TABLE public.reservas
+ADD COLUMN rango_reserva tstzrange
+GENERATED ALWAYS AS (tstzrange(dt_fechahora_inicio, dt_fechahora_fin, '[)')) STORED;
+
+-- Antes de crear la restricción: listar reservas confirmadas que ya se solapan.
+-- Si devuelve filas hay que resolverlas (cancelar una de cada par) o la restricción fallará.
+SELECT a.id_reserva, b.id_reserva AS id_reserva_solapada, a.id_instalacion, a.rango_reserva, b.rango_reserva
+FROM public.reservas a
+JOIN public.reservas b
+  ON a.id_instalacion = b.id_instalacion
+ AND a.id_reserva < b.id_reserva
+ AND a.rango_reserva && b.rango_reserva
+WHERE a.ds_estado = 'Confirmada'
+  AND b.ds_estado = 'Confirmada';
+
+-- Restricción de exclusión: dos reservas confirmadas de la misma instalación nunca pueden solaparse.
+-- Postgres la implementa con un índice GiST parcial sobre (id_instalacion, rango_reserva)
+-- WHERE ds_estado = 'Confirmada', que es el mismo índice que usan las consultas con &&;
+-- por eso no se crea un índice adicional.
+ALTER TABLE public.reservas
+ADD CONSTRAINT excl_reservas_confirmadas_sin_solape
+EXCLUDE USING gist (id_instalacion WITH =, rango_reserva WITH &&)
+WHERE (ds_estado = 'Confirmada');
+
+ANALYZE public.reservas;
+
+-- Verificación: el plan debe mostrar "Index Scan using excl_reservas_confirmadas_sin_solape"
+EXPLAIN
+SELECT r.id_reserva, r.probabilidad_cancelacion
+FROM public.reservas r
+WHERE r.id_instalacion = 1
+AND r.ds_estado = 'Confirmada'
+AND r.rango_reserva && tstzrange(now(), now() + interval '1 hour', '[)');
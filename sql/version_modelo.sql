@@ -0,0 +1,9 @@
+-- Migración: versión del modelo de cancelación usada en cada reserva
+--
+-- make_reservation_db guarda junto a probabilidad_cancelacion la versión del modelo que la
+-- calculó ('<artefacto>@<sha256[:12]>', ver app/ml/registry.py). Así se puede saber qué
+-- predicciones proceden de cada modelo tras una recarga en caliente o un reentrenamiento.
+-- Las reservas anteriores a la migración quedan con NULL.
+
+ALTER TABLE public.reservas
+ADD COLUMN IF NOT EXISTS ds_version_modelo VARCHAR(64);
@@ -0,0 +1,131 @@
+"""
+Pruebas del motor de disponibilidad por mapas de bits (app/database/availability.py).
+Funciones puras: no necesitan base de datos.
+"""
+from datetime import date, datetime
+
+import pytest
+
+pytz = pytest.importorskip("pytz")
+
+from app.database import availability  # noqa: E402
+
+MADRID_TZ = pytz.timezone("Europe/Madrid")
+APERTURA, CIERRE = 8, 22
+DIA = date(2030, 6, 10)
+# Último domingo de marzo y de octubre de 2030: cambios de hora en Madrid
+DIA_CAMBIO_VERANO = date(2030, 3, 31)
+DIA_CAMBIO_INVIERNO = date(2030, 10, 27)
+
+
+def _local(dia: date, hora: int, minuto: int = 0) -> datetime:
+    return MADRID_TZ.localize(datetime.combine(dia, datetime.min.time()).replace(hour=hora, minute=minuto))
+
+
+def _mapa(dia: date, *reservas) -> int:
+    """Reservas como ((h, m), (h, m)) en hora local de `dia`."""
+    return availability.mapa_ocupacion([(_local(dia, *inicio), _local(dia, *fin)) for inicio, fin in reservas],
+                                       dia, MADRID_TZ, APERTURA, CIERRE)
+
+
+def _horas(mapa: int, duracion: int, paso: int = None, **kwargs) -> list[str]:
+    mascara = availability.inicios_libres(mapa, duracion, paso or duracion, APERTURA, CIERRE, **kwargs)
+    return availability.celdas_a_horas(mascara, APERTURA)
+
+
+def test_dia_vacio_ofrece_toda_la_rejilla():
+    assert _horas(0, 60) == [f"{h:02d}:00" for h in range(APERTURA, CIERRE)]
+
+
+def test_inicios_libres_excluye_slots_que_solapan():
+    mapa = _mapa(DIA, ((10, 0), (11, 0)), ((15, 30), (16, 0)))
+    horas = _horas(mapa, 60)
+    assert "10:00" not in horas and "15:00" not in horas
+    assert "09:00" in horas and "11:00" in horas and "16:00" in horas
+
+
+def test_reserva_parcial_ocupa_la_celda_entera():
+    mapa = _mapa(DIA, ((9, 58), (10, 2)))
+    assert "09:00" not in _horas(mapa, 60) and "10:00" not in _horas(mapa, 60)
+
+
+def test_slots_de_30_minutos():
+    mapa = _mapa(DIA, ((10, 0), (10, 30)))
+    horas = _horas(mapa, 30)
+    assert len(horas) == (CIERRE - APERTURA) * 2 - 1
+    assert "10:00" not in horas and "09:30" in horas and "10:30" in horas
+
+
+def test_slots_de_90_minutos_con_paso_de_30():
+    mapa = _mapa(DIA, ((12, 0), (13, 0)))
+    horas = _horas(mapa, 90, 30)
+    # Cualquier slot que empiece entre 11:00 y 12:30 pisa la reserva; el de 10:30 acaba a las 12:00
+    assert "10:30" in horas and "13:00" in horas
+    assert not {"11:00", "11:30", "12:00", "12:30"} & set(horas)
+    # El último slot de 90 minutos termina justo al cierre
+    assert horas[-1] == "20:30"
+
+
+def test_slots_de_90_minutos_sin_paso_siguen_la_rejilla_de_90():
+    assert _horas(0, 90) == ["08:00", "09:30", "11:00", "12:30", "14:00", "15:30", "17:00", "18:30", "20:00"]
+
+
+def test_limites_desde_y_hasta_minuto():
+    horas = _horas(0, 60, desde_minuto=10 * 60 + 1, hasta_minuto=13 * 60)
+    assert horas == ["11:00", "12:00", "13:00"]
+
+
+def test_duracion_mayor_que_la_jornada():
+    assert availability.inicios_libres(0, (CIERRE - APERTURA + 1) * 60, 60, APERTURA, CIERRE) == 0
+
+
+def test_ventanas_libres_agrupa_inicios_consecutivos():
+    mapa = _mapa(DIA, ((11, 0), (15, 0)))
+    mascara = availability.inicios_libres(mapa, 60, 60, APERTURA, CIERRE)
+    ventanas = availability.ventanas_libres(mascara, 60, 60, APERTURA)
+    assert ventanas == [(8 * 60, 11 * 60), (15 * 60, 22 * 60)]
+    assert availability.formatear_ventanas(ventanas) == "08:00-11:00, 15:00-22:00"
+
+
+def test_ventanas_libres_con_paso_menor_que_la_duracion():
+    mapa = _mapa(DIA, ((12, 0), (13, 0)))
+    mascara = availability.inicios_libres(mapa, 90, 30, APERTURA, CIERRE)
+    ventanas = availability.ventanas_libres(mascara, 90, 30, APERTURA)
+    assert ventanas == [(8 * 60, 12 * 60), (13 * 60, 22 * 60)]
+
+
+def test_slots_libres_descarta_el_pasado():
+    ahora = _local(DIA, 10, 0).replace(second=30)
+    horas = availability.slots_libres(0, DIA, ahora, MADRID_TZ, APERTURA, CIERRE, 60)
+    assert horas[0] == "11:00"
+    manana = availability.slots_libres(0, date(2030, 6, 11), ahora, MADRID_TZ, APERTURA, CIERRE, 60)
+    assert manana[0] == "08:00"
+
+
+@pytest.mark.parametrize("dia", [DIA_CAMBIO_VERANO, DIA_CAMBIO_INVIERNO])
+def test_dias_de_cambio_de_hora_usan_hora_de_reloj(dia):
+    # La reserva llega de la base de datos en UTC: se marca por su hora local de reloj
+    inicio = _local(dia, 10).astimezone(pytz.utc)
+    fin = _local(dia, 11).astimezone(pytz.utc)
+    mapa = availability.mapa_ocupacion([(inicio, fin)], dia, MADRID_TZ, APERTURA, CIERRE)
+    horas = _horas(mapa, 60)
+    assert len(horas) == CIERRE - APERTURA - 1
+    assert "10:00" not in horas and "09:00" in horas and "11:00" in horas
+
+
+def test_reserva_que_cruza_la_medianoche_y_el_cambio_de_hora():
+    # 23:00 del sábado a 09:00 del domingo de cambio de hora (9 horas reales)
+    inicio = _local(date(2030, 3, 30), 23)
+    fin = _local(DIA_CAMBIO_VERANO, 9)
+    mapas = availability.construir_mapas([(1, inicio, fin)], [date(2030, 3, 30), DIA_CAMBIO_VERANO],
+                                         MADRID_TZ, APERTURA, CIERRE)
+    # El sábado la reserva empieza después del cierre: no ocupa nada
+    assert mapas[(1, date(2030, 3, 30))] == 0
+    assert _horas(mapas[(1, DIA_CAMBIO_VERANO)], 60)[0] == "09:00"
+
+
+def test_rango_consulta_en_dia_de_cambio_de_hora():
+    inicio, fin = availability.rango_consulta(DIA_CAMBIO_VERANO, DIA_CAMBIO_VERANO, MADRID_TZ)
+    assert (fin - inicio).total_seconds() == 23 * 3600
+    inicio, fin = availability.rango_consulta(DIA_CAMBIO_INVIERNO, DIA_CAMBIO_INVIERNO, MADRID_TZ)
+    assert (fin - inicio).total_seconds() == 25 * 3600
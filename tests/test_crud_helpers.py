@@ -0,0 +1,67 @@
+"""
+Prueba de humo de los helpers de app/database/crud.py que usan las tools síncronas y la capa
+asíncrona (app/database/async_crud.py), para que un refactor no los elimine sin que se note.
+No necesita base de datos: solo importa el módulo y llama a funciones puras.
+"""
+import os
+import re
+from datetime import date, datetime
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("pytz")
+
+# connection.py exige credenciales al importarse; el pool no se abre hasta el primer uso
+for variable in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASSWORD"):
+    os.environ.setdefault(variable, "test")
+
+from app.database import crud  # noqa: E402
+
+HELPERS = ("_parse_requested_slot", "_day_bounds", "_find_alternative_slots", "_split_overbookings")
+
+
+def test_helpers_existen():
+    for nombre in HELPERS:
+        assert callable(getattr(crud, nombre, None)), f"crud.{nombre} no existe"
+
+
+def test_async_crud_solo_usa_atributos_de_crud_existentes():
+    fuente = (Path(crud.__file__).parent / "async_crud.py").read_text(encoding="utf-8")
+    usados = set(re.findall(r"\bcrud\.(\w+)", fuente)) - {"py"}  # "crud.py" en los docstrings
+    assert set(HELPERS) <= usados
+    faltan = sorted(nombre for nombre in usados if not hasattr(crud, nombre))
+    assert not faltan, f"async_crud usa atributos que crud no define: {faltan}"
+
+
+def test_parse_requested_slot():
+    madrid_tz = crud._get_madrid_tz()
+    inicio, fin = crud._parse_requested_slot("2030-06-10", "10:00", madrid_tz)
+    assert (inicio.hour, inicio.minute) == (10, 0)
+    assert (fin - inicio).total_seconds() == crud.DURACION_SLOT_MINUTOS * 60
+    with pytest.raises(ValueError):
+        crud._parse_requested_slot("10/06/2030", "10:00", madrid_tz)
+
+
+def test_day_bounds():
+    madrid_tz = crud._get_madrid_tz()
+    inicio, fin = crud._day_bounds(date(2030, 6, 10), madrid_tz)
+    assert inicio.date() == date(2030, 6, 10) and fin.date() == date(2030, 6, 11)
+    assert (inicio.hour, fin.hour) == (0, 0)
+
+
+def test_split_overbookings():
+    assert crud._split_overbookings([]) == ([], [])
+    assert crud._split_overbookings([1, 2, 3]) == ([1], [2, 3])
+
+
+def test_find_alternative_slots():
+    madrid_tz = crud._get_madrid_tz()
+    dia = date(2030, 6, 10)
+    ahora = madrid_tz.localize(datetime(2030, 6, 9, 12, 0))
+    libres = crud._find_alternative_slots([], dia, ahora, madrid_tz)
+    assert libres and libres[0] == f"{crud.HORA_INICIO_OPERACION:02d}:00"
+
+    ocupada = crud._parse_requested_slot("2030-06-10", libres[0], madrid_tz)
+    assert libres[0] not in crud._find_alternative_slots([ocupada], dia, ahora, madrid_tz)
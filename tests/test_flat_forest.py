@@ -0,0 +1,66 @@
+"""
+Equivalencia entre el modelo de cancelaciones de sklearn (ML/rf_cancelaciones.pkl) y su
+versión aplanada (app/ml/flat_forest.py), para una fila suelta y para un lote.
+"""
+import json
+import pickle
+import warnings
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("sklearn")
+
+from app.ml import flat_forest  # noqa: E402
+
+ML = Path(__file__).resolve().parent.parent / "ML"
+TOLERANCIA = 1e-9
+
+
+@pytest.fixture(scope="module")
+def modelo():
+    with open(ML / "rf_cancelaciones.pkl", "rb") as f:
+        return pickle.load(f)
+
+
+@pytest.fixture(scope="module")
+def columnas():
+    return json.loads((ML / "columnas_modelo.json").read_text(encoding="utf-8"))
+
+
+@pytest.fixture(scope="module")
+def flat(modelo, tmp_path_factory):
+    directorio = flat_forest.exportar(modelo, tmp_path_factory.mktemp("flat"))
+    return flat_forest.FlatForest.load(directorio)
+
+
+def _proba_sklearn(modelo, X):
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        return modelo.predict_proba(np.asarray(X, dtype=np.float64))
+
+
+def test_metadatos(modelo, columnas, flat):
+    assert flat.n_features_in_ == modelo.n_features_in_ == len(columnas)
+    assert list(flat.classes_) == list(modelo.classes_)
+
+
+def test_una_fila(modelo, columnas, flat):
+    valores = {"id_instalacion": 1, "lluvia": 1, "antelacion_dias": 3, "reservas_previas": 5,
+               "cancelaciones_previas": 2, "es_finde": 0, "es_horario_pico": 1, "es_feriado": 0}
+    fila = [valores[c] for c in columnas]
+    esperado = _proba_sklearn(modelo, [fila])[0, list(modelo.classes_).index(1)]
+    assert flat.predict_proba_row(fila) == pytest.approx(esperado, abs=TOLERANCIA)
+
+
+def test_lote_aleatorio(modelo, flat):
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 30, size=(500, modelo.n_features_in_)).astype(np.float64)
+    np.testing.assert_allclose(flat.predict_proba(X), _proba_sklearn(modelo, X), rtol=0, atol=TOLERANCIA)
+
+
+def test_lote_en_los_umbrales(modelo, flat):
+    # Valores justo en los umbrales y alrededor: donde un error de comparación cambiaría de rama
+    X = flat_forest.muestra_verificacion(modelo, n=2000)
+    assert flat_forest.verificar(modelo, flat, X, atol=TOLERANCIA) <= TOLERANCIA
@@ -0,0 +1,62 @@
+"""
+Pruebas del índice BM25 (app/rag/lexical_index.py) sobre la base de conocimiento real
+(data/knowledge-base.txt).
+"""
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from app.rag.lexical_index import LexicalIndex, plegar, secciones_markdown, tokenizar  # noqa: E402
+
+KNOWLEDGE_BASE_PATH = Path(__file__).resolve().parent.parent / "data" / "knowledge-base.txt"
+
+
+@pytest.fixture(scope="module")
+def indice():
+    return LexicalIndex(secciones_markdown(KNOWLEDGE_BASE_PATH))
+
+
+def test_tokenizar_pliega_tildes_plurales_y_palabras_vacias():
+    assert plegar("Pádel ÑANDÚ") == "padel nandu"
+    assert tokenizar("Los horarios de las pistas") == ["horario", "pista"]
+
+
+def test_consulta_con_confianza(indice):
+    resultados, confianza = indice.search("precio pádel")
+    assert confianza
+    puntuacion, fragmento = resultados[0]
+    assert fragmento["metadata"].get("header3") == "Pádel"
+    # Supera al segundo en el margen pedido
+    assert puntuacion >= 1.3 * resultados[1][0]
+
+
+def test_consulta_sin_confianza(indice):
+    resultados, confianza = indice.search("parking")
+    assert resultados
+    assert not confianza
+
+
+def test_tildes_y_mayusculas_no_cambian_el_resultado(indice):
+    con_tilde, confianza = indice.search("precio pádel")
+    for variante in ("precio padel", "PRECIO PÁDEL", "Precios Padel"):
+        resultados, confianza_variante = indice.search(variante)
+        assert [f["metadata"] for _, f in resultados] == [f["metadata"] for _, f in con_tilde]
+        assert confianza_variante == confianza
+
+
+def test_consulta_vacia_o_sin_terminos(indice):
+    assert indice.search("") == ([], False)
+    assert indice.search("el de la") == ([], False)
+    assert indice.search("zzzz") == ([], False)
+
+
+def test_k_limita_los_resultados(indice):
+    resultados, _ = indice.search("horario piscina exterior", k=2)
+    assert len(resultados) == 2
+    assert resultados[0][0] >= resultados[1][0]
+
+
+def test_indice_vacio():
+    assert LexicalIndex([]).search("pádel") == ([], False)
@@ -0,0 +1,66 @@
+"""
+Pruebas de la búsqueda del índice vectorial local (app/rag/local_index.py), por fuerza
+bruta y con IVF, sobre embeddings sintéticos.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.rag.local_index import LocalVectorIndex, construir_indice, normalizar_filas  # noqa: E402
+
+N, DIMENSION = 200, 16
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    return np.random.default_rng(0).normal(size=(N, DIMENSION)).astype(np.float32)
+
+
+def _indice(directorio, embeddings, n_listas=0):
+    textos = [f"fragmento {i}" for i in range(N)]
+    construir_indice(textos, [{"i": i} for i in range(N)], embeddings, directorio, n_listas=n_listas)
+    return LocalVectorIndex.load(directorio)
+
+
+def _esperado(embeddings, consulta, k):
+    puntuaciones = normalizar_filas(embeddings) @ normalizar_filas(consulta)
+    return [int(i) for i in np.argsort(-puntuaciones)[:k]]
+
+
+def test_fuerza_bruta_devuelve_el_top_k_exacto(tmp_path, embeddings):
+    indice = _indice(tmp_path / "indice", embeddings)
+    assert indice.centroides is None and len(indice) == N
+    for consulta in np.random.default_rng(1).normal(size=(20, DIMENSION)):
+        resultados = indice.search(consulta, k=5)
+        assert [f["metadata"]["i"] for _, f in resultados] == _esperado(embeddings, consulta, 5)
+        puntuaciones = [p for p, _ in resultados]
+        assert puntuaciones == sorted(puntuaciones, reverse=True)
+
+
+def test_el_propio_vector_es_el_primero(tmp_path, embeddings):
+    indice = _indice(tmp_path / "indice", embeddings)
+    puntuacion, fragmento = indice.search(embeddings[42] * 3, k=1)[0]
+    assert fragmento["texto"] == "fragmento 42"
+    assert puntuacion == pytest.approx(1.0, abs=1e-5)
+
+
+def test_k_mayor_que_el_indice(tmp_path, embeddings):
+    indice = _indice(tmp_path / "indice", embeddings)
+    assert len(indice.search(embeddings[0], k=N + 10)) == N
+
+
+def test_ivf_con_todas_las_listas_equivale_a_fuerza_bruta(tmp_path, embeddings):
+    indice = _indice(tmp_path / "indice", embeddings, n_listas=8)
+    assert indice.meta["n_listas"] == 8
+    for consulta in np.random.default_rng(2).normal(size=(20, DIMENSION)):
+        resultados = indice.search(consulta, k=5, n_probe=8)
+        assert [f["metadata"]["i"] for _, f in resultados] == _esperado(embeddings, consulta, 5)
+
+
+def test_ivf_solo_recorre_las_listas_mas_cercanas(tmp_path, embeddings):
+    indice = _indice(tmp_path / "indice", embeddings, n_listas=8)
+    consulta = embeddings[7]
+    cercanas = set(np.argsort(indice.centroides @ normalizar_filas(consulta))[::-1][:2].tolist())
+    resultados = indice.search(consulta, k=10, n_probe=2)
+    assert resultados[0][1]["metadata"]["i"] == 7
+    assert {int(indice.listas[f["metadata"]["i"]]) for _, f in resultados} <= cercanas
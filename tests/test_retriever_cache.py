@@ -0,0 +1,58 @@
+"""
+Pruebas de la caché LRU del retriever (app/rag/retriever.py): capacidad, orden de uso y
+caducidad.
+"""
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from app.rag import retriever  # noqa: E402
+from app.rag.retriever import _LRU  # noqa: E402
+
+
+def test_expulsa_la_entrada_menos_usada():
+    cache = _LRU(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "a" pasa a ser la más reciente
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_put_de_una_clave_existente_la_actualiza():
+    cache = _LRU(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("a", 10)
+    cache.put("c", 3)
+    assert cache.get("a") == 10 and cache.get("b") is None
+
+
+def test_caducidad(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(retriever.time, "monotonic", lambda: ahora[0])
+    cache = _LRU(10, ttl=60)
+    cache.put("a", 1)
+    ahora[0] += 59
+    assert cache.get("a") == 1
+    ahora[0] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_sin_ttl_no_caduca(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(retriever.time, "monotonic", lambda: ahora[0])
+    cache = _LRU(10)
+    cache.put("a", 1)
+    ahora[0] += 10 ** 6
+    assert cache.get("a") == 1
+
+
+def test_clear():
+    cache = _LRU(10)
+    cache.put("a", 1)
+    cache.clear()
+    assert len(cache) == 0 and cache.get("a") is None
@@ -0,0 +1,351 @@
+"""
+Pruebas del historial en segmentos (app/memory/s3_postgres_history.py) sobre
+FilesystemObjectStore. El manifiesto de PostgreSQL se sustituye por uno en memoria que
+interpreta las sentencias del módulo, con commit y rollback.
+"""
+import copy
+import json
+import os
+from contextlib import contextmanager
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("langchain_core")
+
+# connection.py exige credenciales al importarse; el pool no se abre hasta el primer uso
+for variable in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASSWORD"):
+    os.environ.setdefault(variable, "test")
+
+from langchain_core.messages import AIMessage, HumanMessage, messages_to_dict  # noqa: E402
+
+from app.memory import s3_postgres_history as historial  # noqa: E402
+from app.memory.object_store import FilesystemObjectStore, ObjectStore  # noqa: E402
+
+TELEFONO = "34600000000"
+
+
+class ManifiestoFalso:
+    """historial_chats e historial_segmentos en diccionarios."""
+
+    def __init__(self):
+        self.estado = {"cabeceras": {}, "segmentos": {}}
+
+    @contextmanager
+    def conexion(self):
+        conn = _Conexion(self)
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+
+    def segmentos(self, telefono=TELEFONO) -> list:
+        return sorted((numero, *fila) for (tel, numero), fila in self.estado["segmentos"].items() if tel == telefono)
+
+
+class _Conexion:
+    def __init__(self, manifiesto):
+        self.manifiesto = manifiesto
+        self._copia = copy.deepcopy(manifiesto.estado)
+
+    def cursor(self):
+        return _Cursor(self.manifiesto.estado)
+
+    def commit(self):
+        self._copia = copy.deepcopy(self.manifiesto.estado)
+
+    def rollback(self):
+        self.manifiesto.estado = self._copia
+        self._copia = copy.deepcopy(self._copia)
+
+
+class _Cursor:
+    def __init__(self, estado):
+        self.estado = estado
+        self.filas = []
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def fetchone(self):
+        return self.filas[0] if self.filas else None
+
+    def fetchall(self):
+        return list(self.filas)
+
+    def _segmentos(self, telefono):
+        """Filas (nu_segmento, ds_clave, nu_primer_mensaje, nu_mensajes) en orden."""
+        return sorted((numero, *fila[:3]) for (tel, numero), fila in self.estado["segmentos"].items() if tel == telefono)
+
+    def execute(self, sql, params=()):
+        cabeceras, segmentos = self.estado["cabeceras"], self.estado["segmentos"]
+        texto = " ".join(sql.split())
+        self.filas = []
+        if sql is historial.SQL_LEER_CABECERA:
+            cabecera = cabeceras.get(params[0])
+            self.filas = [(cabecera["clave"], cabecera["n"], cabecera["ubicacion"])] if cabecera else []
+        elif sql is historial.SQL_LEER_SEGMENTOS:
+            self.filas = self._segmentos(params[0])
+        elif sql is historial.SQL_LEER_ULTIMOS_SEGMENTOS:
+            telefono, ultimos = params
+            total = cabeceras[telefono]["n"] if telefono in cabeceras else 0
+            self.filas = [s for s in self._segmentos(telefono) if s[2] + s[3] > total - ultimos]
+        elif sql is historial.SQL_LEER_SEGMENTOS_DESDE:
+            telefono, desde = params
+            self.filas = [s for s in self._segmentos(telefono) if s[2] + s[3] > desde]
+        elif sql is historial.SQL_ANEXAR_SEGMENTO:
+            cabecera = cabeceras.setdefault(params["telefono"], {"clave": None, "n": 0, "ultimo": 0, "ubicacion": "s3"})
+            # WHERE historial_chats.ds_ubicacion = 's3': sin fila, no se registra el segmento
+            if cabecera["ubicacion"] != "s3":
+                self.rowcount = 0
+                return
+            self.rowcount = 1
+            cabecera["n"] += params["n"]
+            cabecera["ultimo"] += 1
+            segmentos[(params["telefono"], cabecera["ultimo"])] = (
+                params["clave"], cabecera["n"] - params["n"], params["n"], params["bytes"])
+        elif texto.startswith("DELETE FROM historial_segmentos WHERE ds_telefono = %s RETURNING"):
+            for clave in [c for c in segmentos if c[0] == params[0]]:
+                self.filas.append((segmentos.pop(clave)[0],))
+        elif texto.startswith("DELETE FROM historial_chats"):
+            cabecera = cabeceras.pop(params[0], None)
+            self.filas = [(cabecera["clave"],)] if cabecera else []
+        elif texto.startswith("SELECT s3_chat_history_key FROM historial_chats") and texto.endswith("FOR UPDATE"):
+            cabecera = cabeceras.get(params[0])
+            self.filas = [(cabecera["clave"],)] if cabecera else []
+        elif texto.startswith("DELETE FROM historial_segmentos WHERE ds_telefono = %s AND nu_segmento = ANY(%s)"):
+            telefono, numeros = params
+            for numero in numeros:
+                if (telefono, numero) in segmentos:
+                    self.filas.append((segmentos.pop((telefono, numero))[1],))
+        elif texto.startswith("UPDATE historial_chats SET s3_chat_history_key = NULL"):
+            n, telefono = params
+            cabeceras[telefono]["clave"] = None
+            cabeceras[telefono]["n"] += n
+        elif texto.startswith("UPDATE historial_segmentos SET nu_primer_mensaje"):
+            n, telefono = params
+            for clave, (ds_clave, primero, mensajes, n_bytes) in list(segmentos.items()):
+                if clave[0] == telefono:
+                    segmentos[clave] = (ds_clave, primero + n, mensajes, n_bytes)
+        elif texto.startswith("INSERT INTO historial_segmentos"):
+            telefono, numero, clave, primero, n, n_bytes = params
+            segmentos[(telefono, numero)] = (clave, primero, n, n_bytes)
+        else:
+            raise AssertionError(f"Sentencia no prevista en la prueba: {texto}")
+
+
+@pytest.fixture
+def manifiesto(monkeypatch):
+    falso = ManifiestoFalso()
+    monkeypatch.setattr(historial, "db_connection", falso.conexion)
+    return falso
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FilesystemObjectStore(tmp_path / "historial")
+
+
+def _turno(i: int) -> list:
+    return [HumanMessage(content=f"pregunta {i}"), AIMessage(content=f"respuesta {i}")]
+
+
+def _textos(messages) -> list:
+    return [m.content for m in messages]
+
+
+def test_object_store_es_abstracto():
+    with pytest.raises(TypeError):
+        ObjectStore()
+
+
+def test_filesystem_store(store):
+    store.put("historial/a/1.hc", b"uno")
+    assert store.get("historial/a/1.hc") == b"uno"
+    store.delete(["historial/a/1.hc", "historial/a/no-existe.hc"])
+    with pytest.raises(KeyError):
+        store.get("historial/a/1.hc")
+    with pytest.raises(ValueError):
+        store.put("../fuera.hc", b"x")
+
+
+def test_anexar_y_leer(manifiesto, store):
+    escritor = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    for i in range(5):
+        escritor.add_messages(_turno(i))
+    # Un segmento por turno, con su posición en la conversación
+    assert [(numero, primero, n) for numero, _, primero, n, _ in manifiesto.segmentos()] == [
+        (i + 1, 2 * i, 2) for i in range(5)]
+
+    lector = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    esperado = _textos(m for i in range(5) for m in _turno(i))
+    assert _textos(lector.messages) == esperado
+    assert isinstance(lector.messages[0], HumanMessage) and isinstance(lector.messages[1], AIMessage)
+
+
+def test_ultimos_mensajes_descarga_solo_los_segmentos_necesarios(manifiesto, store, monkeypatch):
+    escritor = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    for i in range(5):
+        escritor.add_messages(_turno(i))
+    leidas = []
+    get = store.get
+    monkeypatch.setattr(store, "get", lambda clave: leidas.append(clave) or get(clave))
+
+    lector = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    assert _textos(lector.ultimos_mensajes(3)) == ["respuesta 3", "pregunta 4", "respuesta 4"]
+    assert len(leidas) == 2
+
+
+def test_leer_desde_descarga_los_segmentos_desde_la_posicion(manifiesto, store, monkeypatch):
+    escritor = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    for i in range(5):
+        escritor.add_messages(_turno(i))
+    leidas = []
+    get = store.get
+    monkeypatch.setattr(store, "get", lambda clave: leidas.append(clave) or get(clave))
+
+    lector = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    # La posición 5 está en el tercer segmento (mensajes 4 y 5): se lee desde su principio
+    primero, mensajes = lector.leer_desde(5)
+    assert primero == 4
+    assert _textos(mensajes) == _textos(m for i in range(2, 5) for m in _turno(i))
+    assert len(leidas) == 3
+    # Todo leído: ningún segmento
+    assert lector.leer_desde(10) == (10, [])
+
+
+def test_historial_inexistente(manifiesto, store):
+    lector = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    assert lector.messages == []
+    assert lector.ultimos_mensajes(4) == []
+    assert lector.leer_desde(0) == (0, [])
+
+
+def test_fallo_del_manifiesto_borra_el_segmento(manifiesto, store, monkeypatch):
+    @contextmanager
+    def rota():
+        raise RuntimeError("sin base de datos")
+        yield
+
+    monkeypatch.setattr(historial, "db_connection", rota)
+    with pytest.raises(RuntimeError):
+        historial.S3PostgresChatMessageHistory(TELEFONO, store).add_messages(_turno(0))
+    assert not [p for p in store.root.rglob("*") if p.is_file()]
+
+
+def test_historial_en_postgres_se_archiva_antes_de_anexar(manifiesto, store, monkeypatch):
+    from app.memory import postgres_history
+
+    manifiesto.estado["cabeceras"][TELEFONO] = {"clave": None, "n": 0, "ultimo": 0, "ubicacion": "pg"}
+    archivados = []
+
+    def archivar(telefono, store_):
+        archivados.append(telefono)
+        manifiesto.estado["cabeceras"][telefono]["ubicacion"] = "s3"
+
+    monkeypatch.setattr(postgres_history, "archivar_historial", archivar)
+    historial.S3PostgresChatMessageHistory(TELEFONO, store).add_messages(_turno(0))
+    assert archivados == [TELEFONO]
+    assert _textos(historial.S3PostgresChatMessageHistory(TELEFONO, store).messages) == _textos(_turno(0))
+
+
+def test_historial_que_sigue_en_postgres_no_deja_segmentos_huerfanos(manifiesto, store, monkeypatch):
+    from app.memory import postgres_history
+
+    manifiesto.estado["cabeceras"][TELEFONO] = {"clave": None, "n": 0, "ultimo": 0, "ubicacion": "pg"}
+    monkeypatch.setattr(postgres_history, "archivar_historial", lambda telefono, store_: None)
+    with pytest.raises(RuntimeError):
+        historial.S3PostgresChatMessageHistory(TELEFONO, store).add_messages(_turno(0))
+    assert manifiesto.segmentos() == []
+    assert not [p for p in store.root.rglob("*") if p.is_file()]
+
+
+def test_lectura_de_historial_en_postgres(manifiesto, store, monkeypatch):
+    from app.memory import postgres_history
+
+    manifiesto.estado["cabeceras"][TELEFONO] = {"clave": None, "n": 2, "ultimo": 0, "ubicacion": "pg"}
+
+    class PostgresFalso:
+        def __init__(self, telefono, store_):
+            pass
+
+        def leer(self, ultimos=None):
+            return _turno(0)[-ultimos:] if ultimos else _turno(0)
+
+        def leer_desde(self, desde):
+            return desde, _turno(0)[desde:]
+
+    monkeypatch.setattr(postgres_history, "PostgresChatMessageHistory", PostgresFalso)
+    lector = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    assert _textos(lector.messages) == _textos(_turno(0))
+    assert _textos(lector.ultimos_mensajes(1)) == _textos(_turno(0)[-1:])
+    assert lector.leer_desde(1)[0] == 1
+
+
+def test_clear_borra_manifiesto_y_objetos(manifiesto, store):
+    escritor = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    escritor.add_messages(_turno(0))
+    escritor.add_messages(_turno(1))
+    escritor.clear()
+    assert manifiesto.segmentos() == []
+    assert not [p for p in store.root.rglob("*") if p.is_file()]
+    assert historial.S3PostgresChatMessageHistory(TELEFONO, store).messages == []
+
+
+def test_tramos_a_fusionar():
+    segmentos = [(i, f"k{i}", 0, n) for i, n in enumerate([2, 2, 2, 5, 1, 1, 9], start=1)]
+    tramos = historial._tramos_a_fusionar(segmentos, objetivo=6)
+    assert [[s[0] for s in tramo] for tramo in tramos] == [[1, 2, 3], [4, 5]]
+    # Los tramos de un solo segmento no se reescriben
+    assert historial._tramos_a_fusionar(segmentos[:1], objetivo=6) == []
+
+
+def test_compactar(manifiesto, store):
+    escritor = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    for i in range(7):
+        escritor.add_messages(_turno(i))
+    esperado = _textos(historial.S3PostgresChatMessageHistory(TELEFONO, store).messages)
+
+    resultado = historial.compactar_historial(TELEFONO, store, objetivo=6, dry_run=True)
+    assert resultado == {"tramos": 2, "segmentos_fusionados": 6}
+    assert len(manifiesto.segmentos()) == 7
+
+    historial.compactar_historial(TELEFONO, store, objetivo=6)
+    segmentos = manifiesto.segmentos()
+    assert [(primero, n) for _, _, primero, n, _ in segmentos] == [(0, 6), (6, 6), (12, 2)]
+    # Los objetos sustituidos se borran
+    assert len([p for p in store.root.rglob("*") if p.is_file()]) == 3
+
+    lector = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    assert _textos(lector.messages) == esperado
+    assert _textos(lector.ultimos_mensajes(4)) == esperado[-4:]
+    # Se sigue anexando detrás de los segmentos fusionados
+    escritor.add_messages(_turno(7))
+    assert _textos(historial.S3PostgresChatMessageHistory(TELEFONO, store).messages) == esperado + _textos(_turno(7))
+
+
+def test_compactar_convierte_el_objeto_antiguo_en_el_segmento_0(manifiesto, store):
+    antiguo = f"historial/{TELEFONO}.json"
+    store.put(antiguo, json.dumps(messages_to_dict(_turno(0))).encode("utf-8"))
+    manifiesto.estado["cabeceras"][TELEFONO] = {"clave": antiguo, "n": 0, "ultimo": 0, "ubicacion": "s3"}
+    escritor = historial.S3PostgresChatMessageHistory(TELEFONO, store)
+    escritor.add_messages(_turno(1))
+    escritor.add_messages(_turno(2))
+    esperado = _textos(_turno(0) + _turno(1) + _turno(2))
+    assert _textos(historial.S3PostgresChatMessageHistory(TELEFONO, store).messages) == esperado
+    # Las posiciones de los segmentos no cuentan el objeto antiguo: se lee todo
+    primero, mensajes = historial.S3PostgresChatMessageHistory(TELEFONO, store).leer_desde(3)
+    assert primero == 0 and _textos(mensajes) == esperado
+
+    historial.compactar_historial(TELEFONO, store, objetivo=100)
+    assert manifiesto.estado["cabeceras"][TELEFONO]["clave"] is None
+    assert manifiesto.estado["cabeceras"][TELEFONO]["n"] == 6
+    assert [(numero, primero, n) for numero, _, primero, n, _ in manifiesto.segmentos()] == [(0, 0, 6)]
+    with pytest.raises(KeyError):
+        store.get(antiguo)
+    assert _textos(historial.S3PostgresChatMessageHistory(TELEFONO, store).messages) == esperado
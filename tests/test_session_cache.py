@@ -0,0 +1,237 @@
+"""
+Pruebas de la caché de historiales (app/memory/session_cache.py) con un backend en memoria:
+carga diferida fuera del event loop, escritura y ventana.
+"""
+import asyncio
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("langchain_core")
+
+# connection.py exige credenciales al importarse; el pool no se abre hasta el primer uso
+for variable in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASSWORD"):
+    os.environ.setdefault(variable, "test")
+
+from langchain_core.chat_history import BaseChatMessageHistory  # noqa: E402
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from app.memory import session_cache, ventana  # noqa: E402
+
+TELEFONO = "34600000000"
+
+
+class BackendFalso(BaseChatMessageHistory):
+    """Historial en memoria que anota desde qué hilo se lee."""
+
+    almacen = {}
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.lecturas = []
+        self.fallar = False
+
+    @property
+    def messages(self):
+        return list(self.almacen.get(self.session_id, []))
+
+    def leer_desde(self, desde: int):
+        self.lecturas.append(threading.current_thread())
+        if self.fallar:
+            raise ConnectionError("sin base de datos")
+        mensajes = self.messages
+        return min(desde, len(mensajes)), mensajes[desde:]
+
+    def add_messages(self, messages):
+        self.almacen.setdefault(self.session_id, []).extend(messages)
+
+    def clear(self):
+        self.almacen.pop(self.session_id, None)
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    BackendFalso.almacen = {}
+    creados = []
+
+    def crear(session_id):
+        creados.append(BackendFalso(session_id))
+        return creados[-1]
+
+    monkeypatch.setattr(session_cache, "crear_historial", crear)
+    monkeypatch.setattr(ventana, "leer_resumen", lambda session_id: (None, 0))
+    monkeypatch.setattr(ventana, "guardar_resumen", lambda *args: None)
+    monkeypatch.setattr(ventana, "borrar_resumen", lambda session_id: None)
+    return creados
+
+
+@pytest.fixture
+def cache(backends):
+    cache = session_cache.SessionHistoryCache(durabilidad="sync")
+    yield cache
+    cache.close()
+
+
+def _turno(i: int) -> list:
+    return [HumanMessage(content=f"pregunta {i}"), AIMessage(content=f"respuesta {i}")]
+
+
+def test_get_no_lee_el_historial(cache, backends):
+    historial = cache.get(TELEFONO)
+    assert backends[0].lecturas == []
+    assert cache.get(TELEFONO) is historial
+    assert cache.stats()["aciertos"] == 1 and cache.stats()["fallos"] == 1
+
+
+def test_aget_messages_carga_fuera_del_event_loop(cache, backends):
+    BackendFalso.almacen[TELEFONO] = _turno(0)
+
+    async def turno():
+        historial = cache.get(TELEFONO)
+        return await historial.aget_messages(), threading.current_thread()
+
+    mensajes, hilo_loop = asyncio.run(turno())
+    assert [m.content for m in mensajes] == ["pregunta 0", "respuesta 0"]
+    assert len(backends[0].lecturas) == 1
+    assert backends[0].lecturas[0] is not hilo_loop
+    # Los siguientes turnos se sirven desde memoria
+    asyncio.run(cache.get(TELEFONO).aget_messages())
+    assert len(backends[0].lecturas) == 1
+
+
+def test_carga_concurrente_lee_una_sola_vez(cache, backends):
+    BackendFalso.almacen[TELEFONO] = _turno(0)
+    historial = cache.get(TELEFONO)
+    hilos = [threading.Thread(target=lambda: historial.messages) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert len(backends[0].lecturas) == 1
+    assert cache.stats()["cargas"] == 1
+
+
+def test_error_de_carga_no_se_queda_en_la_cache(cache, backends):
+    BackendFalso.almacen[TELEFONO] = _turno(0)
+    historial = cache.get(TELEFONO)
+    backends[0].fallar = True
+    assert historial.messages == []
+    # El siguiente mensaje vuelve a intentarlo con un historial nuevo
+    otro = cache.get(TELEFONO)
+    assert otro is not historial
+    assert [m.content for m in otro.messages] == ["pregunta 0", "respuesta 0"]
+
+
+def test_add_messages_carga_antes_de_anexar(cache, backends):
+    BackendFalso.almacen[TELEFONO] = _turno(0)
+    historial = cache.get(TELEFONO)
+    historial.add_messages(_turno(1))
+    assert [m.content for m in historial.ultimos_mensajes(4)] == [
+        "pregunta 0", "respuesta 0", "pregunta 1", "respuesta 1"]
+    assert len(BackendFalso.almacen[TELEFONO]) == 4
+
+
+def test_escritura_diferida(backends):
+    cache = session_cache.SessionHistoryCache(durabilidad="deferred")
+    try:
+        historial = cache.get(TELEFONO)
+        historial.add_messages(_turno(0))
+        historial.add_messages(_turno(1))
+        assert cache.flush(timeout=5)
+        assert [m.content for m in BackendFalso.almacen[TELEFONO]] == [
+            "pregunta 0", "respuesta 0", "pregunta 1", "respuesta 1"]
+    finally:
+        cache.close()
+
+
+def test_clear(cache, backends):
+    BackendFalso.almacen[TELEFONO] = _turno(0)
+    historial = cache.get(TELEFONO)
+    historial.clear()
+    assert historial.messages == []
+    assert TELEFONO not in BackendFalso.almacen
+
+
+def _esperar_resumenes(cache):
+    # El hilo de resúmenes es único: cuando termina esta tarea han terminado las anteriores
+    cache._resumidor.submit(lambda: None).result(timeout=5)
+
+
+def test_mensajes_sin_resumir_se_envian_hasta_que_llega_el_resumen(cache, backends, monkeypatch):
+    BackendFalso.almacen[TELEFONO] = [m for i in range(20) for m in _turno(i)]
+    puede_resumir = threading.Event()
+
+    def resumir(resumen_previo, messages):
+        puede_resumir.wait(timeout=5)
+        return f"resumen de {len(messages)}"
+
+    monkeypatch.setattr(ventana, "resumir", resumir)
+    historial = cache.get(TELEFONO)
+    # Todo cabe en el presupuesto: mientras se resume no se pierde ningún mensaje del prompt
+    assert [m.content for m in historial.messages] == [m.content for m in BackendFalso.almacen[TELEFONO]]
+
+    puede_resumir.set()
+    _esperar_resumenes(cache)
+    visibles = historial.messages
+    assert visibles[0].content.endswith("resumen de 28")
+    assert [m.content for m in visibles[1:]] == [m.content for i in range(14, 20) for m in _turno(i)]
+
+
+def test_mensajes_sin_resumir_respetan_el_presupuesto(cache, backends, monkeypatch):
+    BackendFalso.almacen[TELEFONO] = [m for i in range(20) for m in _turno(i)]
+    monkeypatch.setattr(ventana, "resumir", lambda resumen_previo, messages: "resumen")
+    historial = cache.get(TELEFONO)
+    historial._cargar()
+    presupuesto = sum(historial._tokens[-16:])
+    original = ventana.inicio_ventana
+    monkeypatch.setattr(ventana, "inicio_ventana",
+                        lambda messages, tokens, turnos=ventana.HISTORY_WINDOW_TURNS: original(
+                            messages, tokens, turnos, presupuesto))
+    visibles = historial.messages
+    # Los 8 últimos turnos caben; los anteriores esperan al resumen
+    assert [m.content for m in visibles] == [m.content for i in range(12, 20) for m in _turno(i)]
+    _esperar_resumenes(cache)
+
+
+def test_resumen_por_tramos(cache, backends, monkeypatch):
+    BackendFalso.almacen[TELEFONO] = [m for i in range(40) for m in _turno(i)]
+    llamadas, guardados = [], []
+
+    def resumir(resumen_previo, messages):
+        llamadas.append((resumen_previo, messages[0].content, len(messages)))
+        return f"resumen {len(llamadas)}"
+
+    monkeypatch.setattr(ventana, "resumir", resumir)
+    monkeypatch.setattr(ventana, "guardar_resumen", lambda telefono, resumen, n: guardados.append((resumen, n)))
+    monkeypatch.setattr(session_cache, "MAX_MENSAJES_RESUMEN", 30)
+    historial = cache.get(TELEFONO)
+    historial.messages
+    _esperar_resumenes(cache)
+
+    # 80 mensajes, los 12 últimos en la ventana: 68 a resumir en tramos de 30, sin descartar ninguno
+    assert llamadas == [(None, "pregunta 0", 30), ("resumen 1", "pregunta 15", 30), ("resumen 2", "pregunta 30", 8)]
+    assert guardados == [("resumen 1", 30), ("resumen 2", 60), ("resumen 3", 68)]
+    assert historial.n_resumidos == 68 and historial.resumen == "resumen 3"
+
+
+def test_solo_se_carga_desde_el_cursor_del_resumen(cache, backends, monkeypatch):
+    BackendFalso.almacen[TELEFONO] = [m for i in range(40) for m in _turno(i)]
+    monkeypatch.setattr(ventana, "leer_resumen", lambda session_id: ("resumen previo", 50))
+    resumidos = []
+    monkeypatch.setattr(ventana, "resumir", lambda resumen_previo, messages: resumidos.append(
+        (resumen_previo, [m.content for m in messages])) or "resumen nuevo")
+    historial = cache.get(TELEFONO)
+
+    visibles = historial.messages
+    assert historial._base == 50 and len(historial._messages) == 30
+    assert visibles[0].content.endswith("resumen previo")
+    # Lo pendiente (turnos 25 a 33) cabe en el presupuesto y se envía mientras se resume
+    assert [m.content for m in visibles[1:]] == [m.content for i in range(25, 40) for m in _turno(i)]
+
+    _esperar_resumenes(cache)
+    # Se resume desde el cursor (posición 50) hasta el comienzo de la ventana (turno 34)
+    assert resumidos == [("resumen previo", [m.content for i in range(25, 34) for m in _turno(i)])]
+    assert historial.n_resumidos == 68
+    assert [m.content for m in historial.messages[1:]] == [m.content for i in range(34, 40) for m in _turno(i)]